@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User, Group
 from rest_framework import serializers, exceptions
+from utils.fast_serializers import FastSerializer
 
 
 # HyperLinkedModelSerializer vs ModelSerializer
@@ -24,6 +25,17 @@ class UserSerializerForComment(UserSerializerForTweet):
     pass
 
 
+# tweet / comment / friendship 里嵌套的 user 都缓存成同一份 JSON
+# 这几个 serializer 的输出必须一样，否则不能共用缓存
+class UserFastSerializer(FastSerializer):
+    serializer_class = UserSerializerForTweet
+    cache_fragments = True
+
+
+class UserFastSerializerForComment(UserFastSerializer):
+    serializer_class = UserSerializerForComment
+
+
 # By default the serializer will include a url field instead of a primary key field.
 # The url field will be represented using a HyperlinkedIdentityField serializer field,
 # and any relationships on the model will be represented using a HyperlinkedRelatedField serializer field.
@@ -39,6 +51,10 @@ class UserSerializerForFriendship(UserSerializerForTweet):
     pass
 
 
+class UserFastSerializerForFriendship(UserFastSerializer):
+    serializer_class = UserSerializerForFriendship
+
+
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField()
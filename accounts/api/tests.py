@@ -11,6 +11,7 @@ LOGIN_STATUS_URL = '/api/accounts/login_status/'
 class AccountApiTests(TestCase):
 
     def setUp(self):
+        self.clear_cache()
         # 这个函数在每个test function 执行的时候被执行
         self.client = APIClient() # 相当于模拟一个浏览器
         self.user = self.create_user(
@@ -1,3 +1,8 @@
-from django.db import models
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from utils.listeners import invalidate_json_fragment
 
-# Create your models here.
+
+# tweet / comment 里嵌套的 user 的 JSON 是缓存起来的，改了用户名之后要删掉
+post_save.connect(invalidate_json_fragment, sender=User)
+post_delete.connect(invalidate_json_fragment, sender=User)
@@ -0,0 +1,26 @@
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    """
+    和跑 test 一样新建一个测试数据库，benchmark 跑完之后删掉，不会碰到真实的数据
+    """
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+    # 数据是重新生成的，id 会和上一次一样，cache 里上一次的 JSON 不能再用
+    for cache in caches.all():
+        cache.clear()
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
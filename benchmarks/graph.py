@@ -0,0 +1,171 @@
+import random
+from collections import defaultdict
+from itertools import accumulate
+
+from comments.models import Comment
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from friendships.models import Friendship
+from likes.models import Like
+from newsfeeds.models import NewsFeed
+from newsfeeds.services import NewsFeedService
+from tweets.models import Tweet
+from tweets.services import TweetService
+
+
+USERNAME_PREFIX = 'bench_user_'
+BENCH_PASSWORD = 'bench password'
+
+
+class SocialGraphGenerator(object):
+    """
+    生成一个用来跑 benchmark 的社交网络
+    - follower 的数量服从 power-law 分布：少数大 V 有大量粉丝，大部分人只有很少的粉丝
+    - 所有的写入都用 bulk_create，按 batch_size 分批写，最后再把 tweet 上冗余的计数数一遍
+    - 同一个 seed 生成的数据是完全一样的，这样不同 commit 之间的结果才有可比性
+    """
+
+    def __init__(
+            self,
+            users=1000,
+            tweets=5000,
+            comments=5000,
+            likes=10000,
+            follows_per_user=20,
+            alpha=1.2,
+            seed=42,
+            batch_size=1000,
+    ):
+        self.num_users = users
+        self.num_tweets = tweets
+        self.num_comments = comments
+        self.num_likes = likes
+        self.follows_per_user = follows_per_user
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+
+        self.user_ids = []
+        self.tweet_ids = []
+        self.followers = defaultdict(list)
+
+    def generate(self):
+        self.create_users()
+        self.create_friendships()
+        self.create_tweets()
+        self.create_comments()
+        self.create_likes()
+        self.update_counters()
+        return {
+            'users': len(self.user_ids),
+            'friendships': sum(len(ids) for ids in self.followers.values()),
+            'tweets': len(self.tweet_ids),
+            'newsfeeds': NewsFeedService.count(),
+            'comments': self.num_comments,
+            'likes': Like.objects.count(),
+        }
+
+    def create_users(self):
+        # 密码 hash 非常慢，所有用户共用同一个 hash
+        password = make_password(BENCH_PASSWORD)
+        User.objects.bulk_create([
+            User(
+                username=f'{USERNAME_PREFIX}{i}',
+                email=f'{USERNAME_PREFIX}{i}@jiuzhang.com',
+                password=password,
+            )
+            for i in range(self.num_users)
+        ], batch_size=self.batch_size)
+        # MySQL 的 bulk_create 不会把 id 填回来，需要再查一次
+        self.user_ids = list(
+            User.objects.filter(username__startswith=USERNAME_PREFIX)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+
+    def create_friendships(self):
+        # 第 i 受欢迎的用户被 follow 的权重是 1 / (i + 1) ^ alpha
+        popularity = list(self.user_ids)
+        self.random.shuffle(popularity)
+        cum_weights = list(accumulate(
+            1.0 / (rank + 1) ** self.alpha
+            for rank in range(len(popularity))
+        ))
+        friendships = []
+        for from_user_id in self.user_ids:
+            to_user_ids = set(self.random.choices(
+                popularity,
+                cum_weights=cum_weights,
+                k=self.follows_per_user,
+            ))
+            to_user_ids.discard(from_user_id)
+            for to_user_id in sorted(to_user_ids):
+                self.followers[to_user_id].append(from_user_id)
+                friendships.append(Friendship(
+                    from_user_id=from_user_id,
+                    to_user_id=to_user_id,
+                ))
+        Friendship.objects.bulk_create(friendships, batch_size=self.batch_size)
+
+    def create_tweets(self):
+        authors = [
+            self.random.choice(self.user_ids)
+            for _ in range(self.num_tweets)
+        ]
+        Tweet.objects.bulk_create([
+            Tweet(user_id=user_id, content=f'benchmark tweet {i}')
+            for i, user_id in enumerate(authors)
+        ], batch_size=self.batch_size)
+        tweets = list(
+            Tweet.objects.filter(user_id__in=self.user_ids)
+            .order_by('id')
+            .values_list('id', 'user_id', 'created_at')
+        )
+        self.tweet_ids = [tweet_id for tweet_id, _, _ in tweets]
+
+        # 和 NewsFeedService.fanout_to_followers 一样，每个 follower 和作者自己各一条
+        newsfeeds = []
+        for tweet_id, user_id, created_at in tweets:
+            for owner_id in [user_id] + self.followers[user_id]:
+                newsfeeds.append(NewsFeed(
+                    user_id=owner_id,
+                    tweet_id=tweet_id,
+                    tweet_user_id=user_id,
+                    tweet_created_at=created_at,
+                ))
+            if len(newsfeeds) >= self.batch_size:
+                NewsFeedService.bulk_create(newsfeeds, batch_size=self.batch_size)
+                newsfeeds = []
+        NewsFeedService.bulk_create(newsfeeds, batch_size=self.batch_size)
+
+    def create_comments(self):
+        Comment.objects.bulk_create([
+            Comment(
+                user_id=self.random.choice(self.user_ids),
+                tweet_id=self.random.choice(self.tweet_ids),
+                content=f'benchmark comment {i}',
+            )
+            for i in range(self.num_comments)
+        ], batch_size=self.batch_size)
+
+    def create_likes(self):
+        content_type = ContentType.objects.get_for_model(Tweet)
+        # (user, content_type, object_id) 是 unique 的，先在内存里去重
+        pairs = set()
+        max_pairs = len(self.user_ids) * len(self.tweet_ids)
+        while len(pairs) < min(self.num_likes, max_pairs):
+            pairs.add((
+                self.random.choice(self.user_ids),
+                self.random.choice(self.tweet_ids),
+            ))
+        Like.objects.bulk_create([
+            Like(user_id=user_id, content_type=content_type, object_id=tweet_id)
+            for user_id, tweet_id in sorted(pairs)
+        ], batch_size=self.batch_size)
+
+    def update_counters(self):
+        # bulk_create 不经过 LikeService, 也不发 post_save, comments_count / likes_count 要自己数
+        # 否则 tweet 的 JSON 和 ranking 的分数都和真实的数据不一样
+        for i in range(0, len(self.tweet_ids), self.batch_size):
+            TweetService.recount_counters(self.tweet_ids[i:i + self.batch_size])
@@ -0,0 +1,119 @@
+import json
+import platform
+import subprocess
+import time
+
+from benchmarks.database import benchmark_database
+from benchmarks.graph import SocialGraphGenerator
+from benchmarks.runner import ENDPOINTS, AsyncEndpointBenchmark, EndpointBenchmark
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=settings.BASE_DIR,
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    """
+    python manage.py benchmark --users 1000 --tweets 5000 --concurrency 8
+
+    比较同步 (WSGI) 和 async (ASGI) 的接口:
+    python manage.py benchmark --transport wsgi --endpoints newsfeeds.list --concurrency 32
+    python manage.py benchmark --transport asgi --endpoints async.newsfeeds.list --concurrency 32
+
+    默认会像跑 test 一样新建一个测试数据库，造数据，跑完之后删掉，不会碰到真实的数据。
+    同样的参数 + 同样的 seed 生成的数据和请求序列都是一样的，所以不同 commit 的结果可以直接比较
+    """
+    help = 'Generate a synthetic social graph and benchmark the API endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--tweets', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--likes', type=int, default=10000)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument(
+            '--alpha', type=float, default=1.2,
+            help='Exponent of the power-law follower distribution.',
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Measured requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument(
+            '--endpoints', default=','.join(ENDPOINTS),
+            help='Comma separated list of: {}'.format(', '.join(ENDPOINTS)),
+        )
+        parser.add_argument(
+            '--transport', choices=['wsgi', 'asgi'], default='wsgi',
+            help='wsgi: one thread per concurrent request. '
+                 'asgi: all concurrent requests on one event loop.',
+        )
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the benchmark database between runs (data is regenerated).',
+        )
+
+    def handle(self, *args, **options):
+        endpoints = [name for name in options['endpoints'].split(',') if name]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError('unknown endpoints: {}'.format(', '.join(sorted(unknown))))
+
+        with benchmark_database(keepdb=options['keepdb']):
+            report = self.run_benchmark(endpoints, options)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+    def run_benchmark(self, endpoints, options):
+        generator = SocialGraphGenerator(
+            users=options['users'],
+            tweets=options['tweets'],
+            comments=options['comments'],
+            likes=options['likes'],
+            follows_per_user=options['follows_per_user'],
+            alpha=options['alpha'],
+            seed=options['seed'],
+        )
+        start = time.perf_counter()
+        graph = generator.generate()
+        graph['seconds'] = round(time.perf_counter() - start, 3)
+
+        benchmark_class = AsyncEndpointBenchmark if options['transport'] == 'asgi' else EndpointBenchmark
+        benchmark = benchmark_class(
+            user_ids=generator.user_ids,
+            tweet_ids=generator.tweet_ids,
+            requests=options['requests'],
+            concurrency=options['concurrency'],
+            warmup=options['warmup'],
+            seed=options['seed'],
+            endpoints=endpoints,
+        )
+        return {
+            'git_commit': get_git_commit(),
+            'python': platform.python_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'config': {
+                key: options[key]
+                for key in (
+                    'users', 'tweets', 'comments', 'likes', 'follows_per_user',
+                    'alpha', 'seed', 'requests', 'concurrency', 'warmup', 'transport',
+                )
+            },
+            'graph': graph,
+            'endpoints': benchmark.run(),
+        }
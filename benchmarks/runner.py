@@ -0,0 +1,247 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import AsyncClient, Client
+from rest_framework.test import APIClient
+from utils.metrics import QueryCounter
+
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile, sorted_values 必须是排好序的
+    if not sorted_values:
+        return None
+    index = max(0, int(round(p / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def create_tweet(rng, user_ids, tweet_ids):
+    return 'post', '/api/tweets/', {'content': 'benchmark tweet {}'.format(rng.random())}
+
+
+def list_newsfeeds(rng, user_ids, tweet_ids):
+    return 'get', '/api/newsfeeds/', None
+
+
+def follow(rng, user_ids, tweet_ids):
+    return 'post', '/api/friendships/{}/follow/'.format(rng.choice(user_ids)), None
+
+
+def list_comments(rng, user_ids, tweet_ids):
+    return 'get', '/api/comments/', {'tweet_id': rng.choice(tweet_ids)}
+
+
+def list_tweets(rng, user_ids, tweet_ids):
+    return 'get', '/api/tweets/', {'user_id': rng.choice(user_ids)}
+
+
+def retrieve_tweet(rng, user_ids, tweet_ids):
+    return 'get', '/api/tweets/{}/'.format(rng.choice(tweet_ids)), None
+
+
+def async_endpoint(make_request):
+    # 同一个接口的 async 版本，url 多一个 /async
+    def make_async_request(rng, user_ids, tweet_ids):
+        method, url, data = make_request(rng, user_ids, tweet_ids)
+        return method, url.replace('/api/', '/api/async/', 1), data
+    return make_async_request
+
+
+# endpoint 的名字 -> 生成 (method, url, data) 的函数
+ENDPOINTS = {
+    'tweets.create': create_tweet,
+    'newsfeeds.list': list_newsfeeds,
+    'friendships.follow': follow,
+    'comments.list': list_comments,
+    'tweets.list': list_tweets,
+    'tweets.retrieve': retrieve_tweet,
+    'async.newsfeeds.list': async_endpoint(list_newsfeeds),
+    'async.comments.list': async_endpoint(list_comments),
+    'async.tweets.list': async_endpoint(list_tweets),
+    'async.tweets.retrieve': async_endpoint(retrieve_tweet),
+}
+
+
+class EndpointBenchmark(object):
+    """
+    在进程内用 APIClient 并发地调用真实的 API，
+    统计每个 endpoint 的吞吐量，p50/p95/p99 延迟和每个 request 的 SQL 条数
+    """
+
+    def __init__(
+            self,
+            user_ids,
+            tweet_ids,
+            requests=200,
+            concurrency=4,
+            warmup=10,
+            seed=42,
+            endpoints=None,
+    ):
+        self.user_ids = list(user_ids)
+        self.tweet_ids = list(tweet_ids)
+        self.requests = requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+        self.seed = seed
+        self.endpoints = endpoints or list(ENDPOINTS)
+        self._users = {}
+        self._cookies = {}
+        self._users_lock = threading.Lock()
+
+    def run(self):
+        return {
+            name: self.run_endpoint(name)
+            for name in self.endpoints
+        }
+
+    def split_requests(self, name):
+        # 每个并发的 worker 分到的 request 数和它自己的随机数生成器
+        per_worker = [
+            self.requests // self.concurrency + (1 if i < self.requests % self.concurrency else 0)
+            for i in range(self.concurrency)
+        ]
+        rngs = [
+            random.Random('{}:{}:{}'.format(self.seed, name, i))
+            for i in range(self.concurrency)
+        ]
+        return per_worker, rngs
+
+    def run_endpoint(self, name):
+        make_request = ENDPOINTS[name]
+        # 先预热，不计入结果
+        self._run_worker(make_request, self.warmup, random.Random(self.seed - 1))
+
+        per_worker, rngs = self.split_requests(name)
+        start = time.perf_counter()
+        if self.concurrency == 1:
+            # 单线程的时候直接在当前线程跑，没有线程切换的开销
+            samples = self._run_worker(make_request, per_worker[0], rngs[0])
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = [
+                    executor.submit(self._run_worker, make_request, count, rng)
+                    for count, rng in zip(per_worker, rngs)
+                ]
+                samples = [sample for future in futures for sample in future.result()]
+        elapsed = time.perf_counter() - start
+        return self.summarize(samples, elapsed)
+
+    def summarize(self, samples, elapsed):
+        latencies = sorted(latency for latency, _, _ in samples)
+        queries = [query_count for _, query_count, _ in samples if query_count is not None]
+        errors = sum(1 for _, _, status_code in samples if status_code >= 400)
+        return {
+            'requests': len(samples),
+            'errors': errors,
+            'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+            'latency_ms': {
+                'p50': _ms(percentile(latencies, 50)),
+                'p95': _ms(percentile(latencies, 95)),
+                'p99': _ms(percentile(latencies, 99)),
+                'mean': _ms(sum(latencies) / len(latencies)) if latencies else None,
+            },
+            'queries_per_request': {
+                'mean': round(sum(queries) / len(queries), 2) if queries else None,
+                'max': max(queries) if queries else None,
+            },
+        }
+
+    def _get_user(self, user_id):
+        with self._users_lock:
+            if user_id not in self._users:
+                self._users[user_id] = User.objects.get(id=user_id)
+            return self._users[user_id]
+
+    def _get_cookies(self, user_id):
+        # async 的 view 只支持 session 登录，每个用户登录一次，之后复用 session cookie
+        with self._users_lock:
+            if user_id not in self._cookies:
+                client = Client()
+                client.force_login(User.objects.get(id=user_id))
+                self._cookies[user_id] = client.cookies
+            # 每个 client 一份，response 里的 Set-Cookie 不会影响别的 client
+            cookies = SimpleCookie()
+            cookies.update(self._cookies[user_id])
+            return cookies
+
+    def _run_worker(self, make_request, count, rng):
+        # 500 记为 error，而不是让整个 benchmark 挂掉
+        client = APIClient(raise_request_exception=False)
+        samples = []
+        try:
+            for _ in range(count):
+                user_id = rng.choice(self.user_ids)
+                method, url, data = make_request(rng, self.user_ids, self.tweet_ids)
+                if url.startswith('/api/async/'):
+                    client.cookies = self._get_cookies(user_id)
+                else:
+                    client.force_authenticate(self._get_user(user_id))
+                counter = QueryCounter()
+                start = time.perf_counter()
+                with counter.install():
+                    response = getattr(client, method)(url, data)
+                samples.append((
+                    time.perf_counter() - start,
+                    counter.query_count,
+                    response.status_code,
+                ))
+        finally:
+            # 每个线程有自己的数据库连接，用完要关掉
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+        return samples
+
+
+class AsyncEndpointBenchmark(EndpointBenchmark):
+    """
+    通过 ASGI handler 调用 API，concurrency 个 coroutine 跑在同一个 event loop 上，
+    相当于一个 ASGI worker 同时处理 concurrency 个 request。
+    和 EndpointBenchmark（每个并发占一个线程，相当于 WSGI 的一个 worker 线程）的结果对比，
+    就能看出 async 的 view 每个 worker 能撑住多少并发
+
+    ASGI 下 SQL 在线程池里执行，没法按 request 统计，queries_per_request 是空的
+    """
+
+    def run_endpoint(self, name):
+        return async_to_sync(self._run_endpoint)(name)
+
+    async def _run_endpoint(self, name):
+        make_request = ENDPOINTS[name]
+        await self._run_worker_async(make_request, self.warmup, random.Random(self.seed - 1))
+
+        per_worker, rngs = self.split_requests(name)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            self._run_worker_async(make_request, count, rng)
+            for count, rng in zip(per_worker, rngs)
+        ))
+        elapsed = time.perf_counter() - start
+        return self.summarize([sample for samples in results for sample in samples], elapsed)
+
+    async def _run_worker_async(self, make_request, count, rng):
+        client = AsyncClient(raise_request_exception=False)
+        samples = []
+        for _ in range(count):
+            client.cookies = await sync_to_async(self._get_cookies)(rng.choice(self.user_ids))
+            method, url, data = make_request(rng, self.user_ids, self.tweet_ids)
+            if method == 'get' and data:
+                # Django 3.1.3 的 AsyncClient.get 会丢掉 data, 自己拼到 url 上
+                url, data = '{}?{}'.format(url, urlencode(data)), None
+            start = time.perf_counter()
+            response = await getattr(client, method)(url, data)
+            samples.append((time.perf_counter() - start, None, response.status_code))
+        return samples
+
+
+def _ms(seconds):
+    if seconds is None:
+        return None
+    return round(seconds * 1000, 3)
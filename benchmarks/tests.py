@@ -0,0 +1,110 @@
+from benchmarks.graph import SocialGraphGenerator
+from benchmarks.runner import AsyncEndpointBenchmark, EndpointBenchmark, percentile
+from friendships.models import Friendship
+from testing.testcases import TestCase, TransactionTestCase
+from tweets.models import Tweet
+
+
+class SocialGraphGeneratorTests(TestCase):
+
+    def test_generate(self):
+        generator = SocialGraphGenerator(
+            users=30,
+            tweets=40,
+            comments=20,
+            likes=50,
+            follows_per_user=5,
+            seed=1,
+        )
+        graph = generator.generate()
+        self.assertEqual(graph['users'], 30)
+        self.assertEqual(graph['tweets'], 40)
+        self.assertEqual(graph['likes'], 50)
+        self.assertEqual(graph['friendships'], Friendship.objects.count())
+        # 每个 tweet 的作者和所有 follower 都有一条 newsfeed
+        self.assertEqual(graph['newsfeeds'], sum(
+            len(generator.followers[user_id]) + 1
+            for user_id in Tweet.objects.values_list('user_id', flat=True)
+        ))
+        # 冗余的计数和实际的 comment / like 一样
+        for tweet in Tweet.objects.all():
+            self.assertEqual(tweet.comments_count, tweet.comment_set.count())
+            self.assertEqual(tweet.likes_count, tweet.like_set.count())
+        self.assertEqual(sum(Tweet.objects.values_list('comments_count', flat=True)), 20)
+        self.assertEqual(sum(Tweet.objects.values_list('likes_count', flat=True)), 50)
+        # 没有人 follow 自己
+        self.assertFalse(any(
+            user_id in follower_ids
+            for user_id, follower_ids in generator.followers.items()
+        ))
+
+    def test_power_law(self):
+        generator = SocialGraphGenerator(
+            users=200,
+            tweets=1,
+            comments=0,
+            likes=0,
+            follows_per_user=10,
+            seed=1,
+        )
+        generator.create_users()
+        generator.create_friendships()
+        follower_counts = sorted(
+            (len(ids) for ids in generator.followers.values()),
+            reverse=True,
+        )
+        # 最受欢迎的用户的粉丝数远远多于中位数
+        self.assertGreater(follower_counts[0], 10 * follower_counts[len(follower_counts) // 2])
+
+
+class EndpointBenchmarkTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_run(self):
+        generator = SocialGraphGenerator(
+            users=10, tweets=10, comments=10, likes=10, follows_per_user=3, seed=1,
+        )
+        generator.generate()
+        benchmark = EndpointBenchmark(
+            generator.user_ids,
+            generator.tweet_ids,
+            requests=4,
+            concurrency=1,
+            warmup=0,
+            endpoints=['newsfeeds.list', 'comments.list'],
+        )
+        report = benchmark.run()
+        self.assertEqual(report['newsfeeds.list']['requests'], 4)
+        self.assertEqual(report['newsfeeds.list']['errors'], 0)
+        self.assertGreater(report['comments.list']['queries_per_request']['mean'], 0)
+
+
+class AsyncEndpointBenchmarkTests(TransactionTestCase):
+
+    def test_run(self):
+        self.clear_cache()
+        generator = SocialGraphGenerator(
+            users=10, tweets=10, comments=10, likes=10, follows_per_user=3, seed=1,
+        )
+        generator.generate()
+        benchmark = AsyncEndpointBenchmark(
+            generator.user_ids,
+            generator.tweet_ids,
+            requests=6,
+            concurrency=3,
+            warmup=1,
+            endpoints=['async.newsfeeds.list', 'async.tweets.retrieve', 'tweets.list'],
+        )
+        report = benchmark.run()
+        for name in benchmark.endpoints:
+            self.assertEqual(report[name]['requests'], 6)
+            self.assertEqual(report[name]['errors'], 0)
+        self.assertIsNone(report['tweets.list']['queries_per_request']['mean'])
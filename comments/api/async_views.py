@@ -0,0 +1,25 @@
+from comments.api.serializers import CommentFastSerializer
+from comments.models import Comment
+from rest_framework import status
+from utils.async_views import async_api_view, async_required_params, json_response, run_sync
+from utils.fast_serializers import prefetch_unless_cached
+
+
+def serialize_comments(tweet_id):
+    # tweet 的 async retrieve 也用这个
+    comments = Comment.objects.filter(tweet_id=tweet_id).order_by('id')
+    return CommentFastSerializer(prefetch_unless_cached(comments, 'user'), many=True).data
+
+
+@async_api_view
+@async_required_params(params=['tweet_id'])
+async def list_comments(request):
+    """
+    GET /api/async/comments/?tweet_id=1
+    CommentViewSet.list 的 async 版本，输出一样
+    """
+    tweet_id = request.GET['tweet_id']
+    if not tweet_id.isdigit():
+        return json_response({'tweet_id': ['Enter a number.']}, status=status.HTTP_400_BAD_REQUEST)
+    comments = await run_sync(serialize_comments, int(tweet_id))
+    return json_response({'comments': comments})
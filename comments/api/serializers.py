@@ -2,7 +2,8 @@ from accounts.api.serializers import UserSerializerForComment
 from comments.models import Comment
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.fast_serializers import FastSerializer
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -12,6 +13,9 @@ class CommentSerializer(serializers.ModelSerializer):
     # 加了下面只一句，fields里面的user会以一个嵌套的user dict来显示
     # 这个dict是user的具体信息
     user = UserSerializerForComment()
+    # 64 位的 snowflake id 的字符串，见 TweetSerializer.id_str
+    id_str = serializers.CharField(source='id', read_only=True)
+    tweet_id_str = serializers.CharField(source='tweet_id', read_only=True)
 
     # 一般来说， serializer都是用于显示某个model对应的具体的object
     class Meta:
@@ -20,7 +24,9 @@ class CommentSerializer(serializers.ModelSerializer):
         # @ fields 把要展示的fields 以白名单的模式列在这里
         fields = (
             'id',
+            'id_str',
             'tweet_id',
+            'tweet_id_str',
             'user',
             'content',
             'created_at',
@@ -28,6 +34,11 @@ class CommentSerializer(serializers.ModelSerializer):
         )
 
 
+class CommentFastSerializer(FastSerializer):
+    # comment list 的热点读路径用，输出和 CommentSerializer 完全一样
+    serializer_class = CommentSerializer
+
+
 class CommentSerializerForCreate(serializers.ModelSerializer):
     # 这两项必须手动添加
     # 因为默认的ModelSerializer里面只会自动包含user和tweet，而不是user_id 和 tweet_id
@@ -42,25 +53,25 @@ class CommentSerializerForCreate(serializers.ModelSerializer):
         # 把要展示的field以白名单的形式写下来
         fields = ('content', 'tweet_id', 'user_id', )
 
-        # 总共传进来三个参数， user_id, tweet_id, content
-        # user_id 是当前登录用户的id，self.request.user.id, 不需要验证
-            # 因为permission会验证，只有登录的用户才行
-        # comments：会自动根据数据库的定义进行验证，这里不需要验证
-        # 这里只对tweet_id进行验证， 验证这个tweet是否存在
-        def validate(self, data):
-            tweet_id = data["tweet_id"]
-            if not Tweet.objects.filter(id=tweet_id).exists():
-                raise ValidationError({'message': 'tweet does not exist'})
-            # 必须是return validated data
-            # 也就是经过验证之后，进行过处理的（当然也可以不作处理）输入数据
-            return data
-
-        def create(self, validated_data):
-            return Comment.objects.create(
-                user_id=validated_data['user_id'],
-                tweet_id=validated_data['tweet_id'],
-                content=validated_data['content'],
-            )
+    # 总共传进来三个参数， user_id, tweet_id, content
+    # user_id 是当前登录用户的id，self.request.user.id, 不需要验证
+        # 因为permission会验证，只有登录的用户才行
+    # comments：会自动根据数据库的定义进行验证，这里不需要验证
+    # 这里只对tweet_id进行验证， 验证这个tweet是否存在（软删除的 tweet 也算不存在）
+    def validate(self, data):
+        tweet_id = data["tweet_id"]
+        if not TweetService.get_visible_tweets().filter(id=tweet_id).exists():
+            raise ValidationError({'message': 'tweet does not exist'})
+        # 必须是return validated data
+        # 也就是经过验证之后，进行过处理的（当然也可以不作处理）输入数据
+        return data
+
+    def create(self, validated_data):
+        return Comment.objects.create(
+            user_id=validated_data['user_id'],
+            tweet_id=validated_data['tweet_id'],
+            content=validated_data['content'],
+        )
 
 
 class CommentSerializerForUpdate(serializers.ModelSerializer):
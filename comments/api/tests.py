@@ -2,18 +2,20 @@ from comments.models import Comment
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
-from testing.testcases import TestCase
+from testing.testcases import TestCase, TransactionTestCase
 
 
 
 COMMENT_URL = '/api/comments/'
 COMMENT_DETAIL_URL = '/api/comments/{}/'
+ASYNC_COMMENT_URL = '/api/async/comments/'
 
 
 
 class CommentApiTests(TestCase):
 
     def setUp(self):
+        self.clear_cache()
         self.linghu = self.create_user('linghu')
         self.linghu_client = APIClient()
         self.linghu_client.force_authenticate(self.linghu)
@@ -58,6 +60,14 @@ class CommentApiTests(TestCase):
         self.assertEqual(response.data['tweet_id'], self.tweet.id)
         self.assertEqual(response.data['content'], '1')
 
+        # 带同一个 Idempotency-Key 的重试不会再创建一个 comment
+        data = {'tweet_id': self.tweet.id, 'content': 'retry me'}
+        response = self.linghu_client.post(COMMENT_URL, data, HTTP_IDEMPOTENCY_KEY='comment-1')
+        retry = self.linghu_client.post(COMMENT_URL, data, HTTP_IDEMPOTENCY_KEY='comment-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, response.data)
+        self.assertEqual(Comment.objects.filter(content='retry me').count(), 1)
+
     def test_detroy(self):
         comment = self.create_comment(self.linghu, self.tweet)
         url = COMMENT_DETAIL_URL.format(comment.id)
@@ -143,5 +153,48 @@ class CommentApiTests(TestCase):
         })
         self.assertEqual(len(response.data["comments"]), 2)
 
+    def test_list_queries(self):
+        def list_comments():
+            response = self.anonymous_client.get(COMMENT_URL, {
+                'tweet_id': self.tweet.id,
+            })
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.create_comment(self.linghu, self.tweet)
+        with self.assertQueriesMatchSnapshot('list'):
+            list_comments()
+
+        def add_comments():
+            for i in range(3):
+                user = self.create_user(f'commenter{i}')
+                self.create_comment(user, self.tweet)
+        self.assertQueryCountIndependentOfRows(list_comments, add_comments)
+
+    def test_create_queries(self):
+        with self.assertQueriesMatchSnapshot('create'):
+            response = self.linghu_client.post(COMMENT_URL, {
+                'tweet_id': self.tweet.id,
+                'content': '1',
+            })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
 
+class CommentAsyncApiTests(TransactionTestCase):
 
+    def test_list(self):
+        self.clear_cache()
+        linghu = self.create_user('linghu')
+        tweet = self.create_tweet(linghu)
+        response = self.client.get(ASYNC_COMMENT_URL)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.content, self.client.get(COMMENT_URL).content)
+
+        self.create_comment(linghu, tweet, '1')
+        self.create_comment(self.create_user('dongxie'), tweet, '2')
+        response = self.client.get(ASYNC_COMMENT_URL, {'tweet_id': tweet.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.content,
+            self.client.get(COMMENT_URL, {'tweet_id': tweet.id}).content,
+        )
+        self.assertEqual([c['content'] for c in response.json()['comments']], ['1', '2'])
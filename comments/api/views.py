@@ -3,12 +3,14 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from comments.models import Comment
 from comments.api.serializers import (
+    CommentFastSerializer,
     CommentSerializer,
     CommentSerializerForCreate,
     CommentSerializerForUpdate,
 )
-from comments.api.permissions import IsObjectOwner
-from utils.decorators import required_params
+from utils.permissions import IsObjectOwner
+from outbox.services import OutboxService
+from utils.decorators import idempotent, required_params
 
 
 class CommentViewSet(viewsets.GenericViewSet):
@@ -81,17 +83,19 @@ class CommentViewSet(viewsets.GenericViewSet):
         # 来看看是否要进行相应的filter
         comments = self.filter_queryset(queryset)\
             .prefetch_related('user')\
-            .order_by('created_at')
+            .order_by('id')
         # prefetch_related 优化处理
+        # comment 的 id 按时间递增，按 id 排序就是按时间排序，走 (tweet, id) 的索引
 
         # many=True 表示返回是list of dict
-        serializer = CommentSerializer(comments, many=True)
+        serializer = CommentFastSerializer(comments, many=True)
         # 不直接写 serializer.data 是因为return 风格的要求： 返回必须是个dict， 不能是list
         return Response(
             {"comments": serializer.data},
             status=status.HTTP_200_OK,
         )
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         data = {
             'user_id': request.user.id,  # 当前登录用户的id
@@ -112,7 +116,9 @@ class CommentViewSet(viewsets.GenericViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         # save方法会触发serializer里面的create方法，
-        comment = serializer.save()
+        # comment.created 事件在同一个 transaction 里写进去，由 handler 更新 tweet 的计数
+        with OutboxService.atomic():
+            comment = serializer.save()
         return Response(
             CommentSerializer(comment).data,
             status=status.HTTP_201_CREATED,
@@ -147,7 +153,8 @@ class CommentViewSet(viewsets.GenericViewSet):
 
     def destroy(self, request, *args, **kwargs):
         comment = self.get_object()
-        comment.delete()
+        with OutboxService.atomic():
+            comment.delete()
 
         # DRF里面默认destroy返回的是 status code = 204 no content
         # 这里return success=True 更直观的让前端去做判断， 所以 return 200 更合适
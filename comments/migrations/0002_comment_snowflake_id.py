@@ -0,0 +1,24 @@
+# Generated by Django 3.1.3 on 2026-10-19 14:27
+
+from django.db import migrations, models
+import utils.snowflake
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0005_tweet_snowflake_id'),
+        ('comments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comment',
+            name='id',
+            field=models.BigIntegerField(default=utils.snowflake.next_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together={('tweet', 'id')},
+        ),
+    ]
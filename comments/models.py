@@ -3,6 +3,9 @@ from django.contrib.auth.models import User
 from tweets.models import Tweet
 from likes.models import Like
 from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_delete, post_save
+from outbox.listeners import publish_created, publish_deleted
+from utils.snowflake import next_id
 
 # Create your models here.
 class Comment(models.Model):
@@ -10,6 +13,8 @@ class Comment(models.Model):
     在这个版本上，我们先实现一个比较简单的评论
     评论只评论在某个Tweet上，不能评论别人的评论
     """
+    # 和 Tweet 一样用按时间递增的 id（见 utils.snowflake），按 id 排序就是按评论的时间排序
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
     # User 和 comments是one to many. one user can have many comments. one comments can only belong to one user
     # So ForeignKey in many side, that is, on comments side
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -24,7 +29,7 @@ class Comment(models.Model):
     class Meta:
         # Demand: sort all comments under one tweet.
         # 在某个tweet下排序所有 comments的需求
-        index_together = (('tweet', 'created_at'),)
+        index_together = (('tweet', 'id'),)
 
     @property
     def like_set(self):
@@ -40,3 +45,7 @@ class Comment(models.Model):
             self.content,
             self.tweet_id,  # question: why tweet_id
         )
+
+
+post_save.connect(publish_created, sender=Comment)
+post_delete.connect(publish_deleted, sender=Comment)
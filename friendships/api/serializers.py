@@ -3,6 +3,7 @@ from friendships.models import Friendship
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from django.contrib.auth.models import User
+from utils.fast_serializers import FastSerializer
 
 
 class FriendshipSerializerForCreate(serializers.ModelSerializer):
@@ -70,6 +71,15 @@ class FollowerSerializer(serializers.ModelSerializer):
         # 如果找不到，再到model里去找。
 
 
+# followers / followings 的热点读路径用，输出和上面两个 serializer 完全一样
+class FollowingFastSerializer(FastSerializer):
+    serializer_class = FollowingSerializer
+
+
+class FollowerFastSerializer(FastSerializer):
+    serializer_class = FollowerSerializer
+
+
 class FriendshipsSerializer(serializers.ModelSerializer):
     # from_user = UserSerializerForFriendship(source='from_user')
     # to_user = UserSerializerForFriendship(source='to_user')
@@ -21,6 +21,7 @@ class FriendshipApiTests(TestCase):
     # 每次调用TweetApiTests类下面的test_开头的方法 之前，都会先去执行setUp方法，
     # 所以我们可以将每 个test_xx方法公用的初始化信息都写在这里。
     def setUp(self):
+        self.clear_cache()
         # self.anonymous_client = APIClient() # no need
 
         # user1, user2 are authenticated
@@ -70,6 +71,18 @@ class FriendshipApiTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Friendship.objects.count(), count + 1)
 
+    def test_follow_with_idempotency_key(self):
+        self.clear_cache()
+        url = FOLLOW_URL.format(self.user1.id)
+        count = Friendship.objects.count()
+        response = self.user2_client.post(url, HTTP_IDEMPOTENCY_KEY='follow-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # 重试拿到的是第一次的 response, 而不是 duplicate
+        retry = self.user2_client.post(url, HTTP_IDEMPOTENCY_KEY='follow-1')
+        self.assertEqual(retry.data, response.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Friendship.objects.count(), count + 1)
+
 
     def test_unfollow(self):
         url = UNFOLLOW_URL.format(self.user1.id)
@@ -149,8 +162,39 @@ class FriendshipApiTests(TestCase):
             'user2_follower 0',
         )
 
+    def test_followers_queries(self):
+        url = FOLLOWERS_URL.format(self.user2.id)
 
+        def list_followers():
+            response = self.anonymous_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+        with self.assertQueriesMatchSnapshot('followers'):
+            list_followers()
 
+        def add_followers():
+            for i in range(3):
+                follower = self.create_user(f'user2_new_follower {i}')
+                Friendship.objects.create(from_user=follower, to_user=self.user2)
+        self.assertQueryCountIndependentOfRows(list_followers, add_followers)
 
+    def test_followings_queries(self):
+        url = FOLLOWINGS_URL.format(self.user2.id)
+
+        def list_followings():
+            response = self.anonymous_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertQueriesMatchSnapshot('followings'):
+            list_followings()
 
+        def add_followings():
+            for i in range(3):
+                following = self.create_user(f'user2_new_following {i}')
+                Friendship.objects.create(from_user=self.user2, to_user=following)
+        self.assertQueryCountIndependentOfRows(list_followings, add_followings)
+
+    def test_follow_queries(self):
+        with self.assertQueriesMatchSnapshot('follow'):
+            response = self.user2_client.post(FOLLOW_URL.format(self.user1.id))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -5,11 +5,15 @@ from rest_framework.response import Response
 from friendships.models import Friendship
 from friendships.api.serializers import (
     FriendshipSerializerForCreate,
+    FollowerFastSerializer,
     FollowerSerializer,
+    FollowingFastSerializer,
     FollowingSerializer,
     FriendshipsSerializer,
 )
 from django.contrib.auth.models import User
+from outbox.services import OutboxService
+from utils.decorators import idempotent
 
 
 class FriendshipViewSet(viewsets.GenericViewSet):
@@ -36,8 +40,10 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     def followers(self, request, pk):
         # GET /api/friendships/1/followers, pk 就是 1
-        friendships = Friendship.objects.filter(to_user_id=pk).order_by('-created_at')
-        serializer = FollowerSerializer(friendships, many=True)
+        friendships = Friendship.objects.filter(
+            to_user_id=pk,
+        ).order_by('-created_at').prefetch_related('from_user')
+        serializer = FollowerFastSerializer(friendships, many=True)
         # if there is url field in FollowerSerializer defination, "context={'request': request}" is needed when instantiating the serializer
         # serializer = FollowerSerializer(friendships, context={'request': request}, many=True)
 
@@ -48,8 +54,10 @@ class FriendshipViewSet(viewsets.GenericViewSet):
 
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     def followings(self, request, pk):
-        friendships = Friendship.objects.filter(from_user_id=pk).order_by('-created_at')
-        serializer = FollowingSerializer(friendships, many=True)
+        friendships = Friendship.objects.filter(
+            from_user_id=pk,
+        ).order_by('-created_at').prefetch_related('to_user')
+        serializer = FollowingFastSerializer(friendships, many=True)
         # To serialize a queryset or list of objects instead of a single object instance, you should pass the "many=True" flag when instantiating the serializer. You can then pass a queryset or list of objects to be serialized.
 
         return Response(
@@ -61,6 +69,7 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     # 因为是创建了一条新的记录， 所以用'POST'
     # 因为是基于某一个用户，所以 detail=True
     @action(methods=['POST'], detail=True, permission_classes=[IsAuthenticated])
+    @idempotent
     def follow(self, request, pk):
         # /api/friendships/pk/follow : 当前登录的用户 follow user_id=pk 的用户
         # 特殊判断重复follow的情况（比如前端猛点好多少次follow)
@@ -95,7 +104,8 @@ class FriendshipViewSet(viewsets.GenericViewSet):
                 'errors': serializer.errors,
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        instance = serializer.save()
+        with OutboxService.atomic():
+            instance = serializer.save()
 
         return Response(
             # 通过FollowingSerializer(instance)， 可以得到nested dict， 就是把user的信息嵌套进去
@@ -127,11 +137,13 @@ class FriendshipViewSet(viewsets.GenericViewSet):
         # on_delete=models.CASCADE, 那么当 B 的某个数据被删除的时候，A 中的关联也会被删除。
         # 所以 CASCADE 是很危险的，我们一般最好不要用，而是用 on_delete=models.SET_NULL
         # 取而代之，这样至少可以避免误删除操作带来的多米诺效应。
-        deleted, _ = Friendship.objects.filter(
-            from_user=request.user,
-            to_user=unfollow_user,
-            # to_user=pk, # to_user=unfollow_user 和 to_user=pk 是一样的
-        ).delete()
+        # queryset 的 delete 也会给每一条发 post_delete, 和 friendship.deleted 事件在同一个 transaction 里
+        with OutboxService.atomic():
+            deleted, _ = Friendship.objects.filter(
+                from_user=request.user,
+                to_user=unfollow_user,
+                # to_user=pk, # to_user=unfollow_user 和 to_user=pk 是一样的
+            ).delete()
 
         return Response({'success': True, 'deleted': deleted})
 
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.3 on 2026-10-19 13:53
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('friendships', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='friendship',
+            index_together={('to_user_id', 'from_user_id'), ('to_user_id', 'created_at'), ('from_user_id', 'created_at')},
+        ),
+    ]
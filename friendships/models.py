@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from outbox.listeners import publish_created, publish_deleted
 
 
 class Friendship(models.Model):
@@ -28,11 +30,13 @@ class Friendship(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        index_together: (
+        index_together = (
             # 获取我关注的所有人，按照关注时间排序
             ('from_user_id', 'created_at'),
             # 获得关注我的所有人，按照关注时间排序
-            ('to_user_id', 'created_at')
+            ('to_user_id', 'created_at'),
+            # fanout 按 follower id 的范围分批取粉丝
+            ('to_user_id', 'from_user_id'),
         )
         # 一组字段名，合起来必须是唯一的
         # 在数据库层面设定唯一性约束， 避免出现重复，在高并发情况下会出现重复
@@ -41,3 +45,6 @@ class Friendship(models.Model):
     def __str__(self):
         return f'{self.from_user_id} followed {self.to_user_id}'
 
+
+post_save.connect(publish_created, sender=Friendship)
+post_delete.connect(publish_deleted, sender=Friendship)
@@ -1,5 +1,11 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
 from friendships.models import Friendship
-from newsfeeds.models import NewsFeed
+
+
+def follower_count_cache_key(user_id):
+    return f'friendships:followers_count:{user_id}'
 
 
 class FriendshipService(object):
@@ -45,3 +51,41 @@ class FriendshipService(object):
         ).prefetch_related('from_user')
         return [friendship.from_user for friendship in friendships]
 
+    @classmethod
+    def get_follower_ids(cls, user_id, min_id=None, max_id=None):
+        """
+        只取粉丝的 id, 不需要 user 对象，按 id 排好序
+        min_id / max_id 用来按 id 的范围分批取（包含两端）
+        """
+        friendships = Friendship.objects.filter(to_user_id=user_id)
+        if min_id is not None:
+            friendships = friendships.filter(from_user_id__gte=min_id)
+        if max_id is not None:
+            friendships = friendships.filter(from_user_id__lte=max_id)
+        return list(
+            friendships.order_by('from_user_id').values_list('from_user_id', flat=True)
+        )
+
+    @classmethod
+    def get_follower_counts(cls, user_ids):
+        """
+        {user_id: 粉丝数}, 给 newsfeed 的排序用的，不需要很准
+        大 V 的粉丝数 count 一次很慢，缓存 FOLLOWER_COUNT_CACHE_TIMEOUT 秒，关注 / 取关的时候不去更新
+        """
+        keys = {follower_count_cache_key(user_id): user_id for user_id in set(user_ids)}
+        counts = {keys[key]: count for key, count in cache.get_many(list(keys)).items()}
+        missing = [user_id for user_id in keys.values() if user_id not in counts]
+        if missing:
+            loaded = dict.fromkeys(missing, 0)
+            loaded.update(
+                Friendship.objects.filter(to_user_id__in=missing)
+                .order_by()
+                .values_list('to_user_id')
+                .annotate(count=Count('id'))
+            )
+            cache.set_many(
+                {follower_count_cache_key(user_id): count for user_id, count in loaded.items()},
+                getattr(settings, 'FOLLOWER_COUNT_CACHE_TIMEOUT', 600),
+            )
+            counts.update(loaded)
+        return counts
@@ -0,0 +1,23 @@
+from django.contrib import admin
+from hashtags.models import Hashtag, TweetHashtag, TweetMention
+
+
+@admin.register(Hashtag)
+class HashtagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'created_at')
+    search_fields = ('name',)
+    date_hierarchy = 'created_at'
+
+
+@admin.register(TweetHashtag)
+class TweetHashtagAdmin(admin.ModelAdmin):
+    list_display = ('hashtag', 'tweet_id', 'created_at')
+    raw_id_fields = ('hashtag', 'tweet')
+    date_hierarchy = 'created_at'
+
+
+@admin.register(TweetMention)
+class TweetMentionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'tweet_id', 'created_at')
+    raw_id_fields = ('user', 'tweet')
+    date_hierarchy = 'created_at'
@@ -0,0 +1,68 @@
+from django.test import override_settings
+from hashtags.services import TrendingService
+from outbox.services import OutboxService
+from rest_framework import status
+from rest_framework.test import APIClient
+from testing.testcases import TestCase
+
+
+TWEET_CREATE_API = '/api/tweets/'
+TWEET_RETRIEVE_API = '/api/tweets/{}/'
+HASHTAG_TWEETS_API = '/api/hashtags/{}/tweets/'
+TRENDING_API = '/api/hashtags/trending/'
+
+
+class HashtagApiTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.linghu_client = APIClient()
+        self.linghu_client.force_authenticate(self.linghu)
+
+    def post_tweet(self, content):
+        return self.linghu_client.post(TWEET_CREATE_API, {'content': content}).data['id']
+
+    @override_settings(HASHTAG_TWEETS_PAGE_SIZE=2)
+    def test_tweets(self):
+        # 发 tweet 的时候由 tweet.created 的 handler 解析出 hashtag
+        tweet_ids = [self.post_tweet(f'tweet {i} #Python') for i in range(3)]
+        self.post_tweet('no tags here')
+
+        response = self.anonymous_client.get(HASHTAG_TWEETS_API.format('python'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([tweet['id'] for tweet in response.data['tweets']], tweet_ids[:0:-1])
+        response = self.anonymous_client.get(HASHTAG_TWEETS_API.format('PYTHON'), {
+            'max_id': response.data['next_max_id'],
+        })
+        self.assertEqual([tweet['id'] for tweet in response.data['tweets']], [tweet_ids[0]])
+        self.assertIsNone(response.data['next_max_id'])
+
+        # 删掉的 tweet 马上就不展示了
+        self.linghu_client.delete(TWEET_RETRIEVE_API.format(tweet_ids[2]))
+        response = self.anonymous_client.get(HASHTAG_TWEETS_API.format('python'))
+        self.assertEqual([tweet['id'] for tweet in response.data['tweets']], [tweet_ids[1]])
+        OutboxService.dispatch_batch()
+        response = self.anonymous_client.get(HASHTAG_TWEETS_API.format('python'))
+        self.assertEqual(
+            [tweet['id'] for tweet in response.data['tweets']],
+            [tweet_ids[1], tweet_ids[0]],
+        )
+
+        response = self.anonymous_client.get(HASHTAG_TWEETS_API.format('unknown'))
+        self.assertEqual(response.data['tweets'], [])
+
+    def test_trending(self):
+        response = self.anonymous_client.get(TRENDING_API)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['hashtags'], [])
+
+        TrendingService.publish_snapshot([('python', 3), ('django', 1)])
+        # 只读 snapshot, 不查数据库
+        with self.assertNumQueries(0):
+            response = self.anonymous_client.get(TRENDING_API)
+        self.assertEqual(response.data['hashtags'], [
+            {'name': 'python', 'count': 3},
+            {'name': 'django', 'count': 1},
+        ])
+        self.assertIsNotNone(response.data['updated_at'])
@@ -0,0 +1,46 @@
+from django.conf import settings
+from hashtags.models import Hashtag
+from hashtags.services import HashtagService, TrendingService
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from tweets.api.serializers import serialize_tweet_ids
+
+
+class HashtagViewSet(viewsets.GenericViewSet):
+    # GET /api/hashtags/<name>/tweets/, tag 的名字不区分大小写
+    queryset = Hashtag.objects.all()
+    permission_classes = [AllowAny]
+    lookup_field = 'name'
+    lookup_value_regex = r'\w+'
+
+    @action(methods=['GET'], detail=False)
+    def trending(self, request):
+        """
+        GET /api/hashtags/trending/
+        最近一段时间（TRENDING_WINDOW_SECONDS）出现最多的 hashtag,
+        读的是 update_trending 每隔几秒算好的 snapshot, 不查数据库
+        """
+        return Response(TrendingService.get_snapshot(), status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=True)
+    def tweets(self, request, name):
+        """
+        GET /api/hashtags/<name>/tweets/?max_id=<上一页最后一个 tweet 的 id>
+        带这个 tag 的 tweet, 按时间倒序
+        """
+        max_id = request.query_params.get('max_id', '')
+        limit = getattr(settings, 'HASHTAG_TWEETS_PAGE_SIZE', 20)
+        tweet_ids = HashtagService.get_tweet_ids(
+            name,
+            max_id=int(max_id) if max_id.isdigit() else None,
+            limit=limit,
+        )
+        next_max_id = tweet_ids[-1] if len(tweet_ids) == limit else None
+        return Response({
+            'tweets': serialize_tweet_ids(tweet_ids),
+            # 这一页的 tweet 可能有已经删掉的，下一页从 tag 索引里的最后一个 id 接着往后
+            'next_max_id': next_max_id,
+            'next_max_id_str': str(next_max_id) if next_max_id is not None else None,
+        }, status=status.HTTP_200_OK)
@@ -0,0 +1,76 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from hashtags.models import TweetHashtag
+from hashtags.services import TrendingService
+from hashtags.trending import TrendingCounter
+from utils.checks import ensure_deployable
+from utils.maintenance import iter_pk_batches
+from utils.snowflake import id_to_datetime, min_id_for
+from utils.time_helper import utc_now
+
+
+class Command(BaseCommand):
+    """
+    python manage.py update_trending
+
+    热门 hashtag 的计算，整个部署只跑一个。
+    启动的时候把最近一个窗口（TRENDING_WINDOW_SECONDS）的 TweetHashtag 读一遍，
+    之后每 --interval 秒按 id 读新写进来的行，更新滑动窗口的计数（见 hashtags.trending），
+    然后把 top k 写到数据库里 (TrendingSnapshot) 给 /api/hashtags/trending/ 用。
+    进程挂了重启就行，计数都是从数据库里重新算出来的
+
+    TweetHashtag 的 id 是插入之前生成的，生成 id 和提交之间有一点时间差，
+    只读 --lag 秒之前的行，这样 id 更小但是晚提交的行不会被跳过
+    """
+    help = 'Maintain the trending hashtags snapshot from newly tagged tweets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            default=getattr(settings, 'TRENDING_REFRESH_SECONDS', 5))
+        parser.add_argument('--lag', type=float, default=2,
+                            help='Only read rows created more than this many seconds ago.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--once', action='store_true',
+                            help='Read the current window, publish one snapshot and exit.')
+
+    def handle(self, *args, **options):
+        # 和 Django 自己的 system check 一样，命令行启动的时候检查配置，call_command / --skip-checks 不检查
+        if not options['skip_checks']:
+            ensure_deployable()
+        window = getattr(settings, 'TRENDING_WINDOW_SECONDS', 3600)
+        counter = TrendingCounter(
+            window_seconds=window,
+            bucket_seconds=getattr(settings, 'TRENDING_BUCKET_SECONDS', 300),
+            width=getattr(settings, 'TRENDING_SKETCH_WIDTH', 2048),
+            depth=getattr(settings, 'TRENDING_SKETCH_DEPTH', 4),
+            capacity=getattr(settings, 'TRENDING_CANDIDATES', 100),
+        )
+        top_k = getattr(settings, 'TRENDING_TOP_K', 10)
+        last_id = min_id_for(utc_now() - timedelta(seconds=window)) - 1
+        while True:
+            now = utc_now()
+            last_id, count = self.read_new_rows(
+                counter,
+                last_id,
+                min_id_for(now - timedelta(seconds=options['lag'])),
+                options['batch_size'],
+            )
+            counter.advance(now.timestamp())
+            TrendingService.publish_snapshot(counter.most_common(top_k))
+            if options['once']:
+                self.stdout.write(f'counted {count} hashtags')
+                return
+            time.sleep(options['interval'])
+
+    def read_new_rows(self, counter, last_id, before_id, batch_size):
+        rows = TweetHashtag.objects.filter(id__gt=last_id, id__lt=before_id)
+        count = 0
+        for batch in iter_pk_batches(rows, batch_size, ('pk', 'hashtag__name')):
+            for pk, name in batch:
+                counter.add(name, id_to_datetime(pk).timestamp())
+            last_id = batch[-1][0]
+            count += len(batch)
+        return last_id, count
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.3 on 2026-10-19 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hashtags', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hashtags', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
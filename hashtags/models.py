@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.db import models
+from tweets.models import Tweet
+from utils.snowflake import next_id
+
+
+class Hashtag(models.Model):
+    # 统一存小写，#Django 和 #django 是同一个 tag
+    name = models.CharField(max_length=100, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'#{self.name}'
+
+
+class TweetHashtag(models.Model):
+    """
+    tweet 里出现的 hashtag, 由 tweet.created 事件的 handler 写进来（见 HashtagService.tag_tweet）
+    id 是写进来的时候生成的 snowflake id, update_trending 按 id 往后读新写进来的行
+    """
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE)
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # 某个 tag 下面的 tweet 按 tweet id（发帖时间）倒序，就是这个索引上的一次 range scan
+        # 同时保证重复执行的 handler 不会写出两行
+        unique_together = (('hashtag', 'tweet'),)
+
+    def __str__(self):
+        return f'{self.hashtag_id} in {self.tweet_id}'
+
+
+class TrendingSnapshot(models.Model):
+    """
+    update_trending 算好的热门 hashtag, 只有一行，每 TRENDING_REFRESH_SECONDS 秒覆盖一次
+    update_trending 和 API 不是同一个进程，所以放在数据库里，而不是进程内的 cache
+    """
+    # [{'name': 'python', 'count': 3}, ...]
+    hashtags = models.JSONField(default=list)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'trending at {self.updated_at}'
+
+
+class TweetMention(models.Model):
+    # tweet 里 @ 到的用户，不存在的用户名不记
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # 某个用户被 @ 的 tweet, 按 tweet id 倒序
+        unique_together = (('user', 'tweet'),)
+
+    def __str__(self):
+        return f'{self.user_id} mentioned in {self.tweet_id}'
@@ -0,0 +1,147 @@
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from hashtags.models import Hashtag, TrendingSnapshot, TweetHashtag, TweetMention
+from utils.time_helper import utc_now
+
+
+# 前面不能是字母数字（e.g. email 里的 @, url 里的 #），tag 里至少有一个字母，#2021 不算
+HASHTAG_RE = re.compile(r'(?<![\w#])#(\w*[^\W\d_]\w*)')
+MENTION_RE = re.compile(r'(?<![\w@])@(\w+)')
+# 一个 tweet 最多记这么多个，防止有人发一条全是 tag 的 tweet
+MAX_TAGS_PER_TWEET = 10
+
+
+def _unique(values, limit):
+    seen = []
+    for value in values:
+        if value not in seen:
+            seen.append(value)
+    return seen[:limit]
+
+
+class HashtagService(object):
+
+    @classmethod
+    def extract_hashtags(cls, content):
+        name_length = Hashtag._meta.get_field('name').max_length
+        return _unique(
+            (name.lower() for name in HASHTAG_RE.findall(content) if len(name) <= name_length),
+            MAX_TAGS_PER_TWEET,
+        )
+
+    @classmethod
+    def extract_mentions(cls, content):
+        return _unique(MENTION_RE.findall(content), MAX_TAGS_PER_TWEET)
+
+    @classmethod
+    def tag_tweet(cls, tweet):
+        """
+        把 tweet 里的 hashtag 和 @ 写进 TweetHashtag / TweetMention
+        可以重复执行：已经写过的行会被忽略
+        """
+        names = cls.extract_hashtags(tweet.content)
+        if names:
+            # 新的 tag 先建出来，再一次取出所有的 id
+            Hashtag.objects.bulk_create(
+                [Hashtag(name=name) for name in names],
+                ignore_conflicts=True,
+            )
+            hashtag_ids = Hashtag.objects.using(DEFAULT_DB_ALIAS).filter(
+                name__in=names,
+            ).values_list('id', flat=True)
+            TweetHashtag.objects.bulk_create(
+                [TweetHashtag(hashtag_id=hashtag_id, tweet_id=tweet.id) for hashtag_id in hashtag_ids],
+                ignore_conflicts=True,
+            )
+
+        usernames = cls.extract_mentions(tweet.content)
+        if usernames:
+            user_ids = User.objects.using(DEFAULT_DB_ALIAS).filter(
+                username__in=usernames,
+            ).values_list('id', flat=True)
+            TweetMention.objects.bulk_create(
+                [TweetMention(user_id=user_id, tweet_id=tweet.id) for user_id in user_ids],
+                ignore_conflicts=True,
+            )
+
+    @classmethod
+    def get_tweet_ids(cls, name, max_id=None, limit=None):
+        """
+        某个 tag 下面最新的 limit 个 tweet 的 id, max_id: 只要 id 小于它的（翻页）
+        走 (hashtag, tweet) 的 unique 索引，不需要扫 tweet 表
+        """
+        limit = limit or getattr(settings, 'HASHTAG_TWEETS_PAGE_SIZE', 20)
+        tweet_hashtags = TweetHashtag.objects.filter(hashtag__name=name.lower())
+        if max_id is not None:
+            tweet_hashtags = tweet_hashtags.filter(tweet_id__lt=max_id)
+        return list(tweet_hashtags.order_by('-tweet_id').values_list('tweet_id', flat=True)[:limit])
+
+    @classmethod
+    def delete_tweet_tags(cls, tweet_id, limit):
+        # tweet 被删掉之后由 TweetService.retract 分批删，返回删掉的行数
+        deleted = 0
+        for model in (TweetHashtag, TweetMention):
+            rows = model.objects.using(DEFAULT_DB_ALIAS)
+            ids = list(rows.filter(tweet_id=tweet_id).values_list('id', flat=True)[:limit - deleted])
+            if ids:
+                rows.filter(id__in=ids)._raw_delete(DEFAULT_DB_ALIAS)
+                deleted += len(ids)
+            if deleted >= limit:
+                break
+        return deleted
+
+
+TRENDING_CACHE_KEY = 'hashtags:trending'
+# TrendingSnapshot 只有这一行
+TRENDING_SNAPSHOT_ID = 1
+
+
+def _trending_cache():
+    return caches[getattr(settings, 'TRENDING_CACHE', 'default')]
+
+
+def _refresh_seconds():
+    return getattr(settings, 'TRENDING_REFRESH_SECONDS', 5)
+
+
+class TrendingService(object):
+    """
+    python manage.py update_trending 在一个进程里维护滑动窗口的计数（见 hashtags.trending），
+    每隔几秒把 top k 写到 TrendingSnapshot 这一行里
+    /api/hashtags/trending/ 读这一行，每个进程在 TRENDING_CACHE 里缓存 TRENDING_REFRESH_SECONDS 秒，
+    所以 cache 是不是共享的都可以，大部分请求不查数据库
+    """
+
+    @classmethod
+    def publish_snapshot(cls, items):
+        snapshot = {
+            'hashtags': [{'name': name, 'count': count} for name, count in items],
+            'updated_at': utc_now(),
+        }
+        TrendingSnapshot.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+            id=TRENDING_SNAPSHOT_ID,
+            defaults=snapshot,
+        )
+        _trending_cache().set(TRENDING_CACHE_KEY, snapshot, timeout=_refresh_seconds())
+
+    @classmethod
+    def get_snapshot(cls):
+        cache = _trending_cache()
+        snapshot = cache.get(TRENDING_CACHE_KEY)
+        if snapshot is None:
+            row = TrendingSnapshot.objects.filter(id=TRENDING_SNAPSHOT_ID).first()
+            snapshot = {
+                'hashtags': row.hashtags if row else [],
+                'updated_at': row.updated_at if row else None,
+            }
+            cache.set(TRENDING_CACHE_KEY, snapshot, timeout=_refresh_seconds())
+        # update_trending 停掉之后过一会儿就不再展示过时的数据
+        updated_at = snapshot['updated_at']
+        if updated_at is None or utc_now() - updated_at > timedelta(seconds=_refresh_seconds() * 12):
+            return {'hashtags': [], 'updated_at': None}
+        return snapshot
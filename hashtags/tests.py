@@ -0,0 +1,115 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from hashtags.models import Hashtag, TrendingSnapshot, TweetHashtag, TweetMention
+from hashtags.services import HashtagService, TrendingService
+from hashtags.trending import TrendingCounter
+from testing.testcases import TestCase
+from tweets.services import TweetService
+from utils.time_helper import utc_now
+
+
+class HashtagServiceTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+
+    def test_extract(self):
+        self.assertEqual(
+            HashtagService.extract_hashtags('#Django and #django, #2021 #py3 a#b ##x email#me'),
+            ['django', 'py3'],
+        )
+        self.assertEqual(
+            HashtagService.extract_mentions('hi @dongxie @linghu, me@mail.com @dongxie'),
+            ['dongxie', 'linghu'],
+        )
+        self.assertEqual(len(HashtagService.extract_hashtags(' '.join(f'#t{i}' for i in range(20)))), 10)
+
+    def test_tag_tweet(self):
+        tweet = self.create_tweet(self.linghu, 'hello #Python #django @dongxie @nobody')
+        HashtagService.tag_tweet(tweet)
+        # 重复执行不会写出重复的行
+        HashtagService.tag_tweet(tweet)
+        self.assertEqual(set(Hashtag.objects.values_list('name', flat=True)), {'python', 'django'})
+        self.assertEqual(TweetHashtag.objects.filter(tweet=tweet).count(), 2)
+        self.assertEqual(list(TweetMention.objects.values_list('user_id', flat=True)), [self.dongxie.id])
+
+        other = self.create_tweet(self.dongxie, 'more #python')
+        HashtagService.tag_tweet(other)
+        self.assertEqual(Hashtag.objects.count(), 2)
+        self.assertEqual(HashtagService.get_tweet_ids('PYTHON'), [other.id, tweet.id])
+        self.assertEqual(HashtagService.get_tweet_ids('python', max_id=other.id), [tweet.id])
+        self.assertEqual(HashtagService.get_tweet_ids('python', limit=1), [other.id])
+
+        # 删掉 tweet 之后由 retract 删掉
+        TweetService.soft_delete(tweet)
+        TweetService.retract(tweet.id)
+        self.assertFalse(TweetHashtag.objects.filter(tweet=tweet).exists())
+        self.assertFalse(TweetMention.objects.exists())
+
+
+class TrendingCounterTests(TestCase):
+
+    def test_sliding_window(self):
+        counter = TrendingCounter(window_seconds=60, bucket_seconds=10, capacity=3)
+        for _ in range(5):
+            counter.add('old', 0)
+        for _ in range(3):
+            counter.add('new', 35)
+        counter.add('rare', 35)
+        self.assertEqual(counter.most_common(2), [('old', 5), ('new', 3)])
+
+        # 0 秒的那一段滑出了窗口
+        counter.advance(61)
+        self.assertEqual(counter.estimate('old'), 0)
+        self.assertEqual(counter.most_common(2), [('new', 3), ('rare', 1)])
+        # 已经过期的时间不算
+        counter.add('late', 5)
+        self.assertEqual(counter.estimate('late'), 0)
+
+    def test_capacity(self):
+        counter = TrendingCounter(capacity=2)
+        for key, count in (('a', 1), ('b', 2), ('c', 3)):
+            counter.add(key, 0, count)
+        self.assertEqual(counter.most_common(3), [('c', 3), ('b', 2)])
+
+
+class UpdateTrendingTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+
+    @override_settings(TRENDING_TOP_K=2)
+    def test_update_trending(self):
+        self.assertEqual(TrendingService.get_snapshot(), {'hashtags': [], 'updated_at': None})
+        for content in ('#a #b', '#b #c', '#b', '#c'):
+            HashtagService.tag_tweet(self.create_tweet(self.linghu, content))
+        # 窗口之外的不算
+        old = TweetHashtag.objects.get(hashtag__name='a')
+        TweetHashtag.objects.filter(id=old.id).update(id=1)
+
+        out = StringIO()
+        call_command('update_trending', '--once', '--lag', '-1', stdout=out)
+        self.assertIn('counted 5 hashtags', out.getvalue())
+        snapshot = TrendingService.get_snapshot()
+        self.assertEqual(snapshot['hashtags'], [{'name': 'b', 'count': 3}, {'name': 'c', 'count': 2}])
+        self.assertLess(utc_now() - snapshot['updated_at'], timedelta(minutes=1))
+
+    def test_snapshot_is_shared_through_the_database(self):
+        TrendingService.publish_snapshot([('python', 3)])
+        # 别的进程（API 的 worker）的 cache 里没有，读数据库里的那一行，之后缓存起来
+        self.clear_cache()
+        with self.assertNumQueries(1):
+            snapshot = TrendingService.get_snapshot()
+        self.assertEqual(snapshot['hashtags'], [{'name': 'python', 'count': 3}])
+        with self.assertNumQueries(0):
+            self.assertEqual(TrendingService.get_snapshot(), snapshot)
+
+        # update_trending 停了很久之后不展示过时的数据
+        TrendingSnapshot.objects.update(updated_at=utc_now() - timedelta(hours=1))
+        self.clear_cache()
+        self.assertEqual(TrendingService.get_snapshot(), {'hashtags': [], 'updated_at': None})
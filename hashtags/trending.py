@@ -0,0 +1,59 @@
+from utils.sketches import CountMinSketch, TopK
+
+
+class TrendingCounter(object):
+    """
+    最近 window_seconds 秒里每个 hashtag 出现的次数（估计值）和出现最多的 top k
+
+    窗口切成 bucket_seconds 一段，每一段一个 CountMinSketch, 另外一个 total 是所有段的和。
+    加一次只改 total 和当前这一段，查询只看 total；一段过期的时候从 total 里减掉，
+    所以内存是固定的（段数 x sketch 的大小），和 hashtag 的个数无关。
+    TopK 记下候选的 hashtag, 有段过期的时候按 total 重新估计一遍
+
+    timestamp 都是秒（float），调用的地方保证大致按时间顺序加进来，已经过期的会被忽略
+    """
+
+    def __init__(self, window_seconds=3600, bucket_seconds=300, width=2048, depth=4, capacity=100):
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = max(1, window_seconds // bucket_seconds)
+        self.width = width
+        self.depth = depth
+        self.total = CountMinSketch(width, depth)
+        # bucket 的序号 (timestamp // bucket_seconds) -> 这一段的 sketch
+        self.buckets = {}
+        self.top = TopK(capacity)
+        self.current = None
+
+    def _bucket_index(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    def advance(self, timestamp):
+        """
+        时间走到 timestamp, 把滑出窗口的段从 total 里减掉
+        """
+        index = self._bucket_index(timestamp)
+        if self.current is not None and index <= self.current:
+            return
+        self.current = index
+        expired = [i for i in self.buckets if i <= index - self.num_buckets]
+        for i in expired:
+            self.total.subtract(self.buckets.pop(i))
+        if expired:
+            self.top.rescore(self.total.estimate)
+
+    def add(self, key, timestamp, count=1):
+        self.advance(timestamp)
+        index = self._bucket_index(timestamp)
+        if index <= self.current - self.num_buckets:
+            return
+        bucket = self.buckets.get(index)
+        if bucket is None:
+            bucket = self.buckets[index] = CountMinSketch(self.width, self.depth)
+        bucket.add(key, count)
+        self.top.update(key, self.total.add(key, count))
+
+    def estimate(self, key):
+        return self.total.estimate(key)
+
+    def most_common(self, n):
+        return self.top.most_common(n)
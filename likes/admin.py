@@ -1,5 +1,21 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import prefetch_related_objects
 from likes.models import Like
+from likes.services import LikeService
+
+
+class LikeChangeList(ChangeList):
+
+    def get_results(self, request):
+        super().get_results(request)
+        # content_object 是 GenericForeignKey, 每一行自己去读就是一行一条 query
+        # 这一页的 like 按 content_type 一起取，tweet / comment 的 __str__ 要用到 user 也一起取
+        likes = list(self.result_list)
+        # user / content_type 可以是 NULL, admin 默认的 select_related() 不会带上，也一起取
+        prefetch_related_objects(likes, 'user', 'content_type')
+        self.result_list = LikeService.prefetch_content_objects(likes, 'user')
+
 
 # Register your models here.
 @admin.register(Like)
@@ -14,3 +30,6 @@ class LikeAdmin(admin.ModelAdmin):
 
     list_filter = ('content_type',)
     date_hierarchy = 'created_at'
+
+    def get_changelist(self, request, **kwargs):
+        return LikeChangeList
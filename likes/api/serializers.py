@@ -0,0 +1,45 @@
+from accounts.api.serializers import UserFastSerializer, UserSerializerForTweet
+from likes.models import Like
+from likes.services import LIKEABLE_MODELS, LikeService
+from rest_framework import serializers
+
+
+class LikeSerializer(serializers.ModelSerializer):
+    user = UserSerializerForTweet()
+
+    class Meta:
+        model = Like
+        fields = ('id', 'user', 'created_at')
+
+
+class LikeSerializerForCreate(serializers.Serializer):
+    # 点赞和取消点赞都用这个检查参数
+    content_type = serializers.ChoiceField(choices=list(LIKEABLE_MODELS))
+    object_id = serializers.IntegerField()
+
+    def validate(self, data):
+        target = LikeService.get_target(data['content_type'], data['object_id'])
+        if target is None:
+            raise serializers.ValidationError({
+                'object_id': 'Object does not exist.',
+            })
+        data['target'] = target
+        return data
+
+
+def serialize_likes(likes):
+    """
+    likes 是 LikeService.get_likes 返回的 (id, user_id, created_at)
+    一页里所有的 user 一起取：user 的 JSON 缓存一次 get_many, 没命中的一条 IN query
+    """
+    user_ids = list({user_id for _, user_id, _ in likes if user_id is not None})
+    users = dict(zip(user_ids, UserFastSerializer.from_pks(user_ids)))
+    return [
+        {
+            'id': like_id,
+            'user': users[user_id],
+            'created_at': serializers.DateField().to_representation(created_at),
+        }
+        for like_id, user_id, created_at in likes
+        if users.get(user_id) is not None
+    ]
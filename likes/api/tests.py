@@ -0,0 +1,156 @@
+from django.test import override_settings
+from likes.services import LikeService
+from rest_framework import status
+from rest_framework.test import APIClient
+from testing.testcases import TestCase
+from tweets.models import Tweet
+
+
+LIKES_URL = '/api/likes/'
+CANCEL_URL = '/api/likes/cancel/'
+TWEET_URL = '/api/tweets/{}/'
+
+
+class LikeApiTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.linghu_client = APIClient()
+        self.linghu_client.force_authenticate(self.linghu)
+        self.dongxie = self.create_user('dongxie')
+        self.dongxie_client = APIClient()
+        self.dongxie_client.force_authenticate(self.dongxie)
+        self.tweet = self.create_tweet(self.linghu)
+
+    def test_create(self):
+        data = {'content_type': 'tweet', 'object_id': self.tweet.id}
+        response = self.anonymous_client.post(LIKES_URL, data)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.dongxie_client.post(LIKES_URL, {'content_type': 'user', 'object_id': self.tweet.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.dongxie_client.post(LIKES_URL, {'content_type': 'comment', 'object_id': self.tweet.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('object_id', response.data['errors'])
+
+        response = self.dongxie_client.post(LIKES_URL, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['user']['username'], 'dongxie')
+        # 重复点赞是 200, 还是原来那个赞
+        duplicate = self.dongxie_client.post(LIKES_URL, data)
+        self.assertEqual(duplicate.status_code, status.HTTP_200_OK)
+        self.assertEqual(duplicate.data['id'], response.data['id'])
+        # 缓存的 tweet JSON 里的计数也是新的
+        self.assertEqual(self.linghu_client.get(TWEET_URL.format(self.tweet.id)).data['likes_count'], 1)
+
+        comment = self.create_comment(self.linghu, self.tweet)
+        response = self.dongxie_client.post(LIKES_URL, {'content_type': 'comment', 'object_id': comment.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(comment.like_set.count(), 1)
+
+    def test_cancel(self):
+        data = {'content_type': 'tweet', 'object_id': self.tweet.id}
+        self.create_like(self.dongxie, self.tweet)
+        self.assertEqual(self.linghu_client.get(TWEET_URL.format(self.tweet.id)).data['likes_count'], 1)
+        response = self.anonymous_client.post(CANCEL_URL, data)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.dongxie_client.post(CANCEL_URL, {'content_type': 'tweet'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.dongxie_client.post(CANCEL_URL, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['deleted'], 1)
+        response = self.dongxie_client.post(CANCEL_URL, data)
+        self.assertEqual(response.data['deleted'], 0)
+        self.assertEqual(Tweet.objects.get(id=self.tweet.id).likes_count, 0)
+        self.assertEqual(self.linghu_client.get(TWEET_URL.format(self.tweet.id)).data['likes_count'], 0)
+
+    def test_list(self):
+        response = self.anonymous_client.get(LIKES_URL, {'content_type': 'tweet'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.anonymous_client.get(LIKES_URL, {'content_type': 'user', 'object_id': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.anonymous_client.get(
+            LIKES_URL,
+            {'content_type': 'tweet', 'object_id': self.tweet.id, 'cursor': 'oops'},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        fans = [self.create_user(f'fan{i}') for i in range(25)]
+        for fan in fans:
+            self.create_like(fan, self.tweet)
+
+        def list_likes(cursor=None):
+            self.clear_cache()
+            params = {'content_type': 'tweet', 'object_id': self.tweet.id}
+            if cursor is not None:
+                params['cursor'] = cursor
+            return self.anonymous_client.get(LIKES_URL, params)
+
+        response = list_likes()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['likes']), 20)
+        self.assertEqual(response.data['likes'][0]['user']['username'], 'fan24')
+        self.assertIsNotNone(response.data['next_cursor'])
+        response = list_likes(response.data['next_cursor'])
+        self.assertEqual(
+            [like['user']['username'] for like in response.data['likes']],
+            ['fan4', 'fan3', 'fan2', 'fan1', 'fan0'],
+        )
+        self.assertIsNone(response.data['next_cursor'])
+
+        # 一页的 user 一起取，SQL 的条数和赞的个数无关
+        def add_likes():
+            for i in range(5):
+                self.create_like(self.create_user(f'more{i}'), self.tweet)
+        self.assertQueryCountIndependentOfRows(list_likes, add_likes)
+
+    @override_settings(LIKE_BUFFER_ENABLED=True, LIKE_BUFFER_FLUSH_SECONDS=0)
+    def test_buffered(self):
+        LikeService.flush_buffer()
+        self.addCleanup(LikeService.flush_buffer)
+        self.create_like(self.linghu, self.tweet)
+        LikeService.flush_buffer()
+
+        data = {'content_type': 'tweet', 'object_id': self.tweet.id}
+        response = self.dongxie_client.post(LIKES_URL, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(response.data['id'])
+        self.assertEqual(self.dongxie_client.post(LIKES_URL, data).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.linghu_client.post(CANCEL_URL, data).data['deleted'], 1)
+
+        # 还没写进数据库的也能读到
+        response = self.anonymous_client.get(LIKES_URL, data)
+        self.assertEqual([like['user']['username'] for like in response.data['likes']], ['dongxie'])
+        LikeService.flush_buffer()
+        response = self.anonymous_client.get(LIKES_URL, data)
+        self.assertEqual([like['user']['username'] for like in response.data['likes']], ['dongxie'])
+        self.assertIsNotNone(response.data['likes'][0]['id'])
+        self.assertEqual(self.linghu_client.get(TWEET_URL.format(self.tweet.id)).data['likes_count'], 1)
+
+    @override_settings(LIKE_BUFFER_ENABLED=True, LIKE_BUFFER_FLUSH_SECONDS=0, LIKES_PAGE_SIZE=2)
+    def test_buffered_page_size(self):
+        LikeService.flush_buffer()
+        self.addCleanup(LikeService.flush_buffer)
+        self.create_like(self.linghu, self.tweet)
+        self.create_like(self.dongxie, self.tweet)
+        LikeService.flush_buffer()
+
+        def list_usernames(cursor=None):
+            data = {'content_type': 'tweet', 'object_id': self.tweet.id}
+            if cursor is not None:
+                data['cursor'] = cursor
+            response = self.anonymous_client.get(LIKES_URL, data)
+            return [like['user']['username'] for like in response.data['likes']], response.data['next_cursor']
+
+        # 排队的赞把数据库里的赞挤到下一页，每一页还是最多 LIKES_PAGE_SIZE 个
+        self.create_like(self.create_user('fan0'), self.tweet)
+        usernames, cursor = list_usernames()
+        self.assertEqual(usernames, ['fan0', 'dongxie'])
+        self.assertEqual(list_usernames(cursor), (['linghu'], None))
+
+        # 一页全是排队的赞，下一页从数据库里的第一个赞开始
+        self.create_like(self.create_user('fan1'), self.tweet)
+        usernames, cursor = list_usernames()
+        self.assertEqual(usernames, ['fan1', 'fan0'])
+        self.assertEqual(list_usernames(cursor), (['dongxie', 'linghu'], None))
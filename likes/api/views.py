@@ -0,0 +1,115 @@
+from datetime import date
+
+from django.conf import settings
+from likes.api.serializers import LikeSerializer, LikeSerializerForCreate, serialize_likes
+from likes.models import Like
+from likes.services import LIKEABLE_MODELS, LikeService
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from utils.decorators import idempotent, required_params
+
+
+def encode_cursor(created_at, like_id):
+    return f'{created_at.isoformat()}_{like_id}'
+
+
+def decode_cursor(cursor):
+    # 格式不对抛 ValueError
+    created_at, like_id = cursor.split('_')
+    return date.fromisoformat(created_at), int(like_id)
+
+
+class LikeViewSet(viewsets.GenericViewSet):
+    # POST /api/likes/ 点赞, POST /api/likes/cancel/ 取消, GET /api/likes/ 谁赞了
+    queryset = Like.objects.all()
+    serializer_class = LikeSerializerForCreate
+
+    def get_permissions(self):
+        if self.action == 'list':
+            return [AllowAny()]
+        return [IsAuthenticated()]
+
+    def get_target(self, request):
+        serializer = LikeSerializerForCreate(data=request.data)
+        if not serializer.is_valid():
+            return None, Response({
+                'message': 'Please check input',
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return serializer.validated_data['target'], None
+
+    @required_params(params=['content_type', 'object_id'])
+    def list(self, request):
+        """
+        GET /api/likes/?content_type=tweet&object_id=1&cursor=<上一页的 next_cursor>
+        按时间倒序，每页 LIKES_PAGE_SIZE 个
+        """
+        model = LIKEABLE_MODELS.get(request.query_params['content_type'])
+        object_id = request.query_params['object_id']
+        cursor = request.query_params.get('cursor')
+        try:
+            before = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            before = model = None
+        if model is None or not object_id.isdigit():
+            return Response({
+                'message': 'Please check input',
+                'success': False,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = getattr(settings, 'LIKES_PAGE_SIZE', 20)
+        # 多取一个，用来判断还有没有下一页
+        rows = LikeService.get_likes(model, int(object_id), before=before, limit=limit + 1)
+        # LIKE_BUFFER_ENABLED 的时候加上还没写进数据库的赞 / 取消赞，也是多留一个
+        likes = LikeService.merge_pending(model, int(object_id), rows, first_page=before is None, limit=limit + 1)
+        next_cursor = None
+        if len(rows) > limit or len(likes) > limit:
+            likes = likes[:limit]
+            next_cursor = self.get_next_cursor(likes, rows)
+        return Response({
+            'likes': serialize_likes(likes),
+            'next_cursor': next_cursor,
+        }, status=status.HTTP_200_OK)
+
+    def get_next_cursor(self, likes, rows):
+        # cursor 按这一页里最后一个数据库里的行算，被排队的赞挤出去的行下一页接着返回
+        saved = [like for like in likes if like[0] is not None]
+        if saved:
+            like_id, _, created_at = saved[-1]
+            return encode_cursor(created_at, like_id)
+        # 这一页全是排队的赞，下一页从数据库里的第一个赞开始（包括它自己）
+        # 放不下的排队的赞写进数据库之后才能翻到
+        if not rows:
+            return None
+        like_id, _, created_at = rows[0]
+        return encode_cursor(created_at, like_id + 1)
+
+    @idempotent
+    def create(self, request):
+        """
+        POST /api/likes/ {content_type: tweet / comment, object_id}
+        已经赞过的返回 200 和原来的那个赞，前端连着点好几次不报错
+        LIKE_BUFFER_ENABLED 的时候还没写进数据库的赞 id 是 null
+        """
+        target, error = self.get_target(request)
+        if error is not None:
+            return error
+        like, created = LikeService.like(request.user, target)
+        return Response(
+            LikeSerializer(like).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    @action(methods=['POST'], detail=False)
+    def cancel(self, request):
+        """
+        POST /api/likes/cancel/ {content_type: tweet / comment, object_id}
+        没赞过的取消也是 200, deleted 是 0
+        """
+        target, error = self.get_target(request)
+        if error is not None:
+            return error
+        deleted = LikeService.unlike(request.user, target)
+        return Response({'success': True, 'deleted': deleted}, status=status.HTTP_200_OK)
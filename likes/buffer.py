@@ -0,0 +1,161 @@
+import abc
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer(abc.ABC):
+    """
+    LIKE_BUFFER_ENABLED 的时候还没写进数据库的赞 / 取消赞（见 LikeService.flush_buffer）
+    按 target 分开存，target 是 (content_type_id, object_id), 每个 target 是 {user_id: liked}
+    同一个人对同一个 target 只留最后一次的意图：赞了又取消只剩取消
+
+    flush 分两步：begin_flush 把排队的拿走，写进数据库之前 get / get_target 还能读到，
+    end_flush 之后才真的扔掉，所以 flush 到一半的时候读也是对的
+
+    多台机器部署并且要别的进程马上读到的时候，实现一个共享的子类（e.g. redis 的 hash），
+    然后在 settings.LIKE_BUFFER 里换掉；所有的方法都会被不同的线程同时调用，必须线程安全
+    """
+
+    @abc.abstractmethod
+    def set(self, user_id, target, liked):
+        """
+        排队一个意图 liked = True / False, 覆盖这个人对这个 target 之前排队的意图，
+        并且算作这个 target 上最新的一个
+        """
+
+    @abc.abstractmethod
+    def get(self, user_id, target):
+        """
+        返回排队的意图 True / False, 没有排队的返回 None
+        正在 flush（begin_flush 之后 end_flush 之前）的意图也算，之后又排队的优先
+        """
+
+    @abc.abstractmethod
+    def get_target(self, target):
+        """
+        这个 target 上排队的 {user_id: liked}, 先排队的在前面，包括正在 flush 的
+        """
+
+    @abc.abstractmethod
+    def begin_flush(self):
+        """
+        拿走所有排队的意图，返回 {target: {user_id: liked}}
+        同一时间只有一个 flush, 上一次 end_flush 之前不会再调用
+        """
+
+    @abc.abstractmethod
+    def end_flush(self, failed=False):
+        """
+        扔掉 begin_flush 拿走的意图；failed 的时候放回去，之后又排队的意图优先
+        """
+
+
+class InProcessLikeBuffer(LikeBuffer):
+    """
+    只在当前进程里，每个进程自己 flush（见 start_flusher）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushing = {}
+
+    def set(self, user_id, target, liked):
+        with self._lock:
+            intents = self._pending.setdefault(target, {})
+            # 挪到最后面，get_target 按最后一次的时间排
+            intents.pop(user_id, None)
+            intents[user_id] = liked
+
+    def get(self, user_id, target):
+        with self._lock:
+            for intents in (self._pending, self._flushing):
+                liked = intents.get(target, {}).get(user_id)
+                if liked is not None:
+                    return liked
+        return None
+
+    def get_target(self, target):
+        with self._lock:
+            merged = dict(self._flushing.get(target, {}))
+            for user_id, liked in self._pending.get(target, {}).items():
+                merged.pop(user_id, None)
+                merged[user_id] = liked
+        return merged
+
+    def begin_flush(self):
+        with self._lock:
+            self._flushing, self._pending = self._pending, {}
+            return {target: dict(intents) for target, intents in self._flushing.items()}
+
+    def end_flush(self, failed=False):
+        with self._lock:
+            if failed:
+                for target, intents in self._flushing.items():
+                    merged = dict(intents)
+                    for user_id, liked in self._pending.get(target, {}).items():
+                        merged.pop(user_id, None)
+                        merged[user_id] = liked
+                    self._pending[target] = merged
+            self._flushing = {}
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_like_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buffer_class = import_string(
+                    getattr(settings, 'LIKE_BUFFER', 'likes.buffer.InProcessLikeBuffer')
+                )
+                _buffer = buffer_class()
+    return _buffer
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def start_flusher(flush, interval):
+    """
+    第一次往 buffer 里写的时候在当前进程里起一个 daemon 线程，每 interval 秒 flush 一次
+    进程退出的时候再 flush 一次；interval <= 0 的时候不起线程，由调用的地方自己 flush
+    """
+    global _flusher
+    if interval <= 0 or _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(
+            target=_run_flusher,
+            args=(flush, interval),
+            name='like-buffer-flusher',
+            daemon=True,
+        )
+        _flusher.start()
+        atexit.register(flush)
+
+
+def _run_flusher(flush, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception:
+            # 没写进去的意图已经放回 buffer 了，下一次接着写
+            logger.exception('failed to flush buffered likes')
+        finally:
+            close_old_connections()
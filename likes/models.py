@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django.db.models.signals import post_delete, post_save
+from outbox.listeners import publish_created, publish_deleted
 
 
 # Create your models here.
@@ -11,7 +13,7 @@ class Like(models.Model):
     # A normal Foreignkey can only "point to" ont other models.
     # The Foreignkey allows the relationship to be with one and only one models
     # The contentType provides a special field key(GenericForeignKey),which allows the relationship to be with any models.
-    object_id = models.PositiveIntegerField() # tweet_id or comment_id
+    object_id = models.PositiveBigIntegerField() # tweet_id or comment_id, 都是 64 位的 snowflake id
     content_type = models.ForeignKey(ContentType, on_delete=models.SET_NULL, null=True)
     # content_object不是一个实际的column， 数据库表中没有这一列
     # content_object只是一个快捷方式, 根据（'content_type', 'object_id'这两个参数）去拿到具体的object(tweet or comment)，
@@ -45,4 +47,8 @@ class Like(models.Model):
             self.user,
             self.content_type,
             self.object_id,
-        )
\ No newline at end of file
+        )
+
+
+post_save.connect(publish_created, sender=Like)
+post_delete.connect(publish_deleted, sender=Like)
@@ -0,0 +1,327 @@
+import operator
+import threading
+from collections import defaultdict
+from datetime import date
+from functools import reduce
+
+from comments.models import Comment
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from likes.buffer import get_like_buffer, start_flusher
+from likes.models import Like
+from notifications.services import NotificationService
+from outbox.listeners import counted_writes
+from outbox.services import OutboxService
+from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.fast_serializers import invalidate_fragment
+
+
+# API 里的 content_type 参数 -> 可以被点赞的 model
+LIKEABLE_MODELS = {
+    'tweet': Tweet,
+    'comment': Comment,
+}
+
+# 同一个进程里同一时间只有一个 flush
+_flush_lock = threading.Lock()
+
+
+class LikeService(object):
+
+    @classmethod
+    def get_target(cls, content_type, object_id):
+        """
+        content_type 是 'tweet' / 'comment', 找不到（或者 tweet 已经删掉了）返回 None
+        """
+        if content_type == 'tweet':
+            return TweetService.get_visible_tweets().filter(id=object_id).first()
+        if content_type == 'comment':
+            return Comment.objects.filter(id=object_id).first()
+        return None
+
+    @classmethod
+    def like(cls, user, target):
+        """
+        返回 (like, created)，已经赞过的再赞一次什么也不做
+        """
+        if cls._buffer_enabled():
+            return cls._buffer_like(user, target)
+        content_type = ContentType.objects.get_for_model(target.__class__)
+        # counted: 计数下面自己改，like.created 的 handler 不用再数一遍
+        with OutboxService.atomic(), counted_writes():
+            # like.created 事件和计数在同一个 transaction 里写进去
+            # 两个请求同时赞的时候，后插入的那个违反 unique_together, get_or_create 会再 get 一次
+            like, created = Like.objects.get_or_create(
+                user=user,
+                content_type=content_type,
+                object_id=target.id,
+            )
+            if created:
+                cls._add_to_counter(target, 1)
+        if created:
+            cls._invalidate_target(target)
+        return like, created
+
+    @classmethod
+    def unlike(cls, user, target):
+        """
+        返回删掉了几个 like（0 或者 1），没赞过的取消也不报错
+        """
+        if cls._buffer_enabled():
+            return cls._buffer_unlike(user, target)
+        content_type = ContentType.objects.get_for_model(target.__class__)
+        with OutboxService.atomic(), counted_writes():
+            # queryset 的 delete 也会给每一条发 post_delete, 写 like.deleted 事件
+            deleted, _ = Like.objects.filter(
+                user=user,
+                content_type=content_type,
+                object_id=target.id,
+            ).delete()
+            if deleted:
+                cls._add_to_counter(target, -deleted)
+        if deleted:
+            cls._invalidate_target(target)
+        return deleted
+
+    @classmethod
+    def _add_to_counter(cls, target, delta):
+        # 只有真的插入 / 删掉了一行才改计数，而且和插入 / 删除在同一个 transaction 里，
+        # 所以这里可以用 F('likes_count') + 1, 不用像 outbox 的 handler 那样重新数一遍
+        # 热门的 tweet 每个赞都 COUNT 一遍所有的赞太慢了
+        # 不经过 LikeService 的 create / delete (admin, shell, 级联删除) 由 like 事件的 handler 重新数，
+        # 连 post_save / post_delete 都没有的写 (raw SQL, bulk_create, queryset.update) 靠
+        # python manage.py recount_tweet_counters 定期修正
+        if isinstance(target, Tweet):
+            Tweet.objects.filter(id=target.id).update(likes_count=F('likes_count') + delta)
+
+    @classmethod
+    def _invalidate_target(cls, target):
+        # update() 不会触发 post_save, 缓存好的 tweet JSON 要自己删掉
+        # 放在 transaction 提交之后，不然别的请求可能在提交之前把旧的数又缓存回去
+        if isinstance(target, Tweet):
+            invalidate_fragment(Tweet, target.id)
+
+    @classmethod
+    def get_likes(cls, model, object_id, before=None, limit=20):
+        """
+        某个 tweet / comment 的赞，按时间倒序，返回 (id, user_id, created_at) 的 list
+        before 是上一页最后一个赞的 (created_at, id), 走 (content_type, object_id, created_at)
+        的索引（InnoDB 的二级索引后面自带主键 id），每一页都不需要 OFFSET
+        """
+        likes = Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(model),
+            object_id=object_id,
+        )
+        if before is not None:
+            created_at, like_id = before
+            likes = likes.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=like_id),
+            )
+        return list(
+            likes.order_by('-created_at', '-id').values_list('id', 'user_id', 'created_at')[:limit],
+        )
+
+    @classmethod
+    def prefetch_content_objects(cls, likes, *related):
+        """
+        把一批 like 的 content_object 一起取出来：按 content_type 分组，每种一条 id__in 的 query,
+        之后读 like.content_object 不会再一个一个地查数据库
+        related 是 target 上也要一起取的关系，比如 'user'
+        """
+        object_ids = defaultdict(set)
+        for like in likes:
+            if like.content_type_id is not None:
+                object_ids[like.content_type_id].add(like.object_id)
+
+        targets = {}
+        for content_type_id, ids in object_ids.items():
+            # get_for_id 有进程内的缓存
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is None:
+                continue
+            for target in model.objects.filter(id__in=ids).prefetch_related(*related):
+                targets[(content_type_id, target.id)] = target
+
+        for like in likes:
+            target = targets.get((like.content_type_id, like.object_id))
+            if target is not None:
+                # GenericForeignKey 自己读的时候也是先看这个缓存
+                Like.content_object.set_cached_value(like, target)
+        return likes
+
+    @classmethod
+    def merge_pending(cls, model, object_id, likes, first_page, limit=None):
+        """
+        get_likes 的结果加上 buffer 里还没写进数据库的意图：排队取消的去掉，
+        排队的赞放在第一页的最前面（还没有 id, created_at 是今天）
+        最多返回 limit 个，被排队的赞挤出去的行由调用的地方放到下一页
+        """
+        if not cls._buffer_enabled():
+            return likes[:limit]
+        target = (ContentType.objects.get_for_model(model).id, object_id)
+        intents = get_like_buffer().get_target(target)
+        if not intents:
+            return likes[:limit]
+        likes = [like for like in likes if like[1] not in intents]
+        if first_page:
+            today = date.today()
+            pending = [(None, user_id, today) for user_id, liked in intents.items() if liked]
+            likes = pending[::-1] + likes
+        return likes[:limit]
+
+    # LIKE_BUFFER_ENABLED: 赞 / 取消赞先放进 buffer（见 likes.buffer），
+    # 每 LIKE_BUFFER_FLUSH_SECONDS 秒一起写进数据库，爆款的 tweet 不用每个赞都 INSERT 一次再改一次计数
+
+    @classmethod
+    def _buffer_enabled(cls):
+        return getattr(settings, 'LIKE_BUFFER_ENABLED', False)
+
+    @classmethod
+    def _pending_like(cls, user, content_type, target):
+        # 还没写进数据库的赞，没有 id
+        return Like(user=user, content_type=content_type, object_id=target.id, created_at=date.today())
+
+    @classmethod
+    def _buffer_like(cls, user, target):
+        content_type = ContentType.objects.get_for_model(target.__class__)
+        buffer = get_like_buffer()
+        liked = buffer.get(user.id, (content_type.id, target.id))
+        if liked is None:
+            like = Like.objects.filter(user=user, content_type=content_type, object_id=target.id).first()
+            if like is not None:
+                return like, False
+        elif liked:
+            return cls._pending_like(user, content_type, target), False
+        buffer.set(user.id, (content_type.id, target.id), True)
+        cls._start_flusher()
+        return cls._pending_like(user, content_type, target), True
+
+    @classmethod
+    def _buffer_unlike(cls, user, target):
+        content_type = ContentType.objects.get_for_model(target.__class__)
+        buffer = get_like_buffer()
+        liked = buffer.get(user.id, (content_type.id, target.id))
+        if liked is None:
+            liked = Like.objects.filter(user=user, content_type=content_type, object_id=target.id).exists()
+        if not liked:
+            return 0
+        buffer.set(user.id, (content_type.id, target.id), False)
+        cls._start_flusher()
+        return 1
+
+    @classmethod
+    def _start_flusher(cls):
+        start_flusher(cls.flush_buffer, getattr(settings, 'LIKE_BUFFER_FLUSH_SECONDS', 0.2))
+
+    @classmethod
+    def flush_buffer(cls):
+        """
+        把 buffer 里排队的意图写进数据库，返回写了多少个意图
+        写失败的意图放回 buffer, 下一次接着写
+        """
+        with _flush_lock:
+            buffer = get_like_buffer()
+            intents = buffer.begin_flush()
+            try:
+                tweet_ids = cls._write_intents(intents)
+            except Exception:
+                buffer.end_flush(failed=True)
+                raise
+            buffer.end_flush()
+        for tweet_id in tweet_ids:
+            invalidate_fragment(Tweet, tweet_id)
+        return sum(len(users) for users in intents.values())
+
+    @classmethod
+    def _write_intents(cls, intents):
+        """
+        一批意图不管多少个都是固定的几条 SQL, 返回改了计数的 tweet id
+        """
+        likes, unlikes = {}, {}
+        for target, users in intents.items():
+            liked = [user_id for user_id, value in users.items() if value]
+            if liked:
+                likes[target] = liked
+            unliked = [user_id for user_id, value in users.items() if not value]
+            if unliked:
+                unlikes[target] = unliked
+        # 排队之后 tweet / comment 可能已经删掉了，上面的赞不写
+        existing = cls._get_existing_targets(likes)
+        likes = {target: users for target, users in likes.items() if target in existing}
+
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            created = []
+            if likes:
+                before = set(cls._filter_intents(likes).values_list('content_type_id', 'object_id', 'user_id'))
+                # 别的请求同时直接写进去的赞违反 unique_together, 被忽略
+                Like.objects.bulk_create(
+                    [
+                        Like(user_id=user_id, content_type_id=content_type_id, object_id=object_id)
+                        for (content_type_id, object_id), users in likes.items()
+                        for user_id in users
+                        if (content_type_id, object_id, user_id) not in before
+                    ],
+                    batch_size=getattr(settings, 'LIKE_BUFFER_FLUSH_BATCH_SIZE', 1000),
+                    ignore_conflicts=True,
+                )
+                created = [
+                    like
+                    for like in cls._filter_intents(likes)
+                    if (like.content_type_id, like.object_id, like.user_id) not in before
+                ]
+            if unlikes:
+                # 不走 delete() 的 post_delete: 每一条都会写一个 like.deleted 事件，计数下面一起重新数
+                queryset = cls._filter_intents(unlikes)
+                queryset._raw_delete(queryset.db)
+            tweet_type_id = ContentType.objects.get_for_model(Tweet).id
+            tweet_ids = sorted({
+                object_id
+                for content_type_id, object_id in list(likes) + list(unlikes)
+                if content_type_id == tweet_type_id
+            })
+            cls._recount_tweet_likes(tweet_ids)
+            # bulk_create 不会发 post_save, 没有 like.created 事件
+            # 它的 handler 要做的只是排队通知，这里一批一起排
+            NotificationService.queue_likes(created)
+        return tweet_ids
+
+    @classmethod
+    def _filter_intents(cls, intents):
+        return Like.objects.using(DEFAULT_DB_ALIAS).filter(reduce(operator.or_, [
+            Q(content_type_id=content_type_id, object_id=object_id, user_id__in=users)
+            for (content_type_id, object_id), users in intents.items()
+        ]))
+
+    @classmethod
+    def _get_existing_targets(cls, targets):
+        object_ids = defaultdict(list)
+        for content_type_id, object_id in targets:
+            object_ids[content_type_id].append(object_id)
+        existing = set()
+        for content_type_id, ids in object_ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is None:
+                continue
+            queryset = TweetService.get_visible_tweets() if model is Tweet else model.objects.all()
+            existing.update(
+                (content_type_id, object_id)
+                for object_id in queryset.using(DEFAULT_DB_ALIAS).filter(id__in=ids).values_list('id', flat=True)
+            )
+        return existing
+
+    @classmethod
+    def _recount_tweet_likes(cls, tweet_ids):
+        # 一批里同一个 tweet 的很多个赞只重新数一遍，所有的 tweet 一条 UPDATE
+        if not tweet_ids:
+            return
+        likes = Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(Tweet),
+            object_id=OuterRef('id'),
+        ).order_by().values('object_id').annotate(count=Count('id')).values('count')
+        Tweet.objects.filter(id__in=tweet_ids).update(
+            likes_count=Coalesce(Subquery(likes, output_field=IntegerField()), 0),
+        )
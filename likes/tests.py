@@ -1,3 +1,191 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import Client, override_settings
+from likes.buffer import InProcessLikeBuffer
+from likes.models import Like
+from likes.services import LikeService
+from notifications.models import NotificationEvent
+from outbox.models import OutboxEvent
+from testing.testcases import TestCase
+from tweets.models import Tweet
 
-# Create your tests here.
+
+class LikeServiceTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.tweet = self.create_tweet(self.linghu)
+
+    def test_like_and_unlike(self):
+        like, created = LikeService.like(self.dongxie, self.tweet)
+        self.assertTrue(created)
+        # 再赞一次什么也不做，不会多一个 like.created 事件
+        self.assertEqual(LikeService.like(self.dongxie, self.tweet), (like, False))
+        self.assertEqual(OutboxEvent.objects.filter(topic='like.created').count(), 1)
+        LikeService.like(self.linghu, self.tweet)
+        self.assertEqual(Tweet.objects.get(id=self.tweet.id).likes_count, 2)
+
+        self.assertEqual(LikeService.unlike(self.dongxie, self.tweet), 1)
+        self.assertEqual(LikeService.unlike(self.dongxie, self.tweet), 0)
+        self.assertEqual(Tweet.objects.get(id=self.tweet.id).likes_count, 1)
+        self.assertEqual(OutboxEvent.objects.filter(topic='like.deleted').count(), 1)
+
+        # comment 没有计数，只记下 like
+        comment = self.create_comment(self.dongxie, self.tweet)
+        LikeService.like(self.linghu, comment)
+        self.assertEqual(comment.like_set.count(), 1)
+        self.assertEqual(Tweet.objects.get(id=self.tweet.id).likes_count, 1)
+
+    def test_get_target(self):
+        comment = self.create_comment(self.dongxie, self.tweet)
+        self.assertEqual(LikeService.get_target('tweet', self.tweet.id), self.tweet)
+        self.assertEqual(LikeService.get_target('comment', comment.id), comment)
+        self.assertIsNone(LikeService.get_target('comment', self.tweet.id))
+        self.assertIsNone(LikeService.get_target('user', self.linghu.id))
+
+    def test_get_likes(self):
+        users = [self.create_user(f'fan{i}') for i in range(5)]
+        for user in users:
+            LikeService.like(user, self.tweet)
+        # 同一天的赞用 id 分先后
+        likes = LikeService.get_likes(Tweet, self.tweet.id, limit=3)
+        self.assertEqual([user_id for _, user_id, _ in likes], [users[4].id, users[3].id, users[2].id])
+        like_id, _, created_at = likes[-1]
+        likes = LikeService.get_likes(Tweet, self.tweet.id, before=(created_at, like_id), limit=3)
+        self.assertEqual([user_id for _, user_id, _ in likes], [users[1].id, users[0].id])
+        self.assertEqual(Like.objects.count(), 5)
+
+    def test_prefetch_content_objects(self):
+        comment = self.create_comment(self.dongxie, self.tweet)
+        self.create_like(self.dongxie, self.tweet)
+        self.create_like(self.linghu, comment)
+        other = self.create_comment(self.linghu, self.tweet)
+        self.create_like(self.dongxie, other)
+        other.delete()
+
+        likes = list(Like.objects.order_by('id'))
+        # 每种 content_type 一条 query, 找不到的 target 不放进缓存
+        with self.assertNumQueries(2):
+            LikeService.prefetch_content_objects(likes)
+        with self.assertNumQueries(0):
+            self.assertEqual([like.content_object for like in likes[:2]], [self.tweet, comment])
+        with self.assertNumQueries(1):
+            self.assertIsNone(likes[2].content_object)
+
+    def test_admin_changelist(self):
+        admin = User.objects.create_superuser('admin', 'admin@jiuzhang.com', 'password')
+        client = Client()
+        client.force_login(admin)
+        response = client.get('/admin/likes/like/')
+        self.assertEqual(response.status_code, 200)
+
+        # 一页里的 like 不管赞的是 tweet 还是 comment, SQL 的条数都一样
+        def add_likes():
+            for i in range(5):
+                user = self.create_user(f'fan{User.objects.count()}')
+                tweet = self.create_tweet(user)
+                self.create_like(user, tweet)
+                self.create_like(user, self.create_comment(user, tweet))
+        add_likes()
+        self.assertQueryCountIndependentOfRows(
+            lambda: client.get('/admin/likes/like/'),
+            add_likes,
+        )
+
+
+class InProcessLikeBufferTests(TestCase):
+
+    def test_intents(self):
+        buffer = InProcessLikeBuffer()
+        buffer.set(1, ('t', 1), True)
+        buffer.set(2, ('t', 1), True)
+        buffer.set(1, ('t', 1), False)
+        # 同一个人只留最后一次，按最后一次的先后排
+        self.assertEqual(buffer.get_target(('t', 1)), {2: True, 1: False})
+        self.assertIsNone(buffer.get(3, ('t', 1)))
+
+        # flush 到一半的时候还能读到，之后又排队的优先
+        self.assertEqual(buffer.begin_flush(), {('t', 1): {2: True, 1: False}})
+        buffer.set(2, ('t', 1), False)
+        self.assertFalse(buffer.get(2, ('t', 1)))
+        self.assertFalse(buffer.get(1, ('t', 1)))
+        # 写失败了放回去
+        buffer.end_flush(failed=True)
+        self.assertEqual(buffer.begin_flush(), {('t', 1): {1: False, 2: False}})
+        buffer.end_flush()
+        self.assertEqual(buffer.get_target(('t', 1)), {})
+
+
+@override_settings(LIKE_BUFFER_ENABLED=True, LIKE_BUFFER_FLUSH_SECONDS=0)
+class LikeBufferTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        # 上一个 test 剩下的意图写到已经回滚的数据里，不影响这个 test
+        LikeService.flush_buffer()
+        self.addCleanup(LikeService.flush_buffer)
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.tweet = self.create_tweet(self.linghu)
+
+    def test_like_and_unlike(self):
+        like, created = LikeService.like(self.dongxie, self.tweet)
+        self.assertTrue(created)
+        self.assertIsNone(like.id)
+        # 还没写进数据库，读的时候算上 buffer 里的
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(LikeService.like(self.dongxie, self.tweet)[1])
+        likes = LikeService.get_likes(Tweet, self.tweet.id)
+        self.assertEqual(
+            [user_id for _, user_id, _ in LikeService.merge_pending(Tweet, self.tweet.id, likes, True)],
+            [self.dongxie.id],
+        )
+        comment = self.create_comment(self.linghu, self.tweet)
+        LikeService.like(self.dongxie, comment)
+        LikeService.like(self.linghu, self.tweet)
+
+        self.assertEqual(LikeService.flush_buffer(), 3)
+        self.assertEqual(LikeService.flush_buffer(), 0)
+        self.assertEqual(Like.objects.count(), 3)
+        self.assertEqual(Tweet.objects.get(id=self.tweet.id).likes_count, 2)
+        # 自己赞自己不通知
+        self.assertEqual(
+            sorted(NotificationEvent.objects.values_list('target_id', 'actor_id')),
+            sorted([(self.tweet.id, self.dongxie.id), (comment.id, self.dongxie.id)]),
+        )
+
+        # 赞过的取消，没赞过的取消什么也不做
+        self.assertEqual(LikeService.unlike(self.dongxie, self.tweet), 1)
+        self.assertEqual(LikeService.unlike(self.dongxie, self.tweet), 0)
+        likes = LikeService.get_likes(Tweet, self.tweet.id)
+        self.assertEqual(
+            [user_id for _, user_id, _ in LikeService.merge_pending(Tweet, self.tweet.id, likes, True)],
+            [self.linghu.id],
+        )
+        # 赞了又取消，只写最后一次
+        LikeService.like(self.dongxie, comment)
+        LikeService.unlike(self.dongxie, comment)
+        LikeService.flush_buffer()
+        self.assertEqual(Like.objects.count(), 1)
+        self.assertEqual(Tweet.objects.get(id=self.tweet.id).likes_count, 1)
+
+    def test_deleted_target(self):
+        LikeService.like(self.dongxie, self.tweet)
+        self.tweet.deleted_at = self.tweet.created_at
+        self.tweet.save()
+        LikeService.flush_buffer()
+        self.assertFalse(Like.objects.exists())
+
+    def test_flush_queries(self):
+        def add_intents():
+            for _ in range(5):
+                user = self.create_user(f'fan{User.objects.count()}')
+                tweet = self.create_tweet(user)
+                LikeService.like(self.linghu, tweet)
+                LikeService.like(user, self.tweet)
+                LikeService.unlike(user, self.tweet)
+                LikeService.like(self.dongxie, self.create_comment(user, tweet))
+        add_intents()
+        # 一批不管多少个意图、多少个 target, SQL 的条数都一样
+        self.assertQueryCountIndependentOfRows(LikeService.flush_buffer, add_intents)
@@ -0,0 +1,79 @@
+from accounts.api.serializers import UserFastSerializer
+from django.conf import settings
+from newsfeeds.api.serializers import prefetch_tweets, serialize_newsfeeds
+from newsfeeds.api.views import get_updates, parse_since
+from newsfeeds.push import NewsFeedSubscription, push_enabled
+from newsfeeds.services import NewsFeedService
+from rest_framework import status
+from tweets.api.serializers import TweetFastSerializer
+from utils.async_views import async_api_view, async_login_required, gather, json_response, run_sync
+from utils.fast_serializers import fragments_enabled
+
+
+def _list_newsfeeds(user_id):
+    return serialize_newsfeeds(prefetch_tweets(NewsFeedService.get_timeline(user_id)))
+
+
+def _get_timeline(user_id):
+    # 只取 serialize 要用的列，tweet 的作者冗余在 newsfeed 上
+    return list(
+        NewsFeedService.get_timeline(user_id).only('id', 'created_at', 'tweet_id', 'tweet_user_id')
+    )
+
+
+@async_api_view
+@async_login_required
+async def list_newsfeeds(request):
+    """
+    GET /api/async/newsfeeds/
+    NewsFeedViewSet.list 的 async 版本，输出一样
+    """
+    user_id = request.user.id
+    if not fragments_enabled():
+        # 没有 fragment 缓存的时候 tweet 和 user 一起 prefetch, 没有可以同时做的查询
+        return json_response({'newsfeeds': await run_sync(_list_newsfeeds, user_id)})
+    # 先取这一页的 newsfeed, 然后 tweet 和作者的 fragment 互相独立，同时取
+    newsfeeds = await run_sync(_get_timeline, user_id)
+    tweet_ids = [newsfeed.tweet_id for newsfeed in newsfeeds if newsfeed.tweet_id is not None]
+    user_ids = list({newsfeed.tweet_user_id for newsfeed in newsfeeds if newsfeed.tweet_user_id is not None})
+    tweets, users = await gather(
+        (TweetFastSerializer.fetch_fragments, tweet_ids),
+        (UserFastSerializer.fetch_fragments, user_ids),
+    )
+    # 转发 / 引用的原 tweet 要看了 tweet 的内容才知道，在这里再取
+    newsfeeds = await run_sync(
+        serialize_newsfeeds, newsfeeds, {TweetFastSerializer: tweets, UserFastSerializer: users},
+    )
+    return json_response({'newsfeeds': newsfeeds})
+
+
+@async_api_view
+@async_login_required
+async def poll_newsfeeds(request):
+    """
+    GET /api/async/newsfeeds/poll/?since_id=<id>&timeout=25
+    连不上 SSE (/api/stream/newsfeeds/) 的客户端用的 long-poll,
+    参数和返回的内容和 /api/newsfeeds/updates/ 一样，但是没有新数据的时候不马上返回，
+    等到 fanout 推过来新的 tweet 或者超时再返回，空闲的客户端不会一直打数据库
+    """
+    since, since_id = parse_since(request.GET)
+    if since is None and since_id is None:
+        return json_response({
+            'message': 'missing since or since_id in request',
+            'success': False,
+        }, status=status.HTTP_400_BAD_REQUEST)
+    max_timeout = getattr(settings, 'NEWSFEED_LONG_POLL_TIMEOUT', 25)
+    try:
+        timeout = max(0, min(float(request.GET.get('timeout', max_timeout)), max_timeout))
+    except ValueError:
+        timeout = max_timeout
+
+    user_id = request.user.id
+    # 先订阅再查数据库，查询和订阅之间写进来的 newsfeed 也不会漏掉
+    async with NewsFeedSubscription(user_id) as subscription:
+        updates = await run_sync(get_updates, user_id, since, since_id)
+        if updates['newsfeeds'] or not push_enabled():
+            return json_response(updates)
+        if await subscription.get(timeout=timeout):
+            updates = await run_sync(get_updates, user_id, since, since_id)
+    return json_response(updates)
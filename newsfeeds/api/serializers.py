@@ -1,11 +1,52 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 from newsfeeds.models import NewsFeed
-from tweets.api.serializers import TweetSerializer
+from tweets.api.serializers import TweetSerializer, get_display_id
+from tweets.services import TweetService
+from utils.fast_serializers import FastSerializer, prefetch_unless_cached
 
 class NewsFeedSerializer(serializers.ModelSerializer):
     tweet = TweetSerializer()
+    # 64 位的 snowflake id 的字符串，见 TweetSerializer.id_str
+    id_str = serializers.CharField(source='id', read_only=True)
 
     class Meta:
         model = NewsFeed
-        fields = ('id', 'created_at', 'tweet')
-        # user 不需要展示，因为这里的user就是登录的user
\ No newline at end of file
+        fields = ('id', 'id_str', 'created_at', 'tweet')
+        # user 不需要展示，因为这里的user就是登录的user
+
+
+class NewsFeedFastSerializer(FastSerializer):
+    # newsfeed list 的热点读路径用，输出和 NewsFeedSerializer 完全一样
+    serializer_class = NewsFeedSerializer
+
+
+def prefetch_tweets(newsfeeds):
+    # 用 IN query 一次取出所有的 tweet 和 tweet 的 user, 软删除的 tweet 不取出来（newsfeed.tweet 是 None）
+    # 转发 / 引用的原 tweet 也是一样
+    return prefetch_unless_cached(
+        newsfeeds,
+        Prefetch('tweet', queryset=TweetService.get_visible_tweets()),
+        'tweet__user',
+        Prefetch('tweet__original', queryset=TweetService.get_visible_tweets()),
+        'tweet__original__user',
+    )
+
+
+def serialize_newsfeeds(newsfeeds, fragments=None):
+    # tweet 已经被删掉的 newsfeed 不展示：后台还没删到的（软删除的 tweet 输出是 null）
+    # 和以前 tweet 被删掉之后 tweet_id 设成 NULL 的
+    # 好几个关注的人转发了同一个 tweet (或者还关注了原作者) 的时候只展示第一条，
+    # 原 tweet 已经被删掉的转发不展示
+    shown = set()
+    ret = []
+    # fragments: 已经取好的 tweet / user 的 fragment（见 FastSerializer.fetch_fragments）
+    for newsfeed in NewsFeedFastSerializer(newsfeeds, many=True, fragments=fragments).data:
+        if newsfeed['tweet'] is None:
+            continue
+        display_id = get_display_id(newsfeed['tweet'])
+        if display_id is None or display_id in shown:
+            continue
+        shown.add(display_id)
+        ret.append(newsfeed)
+    return ret
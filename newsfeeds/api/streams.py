@@ -0,0 +1,51 @@
+from django.conf import settings
+from newsfeeds.push import NewsFeedSubscription
+from rest_framework import status
+from tweets.api.serializers import TweetFastSerializer, get_display_id
+from utils.async_views import run_sync
+from utils.json_fragments import dumps
+from utils.sse import ServerSentEvent, get_user, send_json, stream_events
+
+
+async def stream_newsfeeds(scope, receive, send):
+    """
+    GET /api/stream/newsfeeds/  (Server-Sent Events, 只有 ASGI 部署的时候有，见 twitter.asgi)
+
+    fanout 给当前用户写了新的 newsfeed 之后马上推过来:
+        id: <tweet id>
+        event: newsfeed
+        data: {"tweet": {...}}
+    和 /api/newsfeeds/ 里的 tweet 格式一样，tweet 的 JSON 一般都在缓存里，不用查数据库
+    连接空闲的时候不会有任何数据库的读
+    断线重连之后先用 /api/newsfeeds/updates/ 把断线期间的补上
+    """
+    if scope['method'] != 'GET':
+        return await send_json(
+            send,
+            {'detail': 'Method "{}" not allowed.'.format(scope['method'])},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+    user = await get_user(scope)
+    if not user.is_authenticated:
+        return await send_json(
+            send,
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+    await stream_events(
+        receive,
+        send,
+        _newsfeed_events(user.id),
+        heartbeat=getattr(settings, 'NEWSFEED_STREAM_HEARTBEAT', 15),
+    )
+
+
+async def _newsfeed_events(user_id):
+    async with NewsFeedSubscription(user_id) as subscription:
+        while True:
+            tweet_ids = await subscription.get()
+            tweets = await run_sync(TweetFastSerializer.from_pks, tweet_ids)
+            for tweet_id, tweet in zip(tweet_ids, tweets):
+                # 推过来之前 tweet (或者转发的原 tweet) 已经被删掉了
+                if tweet is not None and get_display_id(tweet) is not None:
+                    yield ServerSentEvent(dumps({'tweet': tweet}), event='newsfeed', id=tweet_id)
@@ -1,18 +1,42 @@
+import asyncio
+import base64
+import json
+
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from newsfeeds.api.streams import stream_newsfeeds
 from newsfeeds.models import NewsFeed
+from newsfeeds.push import registry as push_registry
+from newsfeeds.services import NewsFeedService
 from friendships.models import Friendship
+from django.test import Client
 from rest_framework.test import APIClient
-from testing.testcases import TestCase
+from testing.testcases import TestCase, TransactionTestCase
 from rest_framework import status
+from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.async_views import gather
+from utils.metrics import registry
+from utils.pubsub import InProcessBroker
+from utils.sse import ServerSentEventsRouter
 
 
 NEWSFEEDS_URL ='/api/newsfeeds/'
 POST_TWEETS_URL = '/api/tweets/'
 FOLLOW_URL = '/api/friendships/{}/follow/'
+ASYNC_NEWSFEEDS_URL = '/api/async/newsfeeds/'
+NEWSFEEDS_UPDATES_URL = '/api/newsfeeds/updates/'
+NEWSFEEDS_MARK_READ_URL = '/api/newsfeeds/mark_read/'
+POLL_NEWSFEEDS_URL = '/api/async/newsfeeds/poll/'
+STREAM_NEWSFEEDS_URL = '/api/stream/newsfeeds/'
 
 
 class NewsFeedApiTests(TestCase):
 
     def setUp(self):
+        self.clear_cache()
         self.linghu = self.create_user('linghu')
         self.linghu_client = APIClient()
         self.linghu_client.force_authenticate(self.linghu)
@@ -62,4 +86,278 @@ class NewsFeedApiTests(TestCase):
         # print("%%%%%%%")
         # print(response.data['newsfeeds'])
         self.assertEqual(len(response.data['newsfeeds']), 2)
-        self.assertEqual(response.data['newsfeeds'][0]['tweet']['id'], posted_tweet_id)
\ No newline at end of file
+        self.assertEqual(response.data['newsfeeds'][0]['tweet']['id'], posted_tweet_id)
+
+    def test_list_queries(self):
+        def list_newsfeeds():
+            # 没有缓存的情况，tweet 和 user 都要从数据库里取
+            self.clear_cache()
+            response = self.linghu_client.get(NEWSFEEDS_URL)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.linghu_client.post(POST_TWEETS_URL, {'content': 'Hello World'})
+        with self.assertQueriesMatchSnapshot('list'):
+            list_newsfeeds()
+        # tweet 和 user 的 JSON 都缓存起来之后只剩下 newsfeed 的一条 SQL
+        with self.assertQueriesMatchSnapshot('list_cached'):
+            self.linghu_client.get(NEWSFEEDS_URL)
+
+        def add_newsfeeds():
+            for i in range(3):
+                user = self.create_user(f'following{i}')
+                tweet = self.create_tweet(user)
+                NewsFeed.objects.create(user=self.linghu, tweet=tweet)
+        self.assertQueryCountIndependentOfRows(list_newsfeeds, add_newsfeeds)
+
+    def test_list_ranked(self):
+        self.linghu_client.post(FOLLOW_URL.format(self.dongxie.id))
+        popular_id, newer_id = self.post_tweets(2)
+        Tweet.objects.filter(id=popular_id).update(likes_count=1000)
+        response = self.linghu_client.get(NEWSFEEDS_URL, {'mode': 'ranked'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [newsfeed['tweet']['id'] for newsfeed in response.data['newsfeeds']],
+            [popular_id, newer_id],
+        )
+        # 不带 mode 的还是按时间排
+        response = self.linghu_client.get(NEWSFEEDS_URL)
+        self.assertEqual(
+            [newsfeed['tweet']['id'] for newsfeed in response.data['newsfeeds']],
+            [newer_id, popular_id],
+        )
+
+    def post_tweets(self, count):
+        return [
+            self.dongxie_client.post(POST_TWEETS_URL, {'content': f'tweet number {i}'}).data['id']
+            for i in range(count)
+        ]
+
+    def test_updates(self):
+        response = self.anonymous_client.get(NEWSFEEDS_UPDATES_URL, {'since_id': 1})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.linghu_client.get(NEWSFEEDS_UPDATES_URL)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.linghu_client.post(FOLLOW_URL.format(self.dongxie.id))
+        tweet_ids = self.post_tweets(3)
+        newsfeeds = self.linghu_client.get(NEWSFEEDS_URL).data['newsfeeds']
+        oldest = newsfeeds[-1]
+        self.assertEqual(oldest['tweet']['id'], tweet_ids[0])
+
+        # 只返回比 since_id 新的
+        response = self.linghu_client.get(NEWSFEEDS_UPDATES_URL, {'since_id': oldest['id']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [newsfeed['tweet']['id'] for newsfeed in response.data['newsfeeds']],
+            [tweet_ids[2], tweet_ids[1]],
+        )
+        self.assertEqual(response.data['has_more'], False)
+        self.assertEqual(response.data['unread_count'], 3)
+
+        # 用 created_at 也可以
+        response = self.linghu_client.get(NEWSFEEDS_UPDATES_URL, {'since': oldest['created_at']})
+        self.assertEqual(len(response.data['newsfeeds']), 2)
+        response = self.linghu_client.get(NEWSFEEDS_UPDATES_URL, {'since': newsfeeds[0]['created_at']})
+        self.assertEqual(len(response.data['newsfeeds']), 0)
+
+        # 自己发的不算未读
+        self.assertEqual(
+            self.dongxie_client.get(NEWSFEEDS_UPDATES_URL, {'since_id': 0}).data['unread_count'], 0,
+        )
+
+        response = self.linghu_client.post(NEWSFEEDS_MARK_READ_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.linghu_client.get(NEWSFEEDS_UPDATES_URL, {'since_id': newsfeeds[0]['id']})
+        self.assertEqual(response.data['newsfeeds'], [])
+        self.assertEqual(response.data['unread_count'], 0)
+
+        self.post_tweets(1)
+        response = self.linghu_client.get(NEWSFEEDS_UPDATES_URL, {'since_id': newsfeeds[0]['id']})
+        self.assertEqual(len(response.data['newsfeeds']), 1)
+        self.assertEqual(response.data['unread_count'], 1)
+
+    def test_updates_has_more(self):
+        self.linghu_client.post(FOLLOW_URL.format(self.dongxie.id))
+        self.post_tweets(3)
+        with self.settings(NEWSFEED_UPDATES_LIMIT=2):
+            response = self.linghu_client.get(NEWSFEEDS_UPDATES_URL, {'since_id': 0})
+        self.assertEqual(len(response.data['newsfeeds']), 2)
+        self.assertEqual(response.data['has_more'], True)
+
+    def test_updates_queries(self):
+        self.linghu_client.post(FOLLOW_URL.format(self.dongxie.id))
+        self.post_tweets(1)
+        newest = self.linghu_client.get(NEWSFEEDS_URL).data['newsfeeds'][0]
+        # 没有新数据的时候：newsfeed 的一次空的 range scan + 读一行未读数
+        with self.assertQueriesMatchSnapshot('updates_unchanged'):
+            response = self.linghu_client.get(NEWSFEEDS_UPDATES_URL, {'since': newest['created_at']})
+        self.assertEqual(response.data['newsfeeds'], [])
+
+
+class NewsFeedAsyncApiTests(TransactionTestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        registry.clear()
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.linghu_client = Client()
+        self.linghu_client.force_login(self.linghu)
+
+    def test_list(self):
+        response = Client().get(ASYNC_NEWSFEEDS_URL)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.content, Client().get(NEWSFEEDS_URL).content)
+
+        for i in range(3):
+            tweet = self.create_tweet(self.dongxie, f'tweet {i}')
+            NewsFeed.objects.create(user=self.linghu, tweet=tweet)
+        for _ in range(2):
+            response = self.linghu_client.get(ASYNC_NEWSFEEDS_URL)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.content, self.linghu_client.get(NEWSFEEDS_URL).content)
+        self.assertEqual(len(response.json()['newsfeeds']), 3)
+
+        # 线程池里执行的 SQL 也会被统计到
+        label = 'newsfeeds.api.async_views.list_newsfeeds'
+        values = registry.sql_queries.snapshot()[label]
+        self.assertEqual(values[-1], 3)
+        self.assertGreater(values[-2], 0)
+
+    def test_list_gathers_fragments(self):
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+        for i in range(3):
+            NewsFeedService.fanout_to_followers(self.create_tweet(self.dongxie, f'tweet {i}'))
+        original = self.create_tweet(self.linghu, 'original tweet')
+        NewsFeedService.fanout_to_followers(TweetService.retweet(self.dongxie, original)[0])
+        # 先取 newsfeed, 然后 tweet 和作者的 fragment 同时取，输出和同步的接口一样
+        with mock.patch('newsfeeds.api.async_views.gather', wraps=gather) as gathered:
+            for _ in range(2):
+                response = self.linghu_client.get(ASYNC_NEWSFEEDS_URL)
+                self.assertEqual(response.content, self.linghu_client.get(NEWSFEEDS_URL).content)
+        self.assertEqual(len(response.json()['newsfeeds']), 4)
+        tweet_ids, user_ids = gathered.call_args.args[0][1], gathered.call_args.args[1][1]
+        self.assertEqual(len(tweet_ids), 4)
+        self.assertEqual(user_ids, [self.dongxie.id])
+
+    def test_list_with_authentication_classes(self):
+        # 不用 session, 用 DEFAULT_AUTHENTICATION_CLASSES 里的 basic auth 也能访问
+        credentials = base64.b64encode(b'linghu:generic password').decode()
+        response = Client().get(ASYNC_NEWSFEEDS_URL, HTTP_AUTHORIZATION=f'Basic {credentials}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'newsfeeds': []})
+
+        # 密码错了和 DRF 的 view 返回一样的错误
+        credentials = base64.b64encode(b'linghu:wrong password').decode()
+        response = Client().get(ASYNC_NEWSFEEDS_URL, HTTP_AUTHORIZATION=f'Basic {credentials}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        expected = Client().get(NEWSFEEDS_URL, HTTP_AUTHORIZATION=f'Basic {credentials}')
+        self.assertEqual(response.content, expected.content)
+
+
+class NewsFeedPushTests(TransactionTestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+        self.async_client.force_login(self.linghu)
+
+    def post_tweet(self, content='hello push'):
+        # 和 POST /api/tweets/ 之后 outbox 的 handler 做的一样
+        tweet = self.create_tweet(self.dongxie, content)
+        NewsFeedService.fanout_to_followers(tweet)
+        return tweet
+
+    def post_tweet_in_thread(self, content='hello push'):
+        # 等着的 view 占着 thread_sensitive 的那个线程，要在别的线程里写
+        return sync_to_async(self.post_tweet, thread_sensitive=False)(content)
+
+    def test_broker(self):
+        broker = InProcessBroker()
+        received = []
+        unsubscribe = broker.subscribe('topic', received.append)
+        broker.publish('topic', {'a': 1})
+        broker.publish('other', {'a': 2})
+        unsubscribe()
+        broker.publish('topic', {'a': 3})
+        self.assertEqual(received, [{'a': 1}])
+
+    async def test_long_poll(self):
+        response = await self.async_client.get(POLL_NEWSFEEDS_URL)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # 没有新数据的时候等到超时
+        response = await self.async_client.get(f'{POLL_NEWSFEEDS_URL}?since_id=0&timeout=0.1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['newsfeeds'], [])
+
+        # 等的时候 fanout 推过来新的 tweet，马上返回
+        poll = asyncio.ensure_future(
+            self.async_client.get(f'{POLL_NEWSFEEDS_URL}?since_id=0&timeout=10')
+        )
+        await asyncio.sleep(0.2)
+        self.assertFalse(poll.done())
+        tweet = await self.post_tweet_in_thread()
+        response = await asyncio.wait_for(poll, 5)
+        newsfeeds = response.json()['newsfeeds']
+        self.assertEqual([newsfeed['tweet']['id'] for newsfeed in newsfeeds], [tweet.id])
+        self.assertEqual(response.json()['unread_count'], 1)
+
+        # 已经有新数据的时候不等
+        response = await asyncio.wait_for(
+            self.async_client.get(f'{POLL_NEWSFEEDS_URL}?since_id=0&timeout=10'), 5,
+        )
+        self.assertEqual(len(response.json()['newsfeeds']), 1)
+
+    async def test_stream(self):
+        app = ServerSentEventsRouter(None, {STREAM_NEWSFEEDS_URL: stream_newsfeeds})
+        sent = []
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        def scope(cookie=b''):
+            return {
+                'type': 'http',
+                'method': 'GET',
+                'path': STREAM_NEWSFEEDS_URL,
+                'query_string': b'',
+                'headers': [(b'cookie', cookie)],
+            }
+
+        # 需要登录
+        await app(scope(), receive, send)
+        self.assertEqual(sent[0]['status'], status.HTTP_403_FORBIDDEN)
+        sent.clear()
+
+        session_id = self.async_client.cookies[settings.SESSION_COOKIE_NAME].value
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session_id}'.encode()
+        stream = asyncio.ensure_future(app(scope(cookie), receive, send))
+        for _ in range(50):
+            if sent:
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual(sent[0]['status'], status.HTTP_200_OK)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+
+        tweet = await self.post_tweet_in_thread('hello stream')
+        for _ in range(50):
+            if len(sent) > 1:
+                break
+            await asyncio.sleep(0.05)
+        body = sent[1]['body'].decode()
+        self.assertTrue(body.startswith(f'id: {tweet.id}\nevent: newsfeed\ndata: '))
+        data = json.loads(body.split('data: ', 1)[1])
+        self.assertEqual(data['tweet']['content'], 'hello stream')
+
+        # 客户端断开之后取消订阅
+        disconnect.set()
+        await asyncio.wait_for(stream, 5)
+        self.assertFalse(push_registry._subscriptions)
@@ -1,9 +1,35 @@
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
 from rest_framework import viewsets, status
-from rest_framework.decorators import permission_classes
+from rest_framework.decorators import action, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from newsfeeds.models import NewsFeed
-from newsfeeds.api.serializers import NewsFeedSerializer
+from newsfeeds.ranking import NewsFeedRankingService
+from newsfeeds.services import NewsFeedService
+from newsfeeds.api.serializers import prefetch_tweets, serialize_newsfeeds
+
+
+def parse_since(params):
+    since = since_id = None
+    if params.get('since_id', '').isdigit():
+        since_id = int(params['since_id'])
+    elif params.get('since'):
+        # query string 里的 + 会变成空格，e.g. 2021-08-17T03:42:00.123456+00:00
+        since = parse_datetime(params['since'].replace(' ', '+'))
+    return since, since_id
+
+
+def get_updates(user_id, since=None, since_id=None):
+    # /api/newsfeeds/updates/ 和 long-poll 的 /api/async/newsfeeds/poll/ 共用
+    limit = getattr(settings, 'NEWSFEED_UPDATES_LIMIT', 50)
+    newsfeeds = NewsFeedService.get_newsfeeds_since(user_id, since=since, since_id=since_id)
+    # 多取一条，看看是不是还有更多，有的话客户端应该重新拉整个 newsfeed
+    newsfeeds = list(prefetch_tweets(newsfeeds)[:limit + 1])
+    return {
+        'newsfeeds': serialize_newsfeeds(newsfeeds[:limit]),
+        'has_more': len(newsfeeds) > limit,
+        'unread_count': NewsFeedService.get_unread_count(user_id),
+    }
 
 
 class NewsFeedViewSet(viewsets.GenericViewSet):
@@ -15,11 +41,54 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
         # 当前登录用户就是self.request.user
         # 也可以是self.request.user.newsfeed_set.all()
         # 但是一般最好还是按照NewsFeed.objecs.filter的方式写，这样更清晰直观
-        return NewsFeed.objects.filter(user=self.request.user)
+        # NewsFeed 是分片存储的，要通过 NewsFeedService 去 user 所在的 shard 上查
+        # 按 tweet 的时间排序，newsfeed 上有冗余的 tweet_created_at, 不需要 join tweet
+        return NewsFeedService.get_timeline(self.request.user.id)
 
     # list method only take the newsfeed of current user (self.request.user)
     def list(self, request):
-        serializer = NewsFeedSerializer(self.get_queryset(), many=True)
+        """
+        GET /api/newsfeeds/ 按时间倒序
+        GET /api/newsfeeds/?mode=ranked 按 NewsFeedRankingService 的分数排序
+        """
+        if request.query_params.get('mode') == 'ranked':
+            newsfeed_ids = NewsFeedRankingService.get_ranked_ids(request.user.id)
+            newsfeeds = prefetch_tweets(
+                NewsFeedService.get_newsfeeds(request.user.id).filter(id__in=newsfeed_ids)
+            )
+            newsfeeds = {newsfeed.id: newsfeed for newsfeed in newsfeeds}
+            newsfeeds = [newsfeeds[pk] for pk in newsfeed_ids if pk in newsfeeds]
+            return Response({
+                'newsfeeds': serialize_newsfeeds(newsfeeds),
+            }, status=status.HTTP_200_OK)
+
+        # 用 IN query 一次取出所有的 tweet 和 tweet 的 user, 不管有多少条 newsfeed, 最多 3 条 SQL
+        # tweet 和 user 的 JSON 都在缓存里的时候只有 1 条 SQL
+        newsfeeds = prefetch_tweets(self.get_queryset())
         return Response({
-            'newsfeeds': serializer.data,
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+            'newsfeeds': serialize_newsfeeds(newsfeeds),
+        }, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=False)
+    def updates(self, request):
+        """
+        /api/newsfeeds/updates/?since=<最新一条的 created_at> 或者 ?since_id=<最新一条的 id>
+        轮询用：只返回比客户端手上更新的 newsfeed（最多 NEWSFEED_UPDATES_LIMIT 条）和未读数，
+        没有新数据的时候只有两条很轻的 SQL, 返回的内容也很小
+        """
+        since, since_id = parse_since(request.query_params)
+        if since is None and since_id is None:
+            return Response({
+                'message': 'missing since or since_id in request',
+                'success': False,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            get_updates(request.user.id, since, since_id),
+            status=status.HTTP_200_OK,
+        )
+
+    @action(methods=['POST'], detail=False)
+    def mark_read(self, request):
+        # /api/newsfeeds/mark_read/ 客户端把新的 newsfeed 展示出来之后，未读数清零
+        NewsFeedService.mark_read(request.user.id)
+        return Response({'success': True}, status=status.HTTP_200_OK)
@@ -0,0 +1,9 @@
+def detach_deleted_tweet(sender, instance, **kwargs):
+    # 在这里 import 避免 models <-> services 的循环 import
+    from newsfeeds.services import NewsFeedService
+    NewsFeedService.detach_tweet(instance.id)
+
+
+def delete_user_newsfeeds(sender, instance, **kwargs):
+    from newsfeeds.services import NewsFeedService
+    NewsFeedService.delete_newsfeeds(instance.id)
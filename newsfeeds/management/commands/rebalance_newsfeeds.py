@@ -0,0 +1,98 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from newsfeeds.models import NewsFeed
+from newsfeeds.sharding import get_shard, get_shards
+
+
+class Command(BaseCommand):
+    """
+    增加 shard 的步骤（e.g. 从 default 一个 shard 变成 default, shard1, shard2）:
+    1. 在 DATABASES 里加上新的库，python manage.py migrate --database shard1
+    2. python manage.py rebalance_newsfeeds --to default,shard1,shard2
+       把数据按新的分片规则复制过去，旧的数据不动，线上的读写不受影响
+    3. 把 NEWSFEED_SHARDS 改成新的配置并上线
+    4. python manage.py rebalance_newsfeeds --from default --to default,shard1,shard2 --delete
+       再复制一次（补上第 2 步和第 3 步之间新写的数据），然后删掉已经搬走的数据
+
+    每一批都可以重复执行：(user, tweet) 是 unique 的，已经复制过的数据会被忽略
+    """
+    help = 'Copy NewsFeed rows to the shard they belong to under a new shard list.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='source', help='Comma separated source shards. '
+                            'Defaults to settings.NEWSFEED_SHARDS.')
+        parser.add_argument('--to', dest='target', required=True,
+                            help='Comma separated target shard list, in order.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to sleep between batches to limit load.')
+        parser.add_argument('--delete', action='store_true',
+                            help='Delete rows from the source shard after copying them.')
+
+    def handle(self, *args, **options):
+        sources = self.parse_aliases(options['source']) if options['source'] else get_shards()
+        targets = self.parse_aliases(options['target'])
+        for source in sources:
+            copied, deleted = self.rebalance_shard(source, targets, options)
+            self.stdout.write(f'{source}: copied {copied} rows, deleted {deleted} rows')
+
+    def parse_aliases(self, value):
+        aliases = [alias for alias in value.split(',') if alias]
+        unknown = set(aliases) - set(settings.DATABASES)
+        if unknown:
+            raise CommandError('unknown databases: {}'.format(', '.join(sorted(unknown))))
+        return aliases
+
+    def rebalance_shard(self, source, targets, options):
+        copied = deleted = 0
+        last_id = 0
+        while True:
+            # 按主键分批，每批都是一个 range scan
+            newsfeeds = list(
+                NewsFeed.objects.using(source)
+                .filter(id__gt=last_id)
+                .order_by('id')[:options['batch_size']]
+            )
+            if not newsfeeds:
+                break
+            last_id = newsfeeds[-1].id
+
+            moved = {}
+            for newsfeed in newsfeeds:
+                target = get_shard(newsfeed.user_id, targets)
+                if target != source:
+                    moved.setdefault(target, []).append(newsfeed)
+            for target, rows in moved.items():
+                copied += self.copy_rows(rows, target)
+            if options['delete'] and moved:
+                ids = [newsfeed.id for rows in moved.values() for newsfeed in rows]
+                deleted += NewsFeed.objects.using(source).filter(id__in=ids).delete()[0]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        return copied, deleted
+
+    def copy_rows(self, rows, target):
+        # tweet 已经被删掉的 newsfeed 没有必要复制
+        rows = [
+            NewsFeed(
+                id=row.id,
+                user_id=row.user_id,
+                tweet_id=row.tweet_id,
+                tweet_user_id=row.tweet_user_id,
+                tweet_created_at=row.tweet_created_at,
+                created_at=row.created_at,
+            )
+            for row in rows
+            if row.tweet_id is not None
+        ]
+        if not rows:
+            return 0
+        # bulk_create 会把 auto_now_add 的 created_at 改成现在的时间，
+        # 这里用 raw insert 保留原来的 created_at。id 也保留原来的，客户端手上的 since_id 搬完之后还能用
+        fields = NewsFeed._meta.concrete_fields
+        NewsFeed.objects.db_manager(target)._insert(
+            rows, fields=fields, using=target, raw=True, ignore_conflicts=True,
+        )
+        return len(rows)
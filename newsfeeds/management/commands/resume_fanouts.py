@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from newsfeeds.models import FanoutChunk
+from newsfeeds.services import NewsFeedService
+from utils.time_helper import utc_now
+
+
+class Command(BaseCommand):
+    """
+    python manage.py resume_fanouts --older-than 300
+
+    把创建超过 --older-than 秒还没有完成的 FanoutChunk 重新跑一遍（发 tweet 的进程挂掉了，
+    或者某一块写失败了）。每一块都可以重复执行，已经写过的 newsfeed 会被忽略，
+    所以和还在跑的 fanout 撞上也没有关系，只是多做一点无用功
+
+    --purge-days: 顺便删掉完成超过这么多天的 FanoutChunk, 0 表示不删
+    """
+    help = 'Re-run fanout chunks that were started but never completed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=300,
+                            help='Only resume chunks created more than this many seconds ago.')
+        parser.add_argument('--purge-days', type=int, default=7,
+                            help='Delete chunks completed more than this many days ago.')
+
+    def handle(self, *args, **options):
+        created_before = utc_now() - timedelta(seconds=options['older_than'])
+        chunks = NewsFeedService.get_unfinished_fanout_chunks(created_before)
+        NewsFeedService.run_fanout_chunks(chunks)
+        self.stdout.write(f'resumed {len(chunks)} chunks')
+
+        if options['purge_days']:
+            completed_before = utc_now() - timedelta(days=options['purge_days'])
+            deleted, _ = FanoutChunk.objects.filter(completed_at__lt=completed_before).delete()
+            self.stdout.write(f'purged {deleted} completed chunks')
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from newsfeeds.models import NewsFeed
+from newsfeeds.sharding import get_shards
+from utils.maintenance import Throttle
+
+
+class Command(BaseCommand):
+    """
+    python manage.py trim_newsfeeds --keep 1000 --batch-size 500 --sleep 0.1
+
+    每个用户的 newsfeed 只保留最新的 --keep 条，更早的分批删掉
+    用户按 user_id 一个一个地走 (user, id) 的索引，每次 delete 最多 --batch-size 行
+    """
+    help = 'Trim every NewsFeed inbox to its newest N entries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to sleep between batches to limit load.')
+        parser.add_argument('--shard', action='append', dest='shards',
+                            help='Only trim this shard. Can be repeated.')
+
+    def handle(self, *args, **options):
+        throttle = Throttle(options['sleep'])
+        for alias in options['shards'] or get_shards():
+            users = deleted = 0
+            for user_id in self.iter_user_ids(alias):
+                count = self.trim_user(alias, user_id, options['keep'], options['batch_size'], throttle)
+                if count:
+                    users += 1
+                    deleted += count
+            self.stdout.write(f'{alias}: trimmed {users} users, deleted {deleted} rows')
+
+    def iter_user_ids(self, alias):
+        # 每次在索引上跳到下一个 user_id, 有多少个用户就查多少次，不会一次把所有的 user_id 拿出来
+        last_user_id = 0
+        while True:
+            user_id = (
+                NewsFeed.objects.using(alias)
+                .filter(user_id__gt=last_user_id)
+                .order_by('user_id')
+                .values_list('user_id', flat=True)
+                .first()
+            )
+            if user_id is None:
+                return
+            yield user_id
+            last_user_id = user_id
+
+    def trim_user(self, alias, user_id, keep, batch_size, throttle):
+        newsfeeds = NewsFeed.objects.using(alias).filter(user_id=user_id)
+        # 第 keep + 1 新的那一条，比它更早（包括它）的都要删掉，id 是按时间递增的
+        cutoff = newsfeeds.order_by('-id').values_list('id', flat=True)[keep:keep + 1].first()
+        if cutoff is None:
+            return 0
+        older = newsfeeds.filter(id__lte=cutoff)
+        deleted = 0
+        while True:
+            ids = list(older.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += NewsFeed.objects.using(alias).filter(id__in=ids).delete()[0]
+            throttle()
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.3 on 2026-10-19 13:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0002_auto_20210817_0342'),
+        ('newsfeeds', '0002_newsfeed_shard_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FanoutChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author_id', models.IntegerField()),
+                ('min_follower_id', models.IntegerField()),
+                ('max_follower_id', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(null=True)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tweets.tweet')),
+            ],
+            options={
+                'index_together': {('completed_at', 'created_at')},
+            },
+        ),
+    ]
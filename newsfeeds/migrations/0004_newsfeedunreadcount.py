@@ -0,0 +1,22 @@
+# Generated by Django 3.1.3 on 2026-10-19 14:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('newsfeeds', '0003_fanoutchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewsFeedUnreadCount',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='auth.user')),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.1.3 on 2026-10-19 14:27
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+import django.db.models.deletion
+import utils.snowflake
+
+
+def widen_tweet_id(apps, schema_editor):
+    # tweets.0005 把 tweet.id 改成了 bigint, default 库里指向它的外键会一起改，
+    # 单独的 shard 库上不执行 tweets 的 migration, newsfeed.tweet_id 要在这里改
+    if schema_editor.connection.alias == DEFAULT_DB_ALIAS:
+        return
+    NewsFeed = apps.get_model('newsfeeds', 'NewsFeed')
+    old_field = models.IntegerField(null=True, db_index=True, db_column='tweet_id')
+    new_field = models.BigIntegerField(null=True, db_index=True, db_column='tweet_id')
+    for field in (old_field, new_field):
+        field.set_attributes_from_name('tweet')
+        field.model = NewsFeed
+    schema_editor.alter_field(NewsFeed, old_field, new_field)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('newsfeeds', '0004_newsfeedunreadcount'),
+        ('tweets', '0005_tweet_snowflake_id'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='newsfeed',
+            options={'ordering': ('-id',)},
+        ),
+        migrations.AlterField(
+            model_name='newsfeed',
+            name='id',
+            field=models.BigIntegerField(default=utils.snowflake.next_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='newsfeed',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterIndexTogether(
+            name='newsfeed',
+            index_together={('user', 'id')},
+        ),
+        migrations.RunPython(
+            widen_tweet_id,
+            migrations.RunPython.noop,
+            hints={'model_name': 'newsfeed'},
+        ),
+    ]
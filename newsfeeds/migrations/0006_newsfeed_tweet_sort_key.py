@@ -0,0 +1,34 @@
+# Generated by Django 3.1.3 on 2026-10-19 14:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('newsfeeds', '0005_newsfeed_snowflake_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fanoutchunk',
+            name='tweet_created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='newsfeed',
+            name='tweet_created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='newsfeed',
+            name='tweet_user_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='newsfeed',
+            index_together={('user', 'tweet_created_at'), ('user', 'id')},
+        ),
+    ]
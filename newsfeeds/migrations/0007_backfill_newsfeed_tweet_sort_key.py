@@ -0,0 +1,50 @@
+from django.db import DEFAULT_DB_ALIAS, migrations
+
+# 每一批只读 / 改这么多行，newsfeed 表很大的时候也不会有一条长时间锁表的 UPDATE
+BATCH_SIZE = 1000
+
+
+def backfill_tweet_sort_key(apps, schema_editor):
+    # 每个 shard 上各跑一次，tweet 都在 default 上
+    NewsFeed = apps.get_model('newsfeeds', 'NewsFeed')
+    Tweet = apps.get_model('tweets', 'Tweet')
+    newsfeeds = NewsFeed.objects.using(schema_editor.connection.alias)
+    last_id = 0
+    while True:
+        # 按主键往后翻，已经处理过的行不会再扫一遍
+        rows = list(
+            newsfeeds.filter(id__gt=last_id)
+            .order_by('id')
+            .only('id', 'tweet_id', 'tweet_user_id', 'tweet_created_at')[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        last_id = rows[-1].id
+        rows = [row for row in rows if row.tweet_id is not None and row.tweet_created_at is None]
+        tweets = {
+            tweet_id: (user_id, created_at)
+            for tweet_id, user_id, created_at in Tweet.objects.using(DEFAULT_DB_ALIAS)
+            .filter(id__in={row.tweet_id for row in rows})
+            .values_list('id', 'user_id', 'created_at')
+        }
+        # tweet 已经被删掉的 newsfeed 留着 NULL, 反正也不会展示
+        rows = [row for row in rows if row.tweet_id in tweets]
+        for row in rows:
+            row.tweet_user_id, row.tweet_created_at = tweets[row.tweet_id]
+        if rows:
+            newsfeeds.bulk_update(rows, ['tweet_user_id', 'tweet_created_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsfeeds', '0006_newsfeed_tweet_sort_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_tweet_sort_key,
+            migrations.RunPython.noop,
+            hints={'model_name': 'newsfeed'},
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.3 on 2026-10-19 15:50
+
+from django.db import migrations
+
+
+def delete_duplicate_chunks(apps, schema_editor):
+    # 以前重复执行的 tweet.created 事件给同一个 tweet 建了好几份块
+    # 每个 (tweet, min_follower_id) 留一个：有完成了的留完成了的，否则留最早建的
+    FanoutChunk = apps.get_model('newsfeeds', 'FanoutChunk')
+    chunks = FanoutChunk.objects.using(schema_editor.connection.alias)
+    kept = {}
+    duplicate_ids = []
+    for chunk_id, tweet_id, min_follower_id, completed_at in chunks.order_by('id').values_list(
+        'id', 'tweet_id', 'min_follower_id', 'completed_at',
+    ).iterator():
+        key = (tweet_id, min_follower_id)
+        if key not in kept:
+            kept[key] = (chunk_id, completed_at)
+        elif completed_at is not None and kept[key][1] is None:
+            duplicate_ids.append(kept[key][0])
+            kept[key] = (chunk_id, completed_at)
+        else:
+            duplicate_ids.append(chunk_id)
+    if duplicate_ids:
+        chunks.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0007_tweet_retweet_key'),
+        ('newsfeeds', '0007_backfill_newsfeed_tweet_sort_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_duplicate_chunks,
+            migrations.RunPython.noop,
+            hints={'model_name': 'fanoutchunk'},
+        ),
+        migrations.AlterUniqueTogether(
+            name='fanoutchunk',
+            unique_together={('tweet', 'min_follower_id')},
+        ),
+    ]
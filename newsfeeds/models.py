@@ -1,23 +1,85 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models.signals import post_delete
+from newsfeeds.listeners import delete_user_newsfeeds, detach_deleted_tweet
 from tweets.models import Tweet
+from utils.snowflake import next_id
 
 
 class NewsFeed(models.Model):
+    # NewsFeed 按 user_id 分片存在不同的库里（见 newsfeeds.sharding），
+    # user / tweet 可能在另外一个库里，所以不能有数据库的外键约束，
+    # 删除 user / tweet 的时候也不能靠 on_delete, 由下面的 listener 处理
+    # id 按时间递增（见 utils.snowflake），不同的 shard 上也不会重复，搬到别的 shard 的时候 id 不变
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
     # 注意这个user不是存储谁发了这条tweet， 而是谁可以看到这条tweet
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
-    tweet = models.ForeignKey(Tweet, on_delete=models.SET_NULL, null=True)
-    # created_at is the same as created-at in tweet, however, we need created at to sort in newsfeed table,
-    # it is very slow if we use created_at in tweet table, so we add a created_at column in newsfeed table.
+    # 单独的 user 索引不需要，(user, id) 的联合索引可以代替
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, null=True, db_constraint=False, db_index=False,
+    )
+    tweet = models.ForeignKey(Tweet, on_delete=models.DO_NOTHING, null=True, db_constraint=False)
+    # 从 tweet 上冗余过来的两列，fanout 的时候写好。newsfeed 的 id / created_at 是 fanout 的时间,
+    # 大 V 的 fanout 分块跑，或者 resume_fanouts 补跑的时候会比 tweet 晚很多，
+    # 按 tweet 的时间排序、按作者过滤都只需要查这张表，不需要 join tweet（分片之后也 join 不了）
+    tweet_user_id = models.IntegerField(null=True)
+    tweet_created_at = models.DateTimeField(null=True)
+    # 增量更新 (since_id) 用 id, created_at 只是用来展示
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        index_together = (('user', 'created_at'), )
+        # (user, id): 增量更新，按 fanout 的先后顺序
+        # (user, tweet_created_at): 翻页，按 tweet 的时间倒序，按作者过滤也是在这个索引的范围里
+        index_together = (('user', 'id'), ('user', 'tweet_created_at'))
         unique_together = (('user', 'tweet'), )
         # ordering 的作用是拿去加载在queryset的后面
-        ordering = ('-created_at',)
+        ordering = ('-id',)
 
     def __str__(self):
         return f'{self.created_at} inbox of {self.user}: {self.tweet}'
 
 
+class NewsFeedUnreadCount(models.Model):
+    """
+    每个用户有多少条还没有看过的 newsfeed，fanout 的时候顺便 +1，客户端标记已读的时候清零
+    这样轮询的时候只需要按主键读一行，不需要去 count newsfeed 表
+    只是一个提示用的数字：fanout 重试的时候可能会多算
+    这张表不分片，在 default 上
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user_id} has {self.count} unread newsfeeds'
+
+
+class FanoutChunk(models.Model):
+    """
+    大 V 的 fanout 按 follower id 的范围切成很多块，每一块一行，记录进度
+    每一块都可以重复执行（NewsFeed 上 (user, tweet) 是 unique 的，重复的 insert 会被忽略），
+    进程挂掉之后 resume_fanouts 把没有完成的块重新跑一遍就可以了
+    """
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
+    # 发 tweet 的人和发的时间，冗余一份，resume 的时候不需要再去查 tweet
+    author_id = models.IntegerField()
+    # 这个字段之前建的块是 NULL, fanout_chunk 的时候再去查 tweet
+    tweet_created_at = models.DateTimeField(null=True)
+    # follower id 的范围，两端都包含
+    min_follower_id = models.IntegerField()
+    max_follower_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        index_together = (('completed_at', 'created_at'), )
+        # 同一个 tweet 的块只建一次，tweet.created 事件重复执行的时候不会多出一份
+        unique_together = (('tweet', 'min_follower_id'), )
+
+    def __str__(self):
+        return (
+            f'fanout of {self.tweet_id} to followers '
+            f'{self.min_follower_id}-{self.max_follower_id}'
+        )
+
+
+post_delete.connect(detach_deleted_tweet, sender=Tweet)
+post_delete.connect(delete_user_newsfeeds, sender=User)
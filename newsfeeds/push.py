@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+from django.conf import settings
+from utils.pubsub import get_broker
+
+
+# fanout 写完 newsfeed 之后往这个 topic 发一条消息: {'tweet_id': 1, 'user_ids': [2, 3]}
+# 一个 tweet（一个 fanout 的块）只发一条，而不是每个 follower 一条，
+# 每个进程自己挑出连在自己这里的 user
+NEWSFEED_TOPIC = 'newsfeeds'
+
+
+def push_enabled():
+    return getattr(settings, 'NEWSFEED_PUSH_ENABLED', True)
+
+
+def publish_newsfeeds(tweet_id, user_ids):
+    if not user_ids or not push_enabled():
+        return
+    get_broker().publish(NEWSFEED_TOPIC, {'tweet_id': tweet_id, 'user_ids': list(user_ids)})
+
+
+class _SubscriptionRegistry(object):
+    """
+    当前进程里连着的客户端，user_id -> set of NewsFeedSubscription
+    第一个客户端连上来的时候才去 broker 订阅，没有人连着的时候不订阅
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._unsubscribe = None
+
+    def add(self, subscription):
+        with self._lock:
+            self._subscriptions.setdefault(subscription.user_id, set()).add(subscription)
+            if self._unsubscribe is None:
+                self._unsubscribe = get_broker().subscribe(NEWSFEED_TOPIC, self.dispatch)
+
+    def remove(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+            if not self._subscriptions and self._unsubscribe is not None:
+                self._unsubscribe()
+                self._unsubscribe = None
+
+    def dispatch(self, message):
+        with self._lock:
+            targets = [
+                subscription
+                for user_id in message['user_ids']
+                for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription in targets:
+            subscription.notify(message['tweet_id'])
+
+
+registry = _SubscriptionRegistry()
+
+
+class NewsFeedSubscription(object):
+    """
+    一个连接（SSE 的一个连接，或者 long-poll 的一个请求）收到的新 tweet
+    只能在 event loop 里创建和读，notify 可以在任何线程里调用
+
+        async with NewsFeedSubscription(user_id) as subscription:
+            tweet_ids = await subscription.get(timeout=25)
+    """
+
+    def __init__(self, user_id, max_size=100):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        # 客户端太慢的时候丢掉新的消息，客户端之后用 /api/newsfeeds/updates/ 补回来
+        self.queue = asyncio.Queue(maxsize=max_size)
+
+    async def __aenter__(self):
+        registry.add(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        registry.remove(self)
+
+    def notify(self, tweet_id):
+        try:
+            self.loop.call_soon_threadsafe(self._put, tweet_id)
+        except RuntimeError:
+            # event loop 已经关掉了，连接已经断了
+            pass
+
+    def _put(self, tweet_id):
+        if not self.queue.full():
+            self.queue.put_nowait(tweet_id)
+
+    async def get(self, timeout=None):
+        """
+        等到至少有一条，然后把已经到了的都取出来，按到达的顺序返回 tweet id
+        超时返回 []
+        """
+        try:
+            tweet_ids = [await asyncio.wait_for(self.queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.queue.empty():
+            tweet_ids.append(self.queue.get_nowait())
+        return list(dict.fromkeys(tweet_ids))
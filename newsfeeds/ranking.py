@@ -0,0 +1,166 @@
+import math
+
+from comments.models import Comment
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Count
+from friendships.services import FriendshipService
+from likes.models import Like
+from newsfeeds.services import NewsFeedService
+from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.time_helper import utc_now
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover, numpy 是可选的依赖
+    numpy = None
+
+
+# 每个候选的特征，顺序就是 score() 里矩阵的列
+# recency: 0.5 ^ (tweet 发出来多久 / 半衰期)；其他的取 log1p, 几个赞和几万个赞的差别不会大到压过别的特征
+FEATURES = ('recency', 'likes', 'comments', 'affinity', 'followers')
+
+DEFAULT_WEIGHTS = {
+    'recency': 3.0,
+    'likes': 0.5,
+    'comments': 0.8,
+    # 当前用户赞过 / 评论过多少次这个作者的 tweet
+    'affinity': 1.0,
+    # 作者的粉丝数
+    'followers': 0.2,
+}
+
+
+def ranked_cache_key(user_id):
+    return f'newsfeeds:ranked:{user_id}'
+
+
+def score(rows, weights, half_life):
+    """
+    rows: 每个候选一行 (age_seconds, likes, comments, affinity, followers)
+    返回每个候选的分数，装了 numpy 的时候整个窗口一次矩阵运算算完
+    """
+    weights = [weights.get(feature, 0) for feature in FEATURES]
+    if numpy is not None:
+        matrix = numpy.array(rows, dtype=numpy.float64).reshape(len(rows), len(FEATURES))
+        matrix[:, 0] = numpy.exp2(-matrix[:, 0] / half_life)
+        matrix[:, 1:] = numpy.log1p(matrix[:, 1:])
+        return (matrix @ numpy.array(weights)).tolist()
+    return [
+        weights[0] * 2 ** (-row[0] / half_life)
+        + sum(weight * math.log1p(value) for weight, value in zip(weights[1:], row[1:]))
+        for row in rows
+    ]
+
+
+class NewsFeedRankingService(object):
+    """
+    排序的 newsfeed (GET /api/newsfeeds/?mode=ranked):
+    从 inbox 里按时间取最新的 NEWSFEED_RANKED_CANDIDATES 条作为候选，
+    几条批量的 SQL 取出所有候选的特征，一次算完所有的分数，
+    排好的 newsfeed id 按用户缓存 NEWSFEED_RANKED_TTL 秒，缓存有效的时候不需要重新排
+    缓存期间新 fanout 进来的 tweet 要等缓存过期才会出现
+    """
+
+    @classmethod
+    def get_ranked_ids(cls, user_id):
+        key = ranked_cache_key(user_id)
+        newsfeed_ids = cache.get(key)
+        if newsfeed_ids is None:
+            newsfeed_ids = cls.rank(user_id)
+            cache.set(key, newsfeed_ids, getattr(settings, 'NEWSFEED_RANKED_TTL', 60))
+        return newsfeed_ids
+
+    @classmethod
+    def invalidate(cls, user_id):
+        cache.delete(ranked_cache_key(user_id))
+
+    @classmethod
+    def rank(cls, user_id):
+        window = getattr(settings, 'NEWSFEED_RANKED_CANDIDATES', 200)
+        # tweet 的作者和时间都冗余在 newsfeed 上，不需要 join tweet
+        candidates = list(
+            NewsFeedService.get_timeline(user_id)
+            .filter(tweet_id__isnull=False)
+            .values_list('id', 'tweet_id', 'tweet_user_id', 'tweet_created_at')[:window]
+        )
+        if not candidates:
+            return []
+        counters = {
+            tweet_id: (likes_count, comments_count)
+            for tweet_id, likes_count, comments_count in TweetService.get_visible_tweets()
+            .filter(id__in=[tweet_id for _, tweet_id, _, _ in candidates])
+            .values_list('id', 'likes_count', 'comments_count')
+        }
+        # 已经删掉的 tweet 不参加排序
+        candidates = [candidate for candidate in candidates if candidate[1] in counters]
+        author_ids = {author_id for _, _, author_id, _ in candidates if author_id is not None}
+        affinity = cls.get_affinity(user_id, author_ids)
+        followers = FriendshipService.get_follower_counts(author_ids)
+
+        now = utc_now()
+        rows = []
+        for _, tweet_id, author_id, created_at in candidates:
+            likes_count, comments_count = counters[tweet_id]
+            # 没有 tweet_created_at 的老数据当作很久以前的
+            age = (now - created_at).total_seconds() if created_at is not None else math.inf
+            rows.append((
+                max(age, 0),
+                likes_count,
+                comments_count,
+                affinity.get(author_id, 0),
+                followers.get(author_id, 0),
+            ))
+        scores = score(
+            rows,
+            getattr(settings, 'NEWSFEED_RANKING_WEIGHTS', DEFAULT_WEIGHTS),
+            getattr(settings, 'NEWSFEED_RANKING_HALF_LIFE', 6 * 60 * 60),
+        )
+        # 分数一样的新的在前面
+        order = sorted(range(len(candidates)), key=lambda i: (-scores[i], -candidates[i][0]))
+        return [candidates[i][0] for i in order]
+
+    @classmethod
+    def get_affinity(cls, user_id, author_ids):
+        """
+        {author_id: 当前用户最近赞过 + 评论过这个作者的 tweet 的次数}
+        只看最近 NEWSFEED_RANKING_AFFINITY_HISTORY 个赞和最近这么多条评论，
+        老用户的赞 / 评论再多也是固定的代价
+        """
+        if not author_ids:
+            return {}
+        history = getattr(settings, 'NEWSFEED_RANKING_AFFINITY_HISTORY', 500)
+        # 走 like 上的 (user, content_type, created_at) 索引
+        liked_tweet_ids = list(
+            Like.objects.filter(
+                user_id=user_id,
+                content_type=ContentType.objects.get_for_model(Tweet),
+            ).order_by('-created_at').values_list('object_id', flat=True)[:history]
+        )
+        affinity = {}
+        if liked_tweet_ids:
+            affinity.update(
+                Tweet.objects.filter(id__in=liked_tweet_ids, user_id__in=author_ids)
+                .order_by()
+                .values_list('user_id')
+                .annotate(count=Count('id'))
+            )
+        # comment 的 id 按时间递增，走 user_id 的索引（InnoDB 的二级索引后面自带主键 id）
+        # 同一个 tweet 评论了好几次的每一次都算
+        commented_tweet_ids = list(
+            Comment.objects.filter(user_id=user_id, tweet_id__isnull=False)
+            .order_by('-id')
+            .values_list('tweet_id', flat=True)[:history]
+        )
+        if commented_tweet_ids:
+            authors = dict(
+                Tweet.objects.filter(id__in=set(commented_tweet_ids), user_id__in=author_ids)
+                .values_list('id', 'user_id')
+            )
+            for tweet_id in commented_tweet_ids:
+                author_id = authors.get(tweet_id)
+                if author_id is not None:
+                    affinity[author_id] = affinity.get(author_id, 0) + 1
+        return affinity
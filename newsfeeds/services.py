@@ -1,12 +1,35 @@
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F
 from friendships.services import FriendshipService
-from newsfeeds.models import NewsFeed
+from newsfeeds.models import FanoutChunk, NewsFeed, NewsFeedUnreadCount
+from newsfeeds.push import publish_newsfeeds
+from newsfeeds.sharding import get_shard, get_shards, group_by_shard
+from tweets.models import Tweet
+from utils.snowflake import min_id_for
+from utils.time_helper import utc_now
+
+
+def _using(queryset, alias):
+    # default 上的读不指定 alias, 交给 PrimaryReplicaRouter 分到从库
+    if alias == DEFAULT_DB_ALIAS:
+        return queryset
+    return queryset.using(alias)
 
 
 class NewsFeedService(object):
+    """
+    NewsFeed 按 user_id 分片存在 settings.NEWSFEED_SHARDS 上（见 newsfeeds.sharding）
+    所有 NewsFeed 的读写都要通过这里，调用的地方不需要知道数据在哪个 shard 上
+    """
 
     # 一般service 里面的方法都是class method， 因为不太new一个instance出来。都是class直接调用
     @classmethod
-    def fanout_to_followers(self, tweet):
+    def fanout_to_followers(cls, tweet):
 
         # 错误的做法
         # 在production里，不允许for + query
@@ -22,12 +45,253 @@ class NewsFeedService(object):
 
         # 正确的做法
         # 使用bulk_create, 会把insert语句合成一条
-        # 下面 new a list of instance, 只是new instance, 没有数据库操作
-        newsfeeds = [
-            # 这里只是new instance， 只有后面加.save(), 才会存入数据库
-            NewsFeed(user=follower, tweet=tweet)
-            for follower in FriendshipService.get_followers(tweet.user)
+        # 只取 follower 的 id, 不需要把 user 对象 load 出来
+        follower_ids = FriendshipService.get_follower_ids(tweet.user_id)
+        chunk_size = cls._chunk_size()
+        if len(follower_ids) <= chunk_size:
+            # 粉丝不多的时候一条 insert 就完成了，不需要记录进度
+            # 把自己也加进去，因为自己不是自己的follower， 但是自己应该可以看到自己的tweet
+            user_ids = cls.create_newsfeeds(
+                tweet.id, tweet.user_id, tweet.created_at, follower_ids + [tweet.user_id],
+            )
+            # 自己发的 tweet 不算未读
+            cls.increment_unread([user_id for user_id in user_ids if user_id != tweet.user_id])
+            # 推给连着的客户端（见 newsfeeds.push）
+            publish_newsfeeds(tweet.id, user_ids)
+            return
+
+        # 大 V: 按 follower id 的范围切块，每一块记一行 FanoutChunk，然后并发地写
+        user_ids = cls.create_newsfeeds(tweet.id, tweet.user_id, tweet.created_at, [tweet.user_id])
+        publish_newsfeeds(tweet.id, user_ids)
+        chunks = cls.create_fanout_chunks(tweet, follower_ids, chunk_size)
+        cls.run_fanout_chunks(chunks, follower_ids=follower_ids)
+
+    @classmethod
+    def create_fanout_chunks(cls, tweet, follower_ids, chunk_size):
+        """
+        返回这个 tweet 还没完成的块
+        tweet.created 事件重复执行的时候块已经建过了，不按现在的粉丝重新切，只接着跑没完成的块
+        """
+        chunks = FanoutChunk.objects.using(DEFAULT_DB_ALIAS).filter(tweet_id=tweet.id)
+        if not chunks.exists():
+            # 两个 dispatcher 同时建的时候，后建的违反 (tweet, min_follower_id) 的 unique, 被忽略
+            FanoutChunk.objects.bulk_create([
+                FanoutChunk(
+                    tweet_id=tweet.id,
+                    author_id=tweet.user_id,
+                    tweet_created_at=tweet.created_at,
+                    min_follower_id=follower_ids[i],
+                    max_follower_id=follower_ids[min(i + chunk_size, len(follower_ids)) - 1],
+                )
+                for i in range(0, len(follower_ids), chunk_size)
+            ], ignore_conflicts=True)
+        # MySQL / sqlite 的 bulk_create 不会把 id 填回来，需要再查一次
+        return list(chunks.filter(completed_at__isnull=True).order_by('min_follower_id'))
+
+    @classmethod
+    def run_fanout_chunks(cls, chunks, follower_ids=None):
+        """
+        follower_ids: 已经取出来的（排好序的）粉丝 id, 有的话每一块就不需要再查一次
+        resume 的时候没有，每一块自己按范围去查
+        """
+        def run(chunk):
+            ids = None
+            if follower_ids is not None:
+                ids = follower_ids[
+                    bisect_left(follower_ids, chunk.min_follower_id):
+                    bisect_right(follower_ids, chunk.max_follower_id)
+                ]
+            cls.fanout_chunk(chunk, ids)
+
+        workers = min(cls._workers(), len(chunks))
+        if workers <= 1 or not cls._can_run_concurrently():
+            for chunk in chunks:
+                run(chunk)
+            return
+
+        def run_in_thread(chunk):
+            # 每个线程有自己的数据库连接，用完要关掉，否则会一直占着连接
+            try:
+                run(chunk)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() 让某一块的 exception 抛出来，没完成的块留给 resume_fanouts
+            list(executor.map(run_in_thread, chunks))
+
+    @classmethod
+    def fanout_chunk(cls, chunk, follower_ids=None):
+        # 可以重复执行：已经写过的 (user, tweet) 会被忽略
+        if follower_ids is None:
+            follower_ids = FriendshipService.get_follower_ids(
+                chunk.author_id,
+                min_id=chunk.min_follower_id,
+                max_id=chunk.max_follower_id,
+            )
+        tweet_created_at = chunk.tweet_created_at
+        if tweet_created_at is None:
+            tweet_created_at = Tweet.objects.using(DEFAULT_DB_ALIAS).filter(
+                id=chunk.tweet_id,
+            ).values_list('created_at', flat=True).first()
+        user_ids = cls.create_newsfeeds(chunk.tweet_id, chunk.author_id, tweet_created_at, follower_ids)
+        cls.increment_unread(user_ids)
+        publish_newsfeeds(chunk.tweet_id, user_ids)
+        FanoutChunk.objects.filter(id=chunk.id).update(completed_at=utc_now())
+
+    @classmethod
+    def get_unfinished_fanout_chunks(cls, created_before):
+        return list(
+            FanoutChunk.objects.using(DEFAULT_DB_ALIAS)
+            .filter(completed_at__isnull=True, created_at__lt=created_before)
+            .order_by('created_at', 'id')
+        )
+
+    @classmethod
+    def create_newsfeeds(cls, tweet_id, tweet_user_id, tweet_created_at, user_ids):
+        """
+        给 user_ids 写这个 tweet 的 newsfeed, 返回这一次新写进去的 user_id
+        事件 / 块重复执行的时候已经有的 (user, tweet) 不再写，也不会再算一次未读、再推一次
+        """
+        created = []
+        newsfeeds = cls._build_newsfeeds(tweet_id, tweet_user_id, tweet_created_at, user_ids)
+        for alias, shard_newsfeeds in group_by_shard(newsfeeds).items():
+            existing = set(
+                NewsFeed.objects.using(alias)
+                .filter(tweet_id=tweet_id, user_id__in=[newsfeed.user_id for newsfeed in shard_newsfeeds])
+                .order_by()
+                .values_list('user_id', flat=True)
+            )
+            shard_newsfeeds = [newsfeed for newsfeed in shard_newsfeeds if newsfeed.user_id not in existing]
+            # 同时执行的另一个 dispatcher 刚写进去的，违反 (user, tweet) 的 unique, 被忽略
+            NewsFeed.objects.using(alias).bulk_create(shard_newsfeeds, ignore_conflicts=True)
+            created.extend(newsfeed.user_id for newsfeed in shard_newsfeeds)
+        return created
+
+    @classmethod
+    def _build_newsfeeds(cls, tweet_id, tweet_user_id, tweet_created_at, user_ids):
+        # 这里只是new instance， 只有后面加.save(), 才会存入数据库
+        # tweet 的作者和时间冗余在每一条 newsfeed 上，读的时候不需要 join tweet
+        return [
+            NewsFeed(
+                user_id=user_id,
+                tweet_id=tweet_id,
+                tweet_user_id=tweet_user_id,
+                tweet_created_at=tweet_created_at,
+            )
+            for user_id in user_ids
         ]
-        #  把自己也加进去，因为自己不是自己的follower， 但是自己应该可以看到自己的tweet
-        newsfeeds.append(NewsFeed(user=tweet.user, tweet=tweet))
-        NewsFeed.objects.bulk_create(newsfeeds)
+
+    @classmethod
+    def _chunk_size(cls):
+        return getattr(settings, 'NEWSFEED_FANOUT_CHUNK_SIZE', 1000)
+
+    @classmethod
+    def _workers(cls):
+        return getattr(settings, 'NEWSFEED_FANOUT_WORKERS', 1)
+
+    @classmethod
+    def _can_run_concurrently(cls):
+        # sqlite 同一时间只能有一个写，多线程只会互相等锁
+        # 在 transaction 里的时候，别的线程（连接）看不到还没提交的数据
+        for alias in set(get_shards()) | {DEFAULT_DB_ALIAS}:
+            connection = connections[alias]
+            if connection.vendor == 'sqlite' or connection.in_atomic_block:
+                return False
+        return True
+
+    @classmethod
+    def get_newsfeeds(cls, user_id):
+        return _using(NewsFeed.objects.filter(user_id=user_id), get_shard(user_id))
+
+    @classmethod
+    def get_timeline(cls, user_id):
+        # 一页一页地展示用：按 tweet 的时间倒序，走 (user, tweet_created_at) 的索引，不需要 join tweet
+        return cls.get_newsfeeds(user_id).order_by('-tweet_created_at', '-id')
+
+    @classmethod
+    def get_newsfeeds_since(cls, user_id, since=None, since_id=None):
+        """
+        比客户端手上最新的一条更新的 newsfeed, 按 id（也就是时间）倒序
+        都用 id 来限定范围，走 (user, id) 的索引，没有新数据的时候只是一次空的 range scan
+        since: 只有时间的老客户端，先换算成 id 的范围，再按 created_at 过滤
+        id 是 new instance 的时候生成的，created_at 是写数据库的时候才有的，
+        id 里的时间可能比 created_at 早一点（e.g. 一个很大的 bulk_create），所以范围往前多留一分钟
+        """
+        newsfeeds = cls.get_newsfeeds(user_id)
+        if since_id is not None:
+            return newsfeeds.filter(id__gt=since_id)
+        return newsfeeds.filter(
+            id__gte=min_id_for(since - timedelta(minutes=1)),
+            created_at__gt=since,
+        )
+
+    @classmethod
+    def get_unread_count(cls, user_id):
+        return NewsFeedUnreadCount.objects.filter(user_id=user_id).values_list(
+            'count', flat=True,
+        ).first() or 0
+
+    @classmethod
+    def increment_unread(cls, user_ids):
+        if not user_ids:
+            return
+        # 第一次收到 newsfeed 的用户先建一行，然后一条 UPDATE ... SET count = count + 1
+        NewsFeedUnreadCount.objects.bulk_create(
+            [NewsFeedUnreadCount(user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        NewsFeedUnreadCount.objects.filter(user_id__in=user_ids).update(count=F('count') + 1)
+
+    @classmethod
+    def mark_read(cls, user_id):
+        NewsFeedUnreadCount.objects.filter(user_id=user_id, count__gt=0).update(count=0)
+
+    @classmethod
+    def bulk_create(cls, newsfeeds, batch_size=None, ignore_conflicts=False):
+        # 每个 shard 一条（batch_size 条一组的）insert
+        for alias, shard_newsfeeds in group_by_shard(newsfeeds).items():
+            NewsFeed.objects.using(alias).bulk_create(
+                shard_newsfeeds,
+                batch_size=batch_size,
+                ignore_conflicts=ignore_conflicts,
+            )
+
+    @classmethod
+    def count(cls):
+        return sum(NewsFeed.objects.using(alias).count() for alias in get_shards())
+
+    @classmethod
+    def detach_tweet(cls, tweet_id):
+        # tweet 被删掉之后 newsfeed.tweet 设成 NULL
+        # 分片之后 newsfeed 和 tweet 不一定在一个库里，不能用外键的 on_delete 来做
+        for alias in get_shards():
+            NewsFeed.objects.using(alias).filter(tweet_id=tweet_id).update(tweet=None)
+
+    @classmethod
+    def cancel_fanout(cls, tweet_id):
+        # tweet 被删掉了，还没跑完的块不要再让 resume_fanouts 跑了
+        FanoutChunk.objects.filter(tweet_id=tweet_id, completed_at__isnull=True).delete()
+
+    @classmethod
+    def delete_tweet_newsfeeds(cls, tweet_id, limit):
+        """
+        删掉 tweet 的一批（最多 limit 条）newsfeed, 返回删掉的条数，小于 limit 表示已经删完了
+        先按 tweet_id 的索引取出一批 id 再按主键删，每一条 DELETE 都很小，不会长时间锁表
+        """
+        deleted = 0
+        for alias in get_shards():
+            newsfeeds = NewsFeed.objects.using(alias)
+            ids = list(
+                newsfeeds.filter(tweet_id=tweet_id).values_list('id', flat=True)[:limit - deleted]
+            )
+            if ids:
+                newsfeeds.filter(id__in=ids).delete()
+                deleted += len(ids)
+            if deleted >= limit:
+                break
+        return deleted
+
+    @classmethod
+    def delete_newsfeeds(cls, user_id):
+        NewsFeed.objects.using(get_shard(user_id)).filter(user_id=user_id).delete()
@@ -0,0 +1,71 @@
+import zlib
+
+from django.conf import settings
+
+
+def get_shards():
+    return getattr(settings, 'NEWSFEED_SHARDS', ['default'])
+
+
+def get_shard(user_id, shards=None):
+    """
+    一个用户的所有 newsfeed 都在同一个 shard 上，这样读一个用户的 newsfeed 只需要查一个库
+    用 crc32 而不是 hash()，因为 hash() 每个进程的结果不一样
+    """
+    if shards is None:
+        shards = get_shards()
+    if len(shards) == 1:
+        return shards[0]
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def group_by_shard(newsfeeds, shards=None):
+    groups = {}
+    for newsfeed in newsfeeds:
+        groups.setdefault(get_shard(newsfeed.user_id, shards), []).append(newsfeed)
+    return groups
+
+
+class NewsFeedShardRouter(object):
+    """
+    NewsFeed 按 user_id 分布在 settings.NEWSFEED_SHARDS 这几个 database alias 上
+    newsfeed.save() 会自动写到 user 所在的 shard,
+    查询要通过 NewsFeedService，因为 queryset 上没有 user_id 的信息，router 不知道该去哪个 shard
+
+    其他的 model 不管，交给后面的 router
+    """
+
+    def _is_newsfeed(self, model):
+        return model._meta.label_lower == 'newsfeeds.newsfeed'
+
+    def db_for_read(self, model, **hints):
+        if not self._is_newsfeed(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not self._is_newsfeed(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and getattr(instance, 'user_id', None) is not None:
+            return get_shard(instance.user_id)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # NewsFeed 的外键都是 db_constraint=False, 可以指向别的库里的 user / tweet
+        if self._is_newsfeed(type(obj1)) or self._is_newsfeed(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        shards = get_shards()
+        # newsfeeds app 里只有 NewsFeed 是分片的，其他的表（e.g. FanoutChunk）和普通的表一样
+        if app_label == 'newsfeeds' and model_name == 'newsfeed':
+            return db in shards
+        # 单独的 shard 库里只有 newsfeed 的表
+        if db in shards and db != 'default':
+            return False
+        return None
@@ -0,0 +1,388 @@
+import math
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection, router
+from django.test import override_settings
+from newsfeeds.management.commands.rebalance_newsfeeds import Command as RebalanceCommand
+from friendships.models import Friendship
+from friendships.services import FriendshipService
+from newsfeeds import ranking
+from newsfeeds.models import FanoutChunk, NewsFeed
+from newsfeeds.ranking import NewsFeedRankingService
+from newsfeeds.services import NewsFeedService
+from newsfeeds.sharding import get_shard, group_by_shard
+from outbox.models import OutboxEvent
+from testing.testcases import TestCase
+from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.time_helper import utc_now
+
+
+SHARDS = ['shard0', 'shard1', 'shard2']
+
+
+class NewsFeedShardingTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.tweet = self.create_tweet(self.dongxie)
+
+    def test_get_shard(self):
+        # 同一个 user 永远在同一个 shard 上
+        self.assertEqual(get_shard(42, SHARDS), get_shard(42, SHARDS))
+        self.assertEqual(get_shard(42, ['default']), 'default')
+        counts = {shard: 0 for shard in SHARDS}
+        for user_id in range(3000):
+            counts[get_shard(user_id, SHARDS)] += 1
+        for count in counts.values():
+            self.assertGreater(count, 800)
+
+    def test_group_by_shard(self):
+        newsfeeds = [NewsFeed(user_id=user_id, tweet_id=1) for user_id in range(30)]
+        groups = group_by_shard(newsfeeds, SHARDS)
+        self.assertEqual(sum(len(group) for group in groups.values()), 30)
+        for shard, group in groups.items():
+            for newsfeed in group:
+                self.assertEqual(get_shard(newsfeed.user_id, SHARDS), shard)
+
+    @override_settings(NEWSFEED_SHARDS=SHARDS)
+    def test_router(self):
+        newsfeed = NewsFeed(user_id=7, tweet_id=1)
+        self.assertEqual(router.db_for_write(NewsFeed, instance=newsfeed), get_shard(7, SHARDS))
+        self.assertFalse(router.allow_migrate('default', 'newsfeeds', model_name='newsfeed'))
+        self.assertTrue(router.allow_migrate('shard1', 'newsfeeds', model_name='newsfeed'))
+        # FanoutChunk 不分片，只在 default 上
+        self.assertTrue(router.allow_migrate('default', 'newsfeeds', model_name='fanoutchunk'))
+        self.assertFalse(router.allow_migrate('shard1', 'newsfeeds', model_name='fanoutchunk'))
+        self.assertFalse(router.allow_migrate('shard1', 'tweets'))
+        self.assertTrue(router.allow_migrate('default', 'tweets'))
+
+    def test_fanout_and_read(self):
+        NewsFeedService.fanout_to_followers(self.tweet)
+        self.assertEqual(NewsFeedService.count(), 1)
+        self.assertEqual(NewsFeedService.get_newsfeeds(self.dongxie.id).count(), 1)
+        self.assertEqual(NewsFeedService.get_newsfeeds(self.linghu.id).count(), 0)
+
+    def test_delete_tweet_and_user(self):
+        NewsFeed.objects.create(user=self.linghu, tweet=self.tweet)
+        self.tweet.delete()
+        newsfeed = NewsFeedService.get_newsfeeds(self.linghu.id).get()
+        self.assertIsNone(newsfeed.tweet_id)
+
+        self.linghu.delete()
+        self.assertEqual(NewsFeedService.count(), 0)
+
+
+class FanoutTests(TestCase):
+
+    def setUp(self):
+        self.author = self.create_user('dongxie')
+        self.followers = [self.create_user(f'follower{i}') for i in range(7)]
+        for follower in self.followers:
+            Friendship.objects.create(from_user=follower, to_user=self.author)
+        self.tweet = self.create_tweet(self.author)
+
+    def assert_fanned_out(self):
+        user_ids = set(NewsFeed.objects.filter(tweet=self.tweet).values_list('user_id', flat=True))
+        self.assertEqual(user_ids, {self.author.id} | {user.id for user in self.followers})
+        self.assertEqual(NewsFeed.objects.filter(tweet=self.tweet).count(), 8)
+        # 每一条都带着 tweet 的作者和时间
+        self.assertEqual(
+            set(NewsFeed.objects.filter(tweet=self.tweet).values_list('tweet_user_id', 'tweet_created_at')),
+            {(self.author.id, self.tweet.created_at)},
+        )
+
+    def test_small_fanout_has_no_chunks(self):
+        NewsFeedService.fanout_to_followers(self.tweet)
+        self.assert_fanned_out()
+        self.assertEqual(FanoutChunk.objects.count(), 0)
+
+    @override_settings(NEWSFEED_FANOUT_CHUNK_SIZE=3)
+    def test_chunked_fanout(self):
+        NewsFeedService.fanout_to_followers(self.tweet)
+        self.assert_fanned_out()
+        chunks = FanoutChunk.objects.order_by('min_follower_id')
+        follower_ids = sorted(user.id for user in self.followers)
+        self.assertEqual(
+            [(chunk.min_follower_id, chunk.max_follower_id) for chunk in chunks],
+            [
+                (follower_ids[0], follower_ids[2]),
+                (follower_ids[3], follower_ids[5]),
+                (follower_ids[6], follower_ids[6]),
+            ],
+        )
+        self.assertFalse(chunks.filter(completed_at__isnull=True).exists())
+
+        # 重复执行不会写出重复的 newsfeed
+        NewsFeedService.run_fanout_chunks(list(chunks))
+        self.assert_fanned_out()
+
+    def test_retried_event(self):
+        # 同一个 tweet.created 事件执行两次（e.g. dispatcher 执行完之前挂了），大 V 和普通用户都一样
+        for chunk_size, chunk_count in ((3, 3), (1000, 0)):
+            with override_settings(NEWSFEED_FANOUT_CHUNK_SIZE=chunk_size):
+                event = OutboxEvent.objects.get(topic='tweet.created', payload__id=self.tweet.id)
+                call_command('dispatch_outbox', stdout=StringIO())
+                OutboxEvent.objects.filter(id=event.id).update(processed_at=None, available_at=utc_now())
+                out = StringIO()
+                call_command('dispatch_outbox', stdout=out)
+                self.assertIn('dispatched 1 events', out.getvalue())
+            self.assert_fanned_out()
+            # 只有第一次建了块
+            self.assertEqual(FanoutChunk.objects.filter(tweet=self.tweet).count(), chunk_count)
+            self.assertFalse(FanoutChunk.objects.filter(completed_at__isnull=True).exists())
+            # 每个粉丝每个 tweet 只算一次未读
+            for user in self.followers:
+                self.assertEqual(NewsFeedService.get_unread_count(user.id), 1)
+            for user in self.followers:
+                NewsFeedService.mark_read(user.id)
+            self.tweet = self.create_tweet(self.author)
+        self.assertEqual(NewsFeedService.get_unread_count(self.author.id), 0)
+
+    @override_settings(NEWSFEED_FANOUT_CHUNK_SIZE=3)
+    def test_resume(self):
+        # 模拟 fanout 写到一半进程挂掉了：块已经建好，只有第一块写完了
+        follower_ids = sorted(user.id for user in self.followers)
+        chunks = NewsFeedService.create_fanout_chunks(self.tweet, follower_ids, 3)
+        NewsFeedService.fanout_chunk(chunks[0])
+        NewsFeedService.bulk_create([NewsFeed(
+            user_id=self.author.id,
+            tweet_id=self.tweet.id,
+            tweet_user_id=self.author.id,
+            tweet_created_at=self.tweet.created_at,
+        )])
+        # 加 tweet_created_at 之前建的块
+        FanoutChunk.objects.filter(id=chunks[1].id).update(tweet_created_at=None)
+        self.assertEqual(NewsFeed.objects.filter(tweet=self.tweet).count(), 4)
+
+        # 刚建的块不会被 resume, 可能还在跑
+        out = StringIO()
+        call_command('resume_fanouts', stdout=out)
+        self.assertIn('resumed 0 chunks', out.getvalue())
+
+        FanoutChunk.objects.update(created_at=utc_now() - timedelta(hours=1))
+        out = StringIO()
+        call_command('resume_fanouts', stdout=out)
+        self.assertIn('resumed 2 chunks', out.getvalue())
+        self.assert_fanned_out()
+        self.assertFalse(FanoutChunk.objects.filter(completed_at__isnull=True).exists())
+
+    def test_purge_completed_chunks(self):
+        FanoutChunk.objects.create(
+            tweet=self.tweet,
+            author_id=self.author.id,
+            min_follower_id=1,
+            max_follower_id=2,
+            completed_at=utc_now() - timedelta(days=30),
+        )
+        call_command('resume_fanouts', stdout=StringIO())
+        self.assertEqual(FanoutChunk.objects.count(), 0)
+
+
+class NewsFeedSortKeyTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+
+    def test_timeline_uses_tweet_time(self):
+        old_tweet = self.create_tweet(self.dongxie, 'old')
+        new_tweet = self.create_tweet(self.dongxie, 'new')
+        Tweet.objects.filter(id=old_tweet.id).update(created_at=utc_now() - timedelta(hours=1))
+        old_tweet.refresh_from_db()
+        # 新的 tweet 先 fanout, 旧的 tweet 的 newsfeed 的 id 更大
+        NewsFeedService.fanout_to_followers(new_tweet)
+        NewsFeedService.fanout_to_followers(old_tweet)
+
+        timeline = NewsFeedService.get_timeline(self.linghu.id)
+        self.assertEqual(
+            [newsfeed.tweet_id for newsfeed in timeline],
+            [new_tweet.id, old_tweet.id],
+        )
+        # 按作者过滤也不需要 join tweet
+        with self.assertNumQueries(1):
+            self.assertEqual(len(timeline.filter(tweet_user_id=self.dongxie.id)), 2)
+        # 增量更新还是按 id（fanout 的先后）
+        self.assertEqual(
+            list(NewsFeedService.get_newsfeeds(self.linghu.id).values_list('tweet_id', flat=True)),
+            [old_tweet.id, new_tweet.id],
+        )
+
+    def test_backfill_migration(self):
+        tweet = self.create_tweet(self.dongxie)
+        newsfeed = NewsFeed.objects.create(user=self.linghu, tweet=tweet)
+        detached = NewsFeed.objects.create(user=self.dongxie, tweet=None)
+        migration = import_module('newsfeeds.migrations.0007_backfill_newsfeed_tweet_sort_key')
+        with mock.patch.object(migration, 'BATCH_SIZE', 1):
+            migration.backfill_tweet_sort_key(apps, mock.Mock(connection=connection))
+
+        newsfeed.refresh_from_db()
+        self.assertEqual(newsfeed.tweet_user_id, self.dongxie.id)
+        self.assertEqual(newsfeed.tweet_created_at, tweet.created_at)
+        detached.refresh_from_db()
+        self.assertIsNone(detached.tweet_created_at)
+
+
+class NewsFeedRankingTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.meixi = self.create_user('meixi')
+        for user in (self.dongxie, self.meixi):
+            Friendship.objects.create(from_user=self.linghu, to_user=user)
+
+    def post(self, user, hours_ago=0, likes_count=0):
+        tweet = self.create_tweet(user)
+        Tweet.objects.filter(id=tweet.id).update(
+            created_at=utc_now() - timedelta(hours=hours_ago),
+            likes_count=likes_count,
+        )
+        tweet.refresh_from_db()
+        NewsFeedService.fanout_to_followers(tweet)
+        return NewsFeed.objects.get(user=self.linghu, tweet=tweet).id
+
+    SCORE_ROWS = [(0, 0, 0, 0, 0), (3600, 10, 2, 1, 100)]
+    SCORE_WEIGHTS = {'recency': 1, 'likes': 1, 'comments': 1, 'affinity': 1, 'followers': 0}
+    SCORE_EXPECTED = [1.0, 0.5 + math.log1p(10) + math.log1p(2) + math.log1p(1)]
+
+    def test_score_python(self):
+        with mock.patch.object(ranking, 'numpy', None):
+            scores = ranking.score(self.SCORE_ROWS, self.SCORE_WEIGHTS, 3600)
+        for value, want in zip(scores, self.SCORE_EXPECTED):
+            self.assertAlmostEqual(value, want)
+
+    @skipIf(ranking.numpy is None, 'numpy is not installed')
+    def test_score_numpy(self):
+        scores = ranking.score(self.SCORE_ROWS, self.SCORE_WEIGHTS, 3600)
+        for value, want in zip(scores, self.SCORE_EXPECTED):
+            self.assertAlmostEqual(value, want)
+
+        # 两种算法对一整个窗口的候选算出来的分数一样
+        rows = [(i * 97, i * 13 % 500, i % 7, i % 3, i * 31) for i in range(200)]
+        with mock.patch.object(ranking, 'numpy', None):
+            expected = ranking.score(rows, ranking.DEFAULT_WEIGHTS, 6 * 3600)
+        for value, want in zip(ranking.score(rows, ranking.DEFAULT_WEIGHTS, 6 * 3600), expected):
+            self.assertAlmostEqual(value, want)
+
+    def test_rank(self):
+        old_popular = self.post(self.dongxie, hours_ago=12, likes_count=500)
+        old = self.post(self.dongxie, hours_ago=12)
+        new = self.post(self.meixi)
+        deleted = self.post(self.meixi)
+        TweetService.soft_delete(NewsFeed.objects.get(id=deleted).tweet)
+        self.assertEqual(NewsFeedRankingService.rank(self.linghu.id), [old_popular, new, old])
+
+        # 经常给 dongxie 点赞 / 评论之后，dongxie 的 tweet 排到前面
+        liked = self.create_tweet(self.dongxie)
+        self.create_like(self.linghu, liked)
+        for _ in range(20):
+            self.create_comment(self.linghu, liked)
+        self.assertEqual(
+            NewsFeedRankingService.get_affinity(self.linghu.id, {self.dongxie.id, self.meixi.id}),
+            {self.dongxie.id: 21},
+        )
+        self.assertEqual(NewsFeedRankingService.rank(self.linghu.id), [old_popular, old, new])
+        self.assertEqual(NewsFeedRankingService.rank(self.create_user('guojing').id), [])
+
+    @override_settings(NEWSFEED_RANKING_AFFINITY_HISTORY=3)
+    def test_affinity_history(self):
+        # 赞和评论都只看最近的 NEWSFEED_RANKING_AFFINITY_HISTORY 条
+        dongxie_tweet = self.create_tweet(self.dongxie)
+        meixi_tweet = self.create_tweet(self.meixi)
+        for _ in range(5):
+            self.create_comment(self.linghu, dongxie_tweet)
+        self.create_comment(self.linghu, meixi_tweet)
+        self.create_like(self.linghu, meixi_tweet)
+        self.assertEqual(
+            NewsFeedRankingService.get_affinity(self.linghu.id, {self.dongxie.id, self.meixi.id}),
+            {self.dongxie.id: 2, self.meixi.id: 2},
+        )
+
+    def test_follower_counts(self):
+        ids = [self.linghu.id, self.dongxie.id]
+        self.assertEqual(FriendshipService.get_follower_counts(ids), {self.linghu.id: 0, self.dongxie.id: 1})
+        with self.assertNumQueries(0):
+            FriendshipService.get_follower_counts(ids)
+        # 粉丝数允许在缓存的时间里是旧的
+        Friendship.objects.create(from_user=self.meixi, to_user=self.dongxie)
+        self.assertEqual(FriendshipService.get_follower_counts([self.dongxie.id]), {self.dongxie.id: 1})
+
+    def test_cached(self):
+        first = self.post(self.dongxie)
+        self.assertEqual(NewsFeedRankingService.get_ranked_ids(self.linghu.id), [first])
+        # 缓存期间不重新排，新的 newsfeed 要等缓存过期
+        second = self.post(self.meixi)
+        with self.assertNumQueries(0):
+            self.assertEqual(NewsFeedRankingService.get_ranked_ids(self.linghu.id), [first])
+        NewsFeedRankingService.invalidate(self.linghu.id)
+        self.assertEqual(NewsFeedRankingService.get_ranked_ids(self.linghu.id), [second, first])
+
+
+class TrimNewsFeedsTests(TestCase):
+
+    def test_trim(self):
+        linghu = self.create_user('linghu')
+        dongxie = self.create_user('dongxie')
+        tweets = [self.create_tweet(dongxie, f'tweet {i}') for i in range(5)]
+        now = utc_now()
+        for i, tweet in enumerate(tweets):
+            for user in (linghu, dongxie):
+                newsfeed = NewsFeed.objects.create(user=user, tweet=tweet)
+                # 最后一个 tweet 最新
+                NewsFeed.objects.filter(id=newsfeed.id).update(created_at=now - timedelta(minutes=10 - i))
+        NewsFeed.objects.create(user=self.create_user('meixi'), tweet=tweets[0])
+
+        out = StringIO()
+        call_command('trim_newsfeeds', '--keep', '2', '--batch-size', '2', stdout=out)
+        self.assertIn('default: trimmed 2 users, deleted 6 rows', out.getvalue())
+        for user in (linghu, dongxie):
+            self.assertEqual(
+                list(NewsFeedService.get_newsfeeds(user.id).values_list('tweet_id', flat=True)),
+                [tweets[4].id, tweets[3].id],
+            )
+        self.assertEqual(NewsFeedService.count(), 5)
+
+        out = StringIO()
+        call_command('trim_newsfeeds', '--keep', '2', stdout=out)
+        self.assertIn('default: trimmed 0 users, deleted 0 rows', out.getvalue())
+
+
+class RebalanceNewsFeedsTests(TestCase):
+
+    def test_copy_keeps_created_at(self):
+        user = self.create_user('linghu')
+        tweet = self.create_tweet(user)
+        newsfeed = NewsFeed.objects.create(user=user, tweet=tweet)
+        created_at = utc_now() - timedelta(days=3)
+        NewsFeed.objects.filter(id=newsfeed.id).update(created_at=created_at)
+        newsfeed.refresh_from_db()
+        newsfeed_id = newsfeed.id
+        newsfeed.delete()
+        newsfeed.id = newsfeed_id
+
+        command = RebalanceCommand()
+        self.assertEqual(command.copy_rows([newsfeed], 'default'), 1)
+        # 重复执行不会复制出第二份
+        command.copy_rows([newsfeed], 'default')
+        copies = NewsFeed.objects.filter(user=user, tweet=tweet)
+        self.assertEqual(copies.count(), 1)
+        self.assertEqual(copies[0].created_at, created_at)
+        # id 不变，客户端手上的 since_id 搬完之后还能用
+        self.assertEqual(copies[0].id, newsfeed_id)
+
+    def test_nothing_to_move(self):
+        user = self.create_user('linghu')
+        NewsFeed.objects.create(user=user, tweet=self.create_tweet(user))
+        out = StringIO()
+        call_command('rebalance_newsfeeds', '--to', 'default', '--delete', stdout=out)
+        self.assertIn('default: copied 0 rows, deleted 0 rows', out.getvalue())
+        self.assertEqual(NewsFeed.objects.count(), 1)
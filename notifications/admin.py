@@ -0,0 +1,17 @@
+from django.contrib import admin
+from notifications.models import Notification, NotificationEvent
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'verb', 'target_type', 'target_id', 'count', 'unread', 'updated_at')
+    list_filter = ('verb', 'unread')
+    raw_id_fields = ('recipient',)
+    date_hierarchy = 'updated_at'
+
+
+@admin.register(NotificationEvent)
+class NotificationEventAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'actor', 'verb', 'target_type', 'target_id')
+    list_filter = ('verb',)
+    raw_id_fields = ('recipient', 'actor')
@@ -0,0 +1,43 @@
+from accounts.api.serializers import UserFastSerializer
+from django.contrib.contenttypes.models import ContentType
+from notifications.models import Notification
+from rest_framework import serializers
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    # e.g. tweet / comment, follow 是 null
+    target_type = serializers.SerializerMethodField()
+    # 最近的几个人，最新的在前面
+    actors = serializers.SerializerMethodField()
+    # 64 位的 snowflake id 的字符串，见 TweetSerializer.id_str
+    id_str = serializers.CharField(source='id', read_only=True)
+    target_id_str = serializers.CharField(source='target_id', read_only=True)
+
+    class Meta:
+        model = Notification
+        fields = (
+            'id', 'id_str', 'verb', 'target_type', 'target_id', 'target_id_str', 'count', 'actors',
+            'unread', 'created_at', 'updated_at',
+        )
+
+    def get_target_type(self, obj):
+        if obj.target_type_id is None:
+            return None
+        # get_for_id 有进程内的缓存，不会每一行查一次
+        return ContentType.objects.get_for_id(obj.target_type_id).model
+
+    def get_actors(self, obj):
+        users = self.context['users']
+        return [users[actor_id] for actor_id in obj.actor_ids if users.get(actor_id) is not None]
+
+
+def serialize_notifications(notifications):
+    # 一页里所有的 actor 一起取：user 的 JSON 缓存一次 get_many, 没命中的一条 IN query
+    notifications = list(notifications)
+    actor_ids = list({
+        actor_id
+        for notification in notifications
+        for actor_id in notification.actor_ids
+    })
+    users = dict(zip(actor_ids, UserFastSerializer.from_pks(actor_ids)))
+    return NotificationSerializer(notifications, many=True, context={'users': users}).data
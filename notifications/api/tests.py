@@ -0,0 +1,103 @@
+from notifications.models import COMMENT, LIKE, Notification
+from notifications.services import NotificationService
+from outbox.services import OutboxService
+from rest_framework import status
+from rest_framework.test import APIClient
+from testing.testcases import TestCase
+
+
+NOTIFICATIONS_URL = '/api/notifications/'
+UNREAD_COUNT_URL = '/api/notifications/unread_count/'
+MARK_READ_URL = '/api/notifications/{}/mark_read/'
+MARK_ALL_READ_URL = '/api/notifications/mark_all_read/'
+
+
+class NotificationApiTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.linghu_client = APIClient()
+        self.linghu_client.force_authenticate(self.linghu)
+        self.dongxie = self.create_user('dongxie')
+        self.dongxie_client = APIClient()
+        self.dongxie_client.force_authenticate(self.dongxie)
+
+    def deliver(self):
+        while OutboxService.dispatch_batch():
+            pass
+        NotificationService.deliver()
+
+    def test_list(self):
+        response = self.anonymous_client.get(NOTIFICATIONS_URL)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        tweet = self.create_tweet(self.linghu)
+        fans = [self.create_user(f'fan{i}') for i in range(5)]
+        for fan in fans:
+            self.create_like(fan, tweet)
+        self.create_comment(self.dongxie, tweet)
+        self.deliver()
+
+        # 5 个赞合并成一条
+        response = self.linghu_client.get(NOTIFICATIONS_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        comment, like = response.data['results']
+        self.assertEqual((comment['verb'], comment['target_type']), (COMMENT, 'tweet'))
+        self.assertEqual(comment['actors'][0]['username'], 'dongxie')
+        self.assertEqual((like['verb'], like['target_id'], like['count']), (LIKE, tweet.id, 5))
+        self.assertEqual((like['id_str'], like['target_id_str']), (str(like['id']), str(tweet.id)))
+        self.assertEqual([user['username'] for user in like['actors']], ['fan4', 'fan3', 'fan2'])
+        self.assertEqual(self.dongxie_client.get(NOTIFICATIONS_URL).data['count'], 0)
+
+        # 未读的在前面
+        response = self.dongxie_client.post(MARK_READ_URL.format(comment['id']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.linghu_client.post(MARK_READ_URL.format(comment['id']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.create_like(self.dongxie, tweet)
+        self.deliver()
+        # 新的赞合并到还没读的那一条里
+        response = self.linghu_client.get(NOTIFICATIONS_URL)
+        self.assertEqual([item['id'] for item in response.data['results']], [like['id'], comment['id']])
+        self.assertEqual(response.data['results'][0]['count'], 6)
+        self.assertFalse(response.data['results'][1]['unread'])
+
+    def test_unread_count(self):
+        tweet = self.create_tweet(self.linghu)
+        self.create_like(self.dongxie, tweet)
+        self.create_comment(self.dongxie, tweet)
+        self.deliver()
+        response = self.linghu_client.get(UNREAD_COUNT_URL)
+        self.assertEqual(response.data['unread_count'], 2)
+        response = self.linghu_client.post(MARK_ALL_READ_URL)
+        self.assertEqual(response.data['marked_count'], 2)
+        self.assertEqual(self.linghu_client.get(UNREAD_COUNT_URL).data['unread_count'], 0)
+        self.assertEqual(Notification.objects.filter(unread=True).count(), 0)
+
+    def test_pagination(self):
+        tweets = [self.create_tweet(self.linghu) for _ in range(12)]
+        for tweet in tweets:
+            self.create_like(self.dongxie, tweet)
+        self.deliver()
+
+        def list_notifications(page):
+            self.clear_cache()
+            return self.linghu_client.get(NOTIFICATIONS_URL, {'page': page})
+
+        # 一页里的 actor 一起取，SQL 的条数和条数无关
+        response = list_notifications(1)
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertIsNotNone(response.data['next'])
+        response = list_notifications(2)
+        self.assertEqual(
+            [item['target_id'] for item in response.data['results']],
+            [tweets[1].id, tweets[0].id],
+        )
+
+        def add_likers():
+            for i, tweet in enumerate(tweets):
+                self.create_like(self.create_user(f'liker{i}'), tweet)
+            self.deliver()
+        self.assertQueryCountIndependentOfRows(lambda: list_notifications(1), add_likers)
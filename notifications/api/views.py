@@ -0,0 +1,41 @@
+from notifications.api.serializers import serialize_notifications
+from notifications.services import NotificationService
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+
+class NotificationViewSet(viewsets.GenericViewSet):
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        # 只能看自己的通知
+        return NotificationService.get_notifications(self.request.user.id)
+
+    def list(self, request):
+        """
+        GET /api/notifications/?page=2
+        未读的在前面，各自按最后一个事件的时间倒序，每页 PAGE_SIZE 条
+        通知由 deliver_notifications 每隔几秒合并写进来，赞 / 评论 / 关注之后不会马上出现
+        """
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(serialize_notifications(page))
+
+    @action(methods=['GET'], detail=False)
+    def unread_count(self, request):
+        return Response({
+            'unread_count': NotificationService.get_unread_count(request.user.id),
+        }, status=status.HTTP_200_OK)
+
+    @action(methods=['POST'], detail=True)
+    def mark_read(self, request, pk):
+        # POST /api/notifications/1/mark_read/ 别人的通知也是 404
+        notification = self.get_object()
+        NotificationService.mark_read(request.user.id, [notification.id])
+        return Response({'success': True}, status=status.HTTP_200_OK)
+
+    @action(methods=['POST'], detail=False)
+    def mark_all_read(self, request):
+        marked = NotificationService.mark_read(request.user.id)
+        return Response({'success': True, 'marked_count': marked}, status=status.HTTP_200_OK)
@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notifications.services import NotificationService
+from utils.checks import ensure_deployable
+
+
+class Command(BaseCommand):
+    """
+    python manage.py deliver_notifications
+
+    每 --interval 秒把排队的 NotificationEvent 合并进 Notification（见 NotificationService.deliver），
+    整个部署只跑一个。两次之间来的事件一起合并，间隔越长写得越少，通知到得越晚
+    进程挂了重启就行，没合并完的事件还在表里
+    """
+    help = 'Merge queued like / comment / follow events into aggregated notifications.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            default=getattr(settings, 'NOTIFICATION_DELIVERY_SECONDS', 5))
+        parser.add_argument('--batch-size', type=int,
+                            default=getattr(settings, 'NOTIFICATION_DELIVERY_BATCH_SIZE', 1000))
+        parser.add_argument('--once', action='store_true',
+                            help='Deliver everything queued so far and exit.')
+
+    def handle(self, *args, **options):
+        # 和 Django 自己的 system check 一样，命令行启动的时候检查配置，call_command / --skip-checks 不检查
+        if not options['skip_checks']:
+            ensure_deployable()
+        while True:
+            delivered = 0
+            while True:
+                count = NotificationService.deliver(options['batch_size'])
+                delivered += count
+                if count < options['batch_size']:
+                    break
+            if options['once']:
+                self.stdout.write(f'delivered {delivered} events')
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,53 @@
+# Generated by Django 3.1.3 on 2026-10-19 14:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import utils.snowflake
+import utils.time_helper
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationEvent',
+            fields=[
+                ('id', models.BigIntegerField(default=utils.snowflake.next_id, editable=False, primary_key=True, serialize=False)),
+                ('verb', models.CharField(choices=[('like', 'like'), ('comment', 'comment'), ('follow', 'follow')], max_length=16)),
+                ('target_id', models.PositiveBigIntegerField(null=True)),
+                ('source_id', models.BigIntegerField()),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('target_type', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('verb', 'source_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigIntegerField(default=utils.snowflake.next_id, editable=False, primary_key=True, serialize=False)),
+                ('verb', models.CharField(choices=[('like', 'like'), ('comment', 'comment'), ('follow', 'follow')], max_length=16)),
+                ('target_id', models.PositiveBigIntegerField(null=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('actor_ids', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(default=utils.time_helper.utc_now)),
+                ('updated_at', models.DateTimeField(default=utils.time_helper.utc_now)),
+                ('unread', models.BooleanField(default=True)),
+                ('recipient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('target_type', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype')),
+            ],
+            options={
+                'index_together': {('recipient', 'unread', 'updated_at')},
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from utils.snowflake import next_id
+from utils.time_helper import utc_now
+
+
+LIKE = 'like'
+COMMENT = 'comment'
+FOLLOW = 'follow'
+VERB_CHOICES = (
+    (LIKE, 'like'),
+    (COMMENT, 'comment'),
+    (FOLLOW, 'follow'),
+)
+
+
+class NotificationEvent(models.Model):
+    """
+    还没有合并进 Notification 的事件，like / comment / friendship 的 created 事件的 handler 写进来，
+    python manage.py deliver_notifications 分批读出来，合并进 Notification 之后删掉（见 NotificationService）
+    id 是 snowflake, 按 id 读就是按时间读
+    """
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    verb = models.CharField(max_length=16, choices=VERB_CHOICES)
+    # 被赞 / 被评论的 tweet 或者 comment, follow 没有 target
+    target_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, related_name='+')
+    target_id = models.PositiveBigIntegerField(null=True)
+    # 产生这个事件的 like / comment / friendship 的 id
+    source_id = models.BigIntegerField()
+
+    class Meta:
+        # 同一个 like / comment / friendship 的事件重复执行的时候不会写出两行
+        unique_together = (('verb', 'source_id'),)
+
+    def __str__(self):
+        return f'{self.actor_id} {self.verb} -> {self.recipient_id}'
+
+
+class Notification(models.Model):
+    """
+    合并之后的通知：一个人同一个 target 的同一种事件，在一个窗口里只有一行
+    e.g. "N 个人赞了你的 tweet", 爆款的 tweet 也只有几行，而不是每个赞一行
+    """
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
+    # 单独的 recipient 索引不需要，(recipient, unread, updated_at) 的联合索引可以代替
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    verb = models.CharField(max_length=16, choices=VERB_CHOICES)
+    target_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, related_name='+')
+    target_id = models.PositiveBigIntegerField(null=True)
+    # 合并进来的事件个数
+    count = models.PositiveIntegerField(default=0)
+    # 最近的几个人，最新的在前面，用来展示 "A, B 和另外 N 个人"
+    actor_ids = models.JSONField(default=list)
+    # 第一个事件的时间，窗口从这里开始算
+    created_at = models.DateTimeField(default=utc_now)
+    # 最后一个事件的时间
+    updated_at = models.DateTimeField(default=utc_now)
+    unread = models.BooleanField(default=True)
+
+    class Meta:
+        # 未读的在前面，各自按最后一个事件的时间倒序，也是合并的时候找还没读的那几行用的索引
+        index_together = (('recipient', 'unread', 'updated_at'),)
+
+    def __str__(self):
+        return f'{self.count} {self.verb} -> {self.recipient_id}'
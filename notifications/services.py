@@ -0,0 +1,180 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from comments.models import Comment
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS, transaction
+from notifications.models import COMMENT, FOLLOW, LIKE, Notification, NotificationEvent
+from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.snowflake import id_to_datetime
+
+
+def _key(row):
+    # 合并的单位：同一个人，同一种事件，同一个 target
+    return row.recipient_id, row.verb, row.target_type_id, row.target_id
+
+
+class NotificationService(object):
+    """
+    通知分两步写，一个爆款的 tweet 不会每个赞都写一行通知:
+    1. like / comment / friendship 的 created 事件的 handler 只往 NotificationEvent 里插一行（queue_*）
+    2. python manage.py deliver_notifications 每隔几秒调用 deliver(), 一批事件按 (recipient, verb, target)
+       合并进 Notification: 还没读、第一个事件在 NOTIFICATION_WINDOW_SECONDS 之内的那一行计数 +N,
+       否则新建一行。一批不管多少个事件，都是固定的几条 SQL
+    通知只是一个提示，赞在送达之前又取消了也还是会算进去
+    """
+
+    @classmethod
+    def queue_like(cls, like):
+        cls.queue_likes([like])
+
+    @classmethod
+    def queue_likes(cls, likes):
+        # 一批 like 一起排队（见 LikeService.flush_buffer）：每种 target 一条 query 找 recipient
+        object_ids = defaultdict(set)
+        for like in likes:
+            object_ids[like.content_type_id].add(like.object_id)
+        recipients = {}
+        for content_type_id, ids in object_ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is Tweet:
+                targets = TweetService.get_visible_tweets()
+            elif model is Comment:
+                targets = Comment.objects.all()
+            else:
+                continue
+            for object_id, user_id in targets.filter(id__in=ids).values_list('id', 'user_id'):
+                recipients[(content_type_id, object_id)] = user_id
+        cls._queue_events([
+            NotificationEvent(
+                recipient_id=recipients.get((like.content_type_id, like.object_id)),
+                actor_id=like.user_id,
+                verb=LIKE,
+                target_type_id=like.content_type_id,
+                target_id=like.object_id,
+                source_id=like.id,
+            )
+            for like in likes
+        ])
+
+    @classmethod
+    def queue_comment(cls, comment):
+        cls._queue(
+            recipient_id=TweetService.get_visible_tweets().filter(
+                id=comment.tweet_id,
+            ).values_list('user_id', flat=True).first(),
+            actor_id=comment.user_id,
+            verb=COMMENT,
+            target_type_id=ContentType.objects.get_for_model(Tweet).id,
+            target_id=comment.tweet_id,
+            source_id=comment.id,
+        )
+
+    @classmethod
+    def queue_follow(cls, friendship):
+        cls._queue(
+            recipient_id=friendship.to_user_id,
+            actor_id=friendship.from_user_id,
+            verb=FOLLOW,
+            target_type_id=None,
+            target_id=None,
+            source_id=friendship.id,
+        )
+
+    @classmethod
+    def _queue(cls, recipient_id, actor_id, source_id, **target):
+        cls._queue_events([
+            NotificationEvent(
+                recipient_id=recipient_id,
+                actor_id=actor_id,
+                source_id=source_id,
+                **target,
+            ),
+        ])
+
+    @classmethod
+    def _queue_events(cls, events):
+        # 自己赞自己 / target 已经删掉了不通知
+        events = [
+            event
+            for event in events
+            if event.recipient_id is not None
+            and event.actor_id is not None
+            and event.recipient_id != event.actor_id
+        ]
+        if not events:
+            return
+        # 重复执行的 handler 写的行会被忽略
+        NotificationEvent.objects.bulk_create(events, ignore_conflicts=True)
+
+    @classmethod
+    def deliver(cls, batch_size=None):
+        """
+        把最早的 batch_size 个事件合并进 Notification, 返回这一批的事件个数，0 表示已经没有事件了
+        整个部署只跑一个（python manage.py deliver_notifications）
+        """
+        batch_size = batch_size or getattr(settings, 'NOTIFICATION_DELIVERY_BATCH_SIZE', 1000)
+        window = timedelta(seconds=getattr(settings, 'NOTIFICATION_WINDOW_SECONDS', 60 * 60))
+        max_actors = getattr(settings, 'NOTIFICATION_MAX_ACTORS', 3)
+        events = NotificationEvent.objects.using(DEFAULT_DB_ALIAS)
+        notifications = Notification.objects.using(DEFAULT_DB_ALIAS)
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            batch = list(events.order_by('id')[:batch_size])
+            if not batch:
+                return 0
+            # 这一批的人还没读、还在窗口里的通知，一条 SQL 取出来
+            rows = {
+                _key(row): row
+                for row in notifications.filter(
+                    recipient_id__in={event.recipient_id for event in batch},
+                    unread=True,
+                    created_at__gt=id_to_datetime(batch[0].id) - window,
+                ).order_by('created_at')
+            }
+            created = {}
+            updated = {}
+            for event in batch:
+                event_at = id_to_datetime(event.id)
+                row = rows.get(_key(event))
+                if row is None or event_at >= row.created_at + window:
+                    row = rows[_key(event)] = Notification(
+                        recipient_id=event.recipient_id,
+                        verb=event.verb,
+                        target_type_id=event.target_type_id,
+                        target_id=event.target_id,
+                        created_at=event_at,
+                        updated_at=event_at,
+                    )
+                    created[row.id] = row
+                elif row.id not in created:
+                    updated[row.id] = row
+                row.count += 1
+                row.actor_ids = [event.actor_id] + [
+                    actor_id for actor_id in row.actor_ids if actor_id != event.actor_id
+                ][:max_actors - 1]
+                row.updated_at = max(row.updated_at, event_at)
+            notifications.bulk_create(created.values())
+            notifications.bulk_update(updated.values(), ['count', 'actor_ids', 'updated_at'])
+            events.filter(id__in=[event.id for event in batch]).delete()
+        return len(batch)
+
+    @classmethod
+    def get_notifications(cls, recipient_id):
+        # 未读的在前面，各自按最后一个事件的时间倒序
+        return Notification.objects.filter(recipient_id=recipient_id).order_by(
+            '-unread', '-updated_at', '-id',
+        )
+
+    @classmethod
+    def get_unread_count(cls, recipient_id):
+        return Notification.objects.filter(recipient_id=recipient_id, unread=True).count()
+
+    @classmethod
+    def mark_read(cls, recipient_id, notification_ids=None):
+        # notification_ids 是 None 的时候全部标记为已读，之后的事件会合并到新的一行里
+        notifications = Notification.objects.filter(recipient_id=recipient_id, unread=True)
+        if notification_ids is not None:
+            notifications = notifications.filter(id__in=notification_ids)
+        return notifications.update(unread=False)
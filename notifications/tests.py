@@ -0,0 +1,121 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from friendships.models import Friendship
+from notifications.models import COMMENT, FOLLOW, LIKE, Notification, NotificationEvent
+from notifications.services import NotificationService
+from outbox.services import OutboxService
+from testing.testcases import TestCase
+from utils.snowflake import min_id_for
+from utils.time_helper import utc_now
+
+
+class NotificationServiceTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.tweet = self.create_tweet(self.linghu)
+
+    def test_queue(self):
+        # like / comment / friendship 的 created 事件的 handler 只是排队
+        fans = [self.create_user(f'fan{i}') for i in range(3)]
+        for fan in fans:
+            self.create_like(fan, self.tweet)
+        comment = self.create_comment(self.dongxie, self.tweet)
+        self.create_like(self.linghu, comment)
+        Friendship.objects.create(from_user=self.dongxie, to_user=self.linghu)
+        # 自己赞自己不通知
+        self.create_like(self.linghu, self.tweet)
+        while OutboxService.dispatch_batch():
+            pass
+        self.assertEqual(Notification.objects.count(), 0)
+        self.assertEqual(
+            sorted(NotificationEvent.objects.values_list('recipient_id', 'verb')),
+            sorted([(self.linghu.id, LIKE)] * 3 + [
+                (self.linghu.id, COMMENT),
+                (self.dongxie.id, LIKE),
+                (self.linghu.id, FOLLOW),
+            ]),
+        )
+        # 重复执行的 handler 不会重复排队
+        NotificationService.queue_comment(comment)
+        self.assertEqual(NotificationEvent.objects.count(), 6)
+
+        self.assertEqual(NotificationService.deliver(), 6)
+        self.assertEqual(NotificationService.deliver(), 0)
+        self.assertFalse(NotificationEvent.objects.exists())
+        likes = Notification.objects.get(recipient=self.linghu, verb=LIKE)
+        self.assertEqual(likes.target_id, self.tweet.id)
+        self.assertEqual(likes.count, 3)
+        self.assertEqual(likes.actor_ids, [fans[2].id, fans[1].id, fans[0].id])
+        self.assertEqual(Notification.objects.get(recipient=self.dongxie).target_id, comment.id)
+        self.assertEqual(Notification.objects.count(), 4)
+
+    def queue_at(self, actor, when, seq=0):
+        # 事件的时间就是 id 里的时间
+        NotificationEvent.objects.create(
+            id=min_id_for(when) + seq,
+            recipient=self.linghu,
+            actor=actor,
+            verb=FOLLOW,
+            source_id=actor.id,
+        )
+
+    @override_settings(NOTIFICATION_WINDOW_SECONDS=3600, NOTIFICATION_MAX_ACTORS=2)
+    def test_window(self):
+        users = [self.create_user(f'user{i}') for i in range(5)]
+        now = utc_now()
+        self.queue_at(users[0], now - timedelta(minutes=150))
+        self.queue_at(users[1], now - timedelta(minutes=50))
+        self.queue_at(users[2], now - timedelta(minutes=40))
+        NotificationService.deliver()
+        # 第一个事件的窗口已经过了，后面两个合并到新的一行
+        rows = list(Notification.objects.order_by('created_at'))
+        self.assertEqual([row.count for row in rows], [1, 2])
+        self.assertEqual(rows[1].actor_ids, [users[2].id, users[1].id])
+
+        # 还在窗口里，合并到已有的那一行，只留最近的两个人
+        self.queue_at(users[3], now - timedelta(minutes=1))
+        NotificationService.deliver()
+        rows[1].refresh_from_db()
+        self.assertEqual(rows[1].count, 3)
+        self.assertEqual(rows[1].actor_ids, [users[3].id, users[2].id])
+
+        # 读过之后新的事件写一行新的
+        NotificationService.mark_read(self.linghu.id)
+        self.queue_at(users[4], now, seq=1)
+        NotificationService.deliver()
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertEqual(NotificationService.get_unread_count(self.linghu.id), 1)
+
+    def test_deliver_queries(self):
+        now = utc_now()
+
+        def queue(prefix, count):
+            for i in range(count):
+                self.queue_at(self.create_user(f'{prefix}{i}'), now, seq=i)
+                NotificationEvent.objects.create(
+                    recipient=self.create_user(f'{prefix}_other{i}'),
+                    actor=self.dongxie,
+                    verb=LIKE,
+                    source_id=NotificationEvent.objects.count(),
+                )
+
+        # 一批不管多少个事件、多少个人，SQL 的条数都一样（合并到已有的行 + 新建的行）
+        queue('first', 1)
+        NotificationService.deliver()
+        queue('again', 1)
+        self.assertQueryCountIndependentOfRows(
+            NotificationService.deliver,
+            lambda: queue('second', 5),
+        )
+
+    def test_command(self):
+        self.queue_at(self.dongxie, utc_now())
+        out = StringIO()
+        call_command('deliver_notifications', '--once', '--batch-size', '1', stdout=out)
+        self.assertIn('delivered 1 events', out.getvalue())
+        self.assertEqual(Notification.objects.get().recipient_id, self.linghu.id)
@@ -0,0 +1,9 @@
+from django.contrib import admin
+from outbox.models import OutboxEvent
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'topic', 'created_at', 'attempts', 'processed_at')
+    list_filter = ('topic',)
+    date_hierarchy = 'created_at'
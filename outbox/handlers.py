@@ -0,0 +1,109 @@
+from comments.models import Comment
+from friendships.models import Friendship
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS
+from hashtags.services import HashtagService
+from likes.models import Like
+from newsfeeds.services import NewsFeedService
+from notifications.services import NotificationService
+from outbox.services import OutboxService
+from tweets.models import Tweet
+from tweets.services import TweetSearchService, TweetService
+
+
+# 所有的 handler 都可能被执行不止一次，必须是幂等的
+
+
+def fanout_tweet(payload):
+    # 读主库：刚提交的 tweet 从库上可能还没有，而且 tweet 可能在 fanout 之前已经被删掉了
+    tweet = TweetService.get_visible_tweets().using(DEFAULT_DB_ALIAS).filter(id=payload['id']).first()
+    if tweet is None:
+        return
+    # 重复执行的时候已经写过的 newsfeed 会被忽略
+    NewsFeedService.fanout_to_followers(tweet)
+
+
+def index_tweet(payload):
+    tweet = TweetService.get_visible_tweets().using(DEFAULT_DB_ALIAS).filter(id=payload['id']).first()
+    if tweet is None:
+        return
+    # 已经在索引里的会被替换掉
+    TweetSearchService.index_tweets([tweet])
+
+
+def tag_tweet(payload):
+    tweet = TweetService.get_visible_tweets().using(DEFAULT_DB_ALIAS).filter(id=payload['id']).first()
+    if tweet is None:
+        return
+    # 已经写过的 hashtag / mention 会被忽略
+    HashtagService.tag_tweet(tweet)
+
+
+def unindex_tweet(payload):
+    # 软删除之后马上从搜索的索引里删掉，不用等 retract 分批删完
+    TweetSearchService.unindex_tweet(payload['id'])
+
+
+def retract_tweet(payload):
+    # 一个事件只删一部分，剩下的发一个新的事件接着删，每个事件都很快执行完
+    # 重复执行的时候已经删掉的数据查不到，最多多发一个什么也不用删的事件
+    if not TweetService.retract(payload['id']):
+        OutboxService.publish('tweet.deleted', payload)
+
+
+def update_tweet_counters(tweet_id):
+    # 不用 F('comments_count') + 1, 因为事件可能会被执行多次，重新数一遍才是幂等的
+    TweetService.recount_counters([tweet_id])
+
+
+def update_counters_for_comment(payload):
+    if payload.get('tweet_id') is not None:
+        update_tweet_counters(payload['tweet_id'])
+
+
+def update_counters_for_like(payload):
+    # LikeService 写的赞已经在同一个 transaction 里 F() 改好了计数（counted）
+    # admin / shell / 级联删除这些直接用 model 写的赞没有人改计数，这里重新数一遍
+    if payload.get('counted'):
+        return
+    if payload['content_type_id'] == ContentType.objects.get_for_model(Tweet).id:
+        update_tweet_counters(payload['object_id'])
+
+
+def notify_comment(payload):
+    comment = Comment.objects.using(DEFAULT_DB_ALIAS).filter(id=payload['id']).first()
+    if comment is None:
+        return
+    # 只是排队，deliver_notifications 合并之后才写通知；重复执行的时候已经排过的会被忽略
+    NotificationService.queue_comment(comment)
+
+
+def notify_like(payload):
+    like = Like.objects.using(DEFAULT_DB_ALIAS).filter(id=payload['id']).first()
+    if like is None:
+        return
+    NotificationService.queue_like(like)
+
+
+def notify_follow(payload):
+    friendship = Friendship.objects.using(DEFAULT_DB_ALIAS).filter(id=payload['id']).first()
+    if friendship is None:
+        return
+    NotificationService.queue_follow(friendship)
+
+
+HANDLERS = {
+    'tweet.created': [fanout_tweet, index_tweet, tag_tweet],
+    'tweet.deleted': [unindex_tweet, retract_tweet],
+    'comment.created': [update_counters_for_comment, notify_comment],
+    'comment.deleted': [update_counters_for_comment],
+    'like.created': [update_counters_for_like, notify_like],
+    'like.deleted': [update_counters_for_like],
+    'friendship.created': [notify_follow],
+    # 暂时没有 consumer，事件先记下来
+    'friendship.deleted': [],
+}
+
+
+def get_handlers(topic):
+    return HANDLERS.get(topic, [])
@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# 每种 model 的事件里带哪些字段
+# 只存 id, handler 执行的时候再去查最新的数据
+PAYLOAD_FIELDS = {
+    'tweet': ('id', 'user_id'),
+    'comment': ('id', 'user_id', 'tweet_id'),
+    'friendship': ('id', 'from_user_id', 'to_user_id'),
+    'like': ('id', 'user_id', 'content_type_id', 'object_id'),
+}
+
+# 调用的地方在同一个 transaction 里自己改好了计数的写（见 LikeService._add_to_counter）
+_counted = ContextVar('outbox_counted', default=False)
+
+
+@contextmanager
+def counted_writes():
+    """
+    这个 context 里 create / delete 产生的事件带上 counted=True,
+    计数的 handler 看到它就不再重新数一遍
+    """
+    token = _counted.set(True)
+    try:
+        yield
+    finally:
+        _counted.reset(token)
+
+
+def _publish(instance, action):
+    # import 放在这里，避免 models 之间循环 import
+    from outbox.services import OutboxService
+    model_name = instance._meta.model_name
+    payload = {field: getattr(instance, field) for field in PAYLOAD_FIELDS[model_name]}
+    if _counted.get():
+        payload['counted'] = True
+    OutboxService.publish(f'{model_name}.{action}', payload)
+
+
+def publish_created(sender, instance, created, raw=False, **kwargs):
+    # raw: loaddata 导入的数据不产生事件
+    if created and not raw:
+        _publish(instance, 'created')
+
+
+def publish_deleted(sender, instance, **kwargs):
+    _publish(instance, 'deleted')
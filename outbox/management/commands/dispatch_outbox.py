@@ -0,0 +1,47 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from outbox.services import OutboxService
+from utils.checks import ensure_deployable
+from utils.time_helper import utc_now
+
+
+class Command(BaseCommand):
+    """
+    python manage.py dispatch_outbox --loop
+
+    一批一批地执行 OutboxEvent 的 handler，直到没有到时间了的事件为止。
+    --loop 的时候一直跑下去（部署成一个常驻进程，可以起多个），没有事件的时候 sleep 一会儿
+    所有的部署都要跑：默认 (OUTBOX_INLINE_DISPATCH=False) 所有的事件都由这里执行，
+    OUTBOX_INLINE_DISPATCH=True 的时候也还有 atomic() 外面写的事件，请求里执行失败或者进程挂掉留下的事件
+    """
+    help = 'Run the handlers of pending outbox events.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new events instead of exiting when idle.')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when there are no pending events.')
+        parser.add_argument('--purge-days', type=int, default=7,
+                            help='Delete events processed more than this many days ago, 0 to keep.')
+
+    def handle(self, *args, **options):
+        # 和 Django 自己的 system check 一样，命令行启动的时候检查配置，call_command / --skip-checks 不检查
+        if not options['skip_checks']:
+            ensure_deployable()
+        if options['purge_days']:
+            purged = OutboxService.purge(utc_now() - timedelta(days=options['purge_days']))
+            self.stdout.write(f'purged {purged} processed events')
+
+        dispatched = 0
+        while True:
+            count = OutboxService.dispatch_batch(options['batch_size'])
+            dispatched += count
+            if count:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(f'dispatched {dispatched} events')
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.3 on 2026-10-19 13:57
+
+from django.db import migrations, models
+import utils.time_helper
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=64)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('available_at', models.DateTimeField(default=utils.time_helper.utc_now)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('locked_until', models.DateTimeField(null=True)),
+                ('lock_token', models.CharField(blank=True, max_length=32)),
+                ('processed_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'index_together': {('processed_at', 'available_at')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import models
+from utils.time_helper import utc_now
+
+
+class OutboxEvent(models.Model):
+    """
+    和业务数据在同一个 transaction 里写进来的事件（transactional outbox）
+    tweet 存下来了，对应的事件就一定存下来了，反过来也一样
+    fanout / 计数 / 缓存失效这些副作用由 dispatcher 从这张表里取出来执行，至少执行一次
+    """
+    # e.g. tweet.created, like.deleted
+    topic = models.CharField(max_length=64)
+    # 只存 id, handler 执行的时候再去查最新的数据
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 失败之后推迟到这个时间再重试
+    available_at = models.DateTimeField(default=utc_now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # 被某个 dispatcher 领走了，在这个时间之前别的 dispatcher 不会再领
+    # 进程挂掉的话过了这个时间会被别人重新领走
+    locked_until = models.DateTimeField(null=True)
+    lock_token = models.CharField(max_length=32, blank=True)
+    processed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        # dispatcher 按这个顺序取还没有处理的事件
+        index_together = (('processed_at', 'available_at'), )
+
+    def __str__(self):
+        return f'{self.id} {self.topic} {self.payload}'
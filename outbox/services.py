@@ -0,0 +1,165 @@
+import logging
+import secrets
+from contextlib import contextmanager
+from datetime import timedelta
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from outbox.models import OutboxEvent
+from utils.time_helper import utc_now
+
+logger = logging.getLogger(__name__)
+
+# 当前线程（协程）里 OutboxService.atomic() 收集到的事件
+_local = Local()
+
+
+def _outbox():
+    # 事件必须和业务数据写在同一个库里，读也只读主库，从库可能还没同步过来
+    return OutboxEvent.objects.using(DEFAULT_DB_ALIAS)
+
+
+class OutboxService(object):
+    """
+    写数据的地方:
+        with OutboxService.atomic():
+            tweet = Tweet.objects.create(...)
+    model 的 post_save / post_delete（见 outbox.listeners）在同一个 transaction 里写 OutboxEvent,
+    事件由 python manage.py dispatch_outbox 去执行，这个进程必须一直跑着
+    OUTBOX_INLINE_DISPATCH=True 的时候 atomic() 里写的事件在 transaction 提交之后马上在当前请求里执行，
+    atomic() 外面写的事件还是只有 dispatch_outbox 会执行
+
+    handler 可能会被执行不止一次（执行完了还没来得及标记就挂了），所以 handler 必须是幂等的
+    """
+
+    @classmethod
+    @contextmanager
+    def atomic(cls):
+        if getattr(_local, 'events', None) is not None:
+            # 嵌套的时候由最外层在提交之后统一 dispatch
+            with transaction.atomic():
+                yield
+            return
+
+        _local.events = []
+        try:
+            with transaction.atomic():
+                yield
+            events = _local.events
+        finally:
+            _local.events = None
+        if events:
+            cls.dispatch_events(events)
+
+    @classmethod
+    def publish(cls, topic, payload):
+        from outbox.handlers import get_handlers
+        collecting = getattr(_local, 'events', None) is not None
+        event = OutboxEvent(topic=topic, payload=payload)
+        if not get_handlers(topic):
+            # 没有 handler 的事件只是记下来，不需要 dispatch
+            event.processed_at = utc_now()
+            collecting = False
+        elif collecting and cls._inline_dispatch():
+            # 马上就要在当前请求里执行，先占住，免得 dispatcher 同时也拿去执行
+            event.locked_until = utc_now() + timedelta(seconds=cls._lease_seconds())
+        event.save(using=DEFAULT_DB_ALIAS)
+        if collecting:
+            _local.events.append(event)
+        return event
+
+    @classmethod
+    def dispatch_events(cls, events):
+        if not cls._inline_dispatch():
+            return
+        processed = []
+        for event in events:
+            if cls._handle(event):
+                processed.append(event.id)
+        cls._mark_processed(processed)
+
+    @classmethod
+    def dispatch_batch(cls, batch_size=100):
+        """
+        dispatcher 进程调用，领一批到时间了的事件，按 id 的顺序执行
+        多个 dispatcher 同时跑也没关系，每个事件同一时间只会被一个 dispatcher 领走
+        返回这一批领到的事件个数，0 表示暂时没有事件了
+        """
+        events = cls._claim(batch_size)
+        processed = [event.id for event in events if cls._handle(event)]
+        cls._mark_processed(processed)
+        return len(events)
+
+    @classmethod
+    def purge(cls, processed_before):
+        deleted, _ = _outbox().filter(processed_at__lt=processed_before).delete()
+        return deleted
+
+    @classmethod
+    def _claim(cls, batch_size):
+        now = utc_now()
+        candidates = list(
+            _outbox()
+            .filter(processed_at__isnull=True, available_at__lte=now)
+            .filter(attempts__lt=cls._max_attempts())
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not candidates:
+            return []
+        # 条件再检查一遍，别的 dispatcher 在这中间领走的事件这里 update 不到
+        token = secrets.token_hex(16)
+        _outbox().filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+            id__in=candidates,
+            processed_at__isnull=True,
+        ).update(
+            lock_token=token,
+            locked_until=now + timedelta(seconds=cls._lease_seconds()),
+        )
+        return list(_outbox().filter(lock_token=token, id__in=candidates).order_by('id'))
+
+    @classmethod
+    def _handle(cls, event):
+        from outbox.handlers import get_handlers
+        try:
+            for handler in get_handlers(event.topic):
+                handler(event.payload)
+        except Exception as e:
+            # 业务数据已经提交了，这里不能让请求失败，记下来之后重试
+            logger.exception('outbox event %s (%s) failed', event.id, event.topic)
+            cls._mark_failed(event, e)
+            return False
+        return True
+
+    @classmethod
+    def _mark_processed(cls, event_ids):
+        if event_ids:
+            _outbox().filter(id__in=event_ids).update(processed_at=utc_now(), locked_until=None)
+
+    @classmethod
+    def _mark_failed(cls, event, error):
+        attempts = event.attempts + 1
+        # 指数退避：1s, 2s, 4s ... 最多 1 小时
+        delay = min(2 ** (attempts - 1), 60 * 60)
+        _outbox().filter(id=event.id).update(
+            attempts=attempts,
+            last_error=repr(error)[:1000],
+            available_at=utc_now() + timedelta(seconds=delay),
+            locked_until=None,
+        )
+
+    @classmethod
+    def _inline_dispatch(cls):
+        return getattr(settings, 'OUTBOX_INLINE_DISPATCH', False)
+
+    @classmethod
+    def _lease_seconds(cls):
+        return getattr(settings, 'OUTBOX_LEASE_SECONDS', 60)
+
+    @classmethod
+    def _max_attempts(cls):
+        return getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 10)
@@ -0,0 +1,163 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from friendships.models import Friendship
+from likes.models import Like
+from newsfeeds.models import NewsFeed
+from outbox import handlers
+from outbox.handlers import update_tweet_counters
+from outbox.models import OutboxEvent
+from outbox.services import OutboxService
+from testing.testcases import TestCase
+from tweets.models import Tweet
+from utils.time_helper import utc_now
+
+
+def dispatch():
+    out = StringIO()
+    call_command('dispatch_outbox', stdout=out)
+    return out.getvalue()
+
+
+class OutboxServiceTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        # friendship.created 有 handler（通知），在这里就执行掉，不留给下面的 dispatcher
+        with OutboxService.atomic():
+            Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+
+    def test_rollback_drops_event(self):
+        with self.assertRaises(ValueError):
+            with OutboxService.atomic():
+                self.create_tweet(self.dongxie)
+                raise ValueError
+        self.assertFalse(Tweet.objects.exists())
+        self.assertFalse(OutboxEvent.objects.filter(topic='tweet.created').exists())
+
+    @override_settings(OUTBOX_INLINE_DISPATCH=True)
+    def test_inline_dispatch(self):
+        with OutboxService.atomic():
+            tweet = self.create_tweet(self.dongxie)
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+        event = OutboxEvent.objects.get(topic='tweet.created')
+        self.assertEqual(event.payload, {'id': tweet.id, 'user_id': self.dongxie.id})
+        self.assertIsNotNone(event.processed_at)
+        # 已经处理过的事件 dispatcher 不会再处理
+        self.assertIn('dispatched 0 events', dispatch())
+
+    @override_settings(OUTBOX_INLINE_DISPATCH=True)
+    def test_inline_dispatch_outside_atomic(self):
+        # 不在 atomic() 里写的事件 inline 的时候也只有 dispatcher 会执行
+        tweet = self.create_tweet(self.dongxie)
+        self.assertFalse(NewsFeed.objects.filter(tweet=tweet).exists())
+        self.assertIn('dispatched 1 events', dispatch())
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+
+    @override_settings(OUTBOX_INLINE_DISPATCH=False)
+    def test_dispatcher(self):
+        with OutboxService.atomic():
+            tweet = self.create_tweet(self.dongxie)
+        self.assertFalse(NewsFeed.objects.filter(tweet=tweet).exists())
+
+        self.assertIn('dispatched 1 events', dispatch())
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+        self.assertIn('dispatched 0 events', dispatch())
+
+        # 至少执行一次：重复执行 handler 不会写出重复的数据
+        handlers.fanout_tweet({'id': tweet.id, 'user_id': self.dongxie.id})
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+
+    def test_locked_event_is_skipped(self):
+        # 正在被别人（e.g. 请求里的 inline dispatch）处理的事件不会被领走
+        event = OutboxService.publish('comment.created', {'tweet_id': None})
+        OutboxEvent.objects.filter(id=event.id).update(
+            locked_until=utc_now() + timedelta(minutes=1),
+        )
+        self.assertIn('dispatched 0 events', dispatch())
+
+        # lease 过期了说明之前的进程挂了，重新领
+        OutboxEvent.objects.filter(id=event.id).update(
+            locked_until=utc_now() - timedelta(seconds=1),
+        )
+        self.assertIn('dispatched 1 events', dispatch())
+
+    def test_failed_handler_is_retried(self):
+        def fail(payload):
+            raise RuntimeError('boom')
+
+        handlers.HANDLERS['test.fail'] = [fail]
+        self.addCleanup(handlers.HANDLERS.pop, 'test.fail')
+
+        with OutboxService.atomic():
+            OutboxService.publish('test.fail', {})
+        event = OutboxEvent.objects.get(topic='test.fail')
+        self.assertIsNone(event.processed_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn('boom', event.last_error)
+        self.assertGreater(event.available_at, utc_now())
+        # 还没到重试的时间
+        self.assertIn('dispatched 0 events', dispatch())
+
+        handlers.HANDLERS['test.fail'] = []
+        OutboxEvent.objects.update(available_at=utc_now())
+        self.assertIn('dispatched 1 events', dispatch())
+        self.assertIsNotNone(OutboxEvent.objects.get(topic='test.fail').processed_at)
+
+    def test_events_without_handlers(self):
+        with OutboxService.atomic():
+            Friendship.objects.filter(from_user=self.linghu).delete()
+        event = OutboxEvent.objects.filter(topic='friendship.deleted').last()
+        self.assertEqual(event.payload['from_user_id'], self.linghu.id)
+        self.assertIsNotNone(event.processed_at)
+
+    def test_counters(self):
+        tweet = self.create_tweet(self.dongxie)
+        self.create_comment(self.linghu, tweet)
+        self.create_comment(self.dongxie, tweet)
+        self.create_like(self.linghu, tweet)
+        dispatch()
+        tweet.refresh_from_db()
+        self.assertEqual((tweet.comments_count, tweet.likes_count), (2, 1))
+
+        # 重新数一遍，执行多次结果一样
+        update_tweet_counters(tweet.id)
+        tweet.refresh_from_db()
+        self.assertEqual((tweet.comments_count, tweet.likes_count), (2, 1))
+
+        tweet.comment_set.first().delete()
+        dispatch()
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.comments_count, 1)
+
+    def test_like_counters(self):
+        tweet = self.create_tweet(self.dongxie)
+        # LikeService 自己改好了计数，事件里带着 counted
+        like = self.create_like(self.linghu, tweet)
+        event = OutboxEvent.objects.get(topic='like.created')
+        self.assertTrue(event.payload['counted'])
+
+        # admin / shell 直接删的赞，由 handler 重新数
+        Tweet.objects.filter(id=tweet.id).update(likes_count=3)
+        like.delete()
+        self.assertNotIn('counted', OutboxEvent.objects.get(topic='like.deleted').payload)
+        dispatch()
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 0)
+
+        Like.objects.create(user=self.dongxie, content_object=tweet)
+        dispatch()
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 1)
+
+    def test_purge(self):
+        with OutboxService.atomic():
+            self.create_tweet(self.dongxie)
+        OutboxEvent.objects.update(processed_at=utc_now() - timedelta(days=30))
+        out = dispatch()
+        self.assertIn('purged', out)
+        self.assertFalse(OutboxEvent.objects.exists())
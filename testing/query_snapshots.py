@@ -0,0 +1,115 @@
+import json
+import os
+import re
+from contextlib import ExitStack
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+
+
+# UPDATE_QUERY_SNAPSHOTS=1 python manage.py test
+# 会把当前的 SQL 记录写回 snapshot 文件，而不是和 snapshot 做比较
+UPDATE_ENV = 'UPDATE_QUERY_SNAPSHOTS'
+SNAPSHOT_FILENAME = 'query_snapshots.json'
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'\((?:\s*\?\s*,)*\s*\?\s*\)')
+_VALUE_GROUPS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_SAVEPOINT = re.compile(r'\b((?:RELEASE |ROLLBACK TO )?SAVEPOINT)\s+\S+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """
+    把 SQL 变成和参数无关的形状，这样不同的 id / 不同的行数都会得到同一个字符串
+    SELECT ... WHERE "id" IN (%s, %s, %s) -> SELECT ... WHERE id IN (...)
+    """
+    sql = sql.replace('"', '').replace('`', '')
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDERS.sub('(...)', sql)
+    # bulk_create 的 VALUES (...), (...), (...) 也合并成一个
+    sql = _VALUE_GROUPS.sub('(...)', sql)
+    sql = _SAVEPOINT.sub(r'\1 ?', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder(object):
+    """
+    记录一段代码在所有 database alias 上执行的 SQL
+    用 execute_wrapper 实现，不依赖 DEBUG=True
+    """
+
+    def __init__(self):
+        self.queries = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(normalize_sql(sql))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        # ContentType 有进程内的缓存，不清掉的话 SQL 条数会和 test 的执行顺序有关
+        ContentType.objects.clear_cache()
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stack.close()
+
+    def __len__(self):
+        return len(self.queries)
+
+
+class QuerySnapshotStore(object):
+    """
+    每个 test 文件旁边放一个 query_snapshots.json
+    e.g. tweets/api/tests.py -> tweets/api/query_snapshots.json
+    """
+
+    _cache = {}
+
+    def __init__(self, test_file):
+        self.path = os.path.join(os.path.dirname(test_file), SNAPSHOT_FILENAME)
+        if self.path not in self._cache:
+            self._cache[self.path] = self._load()
+        self.snapshots = self._cache[self.path]
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def get(self, key):
+        return self.snapshots.get(key)
+
+    def save(self, key, vendor, queries):
+        self.snapshots[key] = {
+            'count': len(queries),
+            'vendor': vendor,
+            'queries': queries,
+        }
+        with open(self.path, 'w') as f:
+            json.dump(self.snapshots, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+def should_update_snapshots():
+    return os.environ.get(UPDATE_ENV) == '1'
+
+
+def diff_queries(expected, actual):
+    lines = []
+    for i in range(max(len(expected), len(actual))):
+        before = expected[i] if i < len(expected) else '<missing>'
+        after = actual[i] if i < len(actual) else '<missing>'
+        marker = '  ' if before == after else '! '
+        lines.append(f'{marker}{i + 1}. {after}')
+        if before != after:
+            lines.append(f'     expected: {before}')
+    return '\n'.join(lines)
@@ -1,13 +1,30 @@
+import inspect
+from contextlib import contextmanager
+
 from comments.models import Comment
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase as DjangoTestCase
+from django.test import override_settings
+from django.test import TransactionTestCase as DjangoTransactionTestCase
 from rest_framework.test import APIClient
 from tweets.models import Tweet
-from likes.models import Like
-from django.contrib.contenttypes.models import ContentType
+from likes.services import LikeService
+from testing.query_snapshots import (
+    QueryRecorder,
+    QuerySnapshotStore,
+    diff_queries,
+    should_update_snapshots,
+)
+
 
+class TestCaseMixin(object):
 
-class TestCase(DjangoTestCase):
+    def clear_cache(self):
+        # test 之间数据库会回滚，id 会被重复使用，cache 里的旧数据要清掉
+        for cache in caches.all():
+            cache.clear()
 
     @property
     def anonymous_client(self):
@@ -47,23 +64,82 @@ class TestCase(DjangoTestCase):
         return Comment.objects.create(user=user, tweet=tweet, content=content)
 
     def create_like(self, user, target):
-        # 第二个返回结果是created or not.
-        # Returns a tuple of (object, created),
-        # where object is the retrieved or created object
-        # created is a boolean specifying whether a new object was created.
-        instance, _ = Like.objects.get_or_create(
-            # target.__class__: get the class name of target
-            # Then get the content type of the class name
-            # 这个方法可以根据target class name 拿到 对应的 content_type_id
-            content_type=ContentType.objects.get_for_model(target.__class__),
-            object_id=target.id,
-            user=user,
-        )
-        # 此时不可以用create， 因为有可能会违反数据库model设定的唯一性约束。
-        # instance = Like.objects.create(
-        #     content_type_id=ContentType.objects.get_for_model(target.__class__),
-        #     object_id=target.id,
-        #     user=user,
-        # )
+        # 和 API 一样走 LikeService, 已经赞过的直接返回原来的那个赞，likes_count 同时改好
+        instance, _ = LikeService.like(user, target)
         return instance
 
+    @contextmanager
+    def assertQueriesMatchSnapshot(self, name):
+        """
+        记录 with 里面执行的 SQL（条数 + 形状），和提交到 repo 里的 snapshot 做比较
+        SQL 条数变了就 fail，这样给热点路径加了 SQL 的改动在 deploy 之前就能被发现
+        snapshot 需要新建或者更新的时候： UPDATE_QUERY_SNAPSHOTS=1 python manage.py test
+        没有 snapshot 的时候也 fail
+        """
+        store = QuerySnapshotStore(inspect.getfile(type(self)))
+        key = f'{type(self).__name__}.{self._testMethodName}.{name}'
+        with QueryRecorder() as recorder:
+            yield recorder
+
+        if should_update_snapshots():
+            store.save(key, connection.vendor, recorder.queries)
+            return
+        snapshot = store.get(key)
+        if snapshot is None:
+            # 新加的 / 改了名字的 snapshot 不能自己写进去就通过，不然 CI 上永远不会 fail
+            self.fail(
+                f'{key} has no query snapshot ({len(recorder)} queries recorded).\n'
+                'Run with UPDATE_QUERY_SNAPSHOTS=1 to record it and commit the snapshot file.'
+            )
+
+        # 不同数据库生成的 SQL 长得不一样，只有同一种数据库才比较 SQL 的形状
+        same_shape = (
+            snapshot['vendor'] != connection.vendor
+            or snapshot['queries'] == recorder.queries
+        )
+        if snapshot['count'] != len(recorder) or not same_shape:
+            self.fail(
+                f'{key} issued {len(recorder)} queries, '
+                f'snapshot has {snapshot["count"]}:\n'
+                + diff_queries(snapshot['queries'], recorder.queries)
+                + '\nRun with UPDATE_QUERY_SNAPSHOTS=1 if the change is intended.'
+            )
+
+    def assertQueryCountIndependentOfRows(self, make_request, add_rows):
+        """
+        N + 1 检测：先调用一次 make_request, 然后 add_rows 加更多的数据，再调用一次
+        两次的 SQL 条数必须一样，否则说明 SQL 条数和返回的行数有关
+        """
+        with QueryRecorder() as before:
+            make_request()
+        add_rows()
+        with QueryRecorder() as after:
+            make_request()
+        if len(before) != len(after):
+            self.fail(
+                f'query count depends on the number of rows: '
+                f'{len(before)} queries before, {len(after)} after adding rows:\n'
+                + diff_queries(before.queries, after.queries)
+            )
+
+
+# 搜索的索引放在内存里，跑 test 的时候不会写到 settings 里的索引文件
+# outbox 的事件在请求里马上执行，test 里不用再跑 dispatch_outbox 就能看到 fanout / 计数
+TEST_SETTINGS = override_settings(
+    TWEET_SEARCH_INDEX_PATH=':memory:',
+    OUTBOX_INLINE_DISPATCH=True,
+)
+
+
+@TEST_SETTINGS
+class TestCase(TestCaseMixin, DjangoTestCase):
+    pass
+
+
+@TEST_SETTINGS
+class TransactionTestCase(TestCaseMixin, DjangoTransactionTestCase):
+    """
+    async 的 view 在别的线程里用别的数据库连接查询，看不到 TestCase 的事务里还没有提交的数据，
+    测 async 的 view 要用 TransactionTestCase
+    """
+    pass
@@ -9,4 +9,7 @@ class TweetAdmin(admin.ModelAdmin):
         'created_at',
         'user',
         'content',
+        'deleted_at',
     )
+    # 原 tweet 用输入 id 的方式选，不要把所有的 tweet 都列在下拉框里
+    raw_id_fields = ('original',)
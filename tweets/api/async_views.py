@@ -0,0 +1,92 @@
+from accounts.api.serializers import UserFastSerializer
+from comments.api.async_views import serialize_comments
+from rest_framework import status
+from tweets.api.serializers import (
+    TweetFastSerializer,
+    TweetSerializerWithComments,
+    get_display_id,
+    prefetch_originals,
+)
+from tweets.services import TweetService
+from utils.async_views import (
+    async_api_view,
+    async_required_params,
+    gather,
+    json_response,
+    run_sync,
+)
+from utils.fast_serializers import fragments_enabled
+
+
+def _list_tweets(user_id):
+    tweets = TweetService.get_visible_tweets().filter(user_id=user_id).order_by('-id')
+    return [
+        tweet
+        for tweet in TweetFastSerializer(prefetch_originals(tweets), many=True).data
+        if get_display_id(tweet) is not None
+    ]
+
+
+def _get_tweet_ids(user_id):
+    return list(
+        TweetService.get_visible_tweets().filter(user_id=user_id).order_by('-id').values_list('id', flat=True)
+    )
+
+
+def _serialize_tweets(tweet_ids, fragments):
+    return [
+        tweet
+        for tweet in TweetFastSerializer.from_pks(tweet_ids, fragments)
+        if tweet is not None and get_display_id(tweet) is not None
+    ]
+
+
+def _get_tweet(tweet_id):
+    # tweet 的 JSON 在缓存里的时候不查数据库
+    return TweetFastSerializer.from_pks([tweet_id])[0]
+
+
+@async_api_view
+@async_required_params(params=['user_id'])
+async def list_tweets(request):
+    """
+    GET /api/async/tweets/?user_id=1
+    TweetViewSet.list 的 async 版本，输出一样
+    """
+    user_id = request.GET['user_id']
+    if not user_id.isdigit():
+        return json_response({'user_id': ['Enter a number.']}, status=status.HTTP_400_BAD_REQUEST)
+    user_id = int(user_id)
+    if not fragments_enabled():
+        # 没有 fragment 缓存的时候 tweet 和 user 一起 prefetch, 没有可以同时做的查询
+        return json_response({'tweets': await run_sync(_list_tweets, user_id)})
+    # 先取 tweet 的 id, 然后 tweet 和作者（就是 user_id）的 fragment 互相独立，同时取
+    tweet_ids = await run_sync(_get_tweet_ids, user_id)
+    if not tweet_ids:
+        return json_response({'tweets': []})
+    tweets, users = await gather(
+        (TweetFastSerializer.fetch_fragments, tweet_ids),
+        (UserFastSerializer.fetch_fragments, [user_id]),
+    )
+    # 转发 / 引用的原 tweet 要看了 tweet 的内容才知道，在这里再取
+    tweets = await run_sync(
+        _serialize_tweets, tweet_ids, {TweetFastSerializer: tweets, UserFastSerializer: users},
+    )
+    return json_response({'tweets': tweets})
+
+
+@async_api_view
+async def retrieve_tweet(request, tweet_id):
+    """
+    GET /api/async/tweets/1/
+    TweetViewSet.retrieve 的 async 版本
+    tweet 和 comments 是互相独立的两个查询，同时执行
+    """
+    tweet, comments = await gather((_get_tweet, tweet_id), (serialize_comments, tweet_id))
+    if tweet is None:
+        return json_response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    # 字段的顺序和 TweetSerializerWithComments 一样
+    return json_response({
+        field: comments if field == 'comments' else tweet[field]
+        for field in TweetSerializerWithComments.Meta.fields
+    })
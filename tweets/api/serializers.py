@@ -1,23 +1,86 @@
 from accounts.api.serializers import UserSerializerForTweet
 from comments.api.serializers import CommentSerializer
+from django.db.models import Prefetch
 from rest_framework import serializers
 from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.fast_serializers import FastSerializer, prefetch_unless_cached
 
 
 class TweetSerializer(serializers.ModelSerializer):
     user = UserSerializerForTweet()
+    # snowflake 的 id 比 2^53 大，JS 的 JSON.parse 会把数字的 id 变成不精确的 double,
+    # 客户端用 id_str，传回来的 id（since_id / original_id / object_id ...）也可以是字符串
+    id_str = serializers.CharField(source='id', read_only=True)
 
     class Meta:
         model = Tweet
-        fields = ('id', 'user', 'created_at', 'content')
+        fields = ('id', 'id_str', 'user', 'created_at', 'content', 'likes_count', 'comments_count')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # 转发 / 引用的原 tweet, 格式和 tweet 一样，class 里面不能直接引用自己
+        # FastSerializer 里原 tweet 是单独缓存的 fragment, 转发的 JSON 里只有一个占位符，
+        # 一页里所有的原 tweet 一次 get_many 取出来，不会复制原 tweet 的内容
+        fields['original'] = TweetSerializer(read_only=True)
+        return fields
+
+
+class TweetFastSerializer(FastSerializer):
+    # tweet list 的热点读路径用，输出和 TweetSerializer 完全一样
+    # newsfeed 里嵌套的 tweet 也用这份缓存
+    serializer_class = TweetSerializer
+    cache_fragments = True
+
+    @classmethod
+    def load_instances(cls, pks):
+        # 软删除的 tweet 当作不存在，输出 null
+        return TweetService.get_visible_tweets().in_bulk(pks)
+
+
+def get_display_id(tweet):
+    """
+    serialize 之后的 tweet 实际展示的是哪个 tweet: 转发（没有 content）展示的是原 tweet,
+    原 tweet 已经删掉的转发返回 None, 不展示
+    newsfeed 里好几个关注的人转发了同一个 tweet 的时候按这个去重
+    """
+    if tweet['content']:
+        return tweet['id']
+    original = tweet['original']
+    return original['id'] if original is not None else None
+
+
+def prefetch_originals(tweets, prefix=''):
+    # fragment 缓存关掉的时候原 tweet 和原 tweet 的 user 也要用 IN query 一次取出来，软删除的不取
+    return prefetch_unless_cached(
+        tweets,
+        prefix + 'user',
+        Prefetch(prefix + 'original', queryset=TweetService.get_visible_tweets()),
+        prefix + 'original__user',
+    )
+
+
+def serialize_tweet_ids(tweet_ids):
+    """
+    按 tweet_ids 的顺序输出（e.g. 搜索 / hashtag 的结果），已经软删除的 tweet 跳过
+    一条 IN query 取出所有的 tweet, user 的 JSON 不在缓存里的时候再一条 IN query
+    """
+    tweets = prefetch_originals(TweetService.get_visible_tweets().filter(id__in=tweet_ids))
+    tweets = {tweet.id: tweet for tweet in tweets}
+    return TweetFastSerializer(
+        [tweets[tweet_id] for tweet_id in tweet_ids if tweet_id in tweets],
+        many=True,
+    ).data
 
 
 class TweetSerializerForCreate(serializers.ModelSerializer):
     content = serializers.CharField(min_length=6, max_length=140)
+    # 引用 (quote) 的时候传原 tweet 的 id
+    original_id = serializers.IntegerField(required=False)
 
     class Meta:
         model = Tweet
-        fields = ('content',)
+        fields = ('content', 'original_id')
         # 此时不能写user，因为user是来自当时的登录用户
 
         # model: the model for Serializer
@@ -27,21 +90,36 @@ class TweetSerializerForCreate(serializers.ModelSerializer):
     # we need to implement one or both of the .create() and .update() methods.
     # Now when deserializing data, we can call .save() to return an object instance, based on the validated data.
     # serializer.save() will call create method
+    def validate_original_id(self, original_id):
+        original = TweetService.get_visible_tweets().filter(id=original_id).first()
+        original = original and TweetService.get_reshare_target(original)
+        if original is None:
+            raise serializers.ValidationError('tweet does not exist')
+        return original.id
+
     def create(self, validated_data):
         user = self.context['request'].user
         content = validated_data['content']
-        tweet = Tweet.objects.create(user=user, content=content)
+        tweet = Tweet.objects.create(
+            user=user,
+            content=content,
+            original_id=validated_data.get('original_id'),
+        )
         return tweet
 
 
 class TweetSerializerWithComments(serializers.ModelSerializer):
     user = UserSerializerForTweet()
     comments = CommentSerializer(source='comment_set', many=True)
-
+    original = TweetSerializer(read_only=True)
+    id_str = serializers.CharField(source='id', read_only=True)
 
     class Meta:
         model = Tweet
-        fields = ('id', 'user', 'comments', 'created_at', 'content')
+        fields = (
+            'id', 'id_str', 'user', 'comments', 'created_at', 'content',
+            'likes_count', 'comments_count', 'original',
+        )
 
     # <HOMEWORK> 使用 serialziers.SerializerMethodField 的方式实现 comments
     # comments = serializers.SerializerMethodField()
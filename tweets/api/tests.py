@@ -1,18 +1,44 @@
+from accounts.api.serializers import UserFastSerializer
+from comments.models import Comment
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.db.models.query import QuerySet
+from django.test import Client, override_settings
+from friendships.models import Friendship
+from io import StringIO
+from unittest import mock
+from likes.models import Like
+from newsfeeds.models import NewsFeed
+from outbox.services import OutboxService
 from rest_framework.test import APIClient
-from testing.testcases import TestCase
+from testing.testcases import TestCase, TransactionTestCase
+from tweets.api.serializers import TweetFastSerializer
 from tweets.models import Tweet
+from tweets.services import TweetSearchService, TweetService
 from rest_framework import status
+from utils.async_views import gather
+from utils.decorators import idempotency_cache_key
 
 
 # 注意要加 '/' 结尾，要不然会产生 301 redirect
 TWEET_LIST_API = '/api/tweets/'
 TWEET_CREATE_API = '/api/tweets/'
 TWEET_RETRIEVE_API = '/api/tweets/{}/'
+TWEET_SEARCH_API = '/api/tweets/search/'
 # 后面一定要加"/"， 否则会出现301 redirect 错误
+ASYNC_TWEET_LIST_API = '/api/async/tweets/'
+ASYNC_TWEET_RETRIEVE_API = '/api/async/tweets/{}/'
+NEWSFEEDS_URL = '/api/newsfeeds/'
+COMMENT_CREATE_API = '/api/comments/'
+NEWSFEEDS_UPDATES_URL = '/api/newsfeeds/updates/'
+LIKE_CREATE_API = '/api/likes/'
+HASHTAG_TWEETS_API = '/api/hashtags/{}/tweets/'
 
 class TweetApiTests(TestCase):
 
     def setUp(self):
+        self.clear_cache()
         # self.anonymous_client = APIClient() # no need
 
         self.user1 = self.create_user('user1', 'user1@jiuzhang.com')
@@ -86,3 +112,586 @@ class TweetApiTests(TestCase):
         response = self.anonymous_client.get(url)
         self.assertEqual(len(response.data["comments"]), 2)
 
+    def test_list_api_queries(self):
+        def list_tweets():
+            response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user1.id})
+            self.assertEqual(response.status_code, 200)
+
+        with self.assertQueriesMatchSnapshot('list'):
+            list_tweets()
+        # tweet 变多了，SQL 条数不能变多
+        self.assertQueryCountIndependentOfRows(
+            list_tweets,
+            lambda: [self.create_tweet(self.user1) for _ in range(3)],
+        )
+
+    def test_create_api_queries(self):
+        with self.assertQueriesMatchSnapshot('create'):
+            response = self.user1_client.post(TWEET_CREATE_API, {
+                'content': 'Hello World, this is my first tweet!'
+            })
+        self.assertEqual(response.status_code, 201)
+
+    def test_retrieve_queries(self):
+        tweet = self.create_tweet(self.user1)
+        self.create_comment(self.user2, tweet)
+        url = TWEET_RETRIEVE_API.format(tweet.id)
+
+        def retrieve_tweet():
+            response = self.anonymous_client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+        with self.assertQueriesMatchSnapshot('retrieve'):
+            retrieve_tweet()
+
+        def add_comments():
+            for i in range(3):
+                user = self.create_user(f'commenter{i}')
+                self.create_comment(user, tweet)
+        self.assertQueryCountIndependentOfRows(retrieve_tweet, add_comments)
+
+
+class TweetDestroyTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+        self.linghu_client = APIClient()
+        self.linghu_client.force_authenticate(self.linghu)
+        self.dongxie_client = APIClient()
+        self.dongxie_client.force_authenticate(self.dongxie)
+        response = self.dongxie_client.post(TWEET_CREATE_API, {'content': 'to be deleted'})
+        self.tweet = Tweet.objects.get(id=response.data['id'])
+        self.comment = self.create_comment(self.linghu, self.tweet)
+        self.create_like(self.linghu, self.tweet)
+        self.create_like(self.dongxie, self.comment)
+        # 上面的 comment / like 的事件先执行掉
+        OutboxService.dispatch_batch()
+
+    def test_destroy(self):
+        url = TWEET_RETRIEVE_API.format(self.tweet.id)
+        # newsfeed 里的 tweet JSON 先缓存起来
+        self.assertEqual(len(self.linghu_client.get(NEWSFEEDS_URL).data['newsfeeds']), 1)
+
+        response = self.anonymous_client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.linghu_client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.dongxie_client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['success'], True)
+        response = self.dongxie_client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # 马上就看不到了，newsfeed 还没删掉也不会展示出来
+        self.assertIsNotNone(Tweet.objects.get(id=self.tweet.id).deleted_at)
+        self.assertEqual(self.anonymous_client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.dongxie.id})
+        self.assertEqual(response.data['tweets'], [])
+        self.assertEqual(NewsFeed.objects.filter(tweet_id=self.tweet.id).count(), 2)
+        self.assertEqual(self.linghu_client.get(NEWSFEEDS_URL).data['newsfeeds'], [])
+        self.assertEqual(self.dongxie_client.get(NEWSFEEDS_URL).data['newsfeeds'], [])
+        with override_settings(JSON_FRAGMENT_CACHE_ENABLED=False):
+            self.assertEqual(self.linghu_client.get(NEWSFEEDS_URL).data['newsfeeds'], [])
+        # 不能再评论
+        response = self.linghu_client.post(COMMENT_CREATE_API, {
+            'tweet_id': self.tweet.id,
+            'content': 'too late',
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # 删除不在请求里做，由 dispatcher 在后台删掉
+        self.assertEqual(OutboxService.dispatch_batch(), 1)
+        self.assertFalse(NewsFeed.objects.filter(tweet_id=self.tweet.id).exists())
+        self.assertFalse(Comment.objects.filter(tweet_id=self.tweet.id).exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(OutboxService.dispatch_batch(), 0)
+
+    @override_settings(TWEET_RETRACT_BATCH_SIZE=1, TWEET_RETRACT_BATCHES_PER_EVENT=2)
+    def test_retract_in_chunks(self):
+        self.dongxie_client.delete(TWEET_RETRIEVE_API.format(self.tweet.id))
+        # 2 条 newsfeed + 1 个 like + 1 个 comment (和它的 like), 每个事件最多删 2 条
+        dispatched = 0
+        while OutboxService.dispatch_batch():
+            dispatched += 1
+        self.assertEqual(dispatched, 3)
+        self.assertFalse(NewsFeed.objects.filter(tweet_id=self.tweet.id).exists())
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Like.objects.exists())
+        # tombstone 留着
+        self.assertTrue(Tweet.objects.filter(id=self.tweet.id).exists())
+
+
+
+class RetweetApiTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.linghu_client = APIClient()
+        self.linghu_client.force_authenticate(self.linghu)
+        self.dongxie = self.create_user('dongxie')
+        self.dongxie_client = APIClient()
+        self.dongxie_client.force_authenticate(self.dongxie)
+        self.meixi = self.create_user('meixi')
+        self.meixi_client = APIClient()
+        self.meixi_client.force_authenticate(self.meixi)
+        self.guojing = self.create_user('guojing')
+        self.tweet = self.create_tweet(self.guojing, 'original tweet')
+
+    def retweet(self, client, tweet_id):
+        return client.post(TWEET_RETRIEVE_API.format(tweet_id) + 'retweet/')
+
+    def newsfeed_tweets(self, client):
+        return [newsfeed['tweet'] for newsfeed in client.get(NEWSFEEDS_URL).data['newsfeeds']]
+
+    def test_retweet(self):
+        response = self.retweet(self.anonymous_client, self.tweet.id)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.retweet(self.dongxie_client, self.tweet.id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        retweet_id = response.data['id']
+        self.assertEqual(response.data['content'], '')
+        self.assertEqual(response.data['original']['id'], self.tweet.id)
+        self.assertEqual(response.data['original']['user']['username'], 'guojing')
+        # 重复转发返回已有的那条
+        response = self.retweet(self.dongxie_client, self.tweet.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], retweet_id)
+        # 转发一个转发，引用的还是原 tweet
+        response = self.retweet(self.meixi_client, retweet_id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Tweet.objects.get(id=response.data['id']).original_id, self.tweet.id)
+
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.dongxie.id})
+        self.assertEqual([tweet['id'] for tweet in response.data['tweets']], [retweet_id])
+        self.assertEqual(response.data['tweets'][0]['original']['content'], 'original tweet')
+        response = self.anonymous_client.get(TWEET_RETRIEVE_API.format(retweet_id))
+        self.assertEqual(response.data['original']['id'], self.tweet.id)
+
+        # 原 tweet 删掉之后转发不展示，也不能再转发
+        TweetService.soft_delete(self.tweet)
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.dongxie.id})
+        self.assertEqual(response.data['tweets'], [])
+        response = self.retweet(self.linghu_client, retweet_id)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.retweet(self.linghu_client, self.tweet.id)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_retweet_race(self):
+        # 另一个请求的转发在 get 之后、insert 之前插入：唯一索引拦住这次 insert, 返回已有的那条
+        existing = Tweet.objects.create(
+            user=self.dongxie, content='', original=self.tweet, retweet_key=self.tweet.id,
+        )
+        get = QuerySet.get
+        missed = []
+
+        def get_after_concurrent_insert(queryset, *args, **kwargs):
+            if not missed:
+                missed.append(True)
+                raise Tweet.DoesNotExist
+            return get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get', get_after_concurrent_insert):
+            retweet, created = TweetService.retweet(self.dongxie, self.tweet)
+        self.assertTrue(missed)
+        self.assertFalse(created)
+        self.assertEqual(retweet.id, existing.id)
+        self.assertEqual(Tweet.objects.filter(original=self.tweet, content='').count(), 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Tweet.objects.create(user=self.dongxie, content='', original=self.tweet, retweet_key=self.tweet.id)
+
+        # 删掉转发之后可以再转发一次
+        TweetService.soft_delete(existing)
+        response = self.retweet(self.dongxie_client, self.tweet.id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(response.data['id'], existing.id)
+        # 引用不受影响，可以引用好几次
+        for _ in range(2):
+            response = self.dongxie_client.post(TWEET_CREATE_API, {
+                'content': 'quote again', 'original_id': self.tweet.id,
+            })
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_quote(self):
+        retweet, _ = TweetService.retweet(self.dongxie, self.tweet)
+        response = self.linghu_client.post(TWEET_CREATE_API, {
+            'content': 'quoting a retweet',
+            'original_id': retweet.id,
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['content'], 'quoting a retweet')
+        # 引用一个转发，引用的是原 tweet
+        self.assertEqual(response.data['original']['id'], self.tweet.id)
+        quote_id = response.data['id']
+
+        response = self.linghu_client.post(TWEET_CREATE_API, {
+            'content': 'quoting a quote',
+            'original_id': quote_id,
+        })
+        self.assertEqual(response.data['original']['id'], quote_id)
+        self.assertEqual(response.data['original']['original']['id'], self.tweet.id)
+
+        response = self.linghu_client.post(TWEET_CREATE_API, {
+            'content': 'quoting nothing',
+            'original_id': 0,
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('original_id', response.data['errors'])
+
+        # 原 tweet 删掉之后引用还在，原 tweet 是 null
+        TweetService.soft_delete(self.tweet)
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.linghu.id})
+        self.assertEqual(len(response.data['tweets']), 2)
+        self.assertIsNone(response.data['tweets'][1]['original'])
+
+    def test_newsfeed(self):
+        for user in (self.dongxie, self.meixi):
+            Friendship.objects.create(from_user=self.linghu, to_user=user)
+        self.retweet(self.dongxie_client, self.tweet.id)
+        self.retweet(self.meixi_client, self.tweet.id)
+        quote = self.meixi_client.post(TWEET_CREATE_API, {
+            'content': 'look at this',
+            'original_id': self.tweet.id,
+        }).data
+
+        # 两个人转发了同一个 tweet, newsfeed 里只出现一次，引用是一条单独的 tweet
+        tweets = self.newsfeed_tweets(self.linghu_client)
+        self.assertEqual([tweet['id'] for tweet in tweets][0], quote['id'])
+        self.assertEqual(len(tweets), 2)
+        self.assertEqual(tweets[1]['original']['id'], self.tweet.id)
+        self.assertEqual(tweets[1]['user']['username'], 'meixi')
+        # 关注了原作者之后，原 tweet 和转发也只出现一次
+        Friendship.objects.create(from_user=self.linghu, to_user=self.guojing)
+        NewsFeed.objects.create(
+            user=self.linghu,
+            tweet=self.tweet,
+            tweet_user_id=self.guojing.id,
+            tweet_created_at=self.tweet.created_at,
+        )
+        self.assertEqual(len(self.newsfeed_tweets(self.linghu_client)), 2)
+
+        TweetService.soft_delete(self.tweet)
+        tweets = self.newsfeed_tweets(self.linghu_client)
+        self.assertEqual([tweet['id'] for tweet in tweets], [quote['id']])
+        with override_settings(JSON_FRAGMENT_CACHE_ENABLED=False):
+            tweets = self.newsfeed_tweets(self.linghu_client)
+            self.assertEqual([tweet['id'] for tweet in tweets], [quote['id']])
+            self.assertIsNone(tweets[0]['original'])
+
+    def test_newsfeed_queries(self):
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+
+        def list_newsfeeds():
+            self.clear_cache()
+            response = self.linghu_client.get(NEWSFEEDS_URL)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        def add_retweets(prefix):
+            # 每个原 tweet 的作者都不一样，原 tweet 和它们的 user 也是批量取出来的
+            for i in range(3):
+                author = self.create_user(f'{prefix}{i}')
+                TweetService.retweet(self.dongxie, self.create_tweet(author))
+
+        TweetService.retweet(self.dongxie, self.tweet)
+        self.assertQueryCountIndependentOfRows(list_newsfeeds, lambda: add_retweets('author'))
+        with override_settings(JSON_FRAGMENT_CACHE_ENABLED=False):
+            self.assertQueryCountIndependentOfRows(list_newsfeeds, lambda: add_retweets('writer'))
+
+
+class TweetSearchTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        TweetSearchService.get_index().clear()
+        self.linghu = self.create_user('linghu')
+        self.linghu_client = APIClient()
+        self.linghu_client.force_authenticate(self.linghu)
+
+    def post_tweet(self, content):
+        return self.linghu_client.post(TWEET_CREATE_API, {'content': content}).data['id']
+
+    def search(self, **params):
+        return self.anonymous_client.get(TWEET_SEARCH_API, params)
+
+    def test_search(self):
+        response = self.search()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # 发 tweet 的时候增量地写进索引
+        coffee = self.post_tweet('Morning coffee, then more coffee')
+        tea = self.post_tweet('Green tea in the morning')
+        self.post_tweet('Nothing to see here')
+        response = self.search(q='coffee')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([tweet['id'] for tweet in response.data['tweets']], [coffee])
+        self.assertEqual(response.data['tweets'][0]['user']['username'], 'linghu')
+        self.assertIsNone(response.data['next_cursor'])
+        # 所有的词都要出现，大小写没关系
+        response = self.search(q='MORNING tea')
+        self.assertEqual([tweet['id'] for tweet in response.data['tweets']], [tea])
+        response = self.search(q='morning')
+        self.assertEqual({tweet['id'] for tweet in response.data['tweets']}, {coffee, tea})
+        self.assertEqual(self.search(q='"*').data['tweets'], [])
+
+        # 删掉之后马上搜不到了，dispatcher 在后台把它从索引里删掉
+        self.linghu_client.delete(TWEET_RETRIEVE_API.format(coffee))
+        self.assertEqual(self.search(q='coffee').data['tweets'], [])
+        OutboxService.dispatch_batch()
+        self.assertEqual(TweetSearchService.search('coffee'), ([], None))
+
+    @override_settings(TWEET_SEARCH_PAGE_SIZE=2)
+    def test_cursor(self):
+        tweet_ids = [self.post_tweet(f'paging tweet {i}') for i in range(5)]
+        seen = []
+        response = self.search(q='paging')
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(tweet['id'] for tweet in response.data['tweets'])
+            if response.data['next_cursor'] is None:
+                break
+            response = self.search(q='paging', cursor=response.data['next_cursor'])
+        # 长度一样的时候新的在前面
+        self.assertEqual(seen, tweet_ids[::-1])
+
+        response = self.search(q='paging', cursor='bad')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_count(self):
+        def search():
+            self.clear_cache()
+            self.assertEqual(self.search(q='hello').status_code, status.HTTP_200_OK)
+
+        def add_tweets():
+            for i in range(3):
+                self.post_tweet(f'hello number {i}')
+        self.post_tweet('hello world')
+        self.assertQueryCountIndependentOfRows(search, add_tweets)
+
+    def test_index_tweets_command(self):
+        # 直接写数据库的 tweet 不会进索引（事件还没执行）
+        tweets = [self.create_tweet(self.linghu, f'backfill {i}') for i in range(3)]
+        TweetService.soft_delete(tweets[0])
+        self.assertEqual(TweetSearchService.search('backfill'), ([], None))
+
+        out = StringIO()
+        call_command('index_tweets', '--batch-size', '2', stdout=out)
+        self.assertIn('indexed 2 tweets', out.getvalue())
+        self.assertEqual(
+            TweetSearchService.search('backfill')[0],
+            [tweets[2].id, tweets[1].id],
+        )
+
+
+class SnowflakeIdStrTests(TestCase):
+    """
+    64 位的 snowflake id 都比 2^53 大，JS 的 JSON.parse 读出来的数字 id 是不精确的，
+    客户端只用 id_str, 传回来的时候也是字符串
+    """
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.linghu_client = APIClient()
+        self.linghu_client.force_authenticate(self.linghu)
+        self.dongxie = self.create_user('dongxie')
+        self.dongxie_client = APIClient()
+        self.dongxie_client.force_authenticate(self.dongxie)
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+
+    def post_tweet(self, client, data):
+        response = client.post(TWEET_CREATE_API, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    @override_settings(HASHTAG_TWEETS_PAGE_SIZE=1)
+    def test_round_trip(self):
+        tweet = self.post_tweet(self.dongxie_client, {'content': 'first #snowflake'})
+        self.assertGreater(int(tweet['id_str']), 2 ** 53)
+        self.assertEqual(tweet['id_str'], str(tweet['id']))
+        first = tweet['id_str']
+
+        # newsfeed 的 since_id
+        newsfeed = self.linghu_client.get(NEWSFEEDS_URL).data['newsfeeds'][0]
+        self.assertEqual(newsfeed['id_str'], str(newsfeed['id']))
+        self.assertEqual(newsfeed['tweet']['id_str'], first)
+        second = self.post_tweet(self.dongxie_client, {'content': 'second #snowflake'})['id_str']
+        response = self.linghu_client.get(NEWSFEEDS_UPDATES_URL, {'since_id': newsfeed['id_str']})
+        self.assertEqual([item['tweet']['id_str'] for item in response.data['newsfeeds']], [second])
+
+        # 引用的时候 JSON 里的 original_id 是字符串
+        quote = self.post_tweet(self.linghu_client, {'content': 'quote tweet', 'original_id': first})
+        self.assertEqual(quote['original']['id_str'], first)
+
+        # 转发
+        response = self.linghu_client.post(TWEET_RETRIEVE_API.format(second) + 'retweet/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['original']['id_str'], second)
+
+        # 赞的 object_id, 评论的 tweet_id
+        response = self.linghu_client.post(
+            LIKE_CREATE_API, {'content_type': 'tweet', 'object_id': first}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.linghu_client.get(LIKE_CREATE_API, {'content_type': 'tweet', 'object_id': first})
+        self.assertEqual(len(response.data['likes']), 1)
+        response = self.linghu_client.post(
+            COMMENT_CREATE_API, {'tweet_id': first, 'content': 'nice'}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['tweet_id_str'], first)
+        self.assertEqual(response.data['id_str'], str(response.data['id']))
+
+        # hashtag 翻页的 max_id
+        response = self.anonymous_client.get(HASHTAG_TWEETS_API.format('snowflake'))
+        self.assertEqual([item['id_str'] for item in response.data['tweets']], [second])
+        self.assertEqual(response.data['next_max_id_str'], second)
+        response = self.anonymous_client.get(HASHTAG_TWEETS_API.format('snowflake'), {
+            'max_id': response.data['next_max_id_str'],
+        })
+        self.assertEqual([item['id_str'] for item in response.data['tweets']], [first])
+
+
+class TweetIdempotencyTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.user1 = self.create_user('user1')
+        self.user1_client = APIClient()
+        self.user1_client.force_authenticate(self.user1)
+        self.user2 = self.create_user('user2')
+        self.user2_client = APIClient()
+        self.user2_client.force_authenticate(self.user2)
+
+    def post(self, client, content, key):
+        return client.post(
+            TWEET_CREATE_API,
+            {'content': content},
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_response(self):
+        response = self.post(self.user1_client, 'hello world', 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+
+        # 重试不会再碰数据库，也不会再 fanout
+        with self.assertNumQueries(0):
+            retry = self.post(self.user1_client, 'hello world', 'key-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, response.content)
+        self.assertEqual(Tweet.objects.count(), 1)
+
+        # 不带 key 或者换一个 key 就是一个新的请求
+        self.user1_client.post(TWEET_CREATE_API, {'content': 'hello world'})
+        self.post(self.user1_client, 'hello world', 'key-2')
+        self.assertEqual(Tweet.objects.count(), 3)
+
+    def test_key_is_per_user(self):
+        self.post(self.user1_client, 'hello world', 'key-1')
+        response = self.post(self.user2_client, 'hello world', 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Tweet.objects.filter(user=self.user2).count(), 1)
+
+    def test_key_reused_for_different_request(self):
+        self.post(self.user1_client, 'hello world', 'key-1')
+        response = self.post(self.user1_client, 'something else', 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Tweet.objects.count(), 1)
+
+    def test_failed_validation_is_replayed(self):
+        response = self.post(self.user1_client, '1', 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        retry = self.post(self.user1_client, '1', 'key-1')
+        self.assertEqual(retry.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_request_in_progress(self):
+        # 模拟第一个请求还没执行完的时候重试就到了
+        cache.add(idempotency_cache_key(self.user1, 'key-1') + ':lock', 'fingerprint')
+        response = self.post(self.user1_client, 'hello world', 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Tweet.objects.count(), 0)
+
+
+class TweetAsyncApiTests(TransactionTestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.user1 = self.create_user('user1')
+        self.user2 = self.create_user('user2')
+        self.tweets = [self.create_tweet(self.user1, f'tweet {i}') for i in range(3)]
+        self.create_comment(self.user2, self.tweets[0], 'comment 你好')
+        self.create_comment(self.user1, self.tweets[0])
+        self.client = Client()
+
+    def test_list(self):
+        response = self.client.get(ASYNC_TWEET_LIST_API)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(ASYNC_TWEET_LIST_API, {'user_id': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(ASYNC_TWEET_LIST_API, {'user_id': self.user1.id})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        # 输出和同步的接口 byte-for-byte 一样，第二次是从缓存里拼出来的
+        for _ in range(2):
+            response = self.client.get(ASYNC_TWEET_LIST_API, {'user_id': self.user1.id})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(
+                response.content,
+                self.client.get(TWEET_LIST_API, {'user_id': self.user1.id}).content,
+            )
+
+    def test_list_gathers_fragments(self):
+        TweetService.retweet(self.user1, self.create_tweet(self.user2, 'original tweet'))
+        TweetService.soft_delete(self.tweets[1])
+        # tweet 和作者的 fragment 同时取，输出还是和同步的接口一样（包括转发的原 tweet）
+        with mock.patch('tweets.api.async_views.gather', wraps=gather) as gathered:
+            for _ in range(2):
+                response = self.client.get(ASYNC_TWEET_LIST_API, {'user_id': self.user1.id})
+                self.assertEqual(
+                    response.content,
+                    self.client.get(TWEET_LIST_API, {'user_id': self.user1.id}).content,
+                )
+        self.assertEqual(len(response.json()['tweets']), 3)
+        self.assertEqual(
+            [[func for func, *_ in call.args] for call in gathered.call_args_list],
+            [[TweetFastSerializer.fetch_fragments, UserFastSerializer.fetch_fragments]] * 2,
+        )
+
+        # fragment 缓存关掉的时候还是一样的输出
+        with override_settings(JSON_FRAGMENT_CACHE_ENABLED=False):
+            response = self.client.get(ASYNC_TWEET_LIST_API, {'user_id': self.user1.id})
+            self.assertEqual(
+                response.content,
+                self.client.get(TWEET_LIST_API, {'user_id': self.user1.id}).content,
+            )
+
+    def test_retrieve(self):
+        response = self.client.get(ASYNC_TWEET_RETRIEVE_API.format(-1))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        for tweet in self.tweets:
+            url = ASYNC_TWEET_RETRIEVE_API.format(tweet.id)
+            for _ in range(2):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(
+                    response.content,
+                    self.client.get(TWEET_RETRIEVE_API.format(tweet.id)).content,
+                )
+
+        # 软删除之后缓存里的 JSON 也删掉了
+        TweetService.soft_delete(self.tweets[0])
+        response = self.client.get(ASYNC_TWEET_RETRIEVE_API.format(self.tweets[0].id))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_asgi(self):
+        # 走 ASGI 的 handler
+        response = await self.async_client.get(ASYNC_TWEET_RETRIEVE_API.format(self.tweets[0].id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['comments']), 2)
@@ -1,23 +1,34 @@
-from rest_framework import viewsets
+from django.db.models import Prefetch, prefetch_related_objects
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from tweets.api.serializers import (
+    TweetFastSerializer,
     TweetSerializer,
     TweetSerializerForCreate,
     TweetSerializerWithComments,
+    get_display_id,
+    prefetch_originals,
+    serialize_tweet_ids,
 )
-from tweets.models import Tweet
-from newsfeeds.services import NewsFeedService
-from utils.decorators import required_params
+from tweets.services import TweetSearchService, TweetService
+from outbox.services import OutboxService
+from utils.decorators import idempotent, required_params
+from utils.permissions import IsObjectOwner
+from utils.search_index import InvalidCursor
 
 
 class TweetViewSet(viewsets.GenericViewSet):
-    queryset = Tweet.objects.all()
+    # 软删除的 tweet retrieve / destroy 都是 404
+    queryset = TweetService.get_visible_tweets()
     serializer_class = TweetSerializer
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:  # action代表每一个带request parameter的方法
+        if self.action in ['list', 'retrieve', 'search']:  # action代表每一个带request parameter的方法
             return [AllowAny()]  # AllowAny 允许没有登录的客户访问
+        if self.action == 'destroy':
+            return [IsAuthenticated(), IsObjectOwner()]
         return [IsAuthenticated()]
 
     # list API, Django Rstt Framework 把 list all info 叫做 list API
@@ -30,22 +41,80 @@ class TweetViewSet(viewsets.GenericViewSet):
         # if 'user_id' not in request.query_params:
         #     return Response('missing user_id', status=400)
 
-        # 这句查询会被翻译为： SELECT * FROM twitter_tweets WHERE user_id = xxx ORDER BY created_at DESC
-        # 这句SQL语句会用到user和Created_at的联合索引
+        # 这句查询会被翻译为： SELECT * FROM twitter_tweets WHERE user_id = xxx ORDER BY id DESC
+        # 这句SQL语句会用到user和id的联合索引，id 是按时间递增的，按 id 倒序就是按时间倒序
         # 单独user的索引是不够的
-        tweets = Tweet.objects.filter(
+        tweets = TweetService.get_visible_tweets().filter(
             user_id=request.query_params['user_id']  # query_params['user_id']是个字符串，Django会自动转换成int
-        ).order_by('-created_at')
+        ).order_by('-id')
+        # prefetch_related 避免每个 tweet 都去查一次 user (N + 1 queries)
+        # user 的 JSON 有缓存的时候不需要 prefetch
+        # 转发 / 引用的原 tweet 也是一样
+        tweets = prefetch_originals(tweets)
         # To serialize a queryset or list of objects instead of a single object instance,
         # you should pass the many=True flag when instantiating the serializer.
         # You can then pass a queryset or list of objects to be serialized.
-        serializer = TweetSerializer(tweets, many=True) # many=True 表示 return list of dict
-        return Response({'tweets': serializer.data}) # 一般来说 json 格式的 response 默认都要用 dict 的格式而不能用 list 的格式（约定俗成）在外面套一个dict 「'tweets': }
+        # 只读的热点路径用 TweetFastSerializer, 输出和 TweetSerializer 一样但是快很多
+        serializer = TweetFastSerializer(tweets, many=True) # many=True 表示 return list of dict
+        # 原 tweet 已经删掉的转发不展示
+        tweets = [tweet for tweet in serializer.data if get_display_id(tweet) is not None]
+        return Response({'tweets': tweets}) # 一般来说 json 格式的 response 默认都要用 dict 的格式而不能用 list 的格式（约定俗成）在外面套一个dict 「'tweets': }
+
+    @action(methods=['GET'], detail=False)
+    @required_params(params=['q'])
+    def search(self, request):
+        """
+        GET /api/tweets/search/?q=<搜索词>&cursor=<上一页的 next_cursor>
+        所有的词都要出现，按相关度排序，每页 TWEET_SEARCH_PAGE_SIZE 条
+        """
+        try:
+            tweet_ids, next_cursor = TweetSearchService.search(
+                request.query_params['q'],
+                cursor=request.query_params.get('cursor'),
+            )
+        except InvalidCursor:
+            return Response({
+                'message': 'invalid cursor',
+                'success': False,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # 已经软删除但是还没从索引里删掉的 tweet 取不出来
+        return Response({
+            'tweets': serialize_tweet_ids(tweet_ids),
+            'next_cursor': next_cursor,
+        })
+
+    @action(methods=['POST'], detail=True)
+    def retweet(self, request, pk):
+        """
+        POST /api/tweets/1/retweet/ 转发，重复转发返回已有的那条 (200)
+        取消转发就是删掉转发的那条 tweet: DELETE /api/tweets/<转发的 id>/
+        引用 (quote) 是发一条新的 tweet: POST /api/tweets/ 带上 original_id
+        """
+        retweet, created = TweetService.retweet(request.user, self.get_object())
+        if retweet is None:
+            return Response({
+                'message': 'tweet does not exist',
+                'success': False,
+            }, status=status.HTTP_404_NOT_FOUND)
+        return Response(
+            TweetSerializer(retweet).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
 
     def retrieve(self, request, *args, **kwargs):
         tweet = self.get_object()
+        # 一次性把 tweet 的 user, comments 和 comments 的 user 都取出来，避免 N + 1 queries
+        prefetch_related_objects([tweet], 'user', 'comment_set__user')
+        if tweet.original_id is not None:
+            # 原 tweet 软删除之后是 null
+            prefetch_related_objects(
+                [tweet],
+                Prefetch('original', queryset=TweetService.get_visible_tweets()),
+                'original__user',
+            )
         return Response(TweetSerializerWithComments(tweet).data)
 
+    @idempotent
     def create(self, request):
         """
         重写create method， 因为需要默认当前登录客户作为tweet.user
@@ -62,13 +131,21 @@ class TweetViewSet(viewsets.GenericViewSet):
                 "errors": serializer.errors,
             }, status=400)
         # save() will call create() method in TweetSerializerForCreate in serializers.py
-        tweet = serializer.save()
-        # 创建newsfeed
-        NewsFeedService.fanout_to_followers(tweet)
+        # tweet 和 tweet.created 事件在同一个 transaction 里写进去，
+        # 创建 newsfeed (fanout) 由事件的 handler 去做，不会出现 tweet 有了 newsfeed 丢了的情况
+        with OutboxService.atomic():
+            tweet = serializer.save()
 
         # When to display data, use the serializer for display, not use serializer for create
         # 下面是去展示tweet，所以要用 TweetSerializer, 而不是 TweetSerializerForCreate
         return Response(TweetSerializer(tweet).data, status=201)
 
-
-
+    def destroy(self, request, *args, **kwargs):
+        """
+        DELETE /api/tweets/1/
+        只设置 tombstone (deleted_at) 然后马上返回，newsfeed / comment / like 在后台分批删掉，
+        粉丝很多的 tweet 删除也不会卡住请求或者锁表（见 TweetService）
+        """
+        tweet = self.get_object()
+        TweetService.soft_delete(tweet)
+        return Response({'success': True}, status=200)
@@ -0,0 +1,100 @@
+from comments.models import Comment
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from likes.models import Like
+from newsfeeds.models import NewsFeed
+from newsfeeds.sharding import get_shards
+from tweets.models import Tweet
+from utils.maintenance import Throttle, iter_pk_batches
+
+
+def existing_ids(model, ids):
+    ids = {pk for pk in ids if pk is not None}
+    if not ids:
+        return set()
+    return set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+
+
+class Command(BaseCommand):
+    """
+    python manage.py cleanup_orphans --batch-size 500 --sleep 0.1
+
+    删掉 tweet / user 被删掉之后留下来的数据:
+    - NewsFeed: tweet_id 是 NULL，或者 tweet / user 已经不存在了（分片之后没有外键约束）
+    - Comment: tweet 或者 user 被删掉了 (SET_NULL)
+    - Like: user 被删掉了，或者点赞的 tweet / comment 已经不存在了 (GenericForeignKey 不会级联删除)
+
+    每张表都按主键分批扫描，每一批只删这一批里的孤儿数据，可以在线上跑，随时可以停下来重新跑
+    """
+    help = 'Delete NewsFeed, Comment and Like rows left behind by deleted tweets and users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to sleep between batches to limit load.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the orphans, do not delete them.')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.throttle = Throttle(options['sleep'])
+        self.dry_run = options['dry_run']
+        verb = 'found' if self.dry_run else 'deleted'
+
+        for alias in get_shards():
+            count = self.cleanup(
+                NewsFeed.objects.using(alias),
+                ('pk', 'user_id', 'tweet_id'),
+                self.find_orphan_newsfeeds,
+            )
+            self.stdout.write(f'newsfeeds ({alias}): {verb} {count} orphans')
+        count = self.cleanup(Comment.objects.all(), ('pk', 'user_id', 'tweet_id'), self.find_orphan_comments)
+        self.stdout.write(f'comments: {verb} {count} orphans')
+        count = self.cleanup(
+            Like.objects.all(),
+            ('pk', 'user_id', 'content_type_id', 'object_id'),
+            self.find_orphan_likes,
+        )
+        self.stdout.write(f'likes: {verb} {count} orphans')
+
+    def cleanup(self, queryset, fields, find_orphans):
+        total = 0
+        for rows in iter_pk_batches(queryset, self.batch_size, fields):
+            orphan_ids = find_orphans(rows)
+            if orphan_ids:
+                total += len(orphan_ids)
+                if not self.dry_run:
+                    # Comment / Like 用 delete() 而不是 raw SQL, 这样 outbox 的计数也会更新
+                    queryset.filter(pk__in=orphan_ids).delete()
+            self.throttle()
+        return total
+
+    def find_orphan_newsfeeds(self, rows):
+        tweet_ids = existing_ids(Tweet, [tweet_id for _, _, tweet_id in rows])
+        user_ids = existing_ids(User, [user_id for _, user_id, _ in rows])
+        return [
+            pk for pk, user_id, tweet_id in rows
+            if tweet_id not in tweet_ids or user_id not in user_ids
+        ]
+
+    def find_orphan_comments(self, rows):
+        return [
+            pk for pk, user_id, tweet_id in rows
+            if user_id is None or tweet_id is None
+        ]
+
+    def find_orphan_likes(self, rows):
+        object_ids = {}
+        for _, _, content_type_id, object_id in rows:
+            if content_type_id is not None:
+                object_ids.setdefault(content_type_id, []).append(object_id)
+        existing = set()
+        for content_type_id, ids in object_ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is not None:
+                existing.update((content_type_id, pk) for pk in existing_ids(model, ids))
+        return [
+            pk for pk, user_id, content_type_id, object_id in rows
+            if user_id is None or (content_type_id, object_id) not in existing
+        ]
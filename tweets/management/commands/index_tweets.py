@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from tweets.services import TweetSearchService, TweetService
+from utils.maintenance import Throttle, iter_pk_batches
+
+
+class Command(BaseCommand):
+    """
+    python manage.py index_tweets --batch-size 1000 --sleep 0.1
+
+    把数据库里所有没有删除的 tweet 写进搜索的索引（见 TweetSearchService）
+    第一次部署搜索，或者索引文件丢了的时候跑一次，之后由 outbox 的 handler 增量更新
+    已经在索引里的 tweet 会被替换掉，可以随时停下来重新跑
+    """
+    help = 'Build the full-text search index from the existing tweets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to sleep between batches to limit load.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Empty the index before rebuilding it.')
+
+    def handle(self, *args, **options):
+        index = TweetSearchService.get_index()
+        if options['clear']:
+            index.clear()
+        throttle = Throttle(options['sleep'])
+        total = 0
+        for rows in iter_pk_batches(
+            TweetService.get_visible_tweets(),
+            options['batch_size'],
+            ('pk', 'content'),
+        ):
+            index.add(rows)
+            total += len(rows)
+            throttle()
+        self.stdout.write(f'indexed {total} tweets')
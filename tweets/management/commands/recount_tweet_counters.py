@@ -0,0 +1,64 @@
+from comments.models import Comment
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from likes.models import Like
+from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.maintenance import Throttle, iter_pk_batches
+
+
+def count_by(queryset, field, ids):
+    counts = queryset.filter(**{f'{field}__in': ids}).order_by().values(field).annotate(count=Count('id'))
+    return dict(counts.values_list(field, 'count'))
+
+
+class Command(BaseCommand):
+    """
+    python manage.py recount_tweet_counters --batch-size 500 --sleep 0.1
+
+    修正 tweet 上和实际的 comment / like 数不一样的 comments_count / likes_count
+    LikeService 用 F('likes_count') + 1 改计数，不经过它并且不发 post_save / post_delete 的写
+    (raw SQL, bulk_create, queryset.update, 手动改数据库) 会让计数越来越不准，crontab 里定期跑一下
+
+    按主键分批扫描 tweet, 每一批两条 GROUP BY 数出实际的数，只 UPDATE 不一样的 tweet,
+    可以在线上跑，随时可以停下来重新跑
+    """
+    help = 'Recount comments_count and likes_count of tweets whose counters drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to sleep between batches to limit load.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the drifted tweets, do not fix them.')
+
+    def handle(self, *args, **options):
+        throttle = Throttle(options['sleep'])
+        total = 0
+        for rows in iter_pk_batches(
+            Tweet.objects.all(),
+            options['batch_size'],
+            ('pk', 'comments_count', 'likes_count'),
+        ):
+            tweet_ids = self.find_drifted(rows)
+            if tweet_ids:
+                total += len(tweet_ids)
+                if not options['dry_run']:
+                    TweetService.recount_counters(tweet_ids)
+            throttle()
+        verb = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(f'tweets: {verb} {total} drifted counters')
+
+    def find_drifted(self, rows):
+        ids = [pk for pk, _, _ in rows]
+        comments = count_by(Comment.objects.all(), 'tweet_id', ids)
+        likes = count_by(
+            Like.objects.filter(content_type=ContentType.objects.get_for_model(Tweet)),
+            'object_id',
+            ids,
+        )
+        return [
+            pk for pk, comments_count, likes_count in rows
+            if comments_count != comments.get(pk, 0) or likes_count != likes.get(pk, 0)
+        ]
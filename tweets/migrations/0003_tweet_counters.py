@@ -0,0 +1,57 @@
+# Generated by Django 3.1.3 on 2026-10-19 13:57
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.order_by().values(field).annotate(count=Count('id')).values('count'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def backfill_counters(apps, schema_editor):
+    # 已有的 tweet 一条 UPDATE 把计数补上，之后由 outbox 的 handler 维护
+    Tweet = apps.get_model('tweets', 'Tweet')
+    Comment = apps.get_model('comments', 'Comment')
+    Like = apps.get_model('likes', 'Like')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type = ContentType.objects.filter(app_label='tweets', model='tweet').first()
+    updates = {
+        'comments_count': _count(Comment.objects.filter(tweet_id=OuterRef('id')), 'tweet_id'),
+    }
+    if content_type is not None:
+        updates['likes_count'] = _count(
+            Like.objects.filter(content_type_id=content_type.id, object_id=OuterRef('id')),
+            'object_id',
+        )
+    Tweet.objects.update(**updates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0002_auto_20210817_0342'),
+        ('comments', '0001_initial'),
+        ('likes', '0001_initial'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='comments_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
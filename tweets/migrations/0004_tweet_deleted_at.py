@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-19 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0003_tweet_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.3 on 2026-10-19 14:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tweets', '0005_tweet_snowflake_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='original',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tweets.tweet'),
+        ),
+        migrations.AlterIndexTogether(
+            name='tweet',
+            index_together={('user', 'id'), ('original', 'user')},
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.3 on 2026-10-19 15:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+# 每一批只读 / 改这么多行
+BATCH_SIZE = 1000
+
+
+def backfill_retweet_key(apps, schema_editor):
+    # 以前并发的请求可能写出了重复的转发，每个 (user, original) 只给最新的那条设置 retweet_key,
+    # 和以前转发接口返回的是同一条，其他的留着 NULL
+    Tweet = apps.get_model('tweets', 'Tweet')
+    tweets = Tweet.objects.using(schema_editor.connection.alias)
+    retweets = tweets.filter(content='', deleted_at__isnull=True, original__isnull=False)
+    latest = {}
+    for tweet_id, user_id, original_id in retweets.order_by('id').values_list('id', 'user_id', 'original_id').iterator():
+        latest[(user_id, original_id)] = tweet_id
+    tweet_ids = sorted(latest.values())
+    for start in range(0, len(tweet_ids), BATCH_SIZE):
+        tweets.filter(id__in=tweet_ids[start:start + BATCH_SIZE]).update(retweet_key=models.F('original_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tweets', '0006_tweet_original'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='retweet_key',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_retweet_key, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='tweet',
+            unique_together={('user', 'retweet_key')},
+        ),
+    ]
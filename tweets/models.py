@@ -3,9 +3,16 @@ from django.contrib.auth.models import User
 from utils.time_helper import utc_now
 from likes.models import Like
 from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_delete, post_save
+from outbox.listeners import publish_created
+from utils.listeners import invalidate_json_fragment
+from utils.snowflake import next_id
 
 
 class Tweet(models.Model):
+    # 按时间递增的 64 位 id（见 utils.snowflake），new 出来的时候就有了，不需要等数据库分配
+    # 按 id 排序就是按发帖的时间排序
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
     user = models.ForeignKey(
         User,
         on_delete=models.SET_NULL,
@@ -16,15 +23,41 @@ class Tweet(models.Model):
     content = models.CharField(max_length=255)
     # content = models.CharField(max_length=255， db_index=True) 单个索引设定
     created_at = models.DateTimeField(auto_now_add=True) #创建是更新值
+    # 冗余的计数，由 outbox 的 handler 更新（见 outbox.handlers），读的时候不用再去 count
+    likes_count = models.IntegerField(default=0)
+    comments_count = models.IntegerField(default=0)
+    # 软删除的 tombstone: 删除的时候只设置这个时间，所有读的地方都过滤掉 deleted_at 不是 NULL 的 tweet,
+    # newsfeed / comment / like 由 outbox 的 handler 在后台分批删掉（见 TweetService.retract）
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # 转发 / 引用的原 tweet, 只存一个引用，不复制原 tweet 的内容
+    # 转发 (retweet): content 是空的；引用 (quote): 有自己的 content
+    # 转发的转发 / 引用一个转发都指向最开始的原 tweet（见 TweetService.get_reshare_target）
+    # 单独的 original 索引不需要，(original, user) 的联合索引可以代替
+    original = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', db_index=False,
+    )
+    # 没删掉的转发是原 tweet 的 id, 其他的（引用 / 普通的 tweet / 删掉的转发）是 NULL
+    # (user, retweet_key) 唯一：同一个人同一个 tweet 只能有一条没删掉的转发，两个同时的请求只有一个插入成功
+    # MySQL 没有带条件的唯一索引，所以单独存一列，NULL 不参与唯一性检查
+    retweet_key = models.BigIntegerField(null=True, blank=True, editable=False)
     # update_at = models.DateTimeField(auto_noe=True) # 更改时更新值
 
     class Meta:
-        index_together = (('user', 'created_at'),) #联合索引是需要在class Meta中指定
-        # ordering 为查询操作指定默认排序规则， 先按照user升序排序，再按created_at降序排序
+        # 联合索引是需要在class Meta中指定
+        # id 是按时间递增的，(user, id) 的索引可以代替以前的 (user, created_at)
+        # (original, user): 某个人有没有转发过某个 tweet
+        index_together = (('user', 'id'), ('original', 'user'))
+        unique_together = (('user', 'retweet_key'),)
+        # ordering 为查询操作指定默认排序规则， 先按照user升序排序，再按id（也就是发帖时间）降序排序
         # ordering设定了queryset的排序
         # ordering 对数据库不会产生影响，只会对queryset产生影响
-        # -created是倒序排列
-        ordering = ('user', '-created_at')
+        # -id是倒序排列
+        ordering = ('user', '-id')
+
+    @property
+    def is_retweet(self):
+        # 原 tweet 被物理删除之后 original 是 NULL, 没有 content 的还是一个转发
+        return not self.content
 
     @property
     def hours_to_now(self):
@@ -56,4 +89,9 @@ class Tweet(models.Model):
 
 # Each field is specified as a class attribute,
 # and each attribute maps to a database column.
-# id field is added automatically.
+# id field is added automatically, unless the model declares its own primary key (like Tweet.id above).
+
+
+post_save.connect(invalidate_json_fragment, sender=Tweet)
+post_delete.connect(invalidate_json_fragment, sender=Tweet)
+post_save.connect(publish_created, sender=Tweet)
@@ -0,0 +1,201 @@
+from comments.models import Comment
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from hashtags.services import HashtagService
+from likes.models import Like
+from newsfeeds.services import NewsFeedService
+from outbox.services import OutboxService
+from tweets.models import Tweet
+from utils.fast_serializers import invalidate_fragment
+from utils.search_index import get_index, tokenize
+from utils.time_helper import utc_now
+
+
+def _count(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.order_by().values(field).annotate(count=Count('id')).values('count'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+class TweetService(object):
+    """
+    删除 tweet 分两步:
+    1. soft_delete: 在请求里只 UPDATE 一行，设置 tweet.deleted_at (tombstone)，
+       读的地方都通过 get_visible_tweets() 过滤，马上就看不到了
+    2. retract: tweet.deleted 事件的 handler 在后台分批删掉 newsfeed / like / comment,
+       粉丝再多也不会让删除的请求变慢，也不会有一条大的 DELETE 长时间锁表
+    tweet 这一行本身留着，重复的删除请求和重复执行的事件都是幂等的
+    """
+
+    @classmethod
+    def get_visible_tweets(cls):
+        # deleted_at IS NULL 只是在已经按索引取出来的行上多一个条件，不需要额外的查询
+        return Tweet.objects.filter(deleted_at__isnull=True)
+
+    @classmethod
+    def get_reshare_target(cls, tweet):
+        """
+        转发 / 引用 tweet 的时候实际引用的 tweet: 转发的转发 / 引用一个转发都指向原 tweet,
+        不管转发了多少层，引用都只有一层。原 tweet 已经删掉的时候返回 None
+        """
+        if not tweet.is_retweet:
+            return tweet
+        if tweet.original_id is None:
+            return None
+        return cls.get_visible_tweets().filter(id=tweet.original_id).first()
+
+    @classmethod
+    def retweet(cls, user, tweet):
+        """
+        返回 (转发的 tweet, 是不是新建的)，原 tweet 已经删掉的时候返回 (None, False)
+        转发只是一条没有 content 的 tweet, 和普通的 tweet 一样 fanout (newsfeed 里只是一个引用)
+        同一个人转发同一个 tweet 只算一次，重复的请求返回已有的那条
+        """
+        original = cls.get_reshare_target(tweet)
+        if original is None:
+            return None, False
+        with OutboxService.atomic():
+            # 走 (user, retweet_key) 的唯一索引：两个请求同时转发的时候，
+            # 后插入的那个违反唯一性，get_or_create 会再 get 一次，返回先插入的那条
+            return Tweet.objects.get_or_create(
+                user=user,
+                retweet_key=original.id,
+                defaults={'content': '', 'original': original},
+            )
+
+    @classmethod
+    def soft_delete(cls, tweet):
+        # 不用 OutboxService.atomic()：tweet.deleted 事件不在当前请求里执行，
+        # 由 python manage.py dispatch_outbox 在后台执行
+        with transaction.atomic():
+            # 删掉的转发不再占着 retweet_key, 之后还可以再转发一次
+            deleted = Tweet.objects.filter(
+                id=tweet.id,
+                deleted_at__isnull=True,
+            ).update(deleted_at=utc_now(), retweet_key=None)
+            if deleted:
+                OutboxService.publish('tweet.deleted', {'id': tweet.id, 'user_id': tweet.user_id})
+        # update() 不会触发 post_save, 缓存好的 tweet JSON 要自己删掉，
+        # 之后 newsfeed 里的这个 tweet 是 null, 整条 newsfeed 不展示
+        invalidate_fragment(Tweet, tweet.id)
+        return bool(deleted)
+
+    @classmethod
+    def retract(cls, tweet_id, batch_size=None, max_batches=None):
+        """
+        删掉一个已经 soft delete 的 tweet 的 newsfeed, tweet 的 like, comment 和 comment 的 like,
+        hashtag 和 mention
+        每一批最多 batch_size 条，最多删 max_batches 批，返回 True 表示已经全部删完了
+        """
+        batch_size = batch_size or getattr(settings, 'TWEET_RETRACT_BATCH_SIZE', 500)
+        max_batches = max_batches or getattr(settings, 'TWEET_RETRACT_BATCHES_PER_EVENT', 20)
+        # soft_delete 和读请求同时发生的时候，读请求可能把删除之前的 JSON 又写回了缓存
+        invalidate_fragment(Tweet, tweet_id)
+        NewsFeedService.cancel_fanout(tweet_id)
+        steps = (
+            lambda: NewsFeedService.delete_tweet_newsfeeds(tweet_id, batch_size),
+            lambda: cls._delete_likes(Tweet, [tweet_id], batch_size),
+            lambda: cls._delete_comments(tweet_id, batch_size),
+            lambda: HashtagService.delete_tweet_tags(tweet_id, batch_size),
+        )
+        batches = 0
+        for step in steps:
+            while True:
+                if batches >= max_batches:
+                    return False
+                deleted = step()
+                # 已经删完的步骤（重复执行的事件）不占这个事件的批数，否则接着删的事件永远走不到后面的步骤
+                if deleted:
+                    batches += 1
+                if deleted < batch_size:
+                    break
+        return True
+
+    @classmethod
+    def recount_counters(cls, tweet_ids):
+        """
+        重新数一遍这些 tweet 的 comments_count / likes_count, 多次执行结果一样
+        所有的 tweet 一条 UPDATE ... SET comments_count = (SELECT COUNT(*) ...) 搞定
+        """
+        if not tweet_ids:
+            return
+        Tweet.objects.filter(id__in=tweet_ids).update(
+            comments_count=_count(Comment.objects.filter(tweet_id=OuterRef('id')), 'tweet_id'),
+            likes_count=_count(
+                Like.objects.filter(content_type=ContentType.objects.get_for_model(Tweet), object_id=OuterRef('id')),
+                'object_id',
+            ),
+        )
+        # update() 不会触发 post_save, 缓存好的 tweet JSON 要自己删掉
+        for tweet_id in tweet_ids:
+            invalidate_fragment(Tweet, tweet_id)
+
+    @classmethod
+    def _delete_likes(cls, model, object_ids, limit):
+        likes = Like.objects.using(DEFAULT_DB_ALIAS).filter(
+            content_type=ContentType.objects.get_for_model(model),
+            object_id__in=object_ids,
+        )
+        ids = list(likes.values_list('id', flat=True)[:limit])
+        if ids:
+            # 不走 delete() 的 post_delete: 每一条都会写一个 like.deleted 事件，
+            # 去更新一个已经删掉的 tweet 的计数，没有意义
+            likes.filter(id__in=ids)._raw_delete(DEFAULT_DB_ALIAS)
+        return len(ids)
+
+    @classmethod
+    def _delete_comments(cls, tweet_id, limit):
+        # 读主库，从库上可能还有已经删掉的数据，会以为还没删完
+        comments = Comment.objects.using(DEFAULT_DB_ALIAS)
+        ids = list(comments.filter(tweet_id=tweet_id).values_list('id', flat=True)[:limit])
+        if ids:
+            # 先删 comment 的 like, GenericForeignKey 不会级联删除
+            while cls._delete_likes(Comment, ids, limit) == limit:
+                pass
+            comments.filter(id__in=ids)._raw_delete(DEFAULT_DB_ALIAS)
+        return len(ids)
+
+
+class TweetSearchService(object):
+    """
+    tweet 的全文搜索，倒排索引是本机的一个 SQLite FTS5 文件（见 utils.search_index）
+    索引由 outbox 的 handler 增量更新：tweet.created 的时候加进去，tweet.deleted 的时候删掉
+    已有的 tweet 用 python manage.py index_tweets 建索引
+
+    索引只存 tweet id 和 content, 搜索的结果再按 id 去数据库 / fragment 缓存里取，
+    已经软删除但是还没从索引里删掉的 tweet 取不出来，不会展示
+    """
+
+    @classmethod
+    def get_index(cls):
+        return get_index(getattr(settings, 'TWEET_SEARCH_INDEX_PATH', ':memory:'))
+
+    @classmethod
+    def index_tweets(cls, tweets):
+        # 转发没有 content, 不需要进索引
+        cls.get_index().add((tweet.id, tweet.content) for tweet in tweets if tweet.content)
+
+    @classmethod
+    def unindex_tweet(cls, tweet_id):
+        cls.get_index().remove([tweet_id])
+
+    @classmethod
+    def search(cls, query, cursor=None, limit=None):
+        """
+        返回 ([tweet_id], next_cursor)，按相关度排序
+        cursor 不对的时候 raise utils.search_index.InvalidCursor
+        """
+        terms = tokenize(query, max_terms=getattr(settings, 'TWEET_SEARCH_MAX_TERMS', 8))
+        return cls.get_index().search(
+            terms,
+            limit or getattr(settings, 'TWEET_SEARCH_PAGE_SIZE', 20),
+            cursor=cursor,
+            window=getattr(settings, 'TWEET_SEARCH_RANK_WINDOW', 1000),
+        )
@@ -1,3 +1,9 @@
+from comments.models import Comment
+from django.core.management import call_command
+from io import StringIO
+from likes.models import Like
+from newsfeeds.models import NewsFeed
+from tweets.models import Tweet
 from testing.testcases import TestCase
 from datetime import timedelta
 from utils.time_helper import utc_now
@@ -23,4 +29,87 @@ class TweetTests(TestCase):
 
         user2 = self.create_user('user2')
         self.create_like(user2, self.tweet1)
-        self.assertEqual(self.tweet1.like_set.count(), 2)
\ No newline at end of file
+        self.assertEqual(self.tweet1.like_set.count(), 2)
+
+
+class CleanupOrphansTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.tweet = self.create_tweet(self.linghu)
+
+    def cleanup(self, *args):
+        out = StringIO()
+        call_command('cleanup_orphans', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_cleanup(self):
+        deleted_tweet = self.create_tweet(self.dongxie)
+        comment = self.create_comment(self.dongxie, self.tweet)
+        self.create_comment(self.dongxie, deleted_tweet)
+        like = self.create_like(self.dongxie, self.tweet)
+        self.create_like(self.linghu, deleted_tweet)
+        NewsFeed.objects.create(user=self.dongxie, tweet=self.tweet)
+        NewsFeed.objects.create(user=self.linghu, tweet=deleted_tweet)
+        NewsFeed.objects.create(user=self.dongxie, tweet=deleted_tweet)
+        # tweet 删掉之后 comment.tweet 和 newsfeed.tweet 变成 NULL, like 还指向这个 tweet
+        deleted_tweet.delete()
+
+        out = self.cleanup('--dry-run')
+        self.assertIn('newsfeeds (default): found 2 orphans', out)
+        self.assertIn('comments: found 1 orphans', out)
+        self.assertIn('likes: found 1 orphans', out)
+        self.assertEqual(Comment.objects.count(), 2)
+
+        out = self.cleanup()
+        self.assertIn('newsfeeds (default): deleted 2 orphans', out)
+        self.assertEqual(list(NewsFeed.objects.values_list('tweet_id', flat=True)), [self.tweet.id])
+        self.assertEqual(list(Comment.objects.all()), [comment])
+        self.assertEqual(list(Like.objects.all()), [like])
+
+        # 可以重复执行
+        self.assertIn('comments: deleted 0 orphans', self.cleanup())
+
+    def test_deleted_user(self):
+        self.create_comment(self.dongxie, self.tweet)
+        self.create_like(self.dongxie, self.tweet)
+        self.dongxie.delete()
+        self.cleanup()
+        self.assertEqual(Comment.objects.count(), 0)
+        self.assertEqual(Like.objects.count(), 0)
+
+
+class RecountTweetCountersTests(TestCase):
+
+    def setUp(self):
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        self.tweet = self.create_tweet(self.linghu)
+
+    def recount(self, *args):
+        out = StringIO()
+        call_command('recount_tweet_counters', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_recount(self):
+        other = self.create_tweet(self.dongxie)
+        self.create_tweet(self.dongxie)
+        self.create_comment(self.dongxie, self.tweet)
+        self.create_like(self.dongxie, self.tweet)
+        self.create_like(self.linghu, other)
+        # 不发 post_save / post_delete 的写，没有事件去改计数
+        Tweet.objects.filter(id=self.tweet.id).update(likes_count=5, comments_count=0)
+        Like.objects.filter(object_id=other.id)._raw_delete('default')
+
+        self.assertIn('tweets: found 2 drifted counters', self.recount('--dry-run'))
+        self.assertEqual(Tweet.objects.get(id=self.tweet.id).likes_count, 5)
+
+        self.assertIn('tweets: fixed 2 drifted counters', self.recount())
+        self.tweet.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.tweet.comments_count, self.tweet.likes_count), (1, 1))
+        self.assertEqual((other.comments_count, other.likes_count), (0, 0))
+
+        # 可以重复执行
+        self.assertIn('tweets: fixed 0 drifted counters', self.recount())
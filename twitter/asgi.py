@@ -5,6 +5,16 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+
+/api/async/ 下面的接口是 async 的 view，用 ASGI server 部署才能在一个 worker 里同时处理多个 request:
+    uvicorn twitter.asgi:application --workers 4
+middleware 要都支持 async（见 utils.middlewares.AsyncCapableMiddleware），
+只支持同步的 middleware（e.g. debug_toolbar）会让每个 request 都切到线程里执行
+
+/api/stream/newsfeeds/ 是 Server-Sent Events 的长连接，不经过 Django 的 view, 由
+newsfeeds.api.streams 直接处理，只有 ASGI 部署的时候才有。
+不止一个进程（多个 worker, 或者由 dispatch_outbox 做 fanout）的时候 settings.PUBSUB_BROKER
+要换成跨进程的 broker（见 utils.pubsub）
 """
 
 import os
@@ -13,4 +23,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# 要在 Django setup 之后 import
+from newsfeeds.api.streams import stream_newsfeeds  # noqa: E402
+from utils.checks import ensure_deployable  # noqa: E402
+from utils.sse import ServerSentEventsRouter  # noqa: E402
+
+# 配置不适合部署（e.g. 进程内的 cache）的时候不启动，见 utils.checks
+ensure_deployable()
+
+application = ServerSentEventsRouter(django_application, {
+    '/api/stream/newsfeeds/': stream_newsfeeds,
+})
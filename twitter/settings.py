@@ -53,11 +53,20 @@ INSTALLED_APPS = [
     'django_filters',
 
     # Project apps
+    # 没有 model, 只注册部署时的配置检查（见 utils.checks）
+    'utils.apps.UtilsConfig',
+    'accounts',
     'tweets',
     'friendships',
     'newsfeeds',
     'comments',
     'likes',
+    'outbox',
+    'hashtags',
+    'notifications',
+
+    # 性能测试，python manage.py benchmark
+    'benchmarks',
 ]
 
 # 翻页机制
@@ -67,10 +76,18 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
             'django_filters.rest_framework.DjangoFilterBackend',
     ],
-
+    # 输出和 DRF 默认的 JSONRenderer 一样，但是用 orjson encode，并且直接拼接缓存好的 JSON bytes
+    'DEFAULT_RENDERER_CLASSES': [
+        'utils.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 MIDDLEWARE = [
+    # 放在最前面，这样统计的总耗时包括了所有其他 middleware
+    'utils.middlewares.MetricsMiddleware',
+    # 读写分离，写过数据的 client 一段时间内的读都走主库
+    'utils.middlewares.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +100,15 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'twitter.urls'
 
+# 性能监控，按 view action 统计 SQL 条数 / SQL 耗时 / serializer 耗时 / 总耗时
+# 数据从 /metrics/ 以 Prometheus 的格式暴露出来
+METRICS_ENABLED = True
+# 抓 /metrics/ 要带 Authorization: Bearer <METRICS_TOKEN>, 在 local_settings.py 里配
+# 没配的时候只有 DEBUG 能看，不按 IP 判断（反向代理后面所有请求都像是本机来的）
+METRICS_TOKEN = None
+# 是否在 response 里加上 Server-Timing header，浏览器的 devtools 可以直接看到
+METRICS_SERVER_TIMING = DEBUG
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -117,6 +143,162 @@ DATABASES = {
 }
 
 
+# 读写分离：写都走 default (主库)，读随机分到 DATABASE_REPLICAS 里的从库
+# 从库在 DATABASES 里定义，跑 test 的时候从库要设置 'TEST': {'MIRROR': 'default'}
+# e.g. 本地用 sqlite 测试：
+# DATABASES['replica1'] = {
+#     'ENGINE': 'django.db.backends.sqlite3',
+#     'NAME': DATABASES['default']['NAME'],
+#     'TEST': {'MIRROR': 'default'},
+# }
+# DATABASE_REPLICAS = ['replica1']
+DATABASE_ROUTERS = [
+    'newsfeeds.sharding.NewsFeedShardRouter',
+    'utils.db_routers.PrimaryReplicaRouter',
+]
+DATABASE_REPLICAS = []
+# 写过数据之后多少秒之内这个 client 的读都走主库，要比主从同步的延迟长
+DATABASE_REPLICA_PIN_SECONDS = 15
+DATABASE_REPLICA_PIN_COOKIE = 'db_pin'
+
+# NewsFeed 按 crc32(user_id) 分片存在这几个 database alias 上，新的 shard 要先
+# python manage.py migrate --database <alias>
+# 改 shard 的个数之前先用 python manage.py rebalance_newsfeeds 把数据搬过去
+NEWSFEED_SHARDS = ['default']
+# 粉丝多于 NEWSFEED_FANOUT_CHUNK_SIZE 的 fanout 按 follower id 的范围切块，
+# 用 NEWSFEED_FANOUT_WORKERS 个线程并发写（sqlite 不支持并发写，只会串行执行）
+# 没跑完的块用 python manage.py resume_fanouts 继续
+NEWSFEED_FANOUT_CHUNK_SIZE = 1000
+NEWSFEED_FANOUT_WORKERS = 4
+# /api/newsfeeds/updates/ 一次最多返回多少条新的 newsfeed
+NEWSFEED_UPDATES_LIMIT = 50
+# 排序的 newsfeed (/api/newsfeeds/?mode=ranked, 见 newsfeeds.ranking)：
+# 从最新的 NEWSFEED_RANKED_CANDIDATES 条里排序，排好的结果每个用户缓存 NEWSFEED_RANKED_TTL 秒
+# 装了 numpy 的时候所有候选的分数一次矩阵运算算完，没装的时候用 python 算，结果一样
+NEWSFEED_RANKED_CANDIDATES = 200
+NEWSFEED_RANKED_TTL = 60
+# recency 每过这么多秒减半
+NEWSFEED_RANKING_HALF_LIFE = 6 * 60 * 60
+NEWSFEED_RANKING_WEIGHTS = {
+    'recency': 3.0,
+    'likes': 0.5,
+    'comments': 0.8,
+    'affinity': 1.0,
+    'followers': 0.2,
+}
+# 作者亲密度只看当前用户最近的这么多个赞
+NEWSFEED_RANKING_AFFINITY_HISTORY = 500
+# 粉丝数（排序的特征）缓存多久
+FOLLOWER_COUNT_CACHE_TIMEOUT = 10 * 60
+# fanout 写完之后把新的 tweet 推给连着的客户端（SSE: /api/stream/newsfeeds/,
+# long-poll: /api/async/newsfeeds/poll/），见 newsfeeds.push
+NEWSFEED_PUSH_ENABLED = True
+# SSE 空闲多少秒发一次心跳；long-poll 最多等多少秒
+NEWSFEED_STREAM_HEARTBEAT = 15
+NEWSFEED_LONG_POLL_TIMEOUT = 25
+# 进程内的 pub/sub, 只有一个进程的时候能用（一个 ASGI worker, 并且 OUTBOX_INLINE_DISPATCH = True）
+# 否则 fanout 的进程发的消息连着客户端的 worker 收不到，要换成跨进程的实现（utils.pubsub.Broker 的子类）
+PUBSUB_BROKER = 'utils.pubsub.InProcessBroker'
+
+# tweet / comment / like / friendship 的改动在同一个 transaction 里写一条 OutboxEvent（见 outbox）
+# 不管这里怎么设置，都要部署 python manage.py dispatch_outbox --loop 常驻进程：
+# 不在 OutboxService.atomic() 里写的事件、请求里执行失败的事件、进程挂掉留下的事件都只有它会执行
+# False (默认): 只写事件，fanout / 计数 / 缓存失效都由 dispatch_outbox 在后台执行，请求的延迟不受影响
+# True: atomic() 提交之后在当前请求里马上执行，响应要等这些副作用做完（test 里用，结果是同步的）
+OUTBOX_INLINE_DISPATCH = False
+# dispatcher 领走一个事件之后多少秒之内别人不会再领，要比最慢的 handler 长
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_MAX_ATTEMPTS = 10
+# 删除 tweet 之后后台分批删掉它的 newsfeed / comment / like, 每一批一条 DELETE,
+# 一个事件最多删 TWEET_RETRACT_BATCHES_PER_EVENT 批，剩下的交给下一个事件，每个事件都在 lease 之内执行完
+TWEET_RETRACT_BATCH_SIZE = 500
+TWEET_RETRACT_BATCHES_PER_EVENT = 20
+
+# Tweet / Comment / NewsFeed 的 id 由 utils.snowflake 生成：按时间递增的 64 位整数，不需要数据库分配
+# 同时在跑的每个进程必须有不同的 worker id (0 - 1023)，按顺序找：
+# 1. 环境变量 SNOWFLAKE_WORKER_ID, 每个进程自己设（e.g. supervisor 的 %(process_num)d）
+# 2. 这里的 SNOWFLAKE_WORKER_ID, 所有读这份配置的进程都一样，只有一个进程的时候才能用
+# 3. 都没有的时候在 SNOWFLAKE_LEASE_CACHE 里占一个（见 utils.snowflake.WorkerIdLease），
+#    这个 cache 必须是所有机器共享并且不会提前淘汰 key 的（e.g. redis），
+#    locmem 的时候所有进程都是 0, DEBUG = False 的时候 ensure_deployable 不让启动（见 utils.checks）
+SNOWFLAKE_WORKER_ID = None
+SNOWFLAKE_LEASE_CACHE = 'default'
+# 占住的 worker id 多久不续就过期，进程挂掉之后过了这么久别的进程才能用
+SNOWFLAKE_LEASE_SECONDS = 60
+
+# tweet 的全文搜索 (/api/tweets/search/)：本机的 SQLite FTS5 文件，由 outbox 的 handler 增量更新
+# 写索引的进程（dispatch_outbox, OUTBOX_INLINE_DISPATCH 的时候还有 API 进程）和搜索的 API 要在同一台机器上，
+# 多台机器部署的时候把搜索的请求转到跑 dispatch_outbox 的那台机器上。已有的 tweet 用 python manage.py index_tweets 建索引
+TWEET_SEARCH_INDEX_PATH = BASE_DIR / 'search_index.sqlite3'
+TWEET_SEARCH_PAGE_SIZE = 20
+# 只在最新的这么多条匹配的 tweet 里按相关度排序，常见的词有几百万条匹配也只读这么多条
+TWEET_SEARCH_RANK_WINDOW = 1000
+# 搜索词最多用前面的这么多个
+TWEET_SEARCH_MAX_TERMS = 8
+
+# /api/hashtags/<name>/tweets/ 每页多少条
+HASHTAG_TWEETS_PAGE_SIZE = 20
+# 热门 hashtag (/api/hashtags/trending/): python manage.py update_trending 在一个进程里
+# 按 TRENDING_BUCKET_SECONDS 一段的滑动窗口计数（count-min sketch, 内存大小固定），
+# 每 TRENDING_REFRESH_SECONDS 秒把 top k 写到数据库里的一行 (hashtags.TrendingSnapshot)，
+# API 的每个进程把这一行在 TRENDING_CACHE 里缓存 TRENDING_REFRESH_SECONDS 秒，这个 cache 不需要是共享的
+TRENDING_WINDOW_SECONDS = 60 * 60
+TRENDING_BUCKET_SECONDS = 5 * 60
+TRENDING_REFRESH_SECONDS = 5
+TRENDING_TOP_K = 10
+# 候选的 hashtag 比 top k 多留一些，窗口滑动之后排名变化的时候不会漏掉
+TRENDING_CANDIDATES = 100
+# sketch 的误差大约是 窗口里 hashtag 的总数 * 2.7 / width
+TRENDING_SKETCH_WIDTH = 2048
+TRENDING_SKETCH_DEPTH = 4
+TRENDING_CACHE = 'default'
+
+# 赞 / 评论 / 关注的通知 (/api/notifications/): 事件先排队，python manage.py deliver_notifications
+# 每 NOTIFICATION_DELIVERY_SECONDS 秒一批合并写进去，同一个人同一个 target 的同一种事件
+# 在 NOTIFICATION_WINDOW_SECONDS 之内（而且还没读）只有一行
+NOTIFICATION_WINDOW_SECONDS = 60 * 60
+NOTIFICATION_DELIVERY_SECONDS = 5
+NOTIFICATION_DELIVERY_BATCH_SIZE = 1000
+# 每条通知记下最近的几个人
+NOTIFICATION_MAX_ACTORS = 3
+
+# /api/likes/?content_type=tweet&object_id=1 每页多少个赞
+LIKES_PAGE_SIZE = 20
+# True: 赞 / 取消赞先放进 buffer, 每个进程每 LIKE_BUFFER_FLUSH_SECONDS 秒一起写一次数据库
+# （bulk insert / 一条 DELETE / 每个 tweet 只重新数一遍），见 LikeService.flush_buffer
+# 默认的 buffer 在进程里，别的进程要等 flush 之后才能读到，tweet 的 likes_count 也是 flush 之后才变
+LIKE_BUFFER_ENABLED = False
+LIKE_BUFFER = 'likes.buffer.InProcessLikeBuffer'
+LIKE_BUFFER_FLUSH_SECONDS = 0.2
+LIKE_BUFFER_FLUSH_BATCH_SIZE = 1000
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# locmem 是每个进程自己的：同一台机器上的每个 gunicorn / uvicorn worker 都有一份，
+# 一个 worker 删掉的缓存别的 worker 还在用。只有一个进程的开发环境可以用 locmem,
+# 部署的时候（DEBUG = False）必须换成 memcached / redis, 否则 ensure_deployable 不让启动（见 utils.checks）
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# tweet / user 序列化之后的 JSON bytes 的缓存，见 utils.fast_serializers.FastSerializer
+# 写的时候只能删掉当前进程能看到的缓存，所以打开的时候 CACHES['default'] 必须是所有进程共享的
+JSON_FRAGMENT_CACHE_ENABLED = True
+JSON_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# 带 Idempotency-Key header 的写请求，response 在 cache 里存多久（见 utils.decorators.idempotent）
+# 要比客户端重试的时间窗口长。重试可能落到任何一个 worker 上，所以只要不止一个进程（包括同一台机器上的
+# 多个 gunicorn / uvicorn worker）cache 就必须是共享的，DEBUG = False 的时候 locmem 不让启动（见 utils.checks）
+IDEMPOTENCY_CACHE = 'default'
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# 第一个请求执行的时候占住 key 的最长时间
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -159,3 +341,10 @@ try:
     from .local_settings import *
 except:
     pass
+
+# test 用的从库：和 default 是同一个库 ('TEST': {'MIRROR': 'default'})，
+# 只有 DATABASE_REPLICAS 里写了它们才会被读到（见 utils.tests.PrimaryReplicaRouterTests）
+# 放在 local_settings 后面，跟着本地换掉的 default 走
+TEST_DATABASE_REPLICAS = ['test_replica1', 'test_replica2']
+for _alias in TEST_DATABASE_REPLICAS:
+    DATABASES.setdefault(_alias, {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}})
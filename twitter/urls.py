@@ -15,13 +15,20 @@ Including another URLconf
 """
 
 from accounts.api.views import UserViewSet, AccountViewSet
+from comments.api import async_views as comments_async_views
 from comments.api.views import CommentViewSet
 from django.contrib import admin
 from django.urls import include, path
 from friendships.api.views import FriendshipViewSet
+from hashtags.api.views import HashtagViewSet
+from likes.api.views import LikeViewSet
+from newsfeeds.api import async_views as newsfeeds_async_views
 from newsfeeds.api.views import NewsFeedViewSet
+from notifications.api.views import NotificationViewSet
 from rest_framework import routers
+from tweets.api import async_views as tweets_async_views
 from tweets.api.views import TweetViewSet
+from utils import views as utils_views
 
 import debug_toolbar
 
@@ -39,6 +46,9 @@ router.register(r'api/tweets', TweetViewSet, basename='tweets') # 对应TweetVie
 router.register(r'api/friendships', FriendshipViewSet, basename='friendships')
 router.register(r'api/newsfeeds', NewsFeedViewSet, basename='newsfeeds')
 router.register(r'api/comments', CommentViewSet, basename='comments')
+router.register(r'api/hashtags', HashtagViewSet, basename='hashtags')
+router.register(r'api/notifications', NotificationViewSet, basename='notifications')
+router.register(r'api/likes', LikeViewSet, basename='likes')
 
 # Django框架的URL是写在urlpatterns里面
 # Django是用for循环来匹配urls
@@ -48,6 +58,15 @@ urlpatterns = [
     # 这句话把上面router register的urls全部包括进来
     # The API URLs are now determined automatically by the router.
     path('', include(router.urls)),
+    # 热点读接口的 async 版本，输出和上面同步的接口一样，要用 ASGI 部署才能发挥作用
+    path('api/async/newsfeeds/', newsfeeds_async_views.list_newsfeeds),
+    # 连不上 SSE (/api/stream/newsfeeds/, 见 twitter.asgi) 的客户端用的 long-poll
+    path('api/async/newsfeeds/poll/', newsfeeds_async_views.poll_newsfeeds),
+    path('api/async/tweets/', tweets_async_views.list_tweets),
+    path('api/async/tweets/<int:tweet_id>/', tweets_async_views.retrieve_tweet),
+    path('api/async/comments/', comments_async_views.list_comments),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('__debug__', include(debug_toolbar.urls)),
+    # Prometheus 抓取监控数据的 endpoint
+    path('metrics/', utils_views.metrics),
 ]
\ No newline at end of file
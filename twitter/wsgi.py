@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter.settings')
 
 application = get_wsgi_application()
+
+# 配置不适合部署（e.g. 进程内的 cache）的时候不启动，见 utils.checks
+from utils.checks import ensure_deployable  # noqa: E402
+
+ensure_deployable()
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class UtilsConfig(AppConfig):
+    name = 'utils'
+
+    def ready(self):
+        # 注册部署时的配置检查（见 utils.checks）
+        from utils import checks  # noqa: F401
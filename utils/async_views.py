@@ -0,0 +1,115 @@
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from utils.json_fragments import dumps
+from utils.metrics import get_current_metrics
+
+
+def _call_in_thread(func, args, kwargs):
+    # 线程池里的线程不会收到 request_started / request_finished，数据库连接要自己处理
+    close_old_connections()
+    metrics = get_current_metrics()
+    try:
+        if metrics is None:
+            return func(*args, **kwargs)
+        # 每个线程有自己的数据库连接，统计 SQL 要在这个线程里装上 execute_wrapper
+        with metrics.install():
+            return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    在线程池里执行同步的代码（ORM / cache），不阻塞 event loop
+    thread_sensitive=False，几个 run_sync 可以真正地同时执行
+    """
+    return await sync_to_async(_call_in_thread, thread_sensitive=False)(func, args, kwargs)
+
+
+async def gather(*calls):
+    """
+    同时执行几个互相独立的查询，总耗时是最慢的那一个，而不是所有的加起来
+    tweet, comments = await gather((get_tweet, tweet_id), (get_comments, tweet_id))
+    """
+    return await asyncio.gather(*(run_sync(func, *args) for func, *args in calls))
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    # 和 DRF 的 Response + FastJSONRenderer 输出的 bytes 一样
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+def async_api_view(view_func):
+    """
+    async 的只读接口，和 DRF 的 viewset 一样，不支持的 method 返回 405
+    Django 的 require_GET 会把 async 的 view 包成同步的，所以这里自己实现
+    """
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return json_response(
+                {'detail': 'Method "{}" not allowed.'.format(request.method)},
+                status=status.HTTP_405_METHOD_NOT_ALLOWED,
+            )
+        return await view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+def _authenticate(request):
+    """
+    和 DRF 的 view 一样跑一遍 DEFAULT_AUTHENTICATION_CLASSES (session / basic / token ...)
+    返回 (user, None), 没有登录或者认证失败返回 (None, 和 DRF 一样的 response)
+    """
+    authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    drf_request = Request(request, authenticators=authenticators)
+    try:
+        user = drf_request.user
+        if not user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+    except (exceptions.NotAuthenticated, exceptions.AuthenticationFailed) as exc:
+        # DRF 的 APIView.handle_exception: 第一个 authenticator 有 WWW-Authenticate 的时候返回 401
+        header = authenticators[0].authenticate_header(drf_request) if authenticators else None
+        response = json_response(
+            {'detail': exc.detail},
+            status=status.HTTP_401_UNAUTHORIZED if header else status.HTTP_403_FORBIDDEN,
+        )
+        if header:
+            response['WWW-Authenticate'] = header
+        return None, response
+    return user, None
+
+
+def async_login_required(view_func):
+    # 和 DRF 的 IsAuthenticated 一样，没有登录返回 403
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        # session 认证第一次访问 request.user 会查数据库，放到线程池里
+        user, response = await run_sync(_authenticate, request)
+        if response is not None:
+            return response
+        request.user = user
+        return await view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+def async_required_params(params):
+    # utils.decorators.required_params 的 async 版本，只检查 GET 的参数
+    def decorator(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            missing_params = [param for param in params if param not in request.GET]
+            if missing_params:
+                return json_response({
+                    'message': 'missing {} in request'.format(','.join(missing_params)),
+                    'success': False,
+                }, status=status.HTTP_400_BAD_REQUEST)
+            return await view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
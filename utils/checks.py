@@ -0,0 +1,98 @@
+import logging
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+# 只在部署的时候检查（python manage.py check --deploy, 或者 ensure_deployable）
+# 跑 test 的时候 DEBUG 是 False, 但是用的是 locmem, 不能让这些检查拦住 test
+DEPLOY_TAG = 'twitter'
+
+# 只在当前进程里的 cache: 同一台机器上的别的 worker 看不到，也删不掉里面的数据
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_process_local_cache(alias):
+    return settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_CACHES
+
+
+@checks.register(DEPLOY_TAG, deploy=True)
+def check_fragment_cache(app_configs, **kwargs):
+    # 写的那个 worker 只能删掉自己进程里的 fragment, 别的 worker 会一直返回旧的 tweet JSON
+    if getattr(settings, 'JSON_FRAGMENT_CACHE_ENABLED', False) and is_process_local_cache('default'):
+        return [checks.Error(
+            'JSON_FRAGMENT_CACHE_ENABLED needs a cache shared by all processes, '
+            'the default cache is process-local.',
+            hint='Configure memcached / redis as CACHES["default"] or turn the fragment cache off.',
+            id='twitter.E001',
+        )]
+    return []
+
+
+@checks.register(DEPLOY_TAG, deploy=True)
+def check_idempotency_cache(app_configs, **kwargs):
+    # 客户端重试的请求落到别的 worker 上看不到第一次的 response, 写操作会再执行一遍
+    alias = getattr(settings, 'IDEMPOTENCY_CACHE', 'default')
+    if is_process_local_cache(alias):
+        return [checks.Error(
+            f'IDEMPOTENCY_CACHE ({alias!r}) is process-local, retries that reach another '
+            f'worker would run the write again.',
+            hint='Point IDEMPOTENCY_CACHE at a memcached / redis cache shared by all processes.',
+            id='twitter.E002',
+        )]
+    return []
+
+
+@checks.register(DEPLOY_TAG, deploy=True)
+def check_pubsub_broker(app_configs, **kwargs):
+    # 只有一个进程的部署也可以用，所以只是 warning
+    broker = getattr(settings, 'PUBSUB_BROKER', 'utils.pubsub.InProcessBroker')
+    if getattr(settings, 'NEWSFEED_PUSH_ENABLED', True) and broker == 'utils.pubsub.InProcessBroker':
+        return [checks.Warning(
+            'PUBSUB_BROKER is the in-process broker, newsfeed pushes only reach clients '
+            'connected to the process that ran the fanout.',
+            hint='Use a cross-process Broker subclass unless this is a single ASGI worker '
+                 'with OUTBOX_INLINE_DISPATCH = True.',
+            id='twitter.W001',
+        )]
+    return []
+
+
+@checks.register(DEPLOY_TAG, deploy=True)
+def check_snowflake_worker_id(app_configs, **kwargs):
+    # 所有进程都用 worker id 0 的话同一毫秒生成的 id 会重复
+    from utils.snowflake import get_configured_worker_id, get_lease_cache_alias
+    try:
+        worker_id = get_configured_worker_id()
+    except ImproperlyConfigured as e:
+        return [checks.Error(str(e), id='twitter.E003')]
+    if worker_id is None and is_process_local_cache(get_lease_cache_alias()):
+        return [checks.Error(
+            'No snowflake worker id is configured and SNOWFLAKE_LEASE_CACHE is process-local, '
+            'every process would generate ids with worker id 0.',
+            hint='Set the SNOWFLAKE_WORKER_ID environment variable per process, '
+                 'or point SNOWFLAKE_LEASE_CACHE at a shared redis cache.',
+            id='twitter.E003',
+        )]
+    return []
+
+
+def ensure_deployable():
+    """
+    wsgi / asgi 和常驻的 management command 启动的时候调用
+    DEBUG 关掉的时候有 Error 就不启动，Warning 打到日志里
+    """
+    if settings.DEBUG:
+        return
+    messages = checks.run_checks(tags=[DEPLOY_TAG], include_deployment_checks=True)
+    errors = [message for message in messages if message.is_serious()]
+    for message in messages:
+        if not message.is_serious():
+            logger.warning('%s', message)
+    if errors:
+        raise ImproperlyConfigured('\n'.join(str(error) for error in errors))
@@ -0,0 +1,71 @@
+import random
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+# 当前线程（也就是当前 request）的读是否必须走主库
+# 用 asgiref 的 Local, async 的 view 里每个 request 是分开的，并且会传到 sync_to_async 的线程里
+_local = Local()
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_this_thread():
+    _local.pinned = True
+
+
+def unpin_this_thread():
+    _local.pinned = False
+    _local.wrote = False
+
+
+def this_thread_is_pinned():
+    return getattr(_local, 'pinned', False)
+
+
+def this_thread_has_written():
+    return getattr(_local, 'wrote', False)
+
+
+class PrimaryReplicaRouter(object):
+    """
+    写全部走主库 (default)，读随机分到 settings.DATABASE_REPLICAS 里的从库
+
+    主从同步有延迟，刚发完 tweet 马上刷 newsfeed 可能在从库上还看不到。
+    所以一个 request 写过数据之后，这个 request 剩下的读都走主库，
+    ReplicaPinningMiddleware 再给 client 设一个 cookie，
+    DATABASE_REPLICA_PIN_SECONDS 秒之内这个 client 的读都走主库 (read-your-writes)
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or this_thread_is_pinned():
+            return DEFAULT_DB_ALIAS
+        # 通过一个对象取关联的对象（e.g. tweet.user）的时候，用这个对象所在的库，
+        # 同一个 request 里看到的数据来自同一个从库
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in replicas:
+            return instance._state.db
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_this_thread()
+        _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 主库和从库是同一份数据
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 从库的表结构是从主库同步过去的
+        if db in get_replicas():
+            return False
+        return None
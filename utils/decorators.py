@@ -1,3 +1,8 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
 from rest_framework.response import Response
 from rest_framework import status
 from functools import wraps
@@ -41,4 +46,92 @@ def required_params(request_attr='query_params', params=None):
             # 做完检测之后，再去调用被 @required_params 包裹起来的 view_func
             return view_func(instance, request, *args, **kwargs)
         return _wrapped_view
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+def _idempotency_cache():
+    return caches[getattr(settings, 'IDEMPOTENCY_CACHE', 'default')]
+
+
+def idempotency_cache_key(user, key):
+    user_id = user.id if user.is_authenticated else 'anonymous'
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'idempotency:{user_id}:{digest}'
+
+
+def _request_fingerprint(request):
+    # 同一个 key 只能用在同一个请求上，body 不一样说明客户端的 key 用错了
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path} {body}'.encode()).hexdigest()
+
+
+def _execute_and_store(view_func, instance, request, args, kwargs, response_key, fingerprint):
+    response = view_func(instance, request, *args, **kwargs)
+    if response.status_code < 500:
+        _idempotency_cache().set(response_key, {
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'data': response.data,
+        }, getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+    return response
+
+
+def idempotent(view_func):
+    """
+    客户端超时之后会重试 POST，带上同一个 Idempotency-Key header 的请求只会执行一次:
+    第一次的 response 存在 cache 里（IDEMPOTENCY_KEY_TTL 秒），
+    重试的时候直接返回存下来的 response，不会再写数据库，也不会再 fanout 一次
+
+    key 按用户隔离；第一个请求还没执行完的时候重试返回 409，客户端过一会儿再试
+    5xx 不存，客户端可以用同一个 key 重试
+    不带 header 的请求和原来一样
+    """
+    @wraps(view_func)
+    def _wrapped_view(instance, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_func(instance, request, *args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return Response({
+                'message': 'Idempotency-Key is too long',
+                'success': False,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        cache = _idempotency_cache()
+        response_key = idempotency_cache_key(request.user, key)
+        lock_key = f'{response_key}:lock'
+        fingerprint = _request_fingerprint(request)
+
+        stored = cache.get(response_key)
+        if stored is None:
+            # add 是原子的，同时到达的两个请求只有一个能拿到
+            # 锁要有过期时间，进程挂掉的话锁会自己释放
+            if not cache.add(lock_key, fingerprint, getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60)):
+                return Response({
+                    'message': 'A request with this Idempotency-Key is in progress',
+                    'success': False,
+                }, status=status.HTTP_409_CONFLICT)
+            try:
+                # 拿到锁之前前一个请求可能刚好执行完，再看一次
+                stored = cache.get(response_key)
+                if stored is None:
+                    return _execute_and_store(view_func, instance, request, args, kwargs, response_key, fingerprint)
+            finally:
+                cache.delete(lock_key)
+
+        if stored['fingerprint'] != fingerprint:
+            return Response({
+                'message': 'Idempotency-Key was already used for a different request',
+                'success': False,
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        response = Response(stored['data'], status=stored['status'])
+        response['Idempotent-Replayed'] = 'true'
+        return response
+    return _wrapped_view
@@ -0,0 +1,557 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils import timezone
+from rest_framework import ISO_8601, fields, serializers
+from rest_framework.settings import api_settings
+from utils.json_fragments import Hole, JSONFragment, encode_template, render_template
+from utils.metrics import get_current_metrics
+
+
+DATETIME = 'datetime'
+
+
+def _datetime_converter():
+    # 和 DRF 的 DateTimeField.to_representation 一样：
+    # 先转换到当前时区，再输出 ISO 8601, UTC 的 +00:00 写成 Z
+    # 时区在每次 serialize 的时候取一次，而不是每个 item 取一次
+    if not settings.USE_TZ:
+        return lambda value: value.isoformat()
+    tz = timezone.get_current_timezone()
+
+    def convert(value):
+        value = value.astimezone(tz).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+# DRF field 的类型 -> 不依赖 field instance 的快速转换函数
+# 只放 to_representation 和 DRF 完全等价的 field，其他 field 回退到 DRF 自己的 to_representation
+SIMPLE_CONVERTERS = {
+    fields.IntegerField: int,
+    fields.CharField: str,
+    fields.ReadOnlyField: None,
+}
+
+
+# 缓存的 JSON 格式有变化的时候（e.g. TweetSerializer 加了字段）改一下这个版本号，旧的缓存就不会再被用到
+JSON_FRAGMENT_CACHE_VERSION = 3
+
+
+def fragment_cache_key(model, pk):
+    # e.g. json:v1:tweets.tweet:42
+    return f'json:v{JSON_FRAGMENT_CACHE_VERSION}:{model._meta.label_lower}:{pk}'
+
+
+def invalidate_fragment(model, pk):
+    cache.delete(fragment_cache_key(model, pk))
+
+
+def fragments_enabled():
+    return getattr(settings, 'JSON_FRAGMENT_CACHE_ENABLED', False)
+
+
+def prefetch_unless_cached(queryset, *lookups):
+    """
+    fragment 缓存打开的时候嵌套的 tweet / user 由 FastSerializer 先查缓存，没命中的再批量取，
+    这时候 prefetch_related 反而会多出不需要的 SQL
+    缓存关掉的时候还是要 prefetch_related, 避免 N + 1 queries
+    """
+    if fragments_enabled():
+        return queryset
+    return queryset.prefetch_related(*lookups)
+
+
+class _FieldPlan(object):
+
+    def __init__(self, name, source_attrs, converter=None, nested=None, many=False,
+                 fragment=None, attname=None):
+        self.name = name
+        self.source_attrs = source_attrs
+        self.converter = converter
+        self._nested = nested
+        self.many = many
+        # 嵌套的 serializer 如果有对应的 cache_fragments 的 FastSerializer,
+        # fragment 就是那个 FastSerializer，attname 是外键的列名（e.g. user_id）
+        self.fragment = fragment
+        self.attname = attname
+
+    @property
+    def nested(self):
+        # 能缓存的嵌套字段用那个 FastSerializer 自己的 plan, 用到的时候才去取，
+        # 所以 serializer 可以嵌套自己（e.g. tweet 转发的原 tweet）
+        if self._nested is None and self.fragment is not None:
+            return self.fragment._get_plan()
+        return self._nested
+
+
+class FastSerializer(object):
+    """
+    热点读路径用的轻量 serializer
+
+    DRF 的 ModelSerializer 每次 serialize 都要 new 出所有的 field 对象，
+    每个 item 的每个 field 都要走一遍 get_attribute / to_representation，
+    newsfeed 这种一页有很多 item 的接口 CPU 大部分都花在这里。
+
+    FastSerializer 把一个已有的 DRF serializer 的定义"编译"成一个字段列表，只编译一次，
+    之后直接从 model instance 或者 values() 的 dict 生成输出的 dict。
+    因为字段是从原来的 serializer 里读出来的，输出的 JSON 和原来的 serializer 完全一样。
+
+    用法和 DRF 的 serializer 一样：
+        class TweetFastSerializer(FastSerializer):
+            serializer_class = TweetSerializer
+
+        TweetFastSerializer(tweets, many=True).data
+
+    cache_fragments = True 的时候，每个 item 输出的 JSON bytes 会按 pk 缓存在 cache 里，
+    其他 serializer 嵌套到同一个 serializer_class 的时候也会用这份缓存，
+    e.g. newsfeed 里的 tweet, tweet 里的 user。
+    缓存的内容里嵌套的 fragment 只是一个占位符，所以 user 改名之后只需要删掉 user 的缓存，
+    引用它的 tweet 的缓存不需要动。
+    输出是 JSONFragment，需要配合 utils.renderers.FastJSONRenderer 才能省掉 encode 的时间。
+    """
+
+    serializer_class = None
+    cache_fragments = False
+
+    # serializer_class -> 缓存这个 serializer 输出的 FastSerializer
+    _fragment_registry = {}
+    # model label -> FastSerializer, 同一个 model 的缓存只有一份，
+    # 所以同一个 model 的几个 cache_fragments 的 serializer 输出必须是一样的
+    _fragment_by_label = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.cache_fragments and cls.serializer_class is not None:
+            FastSerializer._fragment_registry[cls.serializer_class] = cls
+            label = cls.get_model()._meta.label_lower
+            FastSerializer._fragment_by_label.setdefault(label, cls)
+
+    def __init__(self, instance=None, many=False, fragments=None):
+        self.instance = instance
+        self.many = many
+        # 已经取好的 fragment, 见 fetch_fragments
+        self.fragments = fragments
+
+    @property
+    def data(self):
+        metrics = get_current_metrics()
+        start = time.perf_counter()
+        if self.many:
+            data = self.to_representation_many(self.instance, self.fragments)
+        else:
+            data = self.to_representation_many([self.instance], self.fragments)[0]
+        if metrics is not None:
+            metrics.serializer_time += time.perf_counter() - start
+        return data
+
+    @classmethod
+    def _get_plan(cls):
+        # 每个子类只编译一次
+        if '_plan' not in cls.__dict__:
+            cls._plan = compile_serializer(cls.serializer_class())
+        return cls._plan
+
+    @classmethod
+    def to_representation(cls, instance):
+        return cls.to_representation_many([instance])[0]
+
+    @classmethod
+    def to_representation_many(cls, instances, fragments=None):
+        plan = cls._get_plan()
+        convert_datetime = _datetime_converter()
+        if isinstance(instances, models.Manager):
+            instances = instances.all()
+        if not fragments_enabled():
+            return [_serialize(plan, instance, convert_datetime) for instance in instances]
+
+        # 先收集所有需要的 fragment，一次 get_many 取缓存，没命中的再一次 query 取出来
+        instances = list(instances)
+        resolver = _FragmentResolver(convert_datetime, fragments)
+        if cls.cache_fragments:
+            for instance in instances:
+                resolver.request(cls, instance.pk, instance)
+            resolver.resolve()
+            return [resolver.get(cls, instance.pk) for instance in instances]
+        for instance in instances:
+            _collect(plan, instance, resolver)
+        resolver.resolve()
+        return [_serialize(plan, instance, convert_datetime, resolver) for instance in instances]
+
+    @classmethod
+    def from_pks(cls, pks, fragments=None):
+        """
+        只根据 pk 取数据，返回的顺序和 pks 一样，不存在的 pk 对应 None
+        fragment 都在缓存里的时候不需要查数据库
+        """
+        if not (cls.cache_fragments and fragments_enabled()):
+            instances = cls.load_instances(pks)
+            return [
+                cls.to_representation(instances[pk]) if pk in instances else None
+                for pk in pks
+            ]
+        resolver = _FragmentResolver(_datetime_converter(), fragments)
+        for pk in pks:
+            resolver.request(cls, pk)
+        resolver.resolve()
+        return [resolver.get(cls, pk) for pk in pks]
+
+    @classmethod
+    def fetch_fragments(cls, pks):
+        """
+        只取这一层的 fragment（一次 cache.get_many, 没命中的一次 load_instances），不取嵌套的
+        返回 {pk: template}, 作为 fragments={FastSerializer: templates} 传给 from_pks / serialize 的时候不再取一次
+        几种互相独立的 fragment 可以这样同时取，e.g. async view 里 gather tweet 和 tweet 的作者
+        """
+        if not pks:
+            return {}
+        fast_serializer = _canonical(cls)
+        resolver = _FragmentResolver(_datetime_converter())
+        return resolver.fetch(fast_serializer, {pk: None for pk in pks})
+
+    @classmethod
+    def get_model(cls):
+        return cls.serializer_class.Meta.model
+
+    @classmethod
+    def load_instances(cls, pks):
+        """
+        fragment 缓存没命中的时候用来批量取数据，子类可以 override 加上 select_related 之类
+        """
+        return cls.get_model().objects.in_bulk(pks)
+
+    @classmethod
+    def build_template(cls, instance, resolver):
+        data = _serialize(cls._get_plan(), instance, resolver.convert_datetime, resolver, holes=True)
+        return encode_template(data)
+
+    @classmethod
+    def value_fields(cls):
+        """
+        配合 queryset.values(*value_fields()) 使用
+        e.g. NewsFeedFastSerializer -> ['id', 'created_at', 'tweet__id', 'tweet__user__id', ...]
+        """
+        return _value_fields(cls._get_plan(), '')
+
+    @classmethod
+    def from_values(cls, rows):
+        """
+        rows 是 queryset.values(*value_fields()) 的结果
+        """
+        if '_values_plan' not in cls.__dict__:
+            cls._values_plan = _compile_values(cls._get_plan(), '')
+        values_plan = cls._values_plan
+        convert_datetime = _datetime_converter()
+        return [_serialize_values(values_plan, row, convert_datetime) for row in rows]
+
+
+class _FragmentResolver(object):
+    """
+    一次 serialize 用到的所有 fragment
+    request() 登记需要哪些 (FastSerializer, pk)，resolve() 一次性把它们取出来：
+    每一种 FastSerializer 一次 cache.get_many，没命中的一次 in_bulk 查数据库
+    """
+
+    def __init__(self, convert_datetime, fragments=None):
+        self.convert_datetime = convert_datetime
+        # FastSerializer -> {pk: 已经取出来的 instance 或者 None}
+        self.pending = {}
+        # FastSerializer -> {pk: (chunks, hole_keys), 不存在的 pk 是 None}
+        self.templates = {}
+        # (FastSerializer, pk) -> JSONFragment
+        self.fragments = {}
+        if fragments:
+            # 调用的地方已经取好的 fragment 不再取，它们嵌套的 fragment 还要取
+            for fast_serializer, templates in fragments.items():
+                self.templates.setdefault(_canonical(fast_serializer), {}).update(templates)
+            for templates in list(self.templates.values()):
+                self._request_holes(templates)
+
+    def request(self, fast_serializer, pk, instance=None):
+        fast_serializer = _canonical(fast_serializer)
+        if pk in self.templates.get(fast_serializer, ()):
+            return
+        requested = self.pending.setdefault(fast_serializer, {})
+        if requested.get(pk) is None:
+            requested[pk] = instance
+
+    def resolve(self):
+        while self.pending:
+            fast_serializer, requested = self.pending.popitem()
+            templates = self.fetch(fast_serializer, requested)
+            self.templates.setdefault(fast_serializer, {}).update(templates)
+            self._request_holes(templates)
+
+    def fetch(self, fast_serializer, requested):
+        """
+        一种 FastSerializer 的一批 fragment: 一次 cache.get_many, 没命中的一次 load_instances
+        返回 {pk: template}
+        """
+        timeout = getattr(settings, 'JSON_FRAGMENT_CACHE_TIMEOUT', 3600)
+        model = fast_serializer.get_model()
+        keys = {fragment_cache_key(model, pk): pk for pk in requested}
+        templates = {
+            keys[key]: template
+            for key, template in cache.get_many(list(keys)).items()
+        }
+        missing = {pk: instance for pk, instance in requested.items() if pk not in templates}
+        to_load = [pk for pk, instance in missing.items() if instance is None]
+        if to_load:
+            missing.update(fast_serializer.load_instances(to_load))
+        built = {
+            pk: fast_serializer.build_template(instance, self)
+            for pk, instance in missing.items()
+            # 被删掉的数据没有 fragment, 输出 null
+            if instance is not None
+        }
+        if built:
+            cache.set_many(
+                {fragment_cache_key(model, pk): template for pk, template in built.items()},
+                timeout,
+            )
+        templates.update(built)
+        # 被删掉的数据输出 null, 之后再 request 的时候也不会再查一次
+        for pk in requested:
+            templates.setdefault(pk, None)
+        return templates
+
+    def _request_holes(self, templates):
+        for template in templates.values():
+            if template is None:
+                continue
+            chunks, hole_keys = template
+            for label, pk in hole_keys:
+                self.request(FastSerializer._fragment_by_label[label], pk)
+
+    def get(self, fast_serializer, pk):
+        fast_serializer = _canonical(fast_serializer)
+        key = (fast_serializer, pk)
+        if key not in self.fragments:
+            template = self.templates[fast_serializer].get(pk)
+            if template is None:
+                self.fragments[key] = None
+            else:
+                chunks, hole_keys = template
+                children = [
+                    self.get(FastSerializer._fragment_by_label[label], pk)
+                    for label, pk in hole_keys
+                ]
+                self.fragments[key] = JSONFragment(render_template(chunks, [
+                    child if child is not None else JSONFragment(b'null')
+                    for child in children
+                ]))
+        return self.fragments[key]
+
+
+def _canonical(fast_serializer):
+    return FastSerializer._fragment_by_label[fast_serializer.get_model()._meta.label_lower]
+
+
+def compile_serializer(serializer):
+    plan = []
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    for field in serializer._readable_fields:
+        if isinstance(field, serializers.ListSerializer):
+            plan.append(_FieldPlan(
+                field.field_name,
+                field.source_attrs,
+                nested=compile_serializer(field.child),
+                many=True,
+            ))
+        elif isinstance(field, serializers.BaseSerializer):
+            fragment = FastSerializer._fragment_registry.get(type(field))
+            plan.append(_FieldPlan(
+                field.field_name,
+                field.source_attrs,
+                nested=compile_serializer(field) if fragment is None else None,
+                fragment=fragment,
+                attname=_get_attname(model, field.source_attrs),
+            ))
+        elif type(field) is fields.DateTimeField and _is_default_datetime(field):
+            plan.append(_FieldPlan(field.field_name, field.source_attrs, converter=DATETIME))
+        elif type(field) in SIMPLE_CONVERTERS:
+            plan.append(_FieldPlan(
+                field.field_name,
+                field.source_attrs,
+                converter=SIMPLE_CONVERTERS[type(field)],
+            ))
+        else:
+            plan.append(_FieldPlan(
+                field.field_name,
+                field.source_attrs,
+                converter=field.to_representation,
+            ))
+    return plan
+
+
+def _is_default_datetime(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    return (
+        output_format is not None
+        and output_format.lower() == ISO_8601
+        and not hasattr(field, 'timezone')
+    )
+
+
+def _get_attname(model, source_attrs):
+    # 直接读外键的列（tweet.user_id），不需要把关联的对象取出来
+    if model is None or len(source_attrs) != 1:
+        return None
+    try:
+        field = model._meta.get_field(source_attrs[0])
+    except FieldDoesNotExist:
+        return None
+    if field.many_to_one or (field.one_to_one and field.concrete):
+        return field.attname
+    return None
+
+
+def _get_fragment_pk(field, instance):
+    """
+    返回 (pk, 已经取出来的关联对象或者 None)
+    """
+    if field.attname is not None:
+        model_field = instance._meta.get_field(field.source_attrs[0])
+        return getattr(instance, field.attname), model_field.get_cached_value(instance, None)
+    value = _get_attribute(instance, field.source_attrs)
+    if value is None:
+        return None, None
+    return value.pk, value
+
+
+def _collect(plan, instance, resolver):
+    for field in plan:
+        if field.nested is None:
+            continue
+        if field.fragment is not None:
+            pk, value = _get_fragment_pk(field, instance)
+            if pk is not None:
+                resolver.request(field.fragment, pk, value)
+            continue
+        value = _get_attribute(instance, field.source_attrs)
+        if value is None:
+            continue
+        if field.many:
+            if isinstance(value, models.Manager):
+                value = value.all()
+            for item in value:
+                _collect(field.nested, item, resolver)
+        else:
+            _collect(field.nested, value, resolver)
+
+
+def _get_attribute(instance, source_attrs):
+    for attr in source_attrs:
+        if instance is None:
+            return None
+        instance = getattr(instance, attr)
+    return instance
+
+
+def _serialize(plan, instance, convert_datetime, resolver=None, holes=False):
+    """
+    resolver 不为 None 的时候，能缓存的嵌套字段直接用 resolver 里的 fragment
+    holes=True 的时候（生成缓存的 template）这些字段只放一个占位符
+    """
+    ret = {}
+    for field in plan:
+        if resolver is not None and field.fragment is not None:
+            pk, value = _get_fragment_pk(field, instance)
+            if pk is None:
+                ret[field.name] = None
+            elif holes:
+                resolver.request(field.fragment, pk, value)
+                ret[field.name] = Hole((field.fragment.get_model()._meta.label_lower, pk))
+            else:
+                ret[field.name] = resolver.get(field.fragment, pk)
+            continue
+        value = _get_attribute(instance, field.source_attrs)
+        if value is None:
+            ret[field.name] = None
+        elif field.nested is not None:
+            if field.many:
+                if isinstance(value, models.Manager):
+                    value = value.all()
+                ret[field.name] = [
+                    _serialize(field.nested, item, convert_datetime, resolver, holes)
+                    for item in value
+                ]
+            else:
+                ret[field.name] = _serialize(
+                    field.nested, value, convert_datetime, resolver, holes,
+                )
+        elif field.converter is None:
+            ret[field.name] = value
+        elif field.converter is DATETIME:
+            ret[field.name] = convert_datetime(value)
+        else:
+            ret[field.name] = field.converter(value)
+    return ret
+
+
+def _check_not_recursive(plan, parents):
+    # 嵌套自己的 serializer（e.g. tweet 的 original）没办法展开成有限的几列
+    if any(plan is parent for parent in parents):
+        raise ValueError('values() rows do not support recursive nested fields')
+    return parents + (plan,)
+
+
+def _value_fields(plan, prefix, parents=()):
+    parents = _check_not_recursive(plan, parents)
+    keys = []
+    for field in plan:
+        if field.many:
+            raise ValueError('values() rows do not support many=True nested fields')
+        key = prefix + '__'.join(field.source_attrs)
+        if field.nested is not None:
+            keys.extend(_value_fields(field.nested, key + '__', parents))
+        else:
+            keys.append(key)
+    return keys
+
+
+def _compile_values(plan, prefix, parents=()):
+    # values() 的 row 是一个扁平的 dict, 嵌套的字段用 __ 连起来
+    parents = _check_not_recursive(plan, parents)
+    values_plan = []
+    for field in plan:
+        key = prefix + '__'.join(field.source_attrs)
+        if field.nested is not None:
+            if field.many:
+                raise ValueError('values() rows do not support many=True nested fields')
+            values_plan.append((
+                field.name,
+                _value_fields(field.nested, key + '__', parents),
+                None,
+                _compile_values(field.nested, key + '__', parents),
+            ))
+        else:
+            values_plan.append((field.name, key, field.converter, None))
+    return values_plan
+
+
+def _serialize_values(values_plan, row, convert_datetime):
+    ret = {}
+    for name, key, converter, nested in values_plan:
+        if nested is not None:
+            # 外键为 NULL 的时候，values() 里所有嵌套的列都是 None
+            if all(row[nested_key] is None for nested_key in key):
+                ret[name] = None
+            else:
+                ret[name] = _serialize_values(nested, row, convert_datetime)
+            continue
+        value = row[key]
+        if value is None:
+            ret[name] = None
+        elif converter is None:
+            ret[name] = value
+        elif converter is DATETIME:
+            ret[name] = convert_datetime(value)
+        else:
+            ret[name] = converter(value)
+    return ret
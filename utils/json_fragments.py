@@ -0,0 +1,185 @@
+import json
+import re
+import secrets
+from collections.abc import Mapping
+
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover, orjson 是可选的依赖
+    orjson = None
+
+
+# orjson 默认的输出和 DRF 默认的 JSONRenderer (UNICODE_JSON + COMPACT_JSON) 是一样的：
+# 紧凑的分隔符，非 ASCII 字符不转义
+# datetime / dataclass 交给 DRF 的 JSONEncoder 来处理，保证格式一致
+ORJSON_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATETIME
+    | orjson.OPT_PASSTHROUGH_DATACLASS
+    | orjson.OPT_NON_STR_KEYS
+) if orjson is not None else 0
+
+_drf_encoder = encoders.JSONEncoder()
+
+
+class JSONFragment(Mapping):
+    """
+    一段已经 encode 好的 JSON (bytes)
+    renderer 遇到它的时候直接把 bytes 拼进输出里，不再重新 encode
+
+    同时它也是一个只读的 Mapping, 在 Python 里访问的时候（e.g. test 里的 response.data）
+    才会 decode 一次
+    """
+
+    __slots__ = ('raw', '_value')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._value = None
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = json.loads(self.raw)
+        return self._value
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __repr__(self):
+        return f'JSONFragment({self.raw!r})'
+
+
+class Hole(object):
+    """
+    encode_template 里的占位符，表示这里之后要拼进另外一个 fragment
+    """
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+
+class _Placeholders(object):
+    """
+    encode 的时候把 JSONFragment / Hole 先替换成一个随机的字符串,
+    encode 完之后再把这个字符串替换回来
+    token 里带一个随机数，用户的内容不可能碰巧和 token 一样
+    """
+
+    def __init__(self):
+        self.nonce = secrets.token_hex(8)
+        self.items = []
+        self._pattern = None
+
+    def default(self, obj):
+        if isinstance(obj, (JSONFragment, Hole)):
+            self.items.append(obj)
+            return f'\x00{self.nonce}:{len(self.items) - 1}\x00'
+        return _drf_encoder.default(obj)
+
+    @property
+    def pattern(self):
+        if self._pattern is None:
+            self._pattern = re.compile(
+                rb'"\\u0000' + self.nonce.encode() + rb':(\d+)\\u0000"'
+            )
+        return self._pattern
+
+
+def _is_default_format():
+    return (
+        api_settings.UNICODE_JSON
+        and api_settings.COMPACT_JSON
+        and api_settings.STRICT_JSON
+    )
+
+
+def _dumps_stdlib(data, default, indent=None):
+    separators = None
+    if indent is None and api_settings.COMPACT_JSON:
+        separators = (',', ':')
+    ret = json.dumps(
+        data,
+        cls=encoders.JSONEncoder,
+        default=default,
+        indent=indent,
+        ensure_ascii=not api_settings.UNICODE_JSON,
+        allow_nan=not api_settings.STRICT_JSON,
+        separators=separators,
+    )
+    return ret.encode()
+
+
+def _escape_line_separators(ret):
+    # 和 DRF 的 JSONRenderer 一样，U+2028 / U+2029 在 javascript 里是换行，要转义
+    if b'\xe2\x80' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+def _encode(data, placeholders):
+    if orjson is not None and _is_default_format():
+        try:
+            return orjson.dumps(data, default=placeholders.default, option=ORJSON_OPTIONS)
+        except (orjson.JSONEncodeError, TypeError):
+            # 超过 64 bit 的整数之类 orjson 不支持的情况，退回到标准库
+            placeholders.items = []
+    return _dumps_stdlib(data, placeholders.default)
+
+
+def dumps(data):
+    """
+    和 DRF 默认的 JSONRenderer 输出 byte-for-byte 一样的 JSON，
+    但是用 orjson 来 encode，并且 JSONFragment 直接拼进去
+    """
+    placeholders = _Placeholders()
+    ret = _encode(data, placeholders)
+    if placeholders.items:
+        ret = placeholders.pattern.sub(
+            lambda match: placeholders.items[int(match.group(1))].raw,
+            ret,
+        )
+    return _escape_line_separators(ret)
+
+
+def dumps_indented(data, indent):
+    # 带缩进的输出（浏览器里的 browsable API）很少用，不追求速度，fragment 直接 decode 出来
+    def default(obj):
+        if isinstance(obj, JSONFragment):
+            return obj.value
+        return _drf_encoder.default(obj)
+    return _escape_line_separators(_dumps_stdlib(data, default, indent=indent))
+
+
+def encode_template(data):
+    """
+    encode 一个包含 Hole 的 dict, 返回 (parts, hole_keys)
+    之后用 render_template(parts, fragments) 把 Hole 的位置替换成对应的 fragment
+    """
+    placeholders = _Placeholders()
+    ret = _escape_line_separators(_encode(data, placeholders))
+    parts = placeholders.pattern.split(ret)
+    # split 之后奇数位置是占位符的编号
+    chunks = parts[0::2]
+    keys = [placeholders.items[int(index)].key for index in parts[1::2]]
+    return chunks, keys
+
+
+def render_template(chunks, fragments):
+    if len(chunks) == 1:
+        return chunks[0]
+    pieces = [chunks[0]]
+    for fragment, chunk in zip(fragments, chunks[1:]):
+        pieces.append(fragment.raw)
+        pieces.append(chunk)
+    return b''.join(pieces)
@@ -0,0 +1,7 @@
+from utils.fast_serializers import invalidate_fragment
+
+
+def invalidate_json_fragment(sender, instance, **kwargs):
+    # 数据改了之后删掉缓存好的 JSON, 下次读的时候重新生成
+    # 嵌套在别的 fragment 里的时候缓存里只有占位符，所以只需要删自己这一份
+    invalidate_fragment(sender, instance.pk)
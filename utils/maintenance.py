@@ -0,0 +1,30 @@
+import time
+
+
+def iter_pk_batches(queryset, batch_size, fields=('pk',)):
+    """
+    按主键的顺序分批遍历一张表，每一批都是主键索引上的一次 range scan (WHERE pk > last LIMIT n)，
+    不会像 OFFSET 一样越往后越慢，也不会长时间锁表
+    yield 的是 values_list(*fields) 的结果，第一个 field 必须是 pk
+    """
+    last_pk = None
+    while True:
+        batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(batch.order_by('pk').values_list(*fields)[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_pk = rows[-1][0]
+
+
+class Throttle(object):
+    """
+    维护任务在线上跑的时候每一批之间歇一会儿，给正常的读写和主从同步留出余量
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self):
+        if self.seconds:
+            time.sleep(self.seconds)
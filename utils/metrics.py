@@ -0,0 +1,229 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.local import Local
+from django.db import connections
+
+
+# 每个 view action 的耗时分布用 histogram 来记录
+# bucket 的上界是固定的，这样每次 observe 只是一次二分查找 + 加法，开销很小
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    """
+    Prometheus 风格的 histogram，按 label（这里是 view action 的名字）分开统计
+    """
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, label, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(label)
+            if values is None:
+                values = [0] * (len(self.buckets) + 2)
+                self._values[label] = values
+            if index < len(self.buckets):
+                values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {label: list(values) for label, values in self._values.items()}
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        for label, values in sorted(self.snapshot().items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{view="{label}",le="{upper_bound}"}} {cumulative}'
+                )
+            lines.append(f'{self.name}_bucket{{view="{label}",le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{view="{label}"}} {values[-2]}')
+            lines.append(f'{self.name}_count{{view="{label}"}} {values[-1]}')
+        return '\n'.join(lines)
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self.request_duration = Histogram(
+            'twitter_request_duration_seconds',
+            'Total time spent handling the request.',
+            DURATION_BUCKETS,
+        )
+        self.sql_queries = Histogram(
+            'twitter_request_sql_queries',
+            'Number of SQL queries issued by the request.',
+            QUERY_COUNT_BUCKETS,
+        )
+        self.sql_duration = Histogram(
+            'twitter_request_sql_duration_seconds',
+            'Time spent waiting on SQL queries.',
+            DURATION_BUCKETS,
+        )
+        self.serializer_duration = Histogram(
+            'twitter_request_serializer_duration_seconds',
+            'Time spent turning objects into response data.',
+            DURATION_BUCKETS,
+        )
+
+    @property
+    def histograms(self):
+        return (
+            self.request_duration,
+            self.sql_queries,
+            self.sql_duration,
+            self.serializer_duration,
+        )
+
+    def record(self, label, request_metrics):
+        self.request_duration.observe(label, request_metrics.total_time)
+        self.sql_queries.observe(label, request_metrics.query_count)
+        self.sql_duration.observe(label, request_metrics.sql_time)
+        self.serializer_duration.observe(label, request_metrics.serializer_time)
+
+    def clear(self):
+        for histogram in self.histograms:
+            histogram.clear()
+
+    def render(self):
+        return '\n'.join(histogram.render() for histogram in self.histograms) + '\n'
+
+
+# 进程内唯一的 registry, /metrics/ 从这里读数据
+registry = MetricsRegistry()
+
+
+class QueryCounter(object):
+    """
+    用 connection.execute_wrapper 统计 SQL 的条数和耗时
+    和 CaptureQueriesContext 不同，这里不需要 DEBUG=True，也不会保存 SQL 文本
+    """
+
+    def __init__(self):
+        self.query_count = 0
+        self.sql_time = 0.0
+        # async view 会在多个线程里同时查询，计数要加锁
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.sql_time += duration
+                self.query_count += 1
+
+    def install(self):
+        # 每个 database alias 的 connection 都要装上，读写分离/分库之后也能统计到
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+class RequestMetrics(QueryCounter):
+
+    def __init__(self):
+        super().__init__()
+        self.start = time.perf_counter()
+        self.total_time = 0.0
+        self.serializer_time = 0.0
+        self.view_name = None
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.start
+
+    def server_timing(self):
+        return ', '.join([
+            'total;dur={:.2f}'.format(self.total_time * 1000),
+            'sql;dur={:.2f};desc="{} queries"'.format(
+                self.sql_time * 1000,
+                self.query_count,
+            ),
+            'serializer;dur={:.2f}'.format(self.serializer_time * 1000),
+        ])
+
+
+# 同步的 view 里相当于 threading.local,
+# async 的 view 里每个 request 是分开的，并且会传到 sync_to_async 的线程里
+_local = Local()
+
+
+def get_current_metrics():
+    return getattr(_local, 'metrics', None)
+
+
+def set_current_metrics(metrics):
+    _local.metrics = metrics
+
+
+def _timed_data_property(data_property):
+    # 只统计最外层的 serializer.data,
+    # 嵌套的 serializer 走的是 to_representation，不会重复计算
+    def data(serializer):
+        metrics = get_current_metrics()
+        if metrics is None or getattr(_local, 'in_serializer', False):
+            return data_property.fget(serializer)
+        _local.in_serializer = True
+        start = time.perf_counter()
+        try:
+            return data_property.fget(serializer)
+        finally:
+            metrics.serializer_time += time.perf_counter() - start
+            _local.in_serializer = False
+    data.__wrapped__ = data_property.fget
+    return property(data)
+
+
+_serializer_timing_installed = False
+
+
+def install_serializer_timing():
+    """
+    给 DRF 的 Serializer.data / ListSerializer.data 包一层计时
+    只在 MetricsMiddleware 初始化的时候调用一次
+    """
+    global _serializer_timing_installed
+    if _serializer_timing_installed:
+        return
+    from rest_framework import serializers
+    for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+        serializer_class.data = _timed_data_property(serializer_class.data)
+    _serializer_timing_installed = True
+
+
+def get_view_name(view_func, method):
+    """
+    DRF viewset 的 view_func 上带着 cls 和 actions
+    e.g. POST /api/tweets/ -> TweetViewSet.create
+    """
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return '{}.{}'.format(view_func.__module__, view_func.__qualname__)
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(method.lower(), method.lower())
+    return '{}.{}'.format(cls.__name__, action)
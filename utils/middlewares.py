@@ -0,0 +1,146 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from utils.db_routers import (
+    pin_this_thread,
+    this_thread_has_written,
+    unpin_this_thread,
+)
+from utils.metrics import (
+    RequestMetrics,
+    get_view_name,
+    install_serializer_timing,
+    registry,
+    set_current_metrics,
+)
+
+
+class AsyncCapableMiddleware(object):
+    """
+    同时支持 WSGI 和 ASGI 的 middleware
+    ASGI 下如果 middleware 只支持同步，Django 会把整个 request 切到线程里去执行，
+    async 的 view 就没有意义了
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            # 让 Django 把这个 middleware 当成 async 的（新版本 Django 的 MiddlewareMixin 也是这么做的）
+            markcoroutinefunction(self)
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """
+    记录每个 view action（e.g. TweetViewSet.create）的
+    SQL 条数，SQL 耗时，serializer 耗时以及总耗时
+    数据按 Prometheus 的格式从 /metrics/ 暴露出来
+
+    为了在高负载下也能一直开着，每个 request 只做几次 perf_counter 和加法，
+    不保存 SQL 文本
+
+    ASGI 下数据库查询是在别的线程里执行的，只有通过 utils.async_views.run_sync 执行的查询
+    才会被统计到
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.enabled = getattr(settings, 'METRICS_ENABLED', True)
+        self.server_timing = getattr(settings, 'METRICS_SERVER_TIMING', False)
+        if self.enabled:
+            install_serializer_timing()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        metrics = self.start(request)
+        try:
+            with metrics.install():
+                response = self.get_response(request)
+        finally:
+            set_current_metrics(None)
+        return self.finish(metrics, response)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        metrics = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            set_current_metrics(None)
+        return self.finish(metrics, response)
+
+    def start(self, request):
+        metrics = RequestMetrics()
+        request._metrics = metrics
+        set_current_metrics(metrics)
+        return metrics
+
+    def finish(self, metrics, response):
+        metrics.finish()
+        # 没有匹配到 url 的 request 统一记到一个 label 下，避免 label 无限增长
+        registry.record(metrics.view_name or 'unmatched', metrics)
+        if self.server_timing:
+            response['Server-Timing'] = metrics.server_timing()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, '_metrics', None)
+        if metrics is not None:
+            metrics.view_name = get_view_name(view_func, request.method)
+        return None
+
+
+class ReplicaPinningMiddleware(AsyncCapableMiddleware):
+    """
+    配合 utils.db_routers.PrimaryReplicaRouter 使用
+    1. 写请求 (POST / PUT / PATCH / DELETE) 的读都走主库
+    2. 写过数据之后给 client 设一个 cookie，cookie 过期之前这个 client 的读都走主库，
+       这样发完 tweet 马上刷 newsfeed 一定能看到自己的 tweet
+    """
+
+    UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.cookie_name = getattr(settings, 'DATABASE_REPLICA_PIN_COOKIE', 'db_pin')
+        self.pin_seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 15)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        self.start(request)
+        try:
+            return self.finish(self.get_response(request))
+        finally:
+            unpin_this_thread()
+
+    async def __acall__(self, request):
+        self.start(request)
+        try:
+            return self.finish(await self.get_response(request))
+        finally:
+            unpin_this_thread()
+
+    def start(self, request):
+        unpin_this_thread()
+        if request.method in self.UNSAFE_METHODS or self.cookie_name in request.COOKIES:
+            pin_this_thread()
+
+    def finish(self, response):
+        if this_thread_has_written():
+            response.set_cookie(
+                self.cookie_name,
+                '1',
+                max_age=self.pin_seconds,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -4,7 +4,7 @@ from rest_framework.permissions import BasePermission
 class IsObjectOwner(BasePermission):
     """
     这个Permission负责检查obj.user 是不是 == request.user
-    这个类是比较通用的， 今后如果有其他地方用到这个类， 可以将这个文件放到一个共享的位置
+    这个类是比较通用的，comment 和 tweet 都用到了，所以放在 utils 里
     Permission会一个一个被执行
     - 如果是 detail=False 的action， 只检测 has_permission
     - 如果是 detail=True 的action，同时检测 has_permission 和 has_object_permission
@@ -0,0 +1,78 @@
+import abc
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Broker(abc.ABC):
+    """
+    发布 / 订阅的接口。message 必须可以 JSON 序列化，这样换成跨机器的 broker 的时候不需要改调用的地方
+
+    callback 在 publish 的线程里（或者 broker 自己的线程里）被调用，必须很快并且线程安全，
+    要在 event loop 里处理的话用 loop.call_soon_threadsafe 转过去
+
+    多台机器部署的时候实现一个 Broker 的子类（e.g. redis 的 PUBLISH / SUBSCRIBE），
+    每个进程只需要订阅一次，然后在 settings.PUBSUB_BROKER 里换掉
+    """
+
+    @abc.abstractmethod
+    def publish(self, topic, message):
+        """
+        把 message 发给 topic 的所有订阅者（包括别的进程里的），没有订阅者的时候直接丢掉
+        不等订阅者处理完，也不保证送到
+        """
+
+    @abc.abstractmethod
+    def subscribe(self, topic, callback):
+        """
+        之后 publish 到 topic 的 message 都会调用 callback(message)
+        返回一个函数，调用它取消订阅，调用多次也没关系
+        """
+
+
+class InProcessBroker(Broker):
+    """
+    只在当前进程里广播，只能用在只有一个进程的部署（开发环境）：
+    publish 的是做 fanout 的进程（dispatch_outbox, OUTBOX_INLINE_DISPATCH 的时候是处理写请求的 worker），
+    subscribe 的是连着 SSE / long-poll 的 ASGI worker, 不是同一个进程的时候消息永远收不到，
+    SSE 的客户端收不到新的 newsfeed, long-poll 每次都要等到超时
+    DEBUG = False 的时候用它启动会打一条 warning（见 utils.checks）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = {}
+
+    def publish(self, topic, message):
+        with self._lock:
+            callbacks = list(self._callbacks.get(topic, ()))
+        for callback in callbacks:
+            callback(message)
+
+    def subscribe(self, topic, callback):
+        with self._lock:
+            self._callbacks.setdefault(topic, []).append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._callbacks.get(topic, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+        return unsubscribe
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(
+                    getattr(settings, 'PUBSUB_BROKER', 'utils.pubsub.InProcessBroker')
+                )
+                _broker = broker_class()
+    return _broker
@@ -0,0 +1,186 @@
+import os
+import re
+import sqlite3
+import threading
+
+
+# unicode61: 按 unicode 的字母 / 数字切词，转小写，remove_diacritics 2 让 café 和 cafe 一样
+TOKENIZE = 'unicode61 remove_diacritics 2'
+# 和 unicode61 的切词规则差不多（unicode61 把 _ 也当作分隔符）
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def tokenize(text, max_terms=None):
+    """
+    用户输入的搜索词 -> FTS5 的 query, 每个词用双引号括起来，
+    用户输入里的 AND / OR / NEAR / * / " 之类的都只当作普通的词，不会变成 FTS5 的语法错误
+    """
+    terms = []
+    for term in WORD_RE.findall(text.lower()):
+        if term not in terms:
+            terms.append(term)
+    return terms[:max_terms] if max_terms else terms
+
+
+class FullTextIndex(object):
+    """
+    SQLite FTS5 的倒排索引，存在 path 这个文件里，只用 python 自带的 sqlite3, 不需要额外的服务
+    rowid 就是文档的 id（tweet id 是 64 位的 snowflake id, 正好放得下）
+
+    每个线程一个连接，WAL 模式下写的时候不会挡住读。path 是 ':memory:' 的时候（测试用）
+    所有线程共用一个连接
+
+    search() 的排序：按 bm25 的相关度，但是只在最新的 window 条匹配的文档里排序。
+    FTS5 按 rowid 倒序取匹配的文档是顺着索引读的，很常见的词有几百万条匹配也只读 window 条，
+    而对所有匹配的文档算 bm25 要把它们全部读一遍。所以每一页的耗时只和 window 有关。
+
+    cursor 是 "<第一页的最大 rowid>:<已经返回了多少条>": 翻页的时候只在第一页的那些文档里排序，
+    之后新写进来的文档不会让后面的页重复或者漏掉。不直接用 rank 做 cursor, 因为新写进来的文档
+    会改变 bm25 用到的全局统计（文档数，平均长度），同一个文档每次算出来的 rank 不一样
+    """
+
+    def __init__(self, path, table='documents'):
+        self.path = str(path)
+        self.table = table
+        self._local = threading.local()
+        self._shared = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        in_memory = self.path == ':memory:'
+        connection = sqlite3.connect(
+            self.path,
+            timeout=30,
+            check_same_thread=not in_memory,
+            isolation_level=None,
+        )
+        if not in_memory:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+            f"USING fts5(content, tokenize='{TOKENIZE}')"
+        )
+        return connection
+
+    def _execute(self, sql, params=(), many=False):
+        if self.path == ':memory:':
+            with self._lock:
+                if self._shared is None:
+                    self._shared = self._connect()
+                return self._run(self._shared, sql, params, many)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return self._run(connection, sql, params, many)
+
+    def _run(self, connection, sql, params, many):
+        if many:
+            with connection:
+                connection.executemany(sql, params)
+            return []
+        return connection.execute(sql, params).fetchall()
+
+    def add(self, documents):
+        """
+        documents: [(id, text)]，已经在索引里的会被替换掉，重复执行没有关系
+        """
+        documents = list(documents)
+        if not documents:
+            return
+        # FTS5 的 INSERT OR REPLACE 不会删掉旧的词，先按 rowid 删掉再写
+        self._execute(
+            f'DELETE FROM {self.table} WHERE rowid = ?',
+            [(doc_id,) for doc_id, _ in documents],
+            many=True,
+        )
+        self._execute(
+            f'INSERT INTO {self.table} (rowid, content) VALUES (?, ?)',
+            documents,
+            many=True,
+        )
+
+    def remove(self, doc_ids):
+        self._execute(
+            f'DELETE FROM {self.table} WHERE rowid = ?',
+            [(doc_id,) for doc_id in doc_ids],
+            many=True,
+        )
+
+    def clear(self):
+        self._execute(f'DELETE FROM {self.table}')
+
+    def count(self):
+        return self._execute(f'SELECT COUNT(*) FROM {self.table}')[0][0]
+
+    def search(self, terms, limit, cursor=None, window=1000):
+        """
+        terms: tokenize() 的结果，所有的词都要出现
+        返回 ([id], next_cursor), 没有下一页的时候 next_cursor 是 None
+        """
+        if not terms:
+            return [], None
+        query = ' '.join(f'"{term}"' for term in terms)
+        max_id, offset = (None, 0) if cursor is None else self._parse_cursor(cursor)
+        sql = f'SELECT rowid, rank FROM {self.table} WHERE {self.table} MATCH ?'
+        params = [query]
+        if max_id is not None:
+            sql += ' AND rowid <= ?'
+            params.append(max_id)
+        rows = self._execute(sql + ' ORDER BY rowid DESC LIMIT ?', params + [window])
+        if not rows:
+            return [], None
+        # 第一页记下窗口里最大的 rowid, 之后的页都在同样的这些文档里排序
+        max_id = rows[0][0]
+        # rank 是 bm25 取负数，越小越相关；一样的时候新的在前面
+        rows.sort(key=lambda row: (row[1], -row[0]))
+        page = rows[offset:offset + limit]
+        next_cursor = None
+        if len(rows) > offset + limit:
+            next_cursor = f'{max_id}:{offset + limit}'
+        return [doc_id for doc_id, _ in page], next_cursor
+
+    def _parse_cursor(self, cursor):
+        try:
+            max_id, offset = cursor.split(':')
+            max_id, offset = int(max_id), int(offset)
+        except ValueError:
+            raise InvalidCursor(cursor)
+        if offset < 0:
+            raise InvalidCursor(cursor)
+        return max_id, offset
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path, table='documents'):
+    # 每个 (path, table) 一个 FullTextIndex, 换了 settings（测试里 override_settings）就是另一个
+    key = (str(path), table)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(key, FullTextIndex(path, table))
+    return index
+
+
+def _reset_after_fork():
+    # sqlite 的连接不能带到 fork 出来的子进程里用
+    global _indexes, _indexes_lock
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
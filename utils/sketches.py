@@ -0,0 +1,105 @@
+import hashlib
+import heapq
+
+
+class CountMinSketch(object):
+    """
+    用固定大小的内存（depth x width 个计数器）估计每个 key 出现了多少次，不需要记下所有的 key
+    估计值只会多不会少：不同的 key 落到同一个计数器上会加在一起，取 depth 行里最小的那个
+    误差大约是 总数 * e / width, 出错的概率大约是 e ^ -depth
+
+    同样 width / depth 的两个 sketch 可以相加相减（见 merge / subtract），
+    滑动窗口就是每个时间段一个 sketch, 过期的时候从总的 sketch 里减掉
+    """
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def _indexes(self, key):
+        # 两个 hash 组合出 depth 个 (Kirsch-Mitzenmacher), 不依赖 hash() (每个进程不一样)
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        indexes = self._indexes(key)
+        for row, index in zip(self.rows, indexes):
+            row[index] += count
+        return min(row[index] for row, index in zip(self.rows, indexes))
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+    def merge(self, other, sign=1):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('cannot merge sketches of different sizes')
+        for row, other_row in zip(self.rows, other.rows):
+            for index, count in enumerate(other_row):
+                if count:
+                    row[index] += sign * count
+
+    def subtract(self, other):
+        self.merge(other, sign=-1)
+
+
+class TopK(object):
+    """
+    记下估计值最大的 capacity 个 key
+    用一个最小堆找出当前最小的那个，新的 key 比它大的时候把它换掉
+    key 的值变了的时候直接往堆里再放一条，旧的那条在弹出来的时候发现对不上就丢掉（lazy deletion）
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def _min(self):
+        # 堆顶可能是已经过时的记录
+        while self._heap:
+            count, key = self._heap[0]
+            if self.counts.get(key) == count:
+                return count, key
+            heapq.heappop(self._heap)
+        return None
+
+    def update(self, key, count):
+        if key not in self.counts and len(self.counts) >= self.capacity:
+            smallest = self._min()
+            if smallest is None or count <= smallest[0]:
+                return
+            heapq.heappop(self._heap)
+            del self.counts[smallest[1]]
+        self.counts[key] = count
+        heapq.heappush(self._heap, (count, key))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild()
+
+    def rescore(self, estimate):
+        """
+        所有 key 重新估计一遍（e.g. 滑动窗口过期了一段），估计值是 0 的去掉
+        """
+        self.counts = {
+            key: count
+            for key, count in ((key, estimate(key)) for key in self.counts)
+            if count > 0
+        }
+        self._rebuild()
+
+    def _rebuild(self):
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def most_common(self, n=None):
+        # 一样多的按 key 排，输出是确定的
+        items = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return items if n is None else items[:n]
@@ -0,0 +1,240 @@
+import atexit
+import logging
+import os
+import random
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+
+# 64 位的 id（最高位不用，保证是正数）:
+# | 41 位: 从 EPOCH 开始的毫秒数 | 10 位: worker id | 12 位: 同一毫秒里的序号 |
+# 41 位的毫秒数可以用 69 年，每个 worker 每毫秒最多生成 4096 个 id
+# id 的大小顺序就是生成的时间顺序，按 id 排序 / 翻页不需要 created_at 的索引，
+# 不同的 worker 不会生成一样的 id, 生成的时候也不需要访问数据库
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+EPOCH_MS = int(EPOCH.timestamp() * 1000)
+WORKER_ID_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_ID_BITS + SEQUENCE_BITS
+
+# 每个进程自己设置的 worker id, 比 settings.SNOWFLAKE_WORKER_ID 优先
+WORKER_ID_ENV = 'SNOWFLAKE_WORKER_ID'
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class SnowflakeGenerator(object):
+    """
+    线程安全。同一时间在跑的每个进程（每台机器上的每个 gunicorn / uwsgi worker,
+    每个 dispatch_outbox）都要有不同的 worker_id, 见 get_configured_worker_id 和 WorkerIdLease
+
+    时钟往回拨的时候（NTP 校时）不等待也不报错，继续用上一次的时间戳往后排，
+    id 仍然是唯一并且递增的，只是 id 里的时间会比真实的时间稍微晚一点
+    """
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f'worker_id must be between 0 and {MAX_WORKER_ID}, got {worker_id}')
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            now = max(_now_ms() - EPOCH_MS, self._last_ms)
+            if now == self._last_ms:
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    # 这一毫秒的序号用完了，借用下一毫秒
+                    now += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << TIMESTAMP_SHIFT) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+def get_configured_worker_id():
+    """
+    环境变量 SNOWFLAKE_WORKER_ID 优先（每个进程自己设，e.g. supervisor 的 %(process_num)d），
+    其次是 settings.SNOWFLAKE_WORKER_ID（只能用在一份配置只跑一个进程的时候），都没有返回 None
+    """
+    value = os.environ.get(WORKER_ID_ENV)
+    if value is None:
+        value = getattr(settings, 'SNOWFLAKE_WORKER_ID', None)
+    if value is None:
+        return None
+    try:
+        worker_id = int(value)
+    except (TypeError, ValueError):
+        worker_id = None
+    if worker_id is None or not 0 <= worker_id <= MAX_WORKER_ID:
+        raise ImproperlyConfigured(
+            f'SNOWFLAKE_WORKER_ID must be an integer between 0 and {MAX_WORKER_ID}, got {value!r}'
+        )
+    return worker_id
+
+
+def get_lease_cache_alias():
+    return getattr(settings, 'SNOWFLAKE_LEASE_CACHE', 'default')
+
+
+class WorkerIdLease(object):
+    """
+    没有配置 worker id 的时候，在所有进程共享的 cache 里占一个：
+    cache.add 只有 key 不存在的时候才写得进去，所以同一个 worker id 同一时间只有一个进程拿得到
+    后台线程每 ttl / 3 秒续一次，进程退出的时候还回去，进程挂掉的话 ttl 秒之后别的进程才能再用
+    这个 cache 不能在 key 过期之前把它淘汰掉（e.g. 满了的 memcached），否则给每个进程配置环境变量
+    """
+
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+        self.token = secrets.token_hex(16)
+        self.pid = os.getpid()
+        self.worker_id = None
+
+    @property
+    def cache(self):
+        # 续约在别的线程里，每个线程用自己的 cache 连接
+        return caches[self.alias]
+
+    def _key(self, worker_id):
+        return f'snowflake:worker:{worker_id}'
+
+    def acquire(self):
+        # 从随机的位置开始找，同时启动的进程不会都去抢同一个
+        start = random.randrange(MAX_WORKER_ID + 1)
+        for offset in range(MAX_WORKER_ID + 1):
+            worker_id = (start + offset) % (MAX_WORKER_ID + 1)
+            if self.cache.add(self._key(worker_id), self.token, timeout=self.ttl):
+                self.worker_id = worker_id
+                return worker_id
+        raise ImproperlyConfigured('All snowflake worker ids are leased by other processes.')
+
+    def renew(self):
+        """
+        返回 False 表示这个 worker id 已经不是自己的了（超过 ttl 秒没有续上）
+        """
+        key = self._key(self.worker_id)
+        if self.cache.get(key) != self.token:
+            return False
+        return self.cache.touch(key, self.ttl)
+
+    def release(self):
+        # fork 出来的子进程也会继承 atexit, 只有占住的那个进程能还
+        if os.getpid() != self.pid:
+            return
+        key = self._key(self.worker_id)
+        if self.cache.get(key) == self.token:
+            self.cache.delete(key)
+
+
+_generator = None
+_generator_lock = threading.Lock()
+_lease = None
+
+
+def _create_generator():
+    global _lease
+    worker_id = get_configured_worker_id()
+    if worker_id is None:
+        # 放在这里 import, utils.checks 的 deploy check 也要用这个模块
+        from utils.checks import is_process_local_cache
+        alias = get_lease_cache_alias()
+        if is_process_local_cache(alias):
+            # 只有一个进程的开发环境 / test, DEBUG = False 的时候 ensure_deployable 不让这样启动
+            worker_id = 0
+        else:
+            _lease = WorkerIdLease(alias, getattr(settings, 'SNOWFLAKE_LEASE_SECONDS', 60))
+            worker_id = _lease.acquire()
+            atexit.register(_lease.release)
+            _start_renewal(_lease)
+    return SnowflakeGenerator(worker_id)
+
+
+def _start_renewal(lease):
+    threading.Thread(
+        target=_renew_lease,
+        args=(lease,),
+        name='snowflake-lease',
+        daemon=True,
+    ).start()
+
+
+def _renew_lease(lease):
+    while True:
+        time.sleep(lease.ttl / 3)
+        try:
+            renewed = lease.renew()
+        except Exception:
+            # cache 暂时连不上，下一次再试，ttl 之内续上就没有问题
+            logger.exception('failed to renew snowflake worker id %s', lease.worker_id)
+            continue
+        if not renewed:
+            # 别的进程可能已经在用这个 worker id 了，之后的 id 用重新占到的 worker id 生成
+            logger.error('lost the lease on snowflake worker id %s', lease.worker_id)
+            _drop_generator(lease)
+            return
+
+
+def _drop_generator(lease):
+    global _generator, _lease
+    with _generator_lock:
+        if _lease is lease:
+            _generator = None
+            _lease = None
+
+
+def _get_generator():
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = _create_generator()
+    return _generator
+
+
+def _reset_after_fork():
+    # fork 出来的子进程会带着父进程的状态（和可能被锁住的 lock），
+    # 父进程的 worker id 还是父进程的（续约的线程也没有跟过来），子进程第一次生成 id 的时候自己再拿一个
+    global _generator, _generator_lock, _lease
+    _generator = None
+    _generator_lock = threading.Lock()
+    _lease = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def next_id():
+    # model 的 primary key 的 default, 每次 new 一个 instance（包括 bulk_create）的时候生成
+    return _get_generator().next_id()
+
+
+def id_to_datetime(snowflake_id):
+    ms = (snowflake_id >> TIMESTAMP_SHIFT) + EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def min_id_for(value):
+    """
+    value (aware datetime) 这一毫秒生成的最小的 id,
+    id >= min_id_for(t) 就是 t 之后（包括 t 这一毫秒）生成的数据
+    """
+    ms = int(value.timestamp() * 1000) - EPOCH_MS
+    return max(ms, 0) << TIMESTAMP_SHIFT
@@ -0,0 +1,133 @@
+import asyncio
+import io
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib import auth
+from django.core.handlers.asgi import ASGIRequest
+from rest_framework import status
+from utils.async_views import run_sync
+from utils.json_fragments import dumps
+
+
+class ServerSentEvent(object):
+
+    __slots__ = ('data', 'event', 'id')
+
+    def __init__(self, data, event=None, id=None):
+        # data: bytes 或者 str
+        self.data = data
+        self.event = event
+        self.id = id
+
+    def encode(self):
+        data = self.data.decode() if isinstance(self.data, bytes) else self.data
+        lines = []
+        if self.id is not None:
+            lines.append(f'id: {self.id}')
+        if self.event:
+            lines.append(f'event: {self.event}')
+        # 多行的 data 每一行都要有 data: 前缀
+        lines.extend(f'data: {line}' for line in data.split('\n'))
+        return ('\n'.join(lines) + '\n\n').encode()
+
+
+class ServerSentEventsRouter(object):
+    """
+    包在 Django 的 ASGI application 外面，routes 里的 path 直接由 ASGI handler 处理，其他的交给 Django
+    Django 3.1 的 StreamingHttpResponse 在 ASGI 下也是同步地迭代，长连接会把 event loop 卡住，
+    所以 SSE 不能写成普通的 view
+
+    handler: async def handler(scope, receive, send)
+    """
+
+    def __init__(self, application, routes):
+        self.application = application
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            handler = self.routes.get(scope['path'])
+            if handler is not None:
+                return await handler(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+
+async def get_user(scope):
+    """
+    和 SessionMiddleware + AuthenticationMiddleware 一样，从 session cookie 里拿到当前用户
+    """
+    request = ASGIRequest(scope, io.BytesIO())
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    return await run_sync(auth.get_user, request)
+
+
+async def send_json(send, data, status=status.HTTP_200_OK):
+    body = dumps(data)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def stream_events(receive, send, events, heartbeat):
+    """
+    把 events (async iterator of ServerSentEvent) 一条一条地发给客户端，直到客户端断开
+    heartbeat 秒没有消息的时候发一行注释，让代理（nginx / 负载均衡）不要把空闲的连接断掉
+    """
+    await send({
+        'type': 'http.response.start',
+        'status': status.HTTP_200_OK,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # nginx 默认会把 response 缓冲起来，SSE 要关掉
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    iterator = events.__aiter__()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    next_event = None
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait(
+                {next_event, disconnected},
+                timeout=heartbeat,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                break
+            if next_event not in done:
+                await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                break
+            next_event = None
+            await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+    finally:
+        for future in (next_event, disconnected):
+            if future is not None and not future.done():
+                future.cancel()
+        if next_event is not None:
+            # 等 generator 里的 cleanup（e.g. 取消订阅）执行完
+            await asyncio.gather(next_event, return_exceptions=True)
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
@@ -0,0 +1,676 @@
+import os
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from comments.api.serializers import CommentFastSerializer, CommentSerializer
+from comments.models import Comment
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from friendships.api.serializers import (
+    FollowerFastSerializer,
+    FollowerSerializer,
+    FollowingFastSerializer,
+    FollowingSerializer,
+)
+from friendships.models import Friendship
+from newsfeeds.api.serializers import NewsFeedFastSerializer, NewsFeedSerializer
+from newsfeeds.models import NewsFeed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from testing.query_snapshots import UPDATE_ENV
+from testing.testcases import TestCase, TransactionTestCase
+from tweets.api.serializers import (
+    TweetFastSerializer,
+    TweetSerializer,
+    TweetSerializerWithComments,
+)
+from tweets.models import Tweet
+from utils.checks import check_pubsub_broker, ensure_deployable
+from utils.db_routers import this_thread_is_pinned, unpin_this_thread
+from utils.fast_serializers import FastSerializer
+from utils.json_fragments import JSONFragment, dumps, encode_template, render_template, Hole
+from utils.metrics import Histogram, registry
+from utils.renderers import FastJSONRenderer
+from utils.search_index import FullTextIndex, InvalidCursor, tokenize
+from utils.sketches import CountMinSketch, TopK
+from utils import snowflake
+from utils.snowflake import SnowflakeGenerator, id_to_datetime, min_id_for
+
+
+METRICS_URL = '/metrics/'
+TWEET_CREATE_API = '/api/tweets/'
+TWEET_LIST_API = '/api/tweets/'
+
+
+class HistogramTests(TestCase):
+
+    def test_render(self):
+        histogram = Histogram('test_seconds', 'test histogram', (0.1, 1))
+        histogram.observe('A.list', 0.05)
+        histogram.observe('A.list', 0.5)
+        histogram.observe('A.list', 5)
+        output = histogram.render()
+        self.assertIn('# TYPE test_seconds histogram', output)
+        self.assertIn('test_seconds_bucket{view="A.list",le="0.1"} 1', output)
+        self.assertIn('test_seconds_bucket{view="A.list",le="1"} 2', output)
+        self.assertIn('test_seconds_bucket{view="A.list",le="+Inf"} 3', output)
+        self.assertIn('test_seconds_count{view="A.list"} 3', output)
+
+
+class MetricsMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        registry.clear()
+        self.linghu = self.create_user('linghu')
+        self.linghu_client = APIClient()
+        self.linghu_client.force_authenticate(self.linghu)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint(self):
+        self.linghu_client.post(TWEET_CREATE_API, {'content': 'hello metrics'})
+        self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.linghu.id})
+
+        response = self.anonymous_client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        output = response.content.decode()
+        self.assertIn(
+            'twitter_request_duration_seconds_count{view="TweetViewSet.create"} 1',
+            output,
+        )
+        self.assertIn(
+            'twitter_request_sql_queries_count{view="TweetViewSet.list"} 1',
+            output,
+        )
+        self.assertIn('twitter_request_serializer_duration_seconds_sum', output)
+
+        # 没有 token 或者 token 不对都不行，本机来的也一样（反向代理后面都是 127.0.0.1）
+        response = self.anonymous_client.get(METRICS_URL)
+        self.assertEqual(response.status_code, 403)
+        response = self.anonymous_client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_without_token(self):
+        with override_settings(METRICS_TOKEN=None, DEBUG=False):
+            self.assertEqual(self.anonymous_client.get(METRICS_URL).status_code, 403)
+        with override_settings(METRICS_TOKEN=None, DEBUG=True):
+            self.assertEqual(self.anonymous_client.get(METRICS_URL).status_code, 200)
+
+    def test_sql_query_count(self):
+        self.create_tweet(self.linghu)
+        self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.linghu.id})
+        values = registry.sql_queries.snapshot()['TweetViewSet.list']
+        # 只有一个 request，sum 就是这个 request 的 SQL 条数
+        self.assertGreater(values[-2], 0)
+        self.assertEqual(values[-1], 1)
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.anonymous_client.get(
+            TWEET_LIST_API,
+            {'user_id': self.linghu.id},
+        )
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        self.assertIn('serializer;dur=', response['Server-Timing'])
+
+
+SHARED_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/twitter-test-cache'},
+}
+
+
+class DeployChecksTests(TestCase):
+
+    def assertNotDeployable(self, message):
+        with self.assertRaisesRegex(ImproperlyConfigured, message):
+            ensure_deployable()
+
+    @override_settings(DEBUG=False, CACHES=SHARED_CACHES)
+    def test_deployable(self):
+        ensure_deployable()
+
+    @override_settings(DEBUG=False, JSON_FRAGMENT_CACHE_ENABLED=True)
+    def test_fragment_cache(self):
+        # 每个进程自己的 locmem: 别的 worker 删不掉这个 worker 缓存的 tweet JSON
+        self.assertNotDeployable('JSON_FRAGMENT_CACHE_ENABLED')
+        with override_settings(JSON_FRAGMENT_CACHE_ENABLED=False, CACHES=SHARED_CACHES):
+            ensure_deployable()
+        with override_settings(DEBUG=True):
+            ensure_deployable()
+
+    @override_settings(DEBUG=False, JSON_FRAGMENT_CACHE_ENABLED=False)
+    def test_idempotency_cache(self):
+        # 重试落到别的 worker 上看不到第一次的 response
+        self.assertNotDeployable('IDEMPOTENCY_CACHE')
+        caches = {**SHARED_CACHES, 'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=caches, IDEMPOTENCY_CACHE='local'):
+            self.assertNotDeployable('IDEMPOTENCY_CACHE')
+        with override_settings(CACHES=caches):
+            ensure_deployable()
+
+
+    @override_settings(DEBUG=False, CACHES=SHARED_CACHES)
+    def test_pubsub_broker(self):
+        # 单进程的部署也能用，只打 warning 不拦住
+        with self.assertLogs('utils.checks', 'WARNING') as logs:
+            ensure_deployable()
+        self.assertIn('twitter.W001', logs.output[0])
+        with override_settings(NEWSFEED_PUSH_ENABLED=False):
+            self.assertEqual(check_pubsub_broker(None), [])
+
+
+    @override_settings(DEBUG=False, CACHES=SHARED_CACHES, SNOWFLAKE_WORKER_ID=None)
+    def test_snowflake_worker_id(self):
+        # worker id 从共享的 cache 里占
+        with mock.patch.dict(os.environ, clear=True):
+            ensure_deployable()
+            # 所有进程都会用 0
+            with override_settings(SNOWFLAKE_LEASE_CACHE='local', CACHES={
+                **SHARED_CACHES, 'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            }):
+                self.assertNotDeployable('snowflake worker id')
+                with mock.patch.dict(os.environ, {'SNOWFLAKE_WORKER_ID': '3'}):
+                    ensure_deployable()
+            with mock.patch.dict(os.environ, {'SNOWFLAKE_WORKER_ID': 'x'}):
+                self.assertNotDeployable('SNOWFLAKE_WORKER_ID')
+
+
+class QuerySnapshotTests(TestCase):
+
+    def test_missing_snapshot(self):
+        # 没有 snapshot 的时候 fail, 不会自己写一份然后通过
+        with mock.patch.dict(os.environ, {UPDATE_ENV: ''}):
+            with self.assertRaisesRegex(AssertionError, 'has no query snapshot'):
+                with self.assertQueriesMatchSnapshot('missing'):
+                    Tweet.objects.count()
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(__file__), 'query_snapshots.json')))
+
+
+class TweetWithCommentsFastSerializer(FastSerializer):
+    serializer_class = TweetSerializerWithComments
+
+
+class SerializerTestCase(TestCase):
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.dongxie = self.create_user('dongxie')
+        Friendship.objects.create(from_user=self.dongxie, to_user=self.linghu)
+        Friendship.objects.create(from_user=self.linghu, to_user=self.dongxie)
+        self.tweets = [
+            self.create_tweet(self.linghu, 'hello 你好 "quoted" \\ \u2028'),
+            self.create_tweet(self.dongxie),
+        ]
+        self.create_comment(self.dongxie, self.tweets[0], 'comment 1')
+        self.create_comment(self.linghu, self.tweets[0], 'comment 2')
+        for tweet in self.tweets:
+            NewsFeed.objects.create(user=self.linghu, tweet=tweet)
+        # tweet 被删除之后 newsfeed.tweet 是 NULL
+        NewsFeed.objects.create(user=self.linghu, tweet=None)
+        # user 被删除之后 tweet.user 是 NULL
+        self.create_tweet(None, 'orphan tweet')
+
+
+class FastSerializerParityTests(SerializerTestCase):
+    """
+    FastSerializer 的输出必须和原来的 DRF serializer 渲染出来的 JSON 一模一样
+    """
+
+    def assertSameJSON(self, fast_data, drf_data):
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(fast_data), renderer.render(drf_data))
+
+    def test_tweets(self):
+        tweets = Tweet.objects.order_by('-created_at')
+        self.assertSameJSON(
+            TweetFastSerializer(tweets, many=True).data,
+            TweetSerializer(tweets, many=True).data,
+        )
+        self.assertSameJSON(
+            TweetWithCommentsFastSerializer(self.tweets[0]).data,
+            TweetSerializerWithComments(self.tweets[0]).data,
+        )
+
+    def test_reshares(self):
+        quote = Tweet.objects.create(user=self.dongxie, content='quote', original=self.tweets[0])
+        Tweet.objects.create(user=self.linghu, content='', original=quote)
+        tweets = Tweet.objects.filter(original__isnull=False).order_by('id')
+        self.assertSameJSON(
+            TweetFastSerializer(tweets, many=True).data,
+            TweetSerializer(tweets, many=True).data,
+        )
+        with override_settings(JSON_FRAGMENT_CACHE_ENABLED=False):
+            self.assertSameJSON(
+                TweetFastSerializer(tweets, many=True).data,
+                TweetSerializer(tweets, many=True).data,
+            )
+
+    def test_newsfeeds(self):
+        newsfeeds = NewsFeed.objects.filter(user=self.linghu).prefetch_related('tweet__user')
+        self.assertSameJSON(
+            NewsFeedFastSerializer(newsfeeds, many=True).data,
+            NewsFeedSerializer(newsfeeds, many=True).data,
+        )
+
+    def test_comments(self):
+        comments = Comment.objects.order_by('created_at')
+        self.assertSameJSON(
+            CommentFastSerializer(comments, many=True).data,
+            CommentSerializer(comments, many=True).data,
+        )
+
+    def test_friendships(self):
+        friendships = Friendship.objects.order_by('-created_at')
+        self.assertSameJSON(
+            FollowerFastSerializer(friendships, many=True).data,
+            FollowerSerializer(friendships, many=True).data,
+        )
+        self.assertSameJSON(
+            FollowingFastSerializer(friendships, many=True).data,
+            FollowingSerializer(friendships, many=True).data,
+        )
+
+    def test_from_values(self):
+        friendships = Friendship.objects.order_by('id')
+        self.assertSameJSON(
+            FollowerFastSerializer.from_values(
+                friendships.values(*FollowerFastSerializer.value_fields()),
+            ),
+            FollowerSerializer(friendships, many=True).data,
+        )
+        # tweet 嵌套了自己（转发的原 tweet），没办法展开成 values() 的列
+        with self.assertRaises(ValueError):
+            NewsFeedFastSerializer.value_fields()
+        comments = Comment.objects.order_by('id')
+        self.assertSameJSON(
+            CommentFastSerializer.from_values(
+                comments.values(*CommentFastSerializer.value_fields()),
+            ),
+            CommentSerializer(comments, many=True).data,
+        )
+
+
+class JSONFragmentTests(TestCase):
+
+    def test_dumps_same_as_drf(self):
+        data = {
+            'text': 'hello 你好 "quoted" \\ \n \t \x00 \u2028 \u2029 \U0001f600',
+            'number': 2 ** 70,
+            'list': [1, None, True, False, {}],
+        }
+        self.assertEqual(dumps(data), JSONRenderer().render(data))
+
+    def test_fragment_splicing(self):
+        user = JSONFragment(b'{"id":1,"username":"linghu"}')
+        chunks, keys = encode_template({'id': 2, 'user': Hole('user:1'), 'content': 'hi'})
+        self.assertEqual(keys, ['user:1'])
+        tweet = JSONFragment(render_template(chunks, [user]))
+        self.assertEqual(tweet.raw, b'{"id":2,"user":{"id":1,"username":"linghu"},"content":"hi"}')
+        self.assertEqual(tweet['user']['username'], 'linghu')
+        self.assertEqual(dumps([tweet, None]), b'[' + tweet.raw + b',null]')
+
+    def test_indented(self):
+        data = {'user': JSONFragment(b'{"id":1}')}
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render({'user': {'id': 1}}, 'application/json; indent=4'),
+        )
+
+
+class JSONFragmentCacheTests(SerializerTestCase):
+    """
+    tweet / user 的 JSON 缓存起来之后，renderer 拼出来的 bytes 还是要和 DRF 一样，
+    数据改了之后缓存要失效
+    """
+
+    def assertSameBytes(self, fast_data, drf_data):
+        self.assertEqual(FastJSONRenderer().render(fast_data), JSONRenderer().render(drf_data))
+
+    def render_newsfeeds(self):
+        newsfeeds = NewsFeed.objects.filter(user=self.linghu).order_by('id')
+        return (
+            NewsFeedFastSerializer(newsfeeds, many=True).data,
+            NewsFeedSerializer(newsfeeds, many=True).data,
+        )
+
+    def test_cached_newsfeeds(self):
+        # 第一次生成缓存，第二次全部从缓存里拼出来
+        for _ in range(2):
+            self.assertSameBytes(*self.render_newsfeeds())
+        with self.assertNumQueries(1):
+            NewsFeedFastSerializer(
+                NewsFeed.objects.filter(user=self.linghu), many=True,
+            ).data
+
+    def test_invalidation(self):
+        self.render_newsfeeds()
+        self.linghu.username = 'linghuchong'
+        self.linghu.save()
+        tweet = self.tweets[1]
+        tweet.content = 'edited content'
+        tweet.save()
+        fast_data, drf_data = self.render_newsfeeds()
+        self.assertSameBytes(fast_data, drf_data)
+        self.assertEqual(fast_data[0]['tweet']['user']['username'], 'linghuchong')
+        self.assertEqual(fast_data[1]['tweet']['content'], 'edited content')
+
+        tweet.delete()
+        self.assertSameBytes(*self.render_newsfeeds())
+
+    @override_settings(JSON_FRAGMENT_CACHE_ENABLED=False)
+    def test_disabled(self):
+        fast_data, drf_data = self.render_newsfeeds()
+        self.assertIsInstance(fast_data[0]['tweet'], dict)
+        self.assertSameBytes(fast_data, drf_data)
+
+
+@override_settings(DATABASE_REPLICAS=settings.TEST_DATABASE_REPLICAS)
+class PrimaryReplicaRouterTests(TransactionTestCase):
+    """
+    从库是 settings.TEST_DATABASE_REPLICAS, 和 default 是同一个 test 数据库 (MIRROR)
+    从库的连接看不到 TestCase 的事务里还没提交的数据，所以用 TransactionTestCase
+    """
+
+    databases = {'default', *settings.TEST_DATABASE_REPLICAS}
+
+    def setUp(self):
+        self.clear_cache()
+        self.linghu = self.create_user('linghu')
+        self.linghu_client = APIClient()
+        self.linghu_client.force_authenticate(self.linghu)
+        # 上面的写把当前线程钉在了主库上
+        unpin_this_thread()
+        self.addCleanup(unpin_this_thread)
+
+    @contextmanager
+    def capture_queries(self):
+        """
+        {alias: CaptureQueriesContext}, 看每个连接上各跑了哪些 SQL
+        """
+        with ExitStack() as stack:
+            yield {
+                alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in self.databases
+            }
+
+    def assertReadsOn(self, captured, *aliases):
+        used = {alias for alias, context in captured.items() if len(context)}
+        self.assertTrue(used)
+        self.assertLessEqual(used, set(aliases))
+
+    def test_routing(self):
+        replicas = settings.TEST_DATABASE_REPLICAS
+        self.assertIn(router.db_for_read(Tweet), replicas)
+        tweet = Tweet(content='hello')
+        tweet._state.db = replicas[1]
+        self.assertEqual(router.db_for_read(Tweet, instance=tweet), replicas[1])
+        self.assertEqual(router.db_for_write(Tweet), 'default')
+        # 写过之后读也走主库
+        self.assertTrue(this_thread_is_pinned())
+        self.assertEqual(router.db_for_read(Tweet), 'default')
+        self.assertFalse(router.allow_migrate(replicas[0], 'tweets'))
+        self.assertTrue(router.allow_migrate('default', 'tweets'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        self.assertEqual(router.db_for_read(Tweet), 'default')
+
+    def test_reads_use_replicas(self):
+        self.create_tweet(self.linghu, 'hello')
+        unpin_this_thread()
+        with self.capture_queries() as captured:
+            tweets = list(Tweet.objects.all())
+        self.assertEqual(len(tweets), 1)
+        self.assertIn(tweets[0]._state.db, settings.TEST_DATABASE_REPLICAS)
+        self.assertReadsOn(captured, *settings.TEST_DATABASE_REPLICAS)
+
+        # 关联的对象从同一个从库取
+        with self.capture_queries() as captured:
+            self.assertEqual(tweets[0].user, self.linghu)
+        self.assertReadsOn(captured, tweets[0]._state.db)
+
+        # 写过之后当前线程的读回到主库
+        self.create_tweet(self.linghu, 'world')
+        with self.capture_queries() as captured:
+            self.assertEqual(Tweet.objects.count(), 2)
+        self.assertReadsOn(captured, 'default')
+
+    def test_read_your_writes(self):
+        with self.capture_queries() as captured:
+            response = self.linghu_client.post(TWEET_CREATE_API, {'content': 'hello replica'})
+        self.assertEqual(response.status_code, 201)
+        # 写请求里的读也都在主库上
+        self.assertReadsOn(captured, 'default')
+        self.assertIn('db_pin', response.cookies)
+        self.assertEqual(response.cookies['db_pin']['max-age'], 15)
+        self.assertFalse(this_thread_is_pinned())
+
+        # 带着 cookie 的读都走主库，能看到刚发的 tweet
+        with self.capture_queries() as captured:
+            response = self.linghu_client.get('/api/newsfeeds/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['newsfeeds'][0]['tweet']['content'], 'hello replica')
+        self.assertReadsOn(captured, 'default')
+
+        # cookie 过期之后读又回到从库（newsfeed 表本身按 NEWSFEED_SHARDS 分片，在 default 上）
+        self.linghu_client.cookies.pop('db_pin')
+        with self.capture_queries() as captured:
+            response = self.linghu_client.get(TWEET_LIST_API, {'user_id': self.linghu.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tweets'][0]['content'], 'hello replica')
+        self.assertReadsOn(captured, *settings.TEST_DATABASE_REPLICAS)
+
+
+class SnowflakeTests(TestCase):
+
+    def test_ids_are_increasing_and_unique(self):
+        generator = SnowflakeGenerator(worker_id=3)
+        ids = [generator.next_id() for _ in range(10000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertLess(ids[-1], 2 ** 63)
+        # 中间 10 位是 worker id
+        self.assertEqual((ids[0] >> snowflake.SEQUENCE_BITS) & snowflake.MAX_WORKER_ID, 3)
+
+    def test_threads(self):
+        generator = SnowflakeGenerator(worker_id=0)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            batches = list(executor.map(
+                lambda _: [generator.next_id() for _ in range(2000)], range(4),
+            ))
+        ids = [snowflake_id for batch in batches for snowflake_id in batch]
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_workers_do_not_collide(self):
+        with mock.patch('utils.snowflake._now_ms', return_value=snowflake.EPOCH_MS + 1000):
+            first = SnowflakeGenerator(worker_id=1).next_id()
+            second = SnowflakeGenerator(worker_id=2).next_id()
+        self.assertNotEqual(first, second)
+        self.assertEqual(id_to_datetime(first), id_to_datetime(second))
+
+    def test_sequence_overflow_and_clock_going_back(self):
+        generator = SnowflakeGenerator(worker_id=0)
+        now = snowflake.EPOCH_MS + 1000
+        with mock.patch('utils.snowflake._now_ms', return_value=now):
+            ids = [generator.next_id() for _ in range(snowflake.MAX_SEQUENCE + 2)]
+        # 序号用完了借用下一毫秒
+        self.assertEqual(ids[-1] >> snowflake.TIMESTAMP_SHIFT, 1001)
+        # 时钟往回拨也不会生成重复或者更小的 id
+        with mock.patch('utils.snowflake._now_ms', return_value=now - 500):
+            self.assertGreater(generator.next_id(), ids[-1])
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_invalid_worker_id(self):
+        with self.assertRaises(ValueError):
+            SnowflakeGenerator(worker_id=snowflake.MAX_WORKER_ID + 1)
+
+    def test_configured_worker_id(self):
+        with override_settings(SNOWFLAKE_WORKER_ID=None), mock.patch.dict(os.environ, clear=True):
+            self.assertIsNone(snowflake.get_configured_worker_id())
+        with override_settings(SNOWFLAKE_WORKER_ID=5):
+            self.assertEqual(snowflake.get_configured_worker_id(), 5)
+            # 每个进程自己的环境变量优先
+            with mock.patch.dict(os.environ, {snowflake.WORKER_ID_ENV: '7'}):
+                self.assertEqual(snowflake.get_configured_worker_id(), 7)
+            for value in ('x', '1024', '-1'):
+                with mock.patch.dict(os.environ, {snowflake.WORKER_ID_ENV: value}):
+                    with self.assertRaises(ImproperlyConfigured):
+                        snowflake.get_configured_worker_id()
+
+    def test_worker_id_lease(self):
+        first = snowflake.WorkerIdLease('default', 60)
+        second = snowflake.WorkerIdLease('default', 60)
+        self.assertNotEqual(first.acquire(), second.acquire())
+        self.assertTrue(first.renew())
+
+        # 续约停了太久，worker id 被别的进程占走了
+        first.cache.set(first._key(first.worker_id), 'another process')
+        self.assertFalse(first.renew())
+        first.release()
+        self.assertEqual(first.cache.get(first._key(first.worker_id)), 'another process')
+
+        # fork 出来的子进程不会还父进程的 worker id
+        with mock.patch('os.getpid', return_value=second.pid + 1):
+            second.release()
+        self.assertTrue(second.renew())
+        second.release()
+        self.assertIsNone(second.cache.get(second._key(second.worker_id)))
+
+    @override_settings(SNOWFLAKE_WORKER_ID=None, CACHES=SHARED_CACHES)
+    def test_generator_leases_worker_id(self):
+        self.clear_cache()
+        self.addCleanup(snowflake._reset_after_fork)
+        snowflake._reset_after_fork()
+        with mock.patch.dict(os.environ, clear=True), \
+                mock.patch('utils.snowflake._start_renewal') as start_renewal, \
+                mock.patch('atexit.register'):
+            generator = snowflake._get_generator()
+        lease = start_renewal.call_args[0][0]
+        self.assertEqual(generator.worker_id, lease.worker_id)
+        self.assertIs(snowflake._get_generator(), generator)
+
+        # 没续上之后下一个 id 重新占一个 worker id
+        snowflake._drop_generator(lease)
+        with mock.patch.dict(os.environ, {snowflake.WORKER_ID_ENV: '9'}):
+            self.assertEqual(snowflake._get_generator().worker_id, 9)
+        lease.release()
+
+    def test_time_helpers(self):
+        tweet = self.create_tweet(self.create_user('linghu'))
+        tweet.refresh_from_db()
+        created_at = id_to_datetime(tweet.id)
+        self.assertLessEqual(created_at, tweet.created_at)
+        self.assertLess((tweet.created_at - created_at).total_seconds(), 1)
+        self.assertLessEqual(min_id_for(created_at), tweet.id)
+        self.assertEqual(min_id_for(snowflake.EPOCH), 0)
+
+    def test_models_get_ids_without_saving(self):
+        user = self.create_user('linghu')
+        tweet = Tweet(user=user, content='not saved yet')
+        self.assertIsNotNone(tweet.id)
+        tweets = Tweet.objects.bulk_create([Tweet(user=user, content='bulk') for _ in range(3)])
+        self.assertEqual(Tweet.objects.filter(id__in=[t.id for t in tweets]).count(), 3)
+        self.assertGreater(tweets[0].id, tweet.id)
+
+
+class FullTextIndexTests(TestCase):
+
+    def setUp(self):
+        self.index = FullTextIndex(':memory:')
+
+    def test_tokenize(self):
+        # FTS5 的语法都只当作普通的词
+        self.assertEqual(tokenize('Hello "world* OR hello_NEAR'), ['hello', 'world', 'or', 'near'])
+        self.assertEqual(tokenize('a b c', max_terms=2), ['a', 'b'])
+        self.assertEqual(tokenize('!!!'), [])
+
+    def test_add_and_remove(self):
+        self.index.add([(1, 'hello world'), (2, 'hello there')])
+        self.assertEqual(self.index.search(['hello'], 10)[0], [2, 1])
+        self.assertEqual(self.index.search(['hello', 'world'], 10)[0], [1])
+        # 重新写进去的会替换掉旧的内容
+        self.index.add([(1, 'goodbye world')])
+        self.assertEqual(self.index.search(['hello'], 10)[0], [2])
+        self.index.remove([2, 3])
+        self.assertEqual(self.index.search(['hello'], 10), ([], None))
+        self.assertEqual(self.index.count(), 1)
+
+    def test_rank_and_cursor(self):
+        self.index.add([
+            (doc_id, 'python ' * (doc_id % 4 + 1) + 'filler words ' * 3)
+            for doc_id in range(1, 31)
+        ])
+        ids, cursor = self.index.search(['python'], 4)
+        # python 出现次数最多的排在前面，一样多的新的在前面
+        self.assertEqual(ids, [27, 23, 19, 15])
+        seen = list(ids)
+        # 第一页之后写进来的不会出现在后面的页里
+        self.index.add([(100, 'python python python python')])
+        while cursor is not None:
+            ids, cursor = self.index.search(['python'], 4, cursor)
+            seen.extend(ids)
+        self.assertEqual(sorted(seen), list(range(1, 31)))
+
+        # 只在最新的 window 条匹配的里面排序
+        ids, cursor = self.index.search(['python'], 100, window=5)
+        self.assertEqual(sorted(ids), [27, 28, 29, 30, 100])
+        self.assertIsNone(cursor)
+
+        with self.assertRaises(InvalidCursor):
+            self.index.search(['python'], 4, 'not-a-cursor')
+
+    def test_file_index_from_threads(self):
+        with TemporaryDirectory() as tmp:
+            index = FullTextIndex(f'{tmp}/index.sqlite3')
+            index.add([(doc_id, f'tweet number {doc_id}') for doc_id in range(1, 21)])
+
+            def search(doc_id):
+                return index.search([str(doc_id)], 10)[0]
+
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(search, range(1, 21)))
+            self.assertEqual(results, [[doc_id] for doc_id in range(1, 21)])
+            index.close()
+
+
+class SketchTests(TestCase):
+
+    def test_count_min_sketch(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        for i in range(200):
+            sketch.add(f'key{i % 20}')
+        sketch.add('hot', 50)
+        # 只会多估，不会少估
+        for i in range(20):
+            self.assertGreaterEqual(sketch.estimate(f'key{i}'), 10)
+        self.assertGreaterEqual(sketch.estimate('hot'), 50)
+        # 误差大约是 总数 * e / width
+        self.assertLessEqual(sketch.estimate('hot'), 50 + 250 * 3 // 64)
+
+        other = CountMinSketch(width=64, depth=4)
+        other.add('hot', 50)
+        sketch.subtract(other)
+        self.assertLess(sketch.estimate('hot'), 50)
+        with self.assertRaises(ValueError):
+            sketch.merge(CountMinSketch(width=32, depth=4))
+
+    def test_top_k(self):
+        top = TopK(2)
+        top.update('a', 1)
+        top.update('b', 5)
+        # 比最小的还小，进不来
+        top.update('c', 1)
+        self.assertNotIn('c', top)
+        top.update('c', 3)
+        self.assertEqual(top.most_common(), [('b', 5), ('c', 3)])
+        # 值变小了之后可以被挤掉
+        top.update('b', 2)
+        top.update('d', 4)
+        self.assertEqual(top.most_common(), [('d', 4), ('c', 3)])
+        top.rescore({'d': 0, 'c': 7}.get)
+        self.assertEqual(top.most_common(), [('c', 7)])
@@ -0,0 +1,26 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from utils.metrics import registry
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metrics_authorized(request):
+    # 不能按 REMOTE_ADDR 判断：反向代理在本机的时候，所有请求的 REMOTE_ADDR 都是 127.0.0.1
+    # Prometheus 的 scrape 配置里带上 Authorization: Bearer <METRICS_TOKEN>
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token:
+        # 没有配 token 的时候只有 DEBUG 的开发环境能看
+        return settings.DEBUG
+    return hmac.compare_digest(
+        request.META.get('HTTP_AUTHORIZATION', '').encode(),
+        f'Bearer {token}'.encode(),
+    )
+
+
+def metrics(request):
+    if not metrics_authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)